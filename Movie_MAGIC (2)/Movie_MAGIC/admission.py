@@ -0,0 +1,366 @@
+"""Admission control for the booking routes, for when a big title opens.
+
+Three layers, cheapest first, each a decorator on the views in movie_magic.py:
+
+  waiting_room    /seating, /payment and /process_payment only let in
+                  holders of an admitted queue ticket. Tickets are handed
+                  out first come, first served, each naming the time its
+                  holder gets in: the next one is 1/WAITING_ROOM_RATE
+                  seconds after the last, once a burst of
+                  WAITING_ROOM_BURST has gone in. The booking pages thus
+                  see a steady stream of users however many turn up, and
+                  everybody else is sent to /waiting-room, which shows
+                  their place in the queue and estimated wait.
+  rate_limited    token buckets per user (USER_BOOKING_RATE per second, up
+                  to USER_BOOKING_BURST at once) and per worker
+                  (BOOKING_RATE, BOOKING_BURST); over either, 429 with
+                  Retry-After.
+  write_limited   at most WRITE_CONCURRENCY payments per worker on the
+                  write path at once; others wait up to WRITE_QUEUE_TIMEOUT
+                  seconds for a slot, then get 503 with Retry-After.
+
+Tickets are only handed out to logged-in users, after the login check,
+and are kept in their session: anonymous requests never touch the queue,
+and a user who drops cookies can't get a new place by asking again. Only
+handing one out touches the database. The ticket is also copied to a
+cookie signed with SECRET_KEY, so that the /api/waiting-room polls of
+queued users are answered before Flask (no session, no routing) with a
+signature check and a clock comparison. The time the next ticket gets in
+is kept in the waiting_room table (migration 6), so every gunicorn worker
+shares one queue. Token buckets and the write limit are per worker.
+"""
+import functools
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, jsonify, redirect, render_template, request, session, url_for
+from itsdangerous import BadSignature, URLSafeSerializer
+from werkzeug.http import parse_cookie
+
+import metrics
+from db import write_transaction
+
+DEFAULTS = {
+    'ADMISSION_CONTROL': True,
+    # Users let in to the booking pages per second, shared by all workers,
+    # and how many may go straight in when nobody is queueing
+    'WAITING_ROOM_RATE': 20.0,
+    'WAITING_ROOM_BURST': 40,
+    # An admitted ticket stays good this long, enough to pick seats and pay
+    'ADMISSION_TTL': 20 * 60,
+    # Requests to the booking routes per second, per user and per worker
+    'USER_BOOKING_RATE': 2.0,
+    'USER_BOOKING_BURST': 10,
+    'BOOKING_RATE': 200.0,
+    'BOOKING_BURST': 400,
+    # Payments written at once per worker, and how long others wait for a turn
+    'WRITE_CONCURRENCY': 8,
+    'WRITE_QUEUE_TIMEOUT': 2.0,
+}
+
+# Cookie holding a signed copy of the queue ticket, for /api/waiting-room
+TICKET_COOKIE = 'mm_queue'
+# Session key the ticket itself is kept under
+SESSION_KEY = 'queue_ticket'
+
+# The waiting room page reloads at least this often while the user waits
+REFRESH_SECONDS = 5
+
+# Users whose token buckets are kept; the least recently seen go first
+MAX_TRACKED_USERS = 100000
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `burst`."""
+
+    def __init__(self, rate, burst, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.tokens = float(burst)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Take a token. Returns 0 on success, else the seconds until one is due."""
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+
+class TokenBuckets:
+    """A TokenBucket per key, for the `maxsize` most recently seen keys."""
+
+    def __init__(self, rate, burst, maxsize=MAX_TRACKED_USERS, clock=time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self.clock = clock
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(self.rate, self.burst, self.clock)
+                if len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+        return bucket.take()
+
+
+class Ticket:
+    """A place in the waiting room: admitted from `admit_at` (epoch seconds)."""
+
+    def __init__(self, number, admit_at):
+        self.number = number
+        self.admit_at = admit_at
+
+    def wait(self, now):
+        """Seconds until admission, 0 once admitted."""
+        return max(0.0, self.admit_at - now)
+
+
+class WaitingRoom:
+    """First come, first served queue tickets, let in `rate` per second.
+
+    With a connection pool the queue lives in the waiting_room table and
+    is shared by every process using the database; without one it is
+    kept in memory.
+    """
+
+    def __init__(self, secret, rate, burst, ttl, pool=None, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.ttl = ttl
+        self.pool = pool
+        self.clock = clock
+        self._serializer = URLSafeSerializer(secret, salt='movie-magic-waiting-room')
+        # In-memory queue: when the next ticket gets in, and tickets issued
+        self._next_at = 0.0
+        self._issued = 0
+        self._lock = threading.Lock()
+
+    def issue(self):
+        """A new ticket at the back of the queue."""
+        now = self.clock()
+        interval = 1 / self.rate
+        # Idle time banks up to `burst` tickets that go straight in
+        earliest = now - (max(1, self.burst) - 1) * interval
+        if self.pool is None:
+            with self._lock:
+                admit_at = max(self._next_at, earliest)
+                self._next_at = admit_at + interval
+                self._issued += 1
+                number = self._issued
+        else:
+            with self.pool.connection() as conn, write_transaction(conn):
+                admit_at, number = conn.execute(
+                    "UPDATE waiting_room SET next_at = MAX(next_at, ?) + ?, issued = issued + 1 "
+                    "WHERE id = 1 RETURNING next_at - ?, issued", (earliest, interval, interval)).fetchone()
+        metrics.WAITING_ROOM_TICKETS.inc()
+        return Ticket(number, admit_at)
+
+    def dumps(self, ticket):
+        return self._serializer.dumps([ticket.number, ticket.admit_at])
+
+    def loads(self, value):
+        """The ticket signed into `value`, or None if it is missing, forged or has run out."""
+        if not value:
+            return None
+        try:
+            number, admit_at = self._serializer.loads(value)
+        except (BadSignature, TypeError, ValueError):
+            return None
+        if self.clock() > admit_at + self.ttl:
+            return None
+        return Ticket(number, admit_at)
+
+    def position(self, ticket, now):
+        """Roughly how many tickets get in before this one (0 once admitted)."""
+        return math.ceil(ticket.wait(now) * self.rate)
+
+    def status(self, ticket):
+        """The /api/waiting-room body for `ticket`."""
+        now = self.clock()
+        wait = ticket.wait(now)
+        return json.dumps({'admitted': not wait, 'position': self.position(ticket, now),
+                           'wait_seconds': round(wait, 1)}, separators=(',', ':')).encode()
+
+
+class AdmissionControl:
+    def __init__(self, config, pool):
+        self.room = WaitingRoom(config['SECRET_KEY'], config['WAITING_ROOM_RATE'], config['WAITING_ROOM_BURST'],
+                                config['ADMISSION_TTL'], pool)
+        self.users = TokenBuckets(config['USER_BOOKING_RATE'], config['USER_BOOKING_BURST'])
+        self.bookings = TokenBucket(config['BOOKING_RATE'], config['BOOKING_BURST'])
+        self.writes = threading.BoundedSemaphore(config['WRITE_CONCURRENCY'])
+        self.write_timeout = config['WRITE_QUEUE_TIMEOUT']
+
+    def ticket(self):
+        """The session's queue ticket, issuing one if it has none, and whether the cookie needs setting.
+
+        Only for logged-in users: the ticket is kept in their session, so
+        every request of the session gets the same one.
+        """
+        value = session.get(SESSION_KEY)
+        ticket = self.room.loads(value)
+        if ticket is None:
+            ticket = self.room.issue()
+            value = session[SESSION_KEY] = self.room.dumps(ticket)
+        return ticket, request.cookies.get(TICKET_COOKIE) != value
+
+    def set_ticket(self, response, ticket):
+        max_age = int(ticket.wait(self.room.clock()) + self.room.ttl)
+        response.set_cookie(TICKET_COOKIE, session[SESSION_KEY], max_age=max_age, httponly=True, samesite='Lax')
+        return response
+
+
+def _control():
+    return current_app.extensions.get('admission')
+
+
+def _too_busy(status, reason, retry_after):
+    metrics.ADMISSION_REJECTIONS.inc(reason)
+    retry_after = max(1, math.ceil(retry_after))
+    response = current_app.response_class(
+        f"Bookings are very busy right now, please try again in {retry_after} s.\n",
+        status, mimetype='text/plain')
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+
+def waiting_room(view):
+    """Only let logged-in holders of an admitted queue ticket in; send the rest to /waiting-room."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        control = _control()
+        if control is None:
+            return view(*args, **kwargs)
+        if 'email' not in session:
+            return redirect(url_for('login'))
+        ticket, set_cookie = control.ticket()
+        if ticket.wait(control.room.clock()) > 0:
+            metrics.ADMISSION_REJECTIONS.inc('waiting_room')
+            # A form can't be replayed later; come back to the page instead
+            back = request.full_path.rstrip('?') if request.method == 'GET' else url_for('home')
+            return control.set_ticket(redirect(url_for('waiting_room_page', next=back)), ticket)
+        response = current_app.make_response(view(*args, **kwargs))
+        return control.set_ticket(response, ticket) if set_cookie else response
+    return wrapper
+
+
+def rate_limited(view):
+    """429 once the user's or the worker's token bucket for booking requests is empty."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        control = _control()
+        if control is not None:
+            wait = control.users.take(session.get('email') or request.remote_addr)
+            if wait:
+                return _too_busy(429, 'user_rate', wait)
+            wait = control.bookings.take()
+            if wait:
+                return _too_busy(429, 'booking_rate', wait)
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def write_limited(view):
+    """Run at most WRITE_CONCURRENCY of these at once; 503 after waiting too long for a turn."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        control = _control()
+        if control is None:
+            return view(*args, **kwargs)
+        if not control.writes.acquire(timeout=control.write_timeout):
+            return _too_busy(503, 'write_busy', control.write_timeout)
+        try:
+            return view(*args, **kwargs)
+        finally:
+            control.writes.release()
+    return wrapper
+
+
+def _safe_next(value):
+    # Only paths on this site, never //other.host
+    if value and value.startswith('/') and not value.startswith('//'):
+        return value
+    return url_for('home')
+
+
+def waiting_room_page():
+    control = _control()
+    next_url = _safe_next(request.args.get('next'))
+    if control is None:
+        return redirect(next_url)
+    if 'email' not in session:
+        return redirect(url_for('login'))
+    ticket, set_cookie = control.ticket()
+    now = control.room.clock()
+    wait = ticket.wait(now)
+    if not wait:
+        return control.set_ticket(redirect(next_url), ticket)
+    response = current_app.make_response(render_template(
+        'waiting_room.html', position=control.room.position(ticket, now), wait_seconds=math.ceil(wait),
+        refresh=min(REFRESH_SECONDS, math.ceil(wait)), next_url=next_url))
+    response.headers['Cache-Control'] = 'no-store'
+    return control.set_ticket(response, ticket) if set_cookie else response
+
+
+def waiting_room_status():
+    """{"admitted", "position", "wait_seconds"} for the session's ticket, issuing one if needed.
+
+    Requests with a valid ticket cookie are answered by _StatusApp instead.
+    """
+    control = _control()
+    if control is None:
+        return jsonify({'admitted': True, 'position': 0, 'wait_seconds': 0})
+    if 'email' not in session:
+        return jsonify({'error': 'Log in to get a place in the queue'}), 401
+    ticket, set_cookie = control.ticket()
+    response = current_app.response_class(control.room.status(ticket), mimetype='application/json')
+    response.headers['Cache-Control'] = 'no-store'
+    return control.set_ticket(response, ticket) if set_cookie else response
+
+
+class _StatusApp:
+    """WSGI wrapper answering /api/waiting-room polls of ticket holders without Flask."""
+
+    def __init__(self, wsgi_app, room):
+        self.wsgi_app = wsgi_app
+        self.room = room
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != '/api/waiting-room' or environ.get('REQUEST_METHOD') != 'GET':
+            return self.wsgi_app(environ, start_response)
+        ticket = self.room.loads(parse_cookie(environ).get(TICKET_COOKIE))
+        if ticket is None:
+            return self.wsgi_app(environ, start_response)
+        # Labels the request for metrics, as the Flask view would
+        environ['metrics.route'] = '/api/waiting-room'
+        body = self.room.status(ticket)
+        start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body))),
+                                  ('Cache-Control', 'no-store')])
+        return [body]
+
+
+def init_app(app, pool):
+    """Turn admission control on for `app` if ADMISSION_CONTROL is set, and serve the waiting room."""
+    app.add_url_rule('/waiting-room', 'waiting_room_page', waiting_room_page)
+    app.add_url_rule('/api/waiting-room', 'waiting_room_status', waiting_room_status)
+    if not app.config['ADMISSION_CONTROL']:
+        return None
+    control = app.extensions['admission'] = AdmissionControl(app.config, pool)
+    app.wsgi_app = _StatusApp(app.wsgi_app, control.room)
+    return control
@@ -0,0 +1,237 @@
+"""Hot/cold split of the bookings: past shows move to an archive database.
+
+The bookings and booking_seats tables only grew, and every dashboard
+query, seat reload and backup of database.db carried every booking ever
+made. Bookings of shows that started more than ARCHIVE_AFTER_DAYS days ago
+are now moved, with their seats, to tables of the same name and columns in
+ARCHIVE_DATABASE, which every pooled connection has ATTACHed as `archive`
+(see db.connect). The indexes are the same too, so booking_store's reads
+take schema='archive' and run unchanged against it: the dashboard lists
+the hot bookings and reads the archived ones only when asked to
+(/dashboard?archived=1, /api/bookings?archived=1).
+
+Bookings of a movie's default show (starts_at '') are never moved: that
+show never ends, and SeatInventory needs its sold seats in booking_seats.
+Nor are any moved while reports.py's backfill is still counting old
+bookings into the rollups.
+
+A batch is moved in two transactions: copied into the archive (INSERT OR
+IGNORE, by id), then deleted from the hot tables where the archive has
+them. In WAL mode SQLite commits atomically per database file, not across
+attached ones, so the copy is committed first; a crash in between leaves a
+booking in both, the next run deletes the hot copy, and archived reads skip
+bookings still in the hot table meanwhile. Ids are AUTOINCREMENT, so an
+archived id is never reused. The seat leases of the shows moved are
+deleted with them.
+
+The archive is only ever appended to: a booking is written and backed up
+once, while database.db stays the size of the bookings of upcoming and
+recent shows (SQLite reuses the pages freed by a move; the first run on a
+large database is worth a --vacuum to shrink the file). scan() reads the
+archive in large sequential batches for analytics.
+
+    python archive.py database.db archive.db [--days 7] [--vacuum]
+
+moves what is due now; the app does the same every ARCHIVE_INTERVAL seconds
+from a background thread in each worker process, once ARCHIVE_DATABASE is
+set. It is off by default: BEGIN IMMEDIATE takes the write lock of every
+attached file, so with an archive every booking, session and lease
+transaction takes archive.db's lock as well.
+"""
+import argparse
+import datetime
+import os
+import threading
+import time
+import traceback
+
+import db
+import metrics
+import migrations
+import reports
+
+DEFAULTS = {
+    # The archive database, ATTACHed to every connection as `archive` (None: no
+    # archive). Every write transaction then locks it too, hence off by default
+    'ARCHIVE_DATABASE': None,
+    # Bookings are archived this many days after their show started
+    'ARCHIVE_AFTER_DAYS': 7,
+    # Seconds between archive runs in each worker process (None: only `python archive.py`)
+    'ARCHIVE_INTERVAL': 3600,
+}
+
+# Schema name of the archive on every connection
+SCHEMA = 'archive'
+
+# Bookings moved per pair of transactions (whole shows, so up to a show's
+# worth more). Each holds the write lock of both files (BEGIN IMMEDIATE locks
+# every attached database), so this keeps the booking writer waiting for tens
+# of milliseconds at most
+BATCH_SIZE = 1000
+
+# Rows fetched per query by scan()
+SCAN_FETCH_SIZE = 5000
+
+# Booking columns, in the order both tables have them
+COLUMNS = ('id', 'email', 'movie', 'seats', 'total', 'show_id', 'payment_method', 'created_at')
+
+
+def create_tables(conn):
+    """The archive's tables and indexes, shaped like the hot ones after migration 2."""
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {SCHEMA}.bookings (
+                        id INTEGER PRIMARY KEY,
+                        email TEXT,
+                        movie TEXT,
+                        seats TEXT,
+                        total INTEGER,
+                        show_id INTEGER,
+                        payment_method TEXT,
+                        created_at TEXT
+                    )''')
+    conn.execute(f'''CREATE TABLE IF NOT EXISTS {SCHEMA}.booking_seats (
+                        show_id INTEGER NOT NULL,
+                        seat TEXT NOT NULL,
+                        booking_id INTEGER NOT NULL,
+                        tier TEXT,
+                        PRIMARY KEY (show_id, seat)
+                    ) WITHOUT ROWID''')
+    conn.execute(f'''CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_bookings_email
+                     ON bookings (email, id, movie, total, payment_method, created_at)''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_booking_seats_booking ON booking_seats (booking_id, seat)")
+    conn.commit()
+
+
+def attached(conn):
+    """Whether `conn` has the archive attached."""
+    return any(name == SCHEMA for _, name, _ in conn.execute("PRAGMA database_list"))
+
+
+def cutoff(days, now=None):
+    """shows.starts_at before which a show's bookings are archived."""
+    now = now or datetime.datetime.now()
+    return (now - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M')
+
+
+def due_shows(conn, before):
+    """Ids of the shows that started before `before` (shows.starts_at), oldest first."""
+    return [show_id for show_id, in conn.execute(
+        "SELECT id FROM shows WHERE starts_at != '' AND starts_at < ? ORDER BY starts_at, id", (before,))]
+
+
+def move(conn, ids):
+    """Move the bookings `ids` and their seats to the archive. Returns how many left the hot table."""
+    marks = ','.join('?' * len(ids))
+    columns = ', '.join(COLUMNS)
+    with db.write_transaction(conn):
+        conn.execute(f"INSERT OR IGNORE INTO {SCHEMA}.bookings ({columns}) "
+                     f"SELECT {columns} FROM main.bookings WHERE id IN ({marks}) ORDER BY id", ids)
+        conn.execute(f"INSERT OR IGNORE INTO {SCHEMA}.booking_seats (show_id, seat, booking_id, tier) "
+                     f"SELECT show_id, seat, booking_id, tier FROM main.booking_seats "
+                     f"WHERE booking_id IN ({marks})", ids)
+    # Only once the archive has them
+    with db.write_transaction(conn):
+        conn.execute(f"DELETE FROM main.booking_seats WHERE booking_id IN "
+                     f"(SELECT id FROM {SCHEMA}.bookings WHERE id IN ({marks}))", ids)
+        # Nobody holds seats of a past show any more (see leases.py)
+        conn.execute(f"DELETE FROM main.seat_leases WHERE show_id IN "
+                     f"(SELECT show_id FROM {SCHEMA}.bookings WHERE id IN ({marks}))", ids)
+        return conn.execute(f"DELETE FROM main.bookings WHERE id IN "
+                            f"(SELECT id FROM {SCHEMA}.bookings WHERE id IN ({marks}))", ids).rowcount
+
+
+def archive(conn, days, batch_size=BATCH_SIZE, progress=None, now=None):
+    """Move every booking of shows older than `days` days to the archive. Returns how many were moved."""
+    if reports.backfill_pending(conn):
+        # Its GROUP BY reads the hot tables; archive once it has counted them
+        return 0
+    moved = 0
+    ids = []
+    shows = due_shows(conn, cutoff(days, now))
+    for i, show_id in enumerate(shows):
+        # A show has at most a hall's worth of bookings, on idx_bookings_show
+        ids += [booking_id for booking_id, in conn.execute("SELECT id FROM bookings WHERE show_id = ?", (show_id,))]
+        if len(ids) >= batch_size or (ids and i == len(shows) - 1):
+            count = move(conn, sorted(ids))
+            metrics.BOOKINGS_ARCHIVED.inc(count)
+            moved += count
+            ids = []
+            if progress:
+                progress(moved)
+    return moved
+
+
+def scan(conn, columns=COLUMNS, fetch_size=SCAN_FETCH_SIZE):
+    """Every archived booking, in id order, as tuples of `columns`: a sequential read of the archive."""
+    cur = conn.execute(f"SELECT {', '.join(columns)} FROM {SCHEMA}.bookings ORDER BY id")
+    while True:
+        rows = cur.fetchmany(fetch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+class Archiver:
+    """Runs archive() every ARCHIVE_INTERVAL seconds on a daemon thread, once per process."""
+
+    def __init__(self, pool, config, logger):
+        self.pool = pool
+        self.logger = logger
+        self.enabled = bool(config['ARCHIVE_DATABASE'])
+        self.days = config['ARCHIVE_AFTER_DAYS']
+        self.interval = config['ARCHIVE_INTERVAL']
+        self._pid = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if not self.enabled or self.interval is None or self._pid == os.getpid():
+                return
+            self._stop = threading.Event()
+            threading.Thread(target=self._run, args=(self._stop,), name='booking-archiver', daemon=True).start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            self._stop.set()
+            self._pid = None
+
+    def _run(self, stop):
+        while not stop.wait(self.interval):
+            try:
+                with self.pool.connection() as conn:
+                    if reports.backfill_pending(conn):
+                        # archive() would skip the run; say so rather than move nothing quietly
+                        self.logger.warning("Bookings not archived: the reports backfill has not finished "
+                                            "(run `python reports.py <database>`)")
+                        continue
+                    archive(conn, self.days)
+            except Exception:
+                traceback.print_exc()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Move the bookings of past shows to the archive database.')
+    parser.add_argument('database')
+    parser.add_argument('archive', nargs='?', default='archive.db')
+    parser.add_argument('--days', type=float, default=DEFAULTS['ARCHIVE_AFTER_DAYS'])
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--vacuum', action='store_true',
+                        help='give the space freed in database.db back to the file system (after the first run)')
+    args = parser.parse_args()
+
+    conn = db.connect(args.database, attach={SCHEMA: args.archive})
+    migrations.migrate(conn)
+    create_tables(conn)
+    if reports.backfill_pending(conn):
+        print(f"{args.database}: run `python reports.py {args.database}` first")
+    start = time.perf_counter()
+    moved = archive(conn, args.days, args.batch_size, lambda count: print(f"  bookings: {count}"))
+    print(f"{args.database}: {moved} bookings moved to {args.archive} ({time.perf_counter() - start:.1f}s)")
+    if args.vacuum:
+        conn.execute("VACUUM main")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+"""Static asset build step and its url_for('static') integration.
+
+    python assets.py build
+
+writes static/dist/ from static/:
+
+  * every file copied under a content-hashed name (style.3f9c1a2b4d.css),
+    so it can be cached forever and a change gets a new URL
+  * CSS url() references rewritten to the hashed files, with a WebP
+    image-set() added after each background that has a WebP variant and,
+    after each rule with such a background, @media (max-width: ...) rules
+    that swap in the downscaled widths (1x and 2x) for narrow viewports
+  * .gz (and .br, if the brotli package is installed) next to text files
+  * with Pillow installed: images re-encoded (progressive JPEG, only kept
+    if smaller), downscaled widths and WebP variants for srcset
+  * manifest.json mapping logical names to all of the above
+
+init_app() loads the manifest; url_for('static', filename='style.css') then
+points at the hashed file, which is served with the best precompressed
+encoding the client accepts and an immutable Cache-Control. Without a
+build (no manifest) everything is served from static/ as before.
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+from io import BytesIO
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only .gz variants are built then
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; images are then only fingerprinted
+    Image = None
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# Hashed files never change, so clients may keep them for a year
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+COMPRESSIBLE = {'.css', '.js', '.svg', '.html', '.json', '.txt'}
+IMAGES = {'.jpg', '.jpeg', '.png'}
+
+# srcset widths generated for images wider than them
+IMAGE_WIDTHS = (240, 480, 640, 1280)
+JPEG_QUALITY = 80
+WEBP_QUALITY = 75
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+_CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+_CSS_BACKGROUND = re.compile(r"(background(?:-image)?\s*:)([^;{}]*);")
+# A rule with no rules inside it: (selector and whatever precedes it, declarations)
+_CSS_RULE = re.compile(r"([^{}]*)\{([^{}]*)\}")
+_CSS_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_CSS_IMAGE = re.compile(r"(?:url|(?:repeating-)?(?:linear|radial|conic)-gradient)\(")
+
+
+def _fingerprint(data):
+    return hashlib.blake2b(data, digest_size=5).hexdigest()
+
+
+def _hashed_name(name, data, suffix=''):
+    stem, ext = os.path.splitext(name)
+    return f"{stem}{suffix}.{_fingerprint(data)}{ext}"
+
+
+def _write(out_dir, name, data, encodings):
+    with open(os.path.join(out_dir, name), 'wb') as f:
+        f.write(data)
+    if os.path.splitext(name)[1] not in COMPRESSIBLE:
+        return
+    with open(os.path.join(out_dir, name + '.gz'), 'wb') as f:
+        f.write(gzip.compress(data, compresslevel=9, mtime=0))
+    encoded = ['gzip']
+    if brotli is not None:
+        with open(os.path.join(out_dir, name + '.br'), 'wb') as f:
+            f.write(brotli.compress(data, quality=11))
+        encoded.insert(0, 'br')
+    encodings[name] = encoded
+
+
+def _encode(image, fmt):
+    buffer = BytesIO()
+    if fmt == 'webp':
+        image.save(buffer, 'WEBP', quality=WEBP_QUALITY, method=6)
+    else:
+        image.convert('RGB').save(buffer, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def _build_image(name, data, path, out_dir, manifest):
+    entry = manifest['files'][name] = {'path': None, 'variants': []}
+    if Image is None:
+        entry['path'] = _hashed_name(name, data)
+        _write(out_dir, entry['path'], data, manifest['encodings'])
+        return
+    image = Image.open(path)
+    image.load()
+    width = image.width
+    optimized = _encode(image, 'jpeg')
+    if len(optimized) < len(data) and os.path.splitext(name)[1] in ('.jpg', '.jpeg'):
+        data = optimized
+    entry['path'] = _hashed_name(name, data)
+    _write(out_dir, entry['path'], data, manifest['encodings'])
+    stem = os.path.splitext(name)[0]
+    sizes = [w for w in IMAGE_WIDTHS if w < width] + [width]
+    for w in sizes:
+        scaled = image if w == width else image.resize((w, round(image.height * w / width)), Image.LANCZOS)
+        for fmt, ext in (('jpeg', '.jpg'), ('webp', '.webp')):
+            if w == width and fmt == 'jpeg':
+                variant_path, variant = entry['path'], data
+            else:
+                variant = _encode(scaled, fmt)
+                variant_path = _hashed_name(f"{stem}{ext}", variant, f"-{w}w")
+                _write(out_dir, variant_path, variant, manifest['encodings'])
+            entry['variants'].append({'width': w, 'type': f"image/{fmt}", 'path': variant_path,
+                                      'bytes': len(variant)})
+
+
+def _layer_images(value):
+    """The <image> of each layer of a background value (url(), a gradient or 'none')."""
+    layers, depth, start = [], 0, 0
+    for i, char in enumerate(value + ','):
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == ',' and depth == 0:
+            layers.append(value[start:i])
+            start = i + 1
+    images = []
+    for layer in layers:
+        match = _CSS_IMAGE.search(layer)
+        image = 'none'
+        if match:
+            depth = 0
+            for end in range(match.end() - 1, len(layer)):
+                depth += {'(': 1, ')': -1}.get(layer[end], 0)
+                if not depth:
+                    image = layer[match.start():end + 1]
+                    break
+        images.append(image)
+    return images
+
+
+def _responsive_backgrounds(selector, declarations, files, logical):
+    """@media rules giving `selector`'s background image its downscaled widths, or ''.
+
+    One rule per generated width below the image's own, largest first so the
+    narrowest matching one wins; each offers that width at 1x and the
+    smallest variant at least twice as wide at 2x.
+    """
+    backgrounds = _CSS_BACKGROUND.findall(declarations)
+    if not backgrounds:
+        return ''
+    # The last declaration is the one that applies
+    layers = []
+    for image in _layer_images(backgrounds[-1][1]):
+        url = _CSS_URL.fullmatch(image)
+        name = logical(url.group(2)) if url else None
+        layers.append((image, files[name]['variants'] if name else []))
+    widths = sorted({variant['width'] for _, variants in layers for variant in variants[:-2]}, reverse=True)
+    if not widths:
+        return ''
+
+    def pick(variants, fmt, width):
+        # The smallest at least `width` wide, else the full-width one
+        candidates = [variant for variant in variants if variant['type'] == f"image/{fmt}"]
+        return next((variant for variant in candidates if variant['width'] >= width), candidates[-1])['path']
+
+    rules = []
+    for width in widths:
+        fallback, sets = [], []
+        for image, variants in layers:
+            if not variants:
+                fallback.append(image)
+                sets.append(image)
+                continue
+            fallback.append(f"url('{pick(variants, 'jpeg', width)}')")
+            options = []
+            for fmt in ('webp', 'jpeg'):
+                one, two = pick(variants, fmt, width), pick(variants, fmt, 2 * width)
+                options.append(f"url('{one}') type('image/{fmt}') 1x")
+                if two != one:
+                    options.append(f"url('{two}') type('image/{fmt}') 2x")
+            sets.append(f"image-set({', '.join(options)})")
+        rules.append(f"@media (max-width: {width}px) {{\n  {selector} {{\n"
+                     f"    background-image: {', '.join(fallback)};\n"
+                     f"    background-image: {', '.join(sets)};\n  }}\n}}")
+    return '\n' + '\n'.join(rules)
+
+
+def _rewrite_css(css, manifest):
+    files = manifest['files']
+
+    def logical(ref):
+        name = ref.split('?')[0].split('#')[0]
+        for prefix in ('/static/', '../static/', './'):
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+        return name if name in files else None
+
+    def hashed(match):
+        name = logical(match.group(2))
+        return f"url('{files[name]['path']}')" if name else match.group(0)
+
+    def with_webp(match):
+        prop, value = match.groups()
+        rewritten = _CSS_URL.sub(hashed, value)
+        declaration = f"{prop}{rewritten};"
+
+        def image_set(url_match):
+            name = logical(url_match.group(2))
+            webp = [v for v in files[name]['variants'] if v['type'] == 'image/webp'] if name else []
+            if not webp:
+                return _CSS_URL.sub(hashed, url_match.group(0))
+            return (f"image-set(url('{webp[-1]['path']}') type('image/webp'), "
+                    f"url('{files[name]['path']}') type('image/jpeg'))")
+
+        with_sets = _CSS_URL.sub(image_set, value)
+        if with_sets != rewritten:
+            # Browsers without image-set() ignore the second declaration
+            declaration += f"\n  {prop}{with_sets};"
+        return declaration
+
+    def responsive(match):
+        selector, declarations = match.groups()
+        # Whatever precedes the selector (comments, @import ...;) is left out
+        selector = ' '.join(_CSS_COMMENT.sub('', selector).rpartition(';')[2].split())
+        if not selector or selector.startswith('@'):
+            return match.group(0)
+        return match.group(0) + _responsive_backgrounds(selector, declarations, files, logical)
+
+    css = _CSS_RULE.sub(responsive, css)
+    return _CSS_URL.sub(hashed, _CSS_BACKGROUND.sub(with_webp, css))
+
+
+def build(static_dir):
+    """Rebuild static_dir/dist and its manifest; returns the manifest."""
+    out_dir = os.path.join(static_dir, DIST)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.makedirs(out_dir)
+    manifest = {'files': {}, 'encodings': {}}
+    names = sorted(name for name in os.listdir(static_dir) if os.path.isfile(os.path.join(static_dir, name)))
+    # Images first, so the CSS can refer to their hashed names
+    names.sort(key=lambda name: os.path.splitext(name)[1] == '.css')
+    for name in names:
+        path = os.path.join(static_dir, name)
+        with open(path, 'rb') as f:
+            data = f.read()
+        ext = os.path.splitext(name)[1].lower()
+        if ext in IMAGES:
+            _build_image(name, data, path, out_dir, manifest)
+            continue
+        if ext == '.css':
+            data = _rewrite_css(data.decode(), manifest).encode()
+        hashed = _hashed_name(name, data)
+        _write(out_dir, hashed, data, manifest['encodings'])
+        manifest['files'][name] = {'path': hashed, 'variants': []}
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+class Assets:
+    """The loaded manifest of one app, and the static view that serves it."""
+
+    def __init__(self, app):
+        self.app = app
+        self.dist_dir = os.path.join(app.static_folder, DIST)
+        self.enabled = True
+        self.files = {}
+        self.encodings = {}
+        path = os.path.join(self.dist_dir, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            self.files = manifest['files']
+            self.encodings = manifest['encodings']
+
+    def url_defaults(self, endpoint, values):
+        if endpoint == 'static' and self.enabled:
+            entry = self.files.get(values.get('filename'))
+            if entry is not None:
+                values['filename'] = f"{DIST}/{entry['path']}"
+
+    def srcset(self, filename, image_type='image/jpeg'):
+        """'url 240w, url 480w, ...' for an image, or '' if it has no variants."""
+        entry = self.files.get(filename) if self.enabled else None
+        if not entry:
+            return ''
+        static = self.app.static_url_path
+        return ', '.join(f"{static}/{DIST}/{variant['path']} {variant['width']}w"
+                         for variant in entry['variants'] if variant['type'] == image_type)
+
+    def send_static_file(self, filename):
+        if not filename.startswith(DIST + '/'):
+            return self.app.send_static_file(filename)
+        name = filename[len(DIST) + 1:]
+        mimetype = mimetypes.guess_type(name)[0]
+        available = self.encodings.get(name, ())
+        for encoding, suffix in ENCODINGS:
+            if encoding in available and encoding in request.accept_encodings:
+                response = send_from_directory(self.dist_dir, name + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(self.dist_dir, name, mimetype=mimetype)
+        if available:
+            response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+
+def init_app(app):
+    """Serve fingerprinted assets from static/dist when `python assets.py build` has run."""
+    assets = Assets(app)
+    app.extensions['assets'] = assets
+    app.url_defaults(assets.url_defaults)
+    app.view_functions['static'] = assets.send_static_file
+    app.jinja_env.globals['asset_srcset'] = assets.srcset
+    return assets
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build fingerprinted, precompressed static assets.')
+    parser.add_argument('command', choices=['build'])
+    parser.add_argument('--static-dir', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    args = parser.parse_args()
+    manifest = build(args.static_dir)
+    print(f"Built {len(manifest['files'])} assets into {os.path.join(args.static_dir, DIST)}"
+          f"{'' if Image else ' (Pillow not installed: no image variants)'}"
+          f"{'' if brotli else ' (brotli not installed: gzip only)'}")
+
+
+if __name__ == '__main__':
+    main()
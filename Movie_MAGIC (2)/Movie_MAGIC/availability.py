@@ -0,0 +1,141 @@
+"""Compact seat availability for /api/shows/<id>/availability.
+
+The body is a small JSON document describing the auditorium and which
+seats can't be picked (sold or held):
+
+    {"rows": "ABCDEFGHIJ", "seats_per_row": 8,
+     "tiers": [["premium", "A", "E", 250], ["gold", "F", "J", 170]],
+     "encoding": "rle", "taken": "BgIo"}
+
+`taken` is base64 of either
+  * "bitmap": one bit per seat in SeatLayout.index() order, least
+    significant bit first, or
+  * "rle": lengths of alternating runs of free and taken seats, starting
+    with free, each as an unsigned LEB128 varint,
+whichever is shorter. Halls that fill up in blocks encode to a few bytes
+and no hall costs more than its bitmap, so the body stays at a few hundred
+bytes for thousands of seats.
+
+Bodies are cached per show and rebuilt only when SeatInventory.version()
+changes; the ETag is a hash of the body, so it is the same in every worker
+that sees the same seats. The view in movie_magic.py answers the first
+request for a show; after that init_app()'s WSGI wrapper answers from the
+cache without going through Flask routing, sessions or request hooks.
+"""
+import base64
+import json
+import re
+import threading
+import time
+
+from werkzeug.http import parse_etags
+
+from page_cache import etag_for
+
+# Sold seats are re-read from booking_seats at most this often per show, to
+# pick up sales made by other worker processes
+REFRESH_INTERVAL = 2.0
+
+
+def encode_runs(bitmap, capacity):
+    """Run lengths of free/taken seats in `bitmap` as LEB128 varints."""
+    out = bytearray()
+    taken = False
+    run = 0
+    for index in range(capacity):
+        if bool(bitmap[index >> 3] & (1 << (index & 7))) != taken:
+            _varint(out, run)
+            taken = not taken
+            run = 0
+        run += 1
+    _varint(out, run)
+    return bytes(out)
+
+
+def _varint(out, value):
+    while value > 0x7F:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def encode(layout, bitmap, prices):
+    """The availability JSON body for a show whose unavailable seats are `bitmap`."""
+    runs = encode_runs(bitmap, layout.capacity)
+    encoding, taken = ('rle', runs) if len(runs) < len(bitmap) else ('bitmap', bytes(bitmap))
+    return json.dumps({
+        'rows': layout.rows,
+        'seats_per_row': layout.seats_per_row,
+        'tiers': [[name, first, last, prices.get(name)] for name, first, last in layout.tiers],
+        'encoding': encoding,
+        'taken': base64.b64encode(taken).decode(),
+    }, separators=(',', ':')).encode()
+
+
+class AvailabilityCache:
+    """Encoded availability per show, rebuilt when the show's seats change."""
+
+    def __init__(self, inventory, pool, prices, refresh_interval=REFRESH_INTERVAL):
+        self.inventory = inventory
+        self.pool = pool
+        self.prices = prices
+        self.refresh_interval = refresh_interval
+        # show -> (inventory version, body, etag)
+        self._bodies = {}
+        # show -> time.monotonic() of the last read of booking_seats
+        self._refreshed = {}
+        self._lock = threading.Lock()
+
+    def known(self, show):
+        """Whether `show` has been served before (and so exists)."""
+        return show in self._bodies
+
+    def get(self, show):
+        """(body, etag) for `show`."""
+        now = time.monotonic()
+        if now - self._refreshed.get(show, 0) >= self.refresh_interval:
+            self._refreshed[show] = now
+            with self.pool.connection() as conn:
+                self.inventory.refresh(conn, show)
+        version = self.inventory.version(show)
+        cached = self._bodies.get(show)
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2]
+        with self._lock:
+            version, bitmap = self.inventory.snapshot(show)
+            body = encode(self.inventory.layout, bitmap, self.prices)
+            etag = etag_for(body)
+            self._bodies[show] = (version, body, etag)
+        return body, etag
+
+
+_PATH = re.compile(r"/api/shows/(\d+)/availability\Z")
+
+
+class _AvailabilityApp:
+    """WSGI wrapper answering availability polls for known shows from the cache."""
+
+    def __init__(self, wsgi_app, cache):
+        self.wsgi_app = wsgi_app
+        self.cache = cache
+
+    def __call__(self, environ, start_response):
+        match = _PATH.match(environ.get('PATH_INFO', ''))
+        method = environ.get('REQUEST_METHOD')
+        if match is None or method not in ('GET', 'HEAD') or not self.cache.known(int(match.group(1))):
+            return self.wsgi_app(environ, start_response)
+        # Labels the request for metrics, as the Flask view would
+        environ['metrics.route'] = '/api/shows/<int:show_id>/availability'
+        body, etag = self.cache.get(int(match.group(1)))
+        headers = [('ETag', f'"{etag}"'), ('Cache-Control', 'no-cache')]
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and (if_none_match == f'"{etag}"' or parse_etags(if_none_match).contains(etag)):
+            start_response('304 NOT MODIFIED', headers)
+            return []
+        start_response('200 OK', headers + [('Content-Type', 'application/json'),
+                                            ('Content-Length', str(len(body)))])
+        return [] if method == 'HEAD' else [body]
+
+
+def init_app(app, cache):
+    app.wsgi_app = _AvailabilityApp(app.wsgi_app, cache)
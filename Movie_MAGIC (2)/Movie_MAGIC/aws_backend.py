@@ -0,0 +1,184 @@
+"""The 'aws' backend: DynamoDB copies of bookings and SNS notifications.
+
+Bookings are written to SQLite as with the 'sqlite' backend; the DynamoDB
+item and the SNS messages are queued in the outbox inside the booking
+transaction and delivered by the outbox worker, so requests make no AWS
+calls.
+
+boto3 clients, resources and Table objects are created on first use in
+each process (boto3 itself is only imported then), so importing the app
+makes no AWS calls and forked workers never share a client, or its HTTP
+connection pool, with their parent.
+"""
+import os
+import threading
+
+import dynamo_bookings
+import metrics
+import outbox
+from aws_batch import DynamoBatchWriter, SnsDigest
+from dynamo_bookings import BookingReader
+
+DEFAULTS = {
+    'AWS_REGION': 'us-east-1',
+    'USERS_TABLE': 'movie ticket_user',
+    # Keyed on email + booking_key with a show-index GSI (see dynamo_bookings.py).
+    # The old 'movie ticket_booking' table was keyed on email_title, so repeat
+    # bookings of a movie overwrote each other.
+    'BOOKINGS_TABLE': 'movie ticket_booking_v2',
+    'SNS_TOPIC_ARN': 'arn:aws:sns:us-east-1:495599749771:movieticket_topic',
+    # Booking items are written with batch_write_item, up to this many per outbox round
+    'DYNAMODB_BATCH_SIZE': 100,
+    # "New Movie Booking Alert" messages are merged into one digest per this many
+    # alerts, or once the oldest alert has waited this many seconds
+    'SNS_DIGEST_MAX_MESSAGES': 50,
+    'SNS_DIGEST_MAX_WAIT': 60,
+    # Serve /dashboard from DynamoDB (Query + cache) instead of the local SQLite copy
+    # (MOVIE_MAGIC_DASHBOARD_FROM_DYNAMODB=true)
+    'DASHBOARD_FROM_DYNAMODB': False,
+    # Also count seats sold in DynamoDB (by any instance, on any database) as
+    # sold in seat availability and when booking
+    'AVAILABILITY_FROM_DYNAMODB': False,
+    # Seconds a worker serves cached DynamoDB reads; other workers only see a
+    # new booking once their copy expires (see dynamo_bookings.CACHE_TTL)
+    'DYNAMODB_CACHE_TTL': dynamo_bookings.CACHE_TTL,
+}
+
+
+def boto3_factory(service, region):
+    """boto3.resource('dynamodb') or boto3.client(service) for `region`."""
+    import boto3  # about 0.3 s to import, so only processes that talk to AWS pay for it
+    if service == 'dynamodb':
+        return boto3.resource('dynamodb', region_name=region)
+    return boto3.client(service, region_name=region)
+
+
+class AWSBackend:
+    name = 'aws'
+
+    def __init__(self, config, pool, show_keys, logger, factory=boto3_factory):
+        self.config = config
+        self.logger = logger
+        # Show id -> booking_store.show_key(), the show's name in DynamoDB
+        self.show_keys = show_keys
+        # factory(service, region) -> client; benchmarks swap in aws_fakes
+        self.factory = factory
+        self._objects = {}
+        self._pid = None
+        # Reentrant: creating bookings_writer creates dynamodb
+        self._lock = threading.RLock()
+        self.handlers = {
+            'dynamodb_put': outbox.BatchHandler(self.put_booking_items, config['DYNAMODB_BATCH_SIZE']),
+            'sns_alert': outbox.BatchHandler(self.send_alert_digest, config['SNS_DIGEST_MAX_MESSAGES'],
+                                             config['SNS_DIGEST_MAX_WAIT']),
+            'sns_publish': self.publish_notification,
+        }
+        # Delivers the DynamoDB writes and SNS messages queued by record_booking()
+        self.outbox_worker = outbox.OutboxWorker(pool, self.handlers, logger)
+
+    def _lazy(self, name, create):
+        """The process's `name` object, created on first use after start-up or a fork."""
+        objects = self._objects
+        if self._pid == os.getpid() and name in objects:
+            return objects[name]
+        with self._lock:
+            if self._pid != os.getpid():
+                self._objects = {}
+                self._pid = os.getpid()
+            if name not in self._objects:
+                self._objects[name] = create()
+            return self._objects[name]
+
+    # Every call is timed for /metrics
+    @property
+    def dynamodb(self):
+        return self._lazy('dynamodb', lambda: metrics.timed_aws(
+            self.factory('dynamodb', self.config['AWS_REGION']), 'dynamodb'))
+
+    @property
+    def sns(self):
+        return self._lazy('sns', lambda: metrics.timed_aws(self.factory('sns', self.config['AWS_REGION']), 'sns'))
+
+    @property
+    def users_table(self):
+        return self._lazy('users_table', lambda: self.dynamodb.Table(self.config['USERS_TABLE']))
+
+    @property
+    def bookings_table(self):
+        return self._lazy('bookings_table', lambda: self.dynamodb.Table(self.config['BOOKINGS_TABLE']))
+
+    @property
+    def seat_leases_table(self):
+        return self._lazy('seat_leases_table', lambda: self.dynamodb.Table(self.config['SEAT_LEASES_TABLE']))
+
+    @property
+    def bookings_writer(self):
+        return self._lazy('bookings_writer', lambda: DynamoBatchWriter(
+            self.dynamodb, self.config['BOOKINGS_TABLE'], key_names=dynamo_bookings.KEY_NAMES))
+
+    @property
+    def alert_digest(self):
+        return self._lazy('alert_digest', lambda: SnsDigest(self.sns, self.config['SNS_TOPIC_ARN']))
+
+    # Cached Query reads of user and show bookings
+    @property
+    def booking_reader(self):
+        return self._lazy('booking_reader', lambda: BookingReader(self.bookings_table,
+                                                                  ttl=self.config['DYNAMODB_CACHE_TTL']))
+
+    def start(self):
+        self.outbox_worker.start()
+
+    def stop(self, timeout=None):
+        self.outbox_worker.stop(timeout)
+
+    # Outbox handlers: these run on the outbox worker threads, never in a request
+    def put_booking_items(self, payloads):
+        items = [payload['item'] for payload in payloads]
+        errors = self.bookings_writer.write(items)
+        for item, error in zip(items, errors):
+            if error is None:
+                self.booking_reader.invalidate(item)
+        return errors
+
+    def send_alert_digest(self, payloads):
+        return self.alert_digest.send(payloads)
+
+    def publish_notification(self, payload):
+        self.sns.publish(TopicArn=self.config['SNS_TOPIC_ARN'], Message=payload['message'],
+                         Subject=payload['subject'])
+
+    def record_booking(self, conn, email, hold, payment_method, created_at):
+        """Queue the DynamoDB item and SNS messages in the booking transaction on `conn`."""
+        outbox.enqueue(conn, 'dynamodb_put', {'item': dynamo_bookings.booking_item(
+            email, hold.booking_id, self.show_keys(hold.show), hold.movie, hold.seats, hold.total, payment_method,
+            created_at)})
+        outbox.enqueue(conn, 'sns_alert', {
+            'subject': 'New Movie Booking Alert',
+            'message': f"New Booking!\nUser: {email}\nMovie: {hold.movie}\nSeats: {', '.join(hold.seats)}\nTotal: ₹{hold.total}"
+        })
+        outbox.enqueue(conn, 'sns_publish', {
+            'subject': 'Movie Booking Confirmation',
+            'message': f"Booking Confirmed for {hold.movie} - Seats: {hold.seats} - Payment Method: {payment_method}"
+        })
+
+    def booking_committed(self):
+        self.outbox_worker.notify()
+
+    def dashboard_bookings(self, email):
+        """The user's bookings from DynamoDB, or None to read them from SQLite."""
+        if not self.config['DASHBOARD_FROM_DYNAMODB']:
+            return None
+        try:
+            return self.booking_reader.dashboard_bookings(email)
+        except Exception:
+            self.logger.exception("DynamoDB dashboard read failed, using SQLite")
+            return None
+
+    def sold_seats(self, show):
+        """Seats of `show` sold according to DynamoDB; none if it can't be read (SQLite still counts)."""
+        try:
+            return self.booking_reader.sold_seats(self.show_keys(show))
+        except Exception:
+            self.logger.exception("DynamoDB seat read failed, using SQLite only")
+            return frozenset()
@@ -0,0 +1,168 @@
+"""Batched DynamoDB writes and coalesced SNS alerts for the outbox worker.
+
+One put_item and one publish per booking means thousands of tiny calls
+(and throttling) at peak. DynamoBatchWriter sends booking items through
+batch_write_item in chunks of 25, retrying UnprocessedItems with backoff.
+SnsDigest folds many "New Movie Booking Alert" messages into one digest
+publish. Both are plugged into OutboxWorker as batch handlers, so batching
+never gives up the outbox's durability: rows are only deleted after the
+batch call that carried them succeeded.
+"""
+import random
+import threading
+import time
+
+import metrics
+
+# DynamoDB accepts at most 25 put/delete requests per BatchWriteItem call
+DYNAMODB_BATCH_LIMIT = 25
+
+# SNS rejects messages over 256 KB; keep digests well below that
+SNS_MAX_BYTES = 200 * 1024
+
+
+class BatchMetrics:
+    """Counters for one batching client: calls made vs. calls saved, flush latency.
+
+    Every flush is also recorded in metrics.REGISTRY under `client`, for /metrics.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.items = 0
+        self.calls = 0
+        self.retries = 0
+        self.flushes = 0
+        self.flush_seconds_total = 0.0
+        self.flush_seconds_max = 0.0
+        self._lock = threading.Lock()
+
+    def record_flush(self, items, calls, seconds, retries=0):
+        with self._lock:
+            self.items += items
+            self.calls += calls
+            self.retries += retries
+            self.flushes += 1
+            self.flush_seconds_total += seconds
+            self.flush_seconds_max = max(self.flush_seconds_max, seconds)
+        metrics.AWS_BATCH_ITEMS.inc(self.client, amount=items)
+        metrics.AWS_BATCH_CALLS.inc(self.client, amount=calls)
+        # One call per item is what the unbatched code made
+        metrics.AWS_BATCH_CALLS_SAVED.inc(self.client, amount=items - calls)
+        metrics.AWS_BATCH_RETRIES.inc(self.client, amount=retries)
+        metrics.AWS_BATCH_FLUSH_SECONDS.observe(seconds, self.client)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'items': self.items,
+                'calls': self.calls,
+                # One call per item is what the unbatched code made
+                'calls_saved': self.items - self.calls,
+                'retries': self.retries,
+                'flushes': self.flushes,
+                'flush_seconds_avg': self.flush_seconds_total / self.flushes if self.flushes else 0.0,
+                'flush_seconds_max': self.flush_seconds_max,
+            }
+
+
+class DynamoBatchWriter:
+    """Put many items into one table with batch_write_item."""
+
+    def __init__(self, dynamodb, table_name, key_names=('booking_id',), max_retries=6,
+                 base_delay=0.05, max_delay=2.0):
+        self.dynamodb = dynamodb
+        self.table_name = table_name
+        self.key_names = key_names
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = BatchMetrics('dynamodb')
+
+    def write(self, items):
+        """Write `items`; returns one error (or None) per item, in order."""
+        start = time.perf_counter()
+        errors = [None] * len(items)
+        calls = 0
+        retries = 0
+        # A batch may not contain the same key twice. Later puts overwrite
+        # earlier ones anyway, so only the last item per key is sent.
+        latest = {}
+        for index, item in enumerate(items):
+            latest[tuple(item.get(name) for name in self.key_names)] = index
+        pending = [(index, items[index]) for index in sorted(latest.values())]
+        for offset in range(0, len(pending), DYNAMODB_BATCH_LIMIT):
+            chunk = pending[offset:offset + DYNAMODB_BATCH_LIMIT]
+            attempt = 0
+            while chunk:
+                requests = [{'PutRequest': {'Item': item}} for _, item in chunk]
+                calls += 1
+                try:
+                    response = self.dynamodb.batch_write_item(RequestItems={self.table_name: requests})
+                except Exception as e:
+                    for index, _ in chunk:
+                        errors[index] = f"{type(e).__name__}: {e}"
+                    break
+                unprocessed = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                if not unprocessed:
+                    break
+                # Throttled items come back unchanged; match them up again by value
+                left = [request['PutRequest']['Item'] for request in unprocessed]
+                chunk = [(index, item) for index, item in chunk if any(item == other for other in left)]
+                attempt += 1
+                if attempt > self.max_retries:
+                    for index, _ in chunk:
+                        errors[index] = 'UnprocessedItems after retries'
+                    break
+                retries += 1
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        self.metrics.record_flush(len(items), calls, time.perf_counter() - start, retries)
+        return errors
+
+
+class SnsDigest:
+    """Publish many alert messages as one digest message per topic."""
+
+    def __init__(self, sns_client, topic_arn, subject='Movie Booking Digest', max_bytes=SNS_MAX_BYTES):
+        self.sns_client = sns_client
+        self.topic_arn = topic_arn
+        self.subject = subject
+        self.max_bytes = max_bytes
+        self.metrics = BatchMetrics('sns')
+
+    def _digests(self, messages):
+        separator = '\n\n----\n\n'
+        current = []
+        size = 0
+        for message in messages:
+            length = len(message.encode()) + len(separator)
+            if current and size + length > self.max_bytes:
+                yield current
+                current, size = [], 0
+            current.append(message)
+            size += length
+        if current:
+            yield current
+
+    def send(self, payloads):
+        """Publish `payloads` (dicts with 'message') as digests; one error (or None) each."""
+        start = time.perf_counter()
+        errors = []
+        calls = 0
+        for group in self._digests([payload['message'] for payload in payloads]):
+            calls += 1
+            if len(group) == 1:
+                subject = payloads[len(errors)].get('subject', self.subject)
+                message = group[0]
+            else:
+                subject = f"{self.subject} ({len(group)} bookings)"
+                message = '\n\n----\n\n'.join(group)
+            try:
+                self.sns_client.publish(TopicArn=self.topic_arn, Message=message, Subject=subject)
+            except Exception as e:
+                errors.extend([f"{type(e).__name__}: {e}"] * len(group))
+            else:
+                errors.extend([None] * len(group))
+        self.metrics.record_flush(len(payloads), calls, time.perf_counter() - start)
+        return errors
@@ -0,0 +1,231 @@
+"""In-process stand-ins for the DynamoDB and SNS calls AWS_app.py makes.
+
+They accept the same arguments as the boto3 objects they replace, keep what
+they receive in memory and can simulate network latency and failures, so
+AWS_app.py can be exercised and benchmarked without an AWS account:
+
+    dynamodb = FakeDynamoResource(latency=0.02)
+    sns = FakeSNS(latency=0.03, failure_rate=0.1)
+"""
+import copy
+import random
+import threading
+import time
+
+
+class FakeAWSError(Exception):
+    """Raised for injected failures, like a botocore ClientError would be."""
+
+
+class ConditionalCheckFailed(FakeAWSError):
+    """Raised when a ConditionExpression doesn't hold, with the code botocore's ClientError carries."""
+
+    def __init__(self, operation):
+        super().__init__(f"The conditional request failed in {operation}")
+        self.response = {'Error': {'Code': 'ConditionalCheckFailedException'}}
+
+
+class _FakeService:
+    def __init__(self, latency=0.0, failure_rate=0.0, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, operation):
+        with self._lock:
+            self.calls += 1
+            fail = self._rng.random() < self.failure_rate
+        if self.latency:
+            time.sleep(self.latency)
+        if fail:
+            raise FakeAWSError(f"Injected failure in {operation}")
+
+
+def _conditions(condition):
+    """Flatten a boto3 Key(...) condition into [(operator, attribute, value)]."""
+    kind = type(condition).__name__
+    if kind == 'And':
+        return _conditions(condition._values[0]) + _conditions(condition._values[1])
+    key, *values = condition._values
+    return [(kind, key.name, values)]
+
+
+def _matches(item, conditions):
+    for kind, name, values in conditions:
+        value = item.get(name)
+        if value is None:
+            return False
+        if kind == 'Equals' and value != values[0]:
+            return False
+        if kind == 'BeginsWith' and not str(value).startswith(values[0]):
+            return False
+        if kind == 'Between' and not values[0] <= value <= values[1]:
+            return False
+        if kind == 'GreaterThan' and not value > values[0]:
+            return False
+        if kind == 'LessThan' and not value < values[0]:
+            return False
+    return True
+
+
+def _holds(item, condition):
+    """Whether `item` (None: no such item) satisfies a boto3 Attr(...) condition."""
+    kind = type(condition).__name__
+    if kind in ('And', 'Or'):
+        results = [_holds(item, part) for part in condition._values]
+        return all(results) if kind == 'And' else any(results)
+    if kind == 'Not':
+        return not _holds(item, condition._values[0])
+    attribute, *values = condition._values
+    exists = item is not None and attribute.name in item
+    if kind == 'AttributeNotExists':
+        return not exists
+    if kind == 'AttributeExists':
+        return exists
+    return exists and _matches(item, [(kind, attribute.name, values)])
+
+
+class FakeTable(_FakeService):
+    """DynamoDB table keyed on `key_names` (partition key, optional sort key).
+
+    indexes maps a GSI name to its (partition key, sort key) names; query()
+    supports Key() conditions, Limit/ExclusiveStartKey pagination,
+    ScanIndexForward and ProjectionExpression. put_item() and delete_item()
+    check an Attr() ConditionExpression atomically, as DynamoDB does.
+    """
+
+    def __init__(self, name, key_names=('booking_id',), indexes=None, **kwargs):
+        super().__init__(**kwargs)
+        self.name = name
+        self.key_names = tuple(key_names)
+        self.indexes = indexes or {}
+        self.items = {}
+
+    def configure(self, key_names, indexes=None):
+        self.key_names = tuple(key_names)
+        self.indexes = indexes or {}
+        self.items = {}
+
+    def wait_until_exists(self):
+        pass
+
+    def query(self, KeyConditionExpression, IndexName=None, Limit=None, ExclusiveStartKey=None,
+              ScanIndexForward=True, ProjectionExpression=None, **kwargs):
+        self._call('Query')
+        index_keys = self.indexes[IndexName] if IndexName else self.key_names
+        sort_key = index_keys[1] if len(index_keys) > 1 else None
+        page_keys = list(dict.fromkeys(self.key_names + tuple(index_keys)))
+        conditions = _conditions(KeyConditionExpression)
+        with self._lock:
+            # GSIs are sparse: items without the index keys are not in them
+            items = [item for item in self.items.values()
+                     if all(name in item for name in index_keys) and _matches(item, conditions)]
+        if sort_key:
+            items.sort(key=lambda item: item[sort_key], reverse=not ScanIndexForward)
+        if ExclusiveStartKey:
+            marker = tuple(ExclusiveStartKey[name] for name in page_keys)
+            positions = [i for i, item in enumerate(items) if tuple(item[name] for name in page_keys) == marker]
+            items = items[positions[0] + 1:] if positions else []
+        response = {}
+        if Limit is not None and len(items) > Limit:
+            items = items[:Limit]
+            response['LastEvaluatedKey'] = {name: items[-1][name] for name in page_keys}
+        if ProjectionExpression:
+            names = [name.strip() for name in ProjectionExpression.split(',')]
+            items = [{name: item[name] for name in names if name in item} for item in items]
+        response['Items'] = [copy.deepcopy(item) for item in items]
+        response['Count'] = len(items)
+        return response
+
+    def _key(self, item):
+        return tuple(item[name] for name in self.key_names)
+
+    def put_item(self, Item, ConditionExpression=None, **kwargs):
+        self._call('PutItem')
+        key = self._key(Item)
+        with self._lock:
+            if ConditionExpression is not None and not _holds(self.items.get(key), ConditionExpression):
+                raise ConditionalCheckFailed('PutItem')
+            self.items[key] = copy.deepcopy(Item)
+        return {}
+
+    def get_item(self, Key, **kwargs):
+        self._call('GetItem')
+        with self._lock:
+            item = self.items.get(self._key(Key))
+        return {'Item': copy.deepcopy(item)} if item is not None else {}
+
+    def delete_item(self, Key, ConditionExpression=None, **kwargs):
+        self._call('DeleteItem')
+        key = self._key(Key)
+        with self._lock:
+            if ConditionExpression is not None and not _holds(self.items.get(key), ConditionExpression):
+                raise ConditionalCheckFailed('DeleteItem')
+            self.items.pop(key, None)
+        return {}
+
+
+class FakeDynamoResource(_FakeService):
+    """Stand-in for boto3.resource('dynamodb').
+
+    unprocessed_rate is the chance that each request of a batch_write_item
+    call comes back in UnprocessedItems, as it does when throttled.
+    """
+
+    def __init__(self, key_names=None, unprocessed_rate=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.key_names = key_names or {}
+        self.unprocessed_rate = unprocessed_rate
+        self.kwargs = kwargs
+        self.tables = {}
+
+    def Table(self, name):
+        if name not in self.tables:
+            self.tables[name] = FakeTable(name, self.key_names.get(name, ('booking_id',)), **self.kwargs)
+        return self.tables[name]
+
+    def create_table(self, TableName, KeySchema, GlobalSecondaryIndexes=(), **kwargs):
+        """Set up (or reset) the key schema of a table, like the real create_table."""
+        def key_names(schema):
+            return tuple(key['AttributeName'] for key in sorted(schema, key=lambda key: key['KeyType'] != 'HASH'))
+        table = self.Table(TableName)
+        table.configure(key_names(KeySchema),
+                        {index['IndexName']: key_names(index['KeySchema']) for index in GlobalSecondaryIndexes})
+        return table
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise FakeAWSError("ValidationException: too many items requested for the BatchWriteItem call")
+        self._call('BatchWriteItem')
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            table = self.Table(name)
+            keys = [table._key(request['PutRequest']['Item']) for request in requests]
+            if len(set(keys)) != len(keys):
+                raise FakeAWSError("ValidationException: Provided list of item keys contains duplicates")
+            for request in requests:
+                with self._lock:
+                    throttled = self._rng.random() < self.unprocessed_rate
+                if throttled:
+                    unprocessed.setdefault(name, []).append(request)
+                    continue
+                item = request['PutRequest']['Item']
+                with table._lock:
+                    table.items[table._key(item)] = copy.deepcopy(item)
+        return {'UnprocessedItems': unprocessed}
+
+
+class FakeSNS(_FakeService):
+    """Stand-in for boto3.client('sns')."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.messages = []
+
+    def publish(self, TopicArn, Message, Subject=None, **kwargs):
+        self._call('Publish')
+        with self._lock:
+            self.messages.append({'TopicArn': TopicArn, 'Subject': Subject, 'Message': Message})
+            return {'MessageId': str(len(self.messages))}
@@ -0,0 +1,55 @@
+"""Shared helpers for the benchmark scripts: load an app on a scratch database."""
+import os
+import sys
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, APP_DIR)
+
+import aws_fakes  # noqa: E402
+import dynamo_bookings  # noqa: E402
+import leases  # noqa: E402
+import movie_magic  # noqa: E402
+
+# The backend each of the old entry points runs
+BACKENDS = {'app': 'sqlite', 'AWS_app': 'aws'}
+
+# Benchmarks that aren't about signing in don't spend ~100 ms per user
+# hashing its password (bench_login.py measures that)
+CHEAP_PASSWORDS = {'SCRYPT_N': 2 ** 4}
+
+
+def load_app(name, workdir, dynamodb=None, sns=None, config=None):
+    """Create the app.py ('app') or AWS_app.py ('AWS_app') app with its SQLite and ticket files under `workdir`.
+
+    The 'aws' backend gets the in-process fakes from aws_fakes instead of
+    real boto3 clients; `config` overrides CHEAP_PASSWORDS and other
+    settings of movie_magic.DEFAULTS. Returns the started movie_magic.MovieMagic, whose
+    .app, .pool, .catalog, .pages, .holds and .backend the benchmarks use.
+    """
+    os.chdir(workdir)
+    app = movie_magic.create_app({'BACKEND': BACKENDS[name], 'TESTING': True, **CHEAP_PASSWORDS,
+                                  'TICKET_DIR': os.path.join(workdir, 'tickets'), **(config or {})})
+    state = app.extensions['movie_magic']
+    if state.backend.name == 'aws':
+        fakes = {'dynamodb': dynamodb or aws_fakes.FakeDynamoResource(), 'sns': sns or aws_fakes.FakeSNS()}
+        state.backend.factory = lambda service, region: fakes[service]
+        dynamo_bookings.create_table(fakes['dynamodb'], app.config['BOOKINGS_TABLE'])
+        leases.create_table(fakes['dynamodb'], app.config['SEAT_LEASES_TABLE'])
+    state.start()
+    return state
+
+
+def login(app, email, password='pw'):
+    client = app.test_client()
+    client.post('/register', data={'name': 'bench', 'email': email, 'password': password})
+    client.post('/login', data={'email': email, 'password': password})
+    return client
+
+
+def percentiles(latencies, points=(0.5, 0.95, 0.99)):
+    """{'p50_ms': ..., ...} for a list of durations in seconds."""
+    ordered = sorted(latencies)
+    if not ordered:
+        return {f"p{int(p * 100)}_ms": None for p in points}
+    return {f"p{int(p * 100)}_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 3)
+            for p in points}
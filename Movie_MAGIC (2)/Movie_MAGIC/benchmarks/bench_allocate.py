@@ -0,0 +1,171 @@
+"""Quality and speed of best-available seat allocation.
+
+Uses a 26x48 hall (1248 seats; premium rows A-M, gold N-Z) and a stream of
+parties of 1-6 people asking for a random tier, and reports:
+
+  * quality, best available (SeatInventory.allocate(), middle rows, centred
+    blocks) against first fit (front row, leftmost block), for parties
+    asking for 75% and for 120% of the hall: parties seated, parties
+    seated before the first one was turned away, seats filled, free seats
+    left stranded alone, how far blocks sit from the middle of their row
+    and from the middle row of their tier, and the mean allocate() score
+    (ROW_WEIGHT per row from the middle, plus seats off centre; lower is
+    better) of the seats each party got, overall and for the first half
+    of the parties
+  * allocations per second for allocate() against a brute-force scan of
+    every seat with the same policy, on an empty and a nearly full hall
+  * allocations per second with --threads threads sharing one show, and a
+    check that no seat was handed out twice
+
+    python benchmarks/bench_allocate.py --threads 8
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from seat_inventory import ROW_WEIGHT, SeatInventory, SeatLayout  # noqa: E402
+
+LAYOUT = SeatLayout('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 48, [('premium', 'A', 'M'), ('gold', 'N', 'Z')])
+PARTY_SIZES = [1, 2, 2, 2, 3, 4, 4, 5, 6]
+
+
+def brute_force(inventory, show, count, rows, centred=True):
+    """allocate() by testing every seat of every row."""
+    per_row = inventory.layout.seats_per_row
+    ideal = (per_row - count) // 2
+    for row in rows:
+        starts = [start for start in range(per_row - count + 1)
+                  if all(inventory.is_available(show, inventory.layout.label(row * per_row + col))
+                         for col in range(start, start + count))]
+        if starts:
+            start = min(starts, key=lambda s: (abs(s - ideal), s)) if centred else starts[0]
+            return inventory.hold(show, [inventory.layout.label(row * per_row + col)
+                                         for col in range(start, start + count)])
+    return None
+
+
+def quality(policy, parties):
+    inventory = SeatInventory(LAYOUT)
+    seated = filled = 0
+    first_refusal = None
+    offsets = []
+    row_offsets = []
+    scores = []
+    for size, tier in parties:
+        if policy == 'best_available':
+            seats = inventory.allocate(1, size, LAYOUT.row_order(tier, 'middle'))
+        else:
+            seats = brute_force(inventory, 1, size, LAYOUT.row_order(tier, 'front'), centred=False)
+        if seats is None:
+            first_refusal = seated if first_refusal is None else first_refusal
+            continue
+        seated += 1
+        filled += size
+        row, first = divmod(LAYOUT.index(seats[0]), LAYOUT.seats_per_row)
+        offsets.append(abs(first + size / 2 - LAYOUT.seats_per_row / 2))
+        tier_rows = LAYOUT.row_order(tier, 'front')
+        row_offsets.append(abs(row - (tier_rows[0] + tier_rows[-1]) / 2))
+        scores.append(LAYOUT.row_order(tier, 'middle').index(row) * ROW_WEIGHT
+                      + abs(first - (LAYOUT.seats_per_row - size) // 2))
+    stranded = 0
+    for row in range(len(LAYOUT.rows)):
+        free = [inventory.is_available(1, LAYOUT.label(row * LAYOUT.seats_per_row + col))
+                for col in range(LAYOUT.seats_per_row)]
+        free = [False] + free + [False]
+        stranded += sum(1 for col in range(1, len(free) - 1) if free[col] and not free[col - 1] and not free[col + 1])
+    return {'parties_seated': f"{seated}/{len(parties)}", 'seated_before_first_refusal': first_refusal,
+            'fill_percent': round(100 * filled / LAYOUT.capacity, 1), 'stranded_single_seats': stranded,
+            'mean_seats_from_row_middle': round(sum(offsets) / len(offsets), 2),
+            'mean_rows_from_tier_middle': round(sum(row_offsets) / len(row_offsets), 2),
+            'mean_score': round(sum(scores) / len(scores), 2),
+            'mean_score_first_half': round(sum(scores[:len(scores) // 2]) / (len(scores) // 2), 2)}
+
+
+def parties_for(demand, rng):
+    """Random parties asking for `demand` times the hall's seats in total."""
+    parties = []
+    while sum(size for size, _ in parties) < demand * LAYOUT.capacity:
+        parties.append((rng.choice(PARTY_SIZES), rng.choice(['premium', 'gold'])))
+    return parties
+
+
+def speed(allocate, prefill, requests, rng):
+    """Allocations per second on a hall with `prefill` of its seats held at random."""
+    inventory = SeatInventory(LAYOUT)
+    inventory.hold(1, [LAYOUT.label(i) for i in rng.sample(range(LAYOUT.capacity), int(LAYOUT.capacity * prefill))])
+    rows = LAYOUT.row_order('premium', 'middle')
+    elapsed = 0.0
+    for _ in range(requests):
+        start = time.perf_counter()
+        seats = allocate(inventory, 1, 2, rows)
+        elapsed += time.perf_counter() - start
+        if seats:
+            inventory.release(1, seats)
+    return round(requests / elapsed)
+
+
+def concurrent(threads, rng):
+    inventory = SeatInventory(LAYOUT)
+    handed_out = []
+    lock = threading.Lock()
+
+    def worker(seed):
+        local = random.Random(seed)
+        while True:
+            tier = local.choice(['premium', 'gold'])
+            seats = inventory.allocate(1, local.choice(PARTY_SIZES), LAYOUT.row_order(tier, 'middle'))
+            if seats is None:
+                # Mop up the last seats one by one, in either tier
+                seats = inventory.allocate(1, 1, LAYOUT.row_order('premium', 'middle')) or \
+                    inventory.allocate(1, 1, LAYOUT.row_order('gold', 'middle'))
+                if seats is None:
+                    return
+            with lock:
+                handed_out.extend(seats)
+
+    workers = [threading.Thread(target=worker, args=(rng.random(),)) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {'threads': threads, 'seats_handed_out': len(handed_out),
+            'seats_handed_out_twice': len(handed_out) - len(set(handed_out)),
+            'seconds_to_fill_hall': round(elapsed, 4)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    def indexed(inventory, show, count, rows):
+        return inventory.allocate(show, count, rows)
+
+    print(json.dumps({
+        'hall_seats': LAYOUT.capacity,
+        'quality': {f"demand_{int(demand * 100)}pct": {policy: quality(policy, parties)
+                                                        for policy in ('best_available', 'first_fit')}
+                    for demand, parties in ((demand, parties_for(demand, rng)) for demand in (0.75, 1.2))},
+        'allocations_per_sec': {
+            f"{label}_{int(prefill * 100)}pct_held": speed(allocate, prefill, args.requests, random.Random(args.seed))
+            for prefill in (0.0, 0.9)
+            for label, allocate in (('indexed', indexed), ('brute_force', brute_force))
+        },
+        'concurrent': concurrent(args.threads, rng),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""database.db with and without the bookings of past shows archived.
+
+For each --bookings size, fills a scratch database with that many bookings
+(1-4 seats each, 2000 users, shows filled one after the other over the
+past year, the last --hot-percent of them still to come), measures it,
+runs archive.archive() and VACUUM, and measures it again:
+
+  * hot        bookings and booking_seats rows in database.db, its size
+  * dashboard  the first dashboard page of random users (BookingPage)
+  * backup     sqlite3's online backup of database.db to a file
+  * seats      SeatInventory.load(), what every worker does at start
+  * scan       reading every booking in id order: the bookings table
+               before, archive.scan() after (bulk reads for analytics)
+
+plus how long the archive run took and the archived dashboard page
+(?archived=1), which is only read when asked for.
+
+    python benchmarks/bench_archive.py --bookings 100000 1000000
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import tempfile
+import time
+
+from _harness import percentiles
+
+import archive  # noqa: E402
+import booking_store  # noqa: E402
+import db  # noqa: E402
+import movie_magic  # noqa: E402
+from seat_inventory import DEFAULT_LAYOUT, SeatInventory  # noqa: E402
+
+MOVIES = ['KUBERA', 'DEVARA', 'ANIMAL']
+USERS = 2000
+ARCHIVE_AFTER_DAYS = 7
+
+
+def fill(conn, count, hot_percent, seed=1):
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    shows = -(-count * 25 // (DEFAULT_LAYOUT.capacity * 10))
+    first_hot = shows - max(1, shows * hot_percent // 100)
+    bookings, seats = [], []
+    show, next_seat = 0, 0
+    for booking_id in range(1, count + 1):
+        size = rng.randint(1, 4)
+        if next_seat + size > DEFAULT_LAYOUT.capacity:
+            show, next_seat = show + 1, 0
+        labels = [DEFAULT_LAYOUT.label(next_seat + i) for i in range(size)]
+        next_seat += size
+        total = sum(movie_magic.SEAT_PRICES[DEFAULT_LAYOUT.tier_of(label)] for label in labels)
+        bookings.append((booking_id, f"user{rng.randrange(USERS)}@example.com", MOVIES[show % len(MOVIES)],
+                         ','.join(labels), total, show + 1, 'UPI', '2025-01-01 12:00:00'))
+        seats += [(show + 1, label, booking_id, DEFAULT_LAYOUT.tier_of(label)) for label in labels]
+
+    def starts_at(i):
+        # Past shows spread over the last year; the hot ones from tomorrow on
+        days = -1 - (first_hot - i) * 365 / first_hot if i < first_hot else 1 + (i - first_hot) / 4
+        return (now + datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M')
+
+    with conn:
+        conn.executemany("INSERT INTO shows (id, movie, starts_at) VALUES (?, ?, ?)",
+                         [(i + 1, MOVIES[i % len(MOVIES)], starts_at(i)) for i in range(show + 1)])
+        conn.executemany("INSERT INTO bookings (id, email, movie, seats, total, show_id, payment_method, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", bookings)
+        conn.executemany("INSERT INTO booking_seats (show_id, seat, booking_id, tier) VALUES (?, ?, ?, ?)", seats)
+        # The rollups count these already, as if they were booked after migration 7
+        conn.execute("UPDATE report_backfill SET below = 0")
+
+
+def timed(function, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies, (0.5, 0.99))
+
+
+def measure(conn, path, tmp, repeat, schema='main'):
+    rng = random.Random(2)
+    result = {
+        'hot_bookings': conn.execute("SELECT COUNT(*) FROM main.bookings").fetchone()[0],
+        'hot_seats': conn.execute("SELECT COUNT(*) FROM main.booking_seats").fetchone()[0],
+        'database_mb': round(os.path.getsize(path) / 2 ** 20, 1),
+        'dashboard': timed(lambda: list(booking_store.BookingPage(
+            conn, f"user{rng.randrange(USERS)}@example.com")), repeat),
+    }
+    backup = os.path.join(tmp, 'backup.db')
+    start = time.perf_counter()
+    target = db.connect(backup)
+    # The main database only, as a backup of database.db would be
+    conn.backup(target, name='main')
+    target.close()
+    result['backup_seconds'] = round(time.perf_counter() - start, 3)
+    os.unlink(backup)
+    start = time.perf_counter()
+    SeatInventory().load(conn)
+    result['seats_load_seconds'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    if schema == 'main':
+        count = sum(1 for _ in conn.execute(f"SELECT {', '.join(archive.COLUMNS)} FROM main.bookings ORDER BY id"))
+    else:
+        count = sum(1 for _ in archive.scan(conn))
+    result['scan_rows_per_sec'] = round(count / (time.perf_counter() - start))
+    return result
+
+
+def run(count, hot_percent, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db')
+        conn = db.connect(path, attach={archive.SCHEMA: os.path.join(tmp, 'archive.db')})
+        movie_magic.init_db(conn)
+        archive.create_tables(conn)
+        fill(conn, count, hot_percent)
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+        result = {'bookings': count, 'without_archive': measure(conn, path, tmp, repeat)}
+        start = time.perf_counter()
+        moved = archive.archive(conn, ARCHIVE_AFTER_DAYS)
+        seconds = time.perf_counter() - start
+        conn.execute("VACUUM main")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        result['archive_run'] = {'moved': moved, 'seconds': round(seconds, 2),
+                                 'bookings_per_sec': round(moved / seconds) if seconds else None}
+        result['with_archive'] = measure(conn, path, tmp, repeat, archive.SCHEMA)
+        rng = random.Random(3)
+        result['archived_dashboard'] = timed(lambda: list(booking_store.BookingPage(
+            conn, f"user{rng.randrange(USERS)}@example.com", schema=archive.SCHEMA)), repeat)
+        result['archive_mb'] = round(os.path.getsize(os.path.join(tmp, 'archive.db')) / 2 ** 20, 1)
+        conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--hot-percent', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps([run(count, args.hot_percent, args.repeat) for count in args.bookings], indent=2))
+
+
+if __name__ == '__main__':
+    main()
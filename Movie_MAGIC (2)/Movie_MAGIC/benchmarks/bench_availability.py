@@ -0,0 +1,90 @@
+"""Size and throughput of /api/shows/<id>/availability.
+
+Reports the body size for the default 10x8 hall and a 26x40 one, empty,
+sold out in blocks and half sold at random, then loads app.py on a scratch
+database and measures requests per second for AvailabilityCache.get() on
+its own and for full requests (200 with the body, 304 with If-None-Match)
+through the WSGI app:
+
+    python benchmarks/bench_availability.py --requests 50000
+"""
+import argparse
+import json
+import random
+import tempfile
+import time
+
+from werkzeug.test import EnvironBuilder
+
+from _harness import load_app
+
+import availability  # noqa: E402
+import booking_store  # noqa: E402
+import movie_magic  # noqa: E402
+from seat_inventory import DEFAULT_LAYOUT, SeatLayout  # noqa: E402
+
+LARGE_LAYOUT = SeatLayout('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 40, [('premium', 'A', 'M'), ('gold', 'N', 'Z')])
+
+
+def body_sizes(layout, rng):
+    fills = {
+        'empty': lambda i: False,
+        'front_half_sold': lambda i: i < layout.capacity // 2,
+        'random_half_sold': lambda i: rng.random() < 0.5,
+        'sold_out': lambda i: True,
+    }
+    sizes = {}
+    for name, taken in fills.items():
+        bitmap = bytearray((layout.capacity + 7) // 8)
+        for index in range(layout.capacity):
+            if taken(index):
+                bitmap[index >> 3] |= 1 << (index & 7)
+        sizes[name] = len(availability.encode(layout, bitmap, movie_magic.SEAT_PRICES))
+    return sizes
+
+
+def rate(requests, call):
+    start = time.perf_counter()
+    for _ in range(requests):
+        call()
+    return round(requests / (time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=50000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    report = {'body_bytes': {f"{len(layout.rows)}x{layout.seats_per_row}": body_sizes(layout, rng)
+                             for layout in (DEFAULT_LAYOUT, LARGE_LAYOUT)}}
+
+    module = load_app('app', tempfile.mkdtemp(prefix='bench_availability_'))
+    app = module.app
+    client = app.test_client()
+    client.get('/login')
+    with module.pool.connection() as conn, conn:
+        show_id = booking_store.show_id_for(conn, 'KUBERA')
+    # Seats spread over the hall, as after a few bookings
+    module.inventory.hold(show_id, ['A1', 'A2', 'C5', 'F3', 'F4', 'J8'])
+    url = f"/api/shows/{show_id}/availability"
+    etag = client.get(url).headers['ETag']
+
+    def wsgi(headers):
+        environ = EnvironBuilder(path=url, headers=headers).get_environ()
+
+        def call():
+            for _ in app(dict(environ), lambda status, headers, exc_info=None: None):
+                pass
+        return call
+
+    report['requests_per_sec'] = {
+        'cache_get': rate(args.requests, lambda: module.availability.get(show_id)),
+        'wsgi_200': rate(args.requests // 5, wsgi({})),
+        'wsgi_304': rate(args.requests // 5, wsgi({'If-None-Match': etag})),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
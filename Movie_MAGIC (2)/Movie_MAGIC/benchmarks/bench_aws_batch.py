@@ -0,0 +1,79 @@
+"""Per-booking AWS calls vs DynamoBatchWriter / SnsDigest, against aws_fakes.
+
+Sends the same booking items and alert messages both ways, checks that
+every item reached the fake table (including ones first returned as
+UnprocessedItems) and reports API calls, calls saved and flush latency:
+
+    python benchmarks/bench_aws_batch.py --bookings 2000 --unprocessed-rate 0.1
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import aws_fakes  # noqa: E402
+from aws_batch import DynamoBatchWriter, SnsDigest  # noqa: E402
+
+TABLE = 'movie ticket_booking'
+TOPIC = 'arn:aws:sns:local:000000000000:movieticket_topic'
+
+
+def bookings(count):
+    return [{'booking_id': f"user{n}@example.com_{n}", 'email': f"user{n}@example.com",
+             'movie': 'KUBERA', 'seats': 'A1,A2', 'total': 500} for n in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, default=2000)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--unprocessed-rate', type=float, default=0.1)
+    parser.add_argument('--digest-size', type=int, default=50)
+    args = parser.parse_args()
+    items = bookings(args.bookings)
+    alerts = [{'subject': 'New Movie Booking Alert', 'message': f"New Booking!\nUser: {item['email']}"}
+              for item in items]
+
+    # One call per booking, as AWS_app.py used to do
+    single = aws_fakes.FakeDynamoResource(latency=args.latency)
+    single_sns = aws_fakes.FakeSNS(latency=args.latency)
+    start = time.perf_counter()
+    for item, alert in zip(items, alerts):
+        single.Table(TABLE).put_item(Item=item)
+        single_sns.publish(TopicArn=TOPIC, Message=alert['message'], Subject=alert['subject'])
+    single_seconds = time.perf_counter() - start
+
+    batched = aws_fakes.FakeDynamoResource(latency=args.latency, unprocessed_rate=args.unprocessed_rate, seed=1)
+    batched_sns = aws_fakes.FakeSNS(latency=args.latency)
+    writer = DynamoBatchWriter(batched, TABLE, base_delay=0.001)
+    digest = SnsDigest(batched_sns, TOPIC)
+    start = time.perf_counter()
+    errors = []
+    # Feed them the way OutboxWorker does: one claimed batch at a time
+    for offset in range(0, len(items), 100):
+        errors += writer.write(items[offset:offset + 100])
+    for offset in range(0, len(alerts), args.digest_size):
+        errors += digest.send(alerts[offset:offset + args.digest_size])
+    batched_seconds = time.perf_counter() - start
+
+    stored = len(batched.Table(TABLE).items)
+    delivered = sum(message['Message'].count('New Booking!') for message in batched_sns.messages)
+    print(json.dumps({
+        'bookings': args.bookings,
+        'per_booking_calls': single.Table(TABLE).calls + single_sns.calls,
+        'per_booking_seconds': round(single_seconds, 3),
+        'batched_seconds': round(batched_seconds, 3),
+        'dynamodb': writer.metrics.snapshot(),
+        'sns': digest.metrics.snapshot(),
+        'items_stored': stored,
+        'alerts_delivered': delivered,
+        'errors': sum(1 for error in errors if error),
+    }, indent=2))
+    sys.exit(0 if stored == args.bookings and delivered == args.bookings else 1)
+
+
+if __name__ == '__main__':
+    main()
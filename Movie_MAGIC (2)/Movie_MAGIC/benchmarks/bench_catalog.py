@@ -0,0 +1,118 @@
+"""Catalog index lookups vs the linear scans they replace.
+
+Fills a scratch database with movies, screens and a few days of shows,
+loads it with Catalog.load() and times, per lookup:
+
+  * movie by title: next(m for m in MOVIES if ...) vs CatalogIndex.movie()
+  * shows on a screen in a time window: list filter vs bisect
+  * a movie's next shows: sort-and-filter vs CatalogIndex.upcoming()
+
+    python benchmarks/bench_catalog.py --movies 300 --screens 40 --shows-per-day 4000 --days 7
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import catalog  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+
+def populate(conn, movies, screens, shows_per_day, days):
+    rng = random.Random(1)
+    with conn:
+        conn.executemany("INSERT INTO movies (title, price, image) VALUES (?, ?, ?)",
+                         [(f"MOVIE {n}", 200 + n % 5 * 50, 'kubera.jpg') for n in range(movies)])
+        conn.executemany("INSERT INTO screens (name, rows, seats_per_row) VALUES (?, 'ABCDEFGHIJ', 8)",
+                         [(f"Screen {n + 2}",) for n in range(screens)])
+        screen_ids = [row[0] for row in conn.execute("SELECT id FROM screens")]
+        titles = [row[0] for row in conn.execute("SELECT title FROM movies")]
+        today = datetime.date.today()
+        rows = []
+        for day in range(days):
+            date = (today + datetime.timedelta(days=day)).isoformat()
+            for n in range(shows_per_day):
+                minute = rng.randrange(9 * 60, 24 * 60)
+                starts_at = f"{date} {minute // 60:02d}:{minute % 60:02d}"
+                rows.append((rng.choice(titles), rng.choice(screen_ids), starts_at))
+        conn.executemany("INSERT OR IGNORE INTO shows (movie, screen_id, starts_at) VALUES (?, ?, ?)", rows)
+    return titles, screen_ids
+
+
+def per_op(fn, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        fn(*args)
+    return round((time.perf_counter() - start) / len(args_list) * 1e6, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--movies', type=int, default=300)
+    parser.add_argument('--screens', type=int, default=40)
+    parser.add_argument('--shows-per-day', type=int, default=4000)
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--lookups', type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_catalog_')
+    conn = db.connect(os.path.join(workdir, 'catalog.db'))
+    migrations.migrate(conn)
+    titles, screen_ids = populate(conn, args.movies, args.screens, args.shows_per_day, args.days)
+
+    holder = catalog.Catalog()
+    start = time.perf_counter()
+    index = holder.load(conn)
+    load_seconds = time.perf_counter() - start
+
+    # The old shapes: a list of movie dicts and a flat list of shows
+    movie_list = [{'title': movie.title, 'price': movie.price, 'image': movie.image} for movie in index.movies]
+    show_list = [catalog.Show(*row) for row in conn.execute("SELECT id, movie, screen_id, starts_at FROM shows "
+                                                           "WHERE starts_at != ''")]
+
+    rng = random.Random(2)
+    today = datetime.date.today().isoformat()
+    title_lookups = [(rng.choice(titles),) for _ in range(args.lookups)]
+    windows = []
+    for _ in range(args.lookups // 10):
+        hour = rng.randrange(9, 23)
+        windows.append((f"{today} {hour:02d}:00", f"{today} {hour + 1:02d}:00", rng.choice(screen_ids)))
+    upcoming = [(rng.choice(titles), f"{today} {rng.randrange(9, 23):02d}:00") for _ in range(args.lookups // 10)]
+
+    def scan_movie(title):
+        return next((m for m in movie_list if m['title'] == title), None)
+
+    def scan_window(start, end, screen_id):
+        return [show for show in show_list if show.screen_id == screen_id and start <= show.starts_at < end]
+
+    def scan_upcoming(title, after):
+        return sorted((show for show in show_list if show.movie == title and show.starts_at >= after),
+                      key=lambda show: show.starts_at)[:10]
+
+    for window in windows[:50]:
+        expected = sorted(scan_window(*window), key=lambda show: (show.starts_at, show.id))
+        if list(index.shows_between(*window)) != expected:
+            sys.exit(f"index and scan disagree for {window}")
+
+    print(json.dumps({
+        'movies': len(index.movies),
+        'shows_loaded': len(index),
+        'load_seconds': round(load_seconds, 3),
+        'us_per_lookup': {
+            'movie_by_title': {'scan': per_op(scan_movie, title_lookups), 'index': per_op(index.movie, title_lookups)},
+            'screen_window': {'scan': per_op(scan_window, windows),
+                              'index': per_op(index.shows_between, windows)},
+            'upcoming': {'scan': per_op(scan_upcoming, upcoming), 'index': per_op(index.upcoming, upcoming)},
+        },
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
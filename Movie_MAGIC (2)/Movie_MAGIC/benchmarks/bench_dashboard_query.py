@@ -0,0 +1,96 @@
+"""Dashboard query latency before and after the normalized schema.
+
+Builds a scratch database with the original bookings layout (CSV seats, no
+indexes), times the old dashboard() query, runs migrations.migrate() on it
+and times booking_store.user_bookings() on the same users:
+
+    python benchmarks/bench_dashboard_query.py --bookings 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import booking_store  # noqa: E402
+import db  # noqa: E402
+import migrations  # noqa: E402
+
+MOVIES = ['KUBERA', 'DEVARA', 'ANIMAL']
+
+
+def build(path, bookings, users, seed=1):
+    rng = random.Random(seed)
+    conn = db.connect(path)
+    conn.execute('''CREATE TABLE users (email TEXT PRIMARY KEY, name TEXT, password TEXT)''')
+    conn.execute('''CREATE TABLE bookings (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                           email TEXT, movie TEXT, seats TEXT, total INTEGER)''')
+    batch = []
+    for _ in range(bookings):
+        seats = ','.join(f"{rng.choice('ABCDEFGHIJ')}{rng.randint(1, 8)}:gold" for _ in range(rng.randint(1, 4)))
+        batch.append((f"user{rng.randrange(users)}@example.com", rng.choice(MOVIES), seats, 300))
+        if len(batch) == 50000:
+            with conn:
+                conn.executemany("INSERT INTO bookings (email, movie, seats, total) VALUES (?, ?, ?, ?)", batch)
+            batch = []
+    with conn:
+        conn.executemany("INSERT INTO bookings (email, movie, seats, total) VALUES (?, ?, ?, ?)", batch)
+    return conn
+
+
+def old_dashboard(conn, email):
+    rows = conn.execute("SELECT movie, seats, total FROM bookings WHERE email = ?", (email,)).fetchall()
+    return [{'movie': row[0], 'seats': row[1].split(','), 'total': row[2]} for row in rows]
+
+
+def time_queries(fn, conn, emails):
+    latencies = []
+    for email in emails:
+        start = time.perf_counter()
+        fn(conn, email)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    return {
+        'queries': len(latencies),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 3),
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--batch-size', type=int, default=migrations.BATCH_SIZE)
+    args = parser.parse_args()
+
+    rng = random.Random(2)
+    emails = [f"user{rng.randrange(args.users)}@example.com" for _ in range(args.queries)]
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build(os.path.join(tmp, 'bench.db'), args.bookings, args.users)
+        before = time_queries(old_dashboard, conn, emails)
+
+        start = time.perf_counter()
+        migrations.migrate(conn, args.batch_size)
+        migration_seconds = time.perf_counter() - start
+
+        after = time_queries(booking_store.user_bookings, conn, emails)
+        conn.close()
+
+    print(json.dumps({
+        'bookings': args.bookings,
+        'users': args.users,
+        'before': before,
+        'after': after,
+        'migration_seconds': round(migration_seconds, 1),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
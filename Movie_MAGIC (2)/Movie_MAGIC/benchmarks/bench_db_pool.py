@@ -0,0 +1,127 @@
+"""Connect-per-request vs pooled WAL connections.
+
+Simulates the /dashboard read and /seating insert handlers from several
+threads at once and prints requests/sec and latency percentiles for both
+paths:
+
+    python benchmarks/bench_db_pool.py --threads 16 --seconds 5
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from db import ConnectionPool  # noqa: E402
+
+SCHEMA = [
+    '''CREATE TABLE users (email TEXT PRIMARY KEY, name TEXT, password TEXT)''',
+    '''CREATE TABLE bookings (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              email TEXT, movie TEXT, seats TEXT, total INTEGER)''',
+]
+
+
+def seed(path, users, bookings_per_user):
+    with sqlite3.connect(path) as conn:
+        for stmt in SCHEMA:
+            conn.execute(stmt)
+        conn.executemany("INSERT INTO users VALUES (?, ?, ?)",
+                         [(f"user{i}@example.com", 'user', 'x') for i in range(users)])
+        conn.executemany("INSERT INTO bookings (email, movie, seats, total) VALUES (?, ?, ?, ?)",
+                         [(f"user{i}@example.com", 'KUBERA', 'A1:premium,A2:premium', 700)
+                          for i in range(users) for _ in range(bookings_per_user)])
+
+
+def dashboard(conn, email):
+    with conn:
+        rows = conn.execute("SELECT movie, seats, total FROM bookings WHERE email = ?", (email,)).fetchall()
+    return [{'movie': r[0], 'seats': r[1].split(','), 'total': r[2]} for r in rows]
+
+
+def book(conn, email):
+    with conn:
+        conn.execute("INSERT INTO bookings (email, movie, seats, total) VALUES (?, ?, ?, ?)",
+                     (email, 'DEVARA', 'F1:gold', 300))
+
+
+def run(mode, path, threads, seconds, write_ratio, users):
+    pool = ConnectionPool(path) if mode == 'pooled' else None
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def worker(seed_):
+        rng = random.Random(seed_)
+        local = []
+        while time.perf_counter() < deadline:
+            email = f"user{rng.randrange(users)}@example.com"
+            handler = book if rng.random() < write_ratio else dashboard
+            start = time.perf_counter()
+            try:
+                if pool is None:
+                    # What app.py did before: a fresh default connection per request
+                    conn = sqlite3.connect(path)
+                    try:
+                        handler(conn, email)
+                    finally:
+                        conn.close()
+                else:
+                    with pool.connection() as conn:
+                        handler(conn, email)
+            except sqlite3.OperationalError:
+                errors[0] += 1
+                continue
+            local.append(time.perf_counter() - start)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    if pool is not None:
+        pool.close()
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3) if latencies else None
+
+    return {
+        'mode': mode,
+        'requests': len(latencies),
+        'requests_per_sec': round(len(latencies) / seconds, 1),
+        'p50_ms': pct(0.50),
+        'p99_ms': pct(0.99),
+        'errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--bookings-per-user', type=int, default=5)
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ('connect', 'pooled'):
+            path = os.path.join(tmp, f"{mode}.db")
+            seed(path, args.users, args.bookings_per_user)
+            results.append(run(mode, path, args.threads, args.seconds, args.write_ratio, args.users))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Query-based booking reads and the BookingReader cache, against aws_fakes.
+
+Writes bookings with the email / booking_key schema (several per user for
+the same movie, which the old email_title key silently overwrote), checks
+that none were lost, that paginated Query returns every booking in order
+and that cached reads see new bookings after invalidation. Reports read
+latency with a cold and a warm cache:
+
+    python benchmarks/bench_dynamo_reads.py --users 200 --bookings-per-user 30
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import aws_fakes  # noqa: E402
+import booking_store  # noqa: E402
+import dynamo_bookings  # noqa: E402
+from aws_batch import DynamoBatchWriter  # noqa: E402
+from dynamo_bookings import BookingReader  # noqa: E402
+
+from _harness import percentiles  # noqa: E402
+
+TABLE = 'movie ticket_booking_v2'
+MOVIES = ['KUBERA', 'DEVARA', 'ANIMAL']
+
+
+def make_bookings(users, per_user):
+    items = []
+    booking_id = 0
+    for n in range(per_user):
+        for user in range(users):
+            booking_id += 1
+            movie = MOVIES[user % len(MOVIES)]
+            seats = [f"{'ABCDEFGHIJ'[booking_id % 10]}{booking_id % 8 + 1}"]
+            created_at = f"2025-01-01 10:{n // 60:02d}:{n % 60:02d}"
+            items.append(dynamo_bookings.booking_item(f"user{user}@example.com", booking_id,
+                                                      booking_store.show_key(movie, ''), movie, seats, 170,
+                                                      'UPI', created_at))
+    return items
+
+
+def timed_reads(reader, emails, rounds):
+    latencies = []
+    for _ in range(rounds):
+        for email in emails:
+            start = time.perf_counter()
+            reader.dashboard_bookings(email)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--bookings-per-user', type=int, default=30)
+    parser.add_argument('--latency', type=float, default=0.002)
+    parser.add_argument('--page-size', type=int, default=dynamo_bookings.PAGE_SIZE)
+    args = parser.parse_args()
+    dynamo_bookings.PAGE_SIZE = args.page_size
+
+    dynamodb = aws_fakes.FakeDynamoResource(latency=args.latency)
+    table = dynamo_bookings.create_table(dynamodb, TABLE)
+    writer = DynamoBatchWriter(dynamodb, TABLE, key_names=dynamo_bookings.KEY_NAMES)
+    items = make_bookings(args.users, args.bookings_per_user)
+    for offset in range(0, len(items), 100):
+        writer.write(items[offset:offset + 100])
+
+    failures = []
+    stored = len(table.items)
+    if stored != len(items):
+        failures.append(f"{len(items) - stored} bookings overwritten")
+
+    emails = [f"user{user}@example.com" for user in range(args.users)]
+    reader = BookingReader(table)
+    queries_before = table.calls
+    cold = timed_reads(reader, emails, 1)
+    cold_queries = table.calls - queries_before
+    warm = timed_reads(reader, emails, 5)
+
+    for email in emails[:10]:
+        expected = sorted((item['booking_id'] for item in items if item['email'] == email), reverse=True)
+        got = [booking['id'] for booking in reader.dashboard_bookings(email)]
+        if got != expected:
+            failures.append(f"{email}: Query returned {len(got)} of {len(expected)} bookings in order")
+
+    # A new booking must show up on the next read, not after the cache TTL
+    rng = random.Random(1)
+    email = rng.choice(emails)
+    show_key = booking_store.show_key(MOVIES[0], '')
+    reader.sold_seats(show_key)
+    new = dynamo_bookings.booking_item(email, len(items) + 1, show_key, MOVIES[0], ['K1'], 170, 'UPI',
+                                       '2025-01-02 09:00:00')
+    if not writer.write([new])[0]:
+        reader.invalidate(new)
+    if reader.dashboard_bookings(email)[0]['id'] != new['booking_id']:
+        failures.append('dashboard read stale after invalidation')
+    if 'K1' not in reader.sold_seats(show_key):
+        failures.append('show seats stale after invalidation')
+
+    print(json.dumps({
+        'bookings': len(items),
+        'items_stored': stored,
+        'page_size': args.page_size,
+        'queries_per_user_cold': round(cold_queries / len(emails), 2),
+        'cold': percentiles(cold),
+        'warm': percentiles(warm),
+        'cache_hits': reader.cache.hits,
+        'cache_misses': reader.cache.misses,
+        'failures': failures,
+    }, indent=2))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,150 @@
+"""Booking write throughput: one commit per booking vs group commit.
+
+Runs the booking transaction of /process_payment (bookings row plus its
+booking_seats rows, through SeatInventory.reserve()) from 1, 8 and 64
+threads at once, on a scratch copy of the schema, with:
+
+  * direct: DirectWriter, every thread commits its own transaction (what
+    process_payment did before BookingWriter)
+  * group:  BookingWriter, one writer thread committing up to --max-batch
+    bookings per transaction
+
+for synchronous=NORMAL (db.PRAGMAS; WAL only syncs on checkpoint) and
+synchronous=FULL (an fsync per commit). Reports bookings/s, latency
+percentiles, bookings per transaction and, since --conflict of the
+bookings ask for a seat that is already sold, that exactly those failed
+and every other booking is in the database.
+
+    python benchmarks/bench_group_commit.py --writers 1 8 64 --seconds 3
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from _harness import percentiles
+
+import booking_store  # noqa: E402
+import booking_writer  # noqa: E402
+import db  # noqa: E402
+import metrics  # noqa: E402
+import movie_magic  # noqa: E402
+from seat_inventory import SeatInventory, SeatUnavailable  # noqa: E402
+
+SHOWS = 2000
+
+
+def batches():
+    """(transactions, bookings) recorded so far in booking_commit_batch_size."""
+    counts = metrics.BOOKING_BATCH_SIZE.collect().get((), [0, 0.0])
+    return sum(counts[:-1]), counts[-1]
+
+
+def run(mode, synchronous, writers, seconds, conflict, max_batch, max_wait_us):
+    pragmas = db.PRAGMAS
+    db.PRAGMAS = [(name, synchronous if name == 'synchronous' else value) for name, value in pragmas]
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = db.ConnectionPool(os.path.join(tmp, 'bench.db'), size=writers + 4)
+        with pool.connection() as conn, conn:
+            movie_magic.init_db(conn)
+            conn.executemany("INSERT INTO shows (id, movie, starts_at) VALUES (?, 'KUBERA', ?)",
+                             [(show, str(show)) for show in range(1, SHOWS + 1)])
+        inventory = SeatInventory()
+        capacity = inventory.layout.capacity
+        if mode == 'group':
+            writer = booking_writer.BookingWriter(pool, max_batch, max_wait_us)
+        else:
+            writer = booking_writer.DirectWriter(pool)
+        writer.start()
+        # Every booking gets the next unsold seat, except the conflicting ones
+        seats = itertools.count()
+        latencies = []
+        booked = []
+        refused = []
+        errors = []
+        lock = threading.Lock()
+        transactions_before, bookings_before = batches()
+        deadline = time.perf_counter() + seconds
+
+        def worker(seed):
+            rng = random.Random(seed)
+            local_latencies, local_booked, local_refused = [], [], []
+            while time.perf_counter() < deadline:
+                n = next(seats)
+                if local_booked and rng.random() < conflict:
+                    n = rng.choice(local_booked)
+                show, seat = n // capacity + 1, inventory.layout.label(n % capacity)
+
+                def write(conn, sale):
+                    sale.booking_id = booking_store.insert_booking(conn, f"user{seed}@example.com", show,
+                                                                   'KUBERA', [seat], 250, 'UPI')
+
+                start = time.perf_counter()
+                try:
+                    # held=False: the bitmap check may let a repeat through
+                    # when two threads race, the primary key catches it
+                    inventory.reserve(writer, show, [seat], write)
+                except SeatUnavailable:
+                    local_refused.append(n)
+                except Exception as e:
+                    with lock:
+                        errors.append(f"{type(e).__name__}: {e}")
+                    continue
+                else:
+                    local_booked.append(n)
+                local_latencies.append(time.perf_counter() - start)
+            with lock:
+                latencies.extend(local_latencies)
+                booked.extend(local_booked)
+                refused.extend(local_refused)
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(writers)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        writer.stop()
+        transactions, bookings = (after - before for after, before in zip(batches(), (transactions_before,
+                                                                                      bookings_before)))
+        with pool.connection() as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+            stored_seats = conn.execute("SELECT COUNT(*) FROM booking_seats").fetchone()[0]
+        pool.close()
+    db.PRAGMAS = pragmas
+    return {
+        'mode': mode,
+        'synchronous': synchronous,
+        'writers': writers,
+        'bookings_per_sec': round(len(booked) / elapsed),
+        'latency': percentiles(latencies),
+        'bookings_per_transaction': round(bookings / transactions, 1) if transactions else None,
+        'refused_as_sold': len(refused),
+        'errors': len(errors),
+        # Every successful booking is stored, and nothing else
+        'stored_ok': stored == stored_seats == len(booked) == len(set(booked)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, nargs='+', default=[1, 8, 64])
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--synchronous', nargs='+', default=['NORMAL', 'FULL'])
+    parser.add_argument('--conflict', type=float, default=0.02)
+    parser.add_argument('--max-batch', type=int, default=booking_writer.MAX_BATCH)
+    parser.add_argument('--max-wait-us', type=int, default=booking_writer.MAX_WAIT_US)
+    args = parser.parse_args()
+    print(json.dumps([run(mode, synchronous, writers, args.seconds, args.conflict, args.max_batch, args.max_wait_us)
+                      for synchronous in args.synchronous
+                      for writers in args.writers
+                      for mode in ('direct', 'group')], indent=2))
+
+
+if __name__ == '__main__':
+    main()
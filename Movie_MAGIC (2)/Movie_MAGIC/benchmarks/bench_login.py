@@ -0,0 +1,179 @@
+"""Login throughput and latency with salted, stretched password hashes.
+
+Registers --users users, then has 1, 8, 32 and 64 clients log in as them
+back to back for --seconds each, while one more client keeps fetching
+/about (a page that hashes nothing) to show what the logins do to the
+rest of the worker. Each concurrency runs with:
+
+  * inline   PASSWORD_WORKERS = 0: every request thread hashes on its own
+             (what the sha256 code did, but with a hash worth having)
+  * thread   the bounded thread pool of passwords.py (hashlib releases the GIL)
+  * process  the same as a process pool
+
+and reports logins/s, p50/p99 of the ones let in, how many got 503 (and
+how fast they got it; clients then wait out Retry-After), and p99 of
+/about. A final "upgrade" row resets every hash to the old unsalted
+sha256 and has --upgrade-clients clients log the users in until all of
+them are upgraded: the first logins after deploying this. A login that
+finds the pool full is let in without upgrading, so that may take a few
+passes; the row shows how many users were left on sha256 each pass.
+
+    python benchmarks/bench_login.py --clients 1 8 32 64 --seconds 5
+"""
+import argparse
+import hashlib
+import json
+import tempfile
+import threading
+import time
+
+from _harness import load_app, percentiles
+
+import passwords  # noqa: E402
+
+PASSWORD = 'correct horse battery staple'
+
+
+def log_in(app, email):
+    """(status, seconds, Retry-After) of one login."""
+    start = time.perf_counter()
+    response = app.test_client().post('/login', data={'email': email, 'password': PASSWORD})
+    return response.status_code, time.perf_counter() - start, float(response.headers.get('Retry-After', 0))
+
+
+def run(app, emails, clients, seconds):
+    logged_in, busy, about, errors = [], [], [], []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client(i):
+        local_in, local_busy = [], []
+        n = i
+        while time.perf_counter() < deadline:
+            status, elapsed, retry_after = log_in(app, emails[n % len(emails)])
+            n += clients
+            if status == 302:
+                local_in.append(elapsed)
+            elif status == 503:
+                local_busy.append(elapsed)
+                # As a browser would be told to
+                time.sleep(retry_after)
+            else:
+                with lock:
+                    errors.append(status)
+        with lock:
+            logged_in.extend(local_in)
+            busy.extend(local_busy)
+
+    def bystander():
+        browser = app.test_client()
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            browser.get('/about')
+            about.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=bystander)]
+    threads += [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return {
+        'logins_per_sec': round(len(logged_in) / elapsed, 1),
+        'login': percentiles(logged_in),
+        'busy_503': len(busy),
+        'busy_p99_ms': percentiles(busy)['p99_ms'],
+        'errors': len(errors),
+        'about_p99_ms': percentiles(about)['p99_ms'],
+    }
+
+
+def upgrade(app, pool, emails, clients, max_passes=10):
+    """Users log in with an old sha256 hash stored, over and over until every hash is upgraded."""
+    legacy = hashlib.sha256(PASSWORD.encode()).hexdigest()
+    with pool.connection() as conn, conn:
+        conn.execute("UPDATE users SET password = ?", (legacy,))
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    passes = []
+    start = time.perf_counter()
+    while len(passes) < max_passes:
+        with pool.connection() as conn:
+            pending = [email for email, in conn.execute("SELECT email FROM users WHERE password = ?", (legacy,))]
+        if not pending:
+            break
+        passes.append(len(pending))
+
+        def client():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    email = pending.pop()
+                status, elapsed, retry_after = log_in(app, email)
+                with lock:
+                    statuses.append(status)
+                    latencies.append(elapsed)
+
+        threads = [threading.Thread(target=client) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    elapsed = time.perf_counter() - start
+    with pool.connection() as conn:
+        upgraded = conn.execute("SELECT COUNT(*) FROM users WHERE password LIKE 'scrypt$%'").fetchone()[0]
+    return {
+        'mode': 'upgrade',
+        'clients': clients,
+        'logins_per_sec': round(statuses.count(302) / elapsed, 1),
+        'login': percentiles(latencies),
+        'busy_503': statuses.count(503),
+        # Users still on sha256 at the start of each pass
+        'legacy_per_pass': passes,
+        'upgraded': f"{upgraded}/{len(emails)}",
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32, 64])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--users', type=int, default=64)
+    parser.add_argument('--upgrade-clients', type=int, default=8)
+    parser.add_argument('--modes', nargs='+', default=['inline', 'thread', 'process'])
+    parser.add_argument('--workers', type=int, default=passwords.DEFAULTS['PASSWORD_WORKERS'])
+    parser.add_argument('--queue', type=int, default=passwords.DEFAULTS['PASSWORD_QUEUE'])
+    parser.add_argument('--scrypt-n', type=int, default=passwords.DEFAULTS['SCRYPT_N'])
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_login_')
+    emails = [f"user{i}@example.com" for i in range(args.users)]
+    results = []
+    for mode in args.modes:
+        config = {
+            'SCRYPT_N': args.scrypt_n,
+            # Logins aren't what the waiting room is for
+            'ADMISSION_CONTROL': False,
+            'PASSWORD_WORKERS': 0 if mode == 'inline' else args.workers,
+            'PASSWORD_POOL': 'process' if mode == 'process' else 'thread',
+            'PASSWORD_QUEUE': args.queue,
+        }
+        module = load_app('app', workdir, config=config)
+        if mode == args.modes[0]:
+            for email in emails:
+                module.app.test_client().post('/register', data={'name': 'bench', 'email': email,
+                                                                 'password': PASSWORD})
+        for clients in args.clients:
+            results.append({'mode': mode, 'clients': clients, **run(module.app, emails, clients, args.seconds)})
+        if mode == args.modes[-1]:
+            results.append(upgrade(module.app, module.pool, emails, args.upgrade_clients))
+        module.stop()
+        module.pool.close()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
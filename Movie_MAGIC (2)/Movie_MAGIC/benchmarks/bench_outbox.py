@@ -0,0 +1,100 @@
+"""process_payment latency with inline AWS calls vs the outbox.
+
+Runs AWS_app.py against the aws_fakes stand-ins with simulated round-trip
+latency. "inline" adds the DynamoDB put and both SNS publishes to each
+request, as AWS_app.py used to; "outbox" is the current request path, with
+delivery time measured separately:
+
+    python benchmarks/bench_outbox.py --bookings 80 --aws-latency 0.03
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+
+from _harness import APP_DIR, load_app, login, percentiles
+
+import aws_fakes  # noqa: E402
+
+
+def book(client, n):
+    seat = f"{'ABCDEFGHIJ'[n // 8 % 10]}{n % 8 + 1}"
+    client.post('/seating/KUBERA', data={'seats': f"{seat}:premium"})
+    start = time.perf_counter()
+    client.post('/process_payment', data={'movie': 'KUBERA', 'seats': seat, 'total': '250',
+                                          'payment_method': 'UPI', 'upi_id': 'bench@upi'})
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, default=80)
+    parser.add_argument('--aws-latency', type=float, default=0.03)
+    parser.add_argument('--failure-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    dynamodb = aws_fakes.FakeDynamoResource(latency=args.aws_latency, failure_rate=args.failure_rate)
+    sns = aws_fakes.FakeSNS(latency=args.aws_latency, failure_rate=args.failure_rate)
+    try:
+        # One user books every seat in a row, which the per-user rate limit would
+        # refuse; seats are leased in SQLite, as --failure-rate is about the outbox
+        # and failed lease calls would turn the bookings themselves away
+        module = load_app('AWS_app', workdir, dynamodb, sns,
+                          config={'ADMISSION_CONTROL': False, 'SEAT_LEASE_BACKEND': 'sqlite'})
+        client = login(module.app, 'bench@example.com')
+        # Don't let the alert digest sit on messages for its usual minute
+        module.backend.handlers['sns_alert'].max_wait = 0.2
+        # The 10x8 grid of one show holds 80 bookings of one seat
+        count = min(args.bookings, 80)
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            # Outbox: the request only writes SQLite
+            outbox_latency = [book(client, n) for n in range(count // 2)]
+            start = time.perf_counter()
+            while module.backend.outbox_worker.delivered < len(outbox_latency) * 3:
+                if time.perf_counter() - start > 60:
+                    break
+                time.sleep(0.01)
+            drain_seconds = time.perf_counter() - start
+
+            # Inline: the same request plus the three AWS calls it used to make
+            module.backend.outbox_worker.stop()
+            inline_latency = []
+            for n in range(count // 2, count):
+                elapsed = book(client, n)
+                start = time.perf_counter()
+                with module.pool.connection() as conn:
+                    rows = conn.execute("SELECT id, kind, payload FROM outbox ORDER BY id").fetchall()
+                    for _, kind, payload in rows:
+                        payload = json.loads(payload)
+                        try:
+                            if kind == 'dynamodb_put':
+                                module.backend.bookings_table.put_item(Item=payload['item'])
+                            else:
+                                module.backend.publish_notification(payload)
+                        except aws_fakes.FakeAWSError:
+                            pass
+                    conn.execute("DELETE FROM outbox")
+                    conn.commit()
+                inline_latency.append(elapsed + time.perf_counter() - start)
+
+        print(json.dumps({
+            'aws_latency_ms': args.aws_latency * 1000,
+            'inline': percentiles(inline_latency),
+            'outbox': percentiles(outbox_latency),
+            'outbox_drain_seconds': round(drain_seconds, 3),
+            'outbox_delivered': module.backend.outbox_worker.delivered,
+            'outbox_failed_attempts': module.backend.outbox_worker.failed,
+        }, indent=2))
+    finally:
+        os.chdir(APP_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
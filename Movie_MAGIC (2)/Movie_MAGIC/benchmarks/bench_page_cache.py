@@ -0,0 +1,85 @@
+"""/home throughput with and without the rendered-page cache.
+
+Loads app.py on a scratch database, adds --movies movies to the catalog so
+the page is of realistic size, and requests /home as a logged-in user with
+pages.enabled off (render every time), on (cached bytes), and on with
+If-None-Match (304, no body):
+
+    python benchmarks/bench_page_cache.py --requests 3000 --threads 4
+"""
+import argparse
+import json
+import tempfile
+import threading
+import time
+
+from _harness import load_app, login, percentiles
+
+import catalog  # noqa: E402
+
+
+def run(app, cookie, requests, threads, headers=None):
+    latencies = []
+    sizes = []
+    lock = threading.Lock()
+
+    def worker():
+        client = app.test_client()
+        client.set_cookie('session', cookie)
+        for _ in range(requests // threads):
+            start = time.perf_counter()
+            response = client.get('/home', headers=headers or {})
+            body = response.get_data()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                sizes.append(len(body))
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    elapsed = time.perf_counter() - start
+    return {'requests_per_sec': round(len(latencies) / elapsed, 1), 'body_bytes': sizes[0],
+            **percentiles(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--movies', type=int, default=60)
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    module = load_app('app', tempfile.mkdtemp(prefix='bench_page_cache_'))
+    app = module.app
+    with module.pool.connection() as conn, conn:
+        for n in range(args.movies):
+            catalog.add_movie(conn, f"MOVIE {n}", 250, 'kubera.jpg')
+    with module.pool.connection() as conn:
+        module.catalog.load(conn)
+    cookie = login(app, 'bench@example.com').get_cookie('session').value
+
+    module.pages.enabled = False
+    uncached = run(app, cookie, args.requests, args.threads)
+    module.pages.enabled = True
+    cached = run(app, cookie, args.requests, args.threads)
+    client = app.test_client()
+    client.set_cookie('session', cookie)
+    etag = client.get('/home').headers['ETag']
+    not_modified = run(app, cookie, args.requests, args.threads, {'If-None-Match': etag})
+
+    print(json.dumps({
+        'movies': len(module.catalog.current.movies),
+        'render_every_time': uncached,
+        'cached': cached,
+        'conditional_304': not_modified,
+        'cache_hits': module.pages.hits,
+        'cache_misses': module.pages.misses,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
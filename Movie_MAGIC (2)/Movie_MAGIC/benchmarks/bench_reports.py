@@ -0,0 +1,138 @@
+"""/admin/reports from the rollup tables vs aggregating the bookings.
+
+For each --bookings size, fills a scratch database with that many bookings
+(1-4 seats each, shows filled one after the other, spread over 90 days),
+then reports:
+
+  * backfill   `python reports.py` over all of them: seconds and bookings/s
+  * rollups    reports.summary(), what /admin/reports serves
+  * scan       the same per movie, tier, day and show figures computed
+               from bookings and booking_seats with GROUP BY
+  * write      what record_booking() adds to one booking transaction
+
+and checks that the backfilled rollups match the scan.
+
+    python benchmarks/bench_reports.py --bookings 10000 100000 1000000
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from _harness import percentiles
+
+import db  # noqa: E402
+import movie_magic  # noqa: E402
+import reports  # noqa: E402
+from seat_inventory import DEFAULT_LAYOUT  # noqa: E402
+
+MOVIES = ['KUBERA', 'DEVARA', 'ANIMAL']
+DAYS = 90
+
+
+def fill(conn, count, seed=1):
+    rng = random.Random(seed)
+    bookings, seats = [], []
+    show, next_seat = 0, DEFAULT_LAYOUT.capacity
+    for booking_id in range(1, count + 1):
+        size = rng.randint(1, 4)
+        if next_seat + size > DEFAULT_LAYOUT.capacity:
+            show, next_seat = show + 1, 0
+        labels = [DEFAULT_LAYOUT.label(next_seat + i) for i in range(size)]
+        next_seat += size
+        total = sum(movie_magic.SEAT_PRICES[DEFAULT_LAYOUT.tier_of(label)] for label in labels)
+        day = f"2025-{1 + (booking_id * DAYS // count) // 30:02d}-{1 + (booking_id * DAYS // count) % 30:02d}"
+        bookings.append((booking_id, f"user{booking_id % 5000}@example.com", MOVIES[show % len(MOVIES)],
+                         ','.join(labels), total, show + 1, 'UPI', f"{day} 12:00:00"))
+        seats += [(show + 1, label, booking_id, DEFAULT_LAYOUT.tier_of(label)) for label in labels]
+    with conn:
+        conn.executemany("INSERT INTO shows (id, movie, starts_at) VALUES (?, ?, ?)",
+                         [(i + 1, MOVIES[i % len(MOVIES)], str(i)) for i in range(show + 1)])
+        conn.executemany("INSERT INTO bookings (id, email, movie, seats, total, show_id, payment_method, created_at) "
+                         "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", bookings)
+        conn.executemany("INSERT INTO booking_seats (show_id, seat, booking_id, tier) VALUES (?, ?, ?, ?)", seats)
+        # As if these were all there when migration 7 ran
+        conn.execute("UPDATE report_backfill SET below = ?, done_through = 0", (count + 1,))
+
+
+def scan(conn):
+    """The report figures straight from the bookings."""
+    def grouped(sql):
+        return {key: list(row) for key, *row in conn.execute(sql)}
+
+    per_booking = '''SELECT b.id, b.show_id, b.movie, substr(b.created_at, 1, 10) AS day, b.total,
+                            (SELECT COUNT(*) FROM booking_seats AS s WHERE s.booking_id = b.id) AS seats
+                     FROM bookings AS b'''
+    return {
+        'report_shows': grouped(f"SELECT show_id, COUNT(*), SUM(seats), SUM(total) FROM ({per_booking}) "
+                                f"GROUP BY show_id"),
+        'report_movies': grouped(f"SELECT movie, COUNT(*), SUM(seats), SUM(total) FROM ({per_booking}) "
+                                 f"GROUP BY movie"),
+        'report_days': grouped(f"SELECT day, COUNT(*), SUM(seats), SUM(total) FROM ({per_booking}) GROUP BY day"),
+        'report_tiers': grouped("SELECT tier, COUNT(DISTINCT booking_id), COUNT(*), NULL FROM booking_seats "
+                                "GROUP BY tier"),
+    }
+
+
+def timed(function, repeat):
+    latencies = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        latencies.append(time.perf_counter() - start)
+    return percentiles(latencies)
+
+
+def run(count, repeat):
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = db.connect(os.path.join(tmp, 'bench.db'))
+        movie_magic.init_db(conn)
+        fill(conn, count)
+
+        start = time.perf_counter()
+        reports.backfill(conn, movie_magic.SEAT_PRICES)
+        backfill_seconds = time.perf_counter() - start
+
+        expected = scan(conn)
+        stored = {table: {key: list(row) for key, *row in conn.execute(
+            f"SELECT {key}, bookings, seats, revenue FROM {table}")} for table, key in reports.TABLES.items()}
+        # The scan can't split totals by tier; compare bookings and seats there
+        for row in stored['report_tiers'].values():
+            row[2] = None
+        matches = stored == expected
+
+        result = {
+            'bookings': count,
+            'backfill_seconds': round(backfill_seconds, 2),
+            'backfill_per_sec': round(count / backfill_seconds),
+            'rollups': timed(lambda: reports.summary(conn, DEFAULT_LAYOUT.capacity), repeat),
+            'scan': timed(lambda: scan(conn), max(1, repeat // 20)),
+            'rollups_match_scan': matches,
+        }
+
+        with conn:
+            conn.execute("INSERT INTO shows (id, movie, starts_at) VALUES (0, 'KUBERA', 'bench')")
+        latencies = []
+        for _ in range(repeat):
+            with db.write_transaction(conn):
+                start = time.perf_counter()
+                reports.record_booking(conn, 0, 'KUBERA', '2025-06-01 12:00:00', 420, ['premium', 'gold'],
+                                       movie_magic.SEAT_PRICES)
+                latencies.append(time.perf_counter() - start)
+        result['write'] = percentiles(latencies)
+        conn.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    print(json.dumps([run(count, args.repeat) for count in args.bookings], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+"""Signed-cookie sessions vs the server-side stores in sessions.py.
+
+Builds the session the apps used to keep for a user with N past bookings
+(session['bookings'] with payment details, plus payment_info), then runs
+open_session()/save_session() for a read-only request and for a request
+that modifies the session, and reports the Cookie header bytes sent with
+every request and the time spent per request:
+
+    python benchmarks/bench_sessions.py --bookings 50
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import Flask, request  # noqa: E402
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+import db  # noqa: E402
+import migrations  # noqa: E402
+import sessions  # noqa: E402
+
+
+def legacy_session(bookings):
+    # Distinct bookings, so the cookie's zlib compression gets realistic input
+    rng = random.Random(1)
+    return {
+        'email': 'user@example.com',
+        'bookings': [{
+            'movie': rng.choice(['KUBERA', 'DEVARA', 'ANIMAL']),
+            'seats': ', '.join(f"{rng.choice('ABCDEFGHIJ')}{rng.randint(1, 8)}" for _ in range(rng.randint(1, 4))),
+            'payment_method': 'Credit Card',
+            'payment_details': {'card_number': f"************{rng.randint(1000, 9999)}",
+                                'card_holder': f"User {rng.randint(1, 10 ** 6)}",
+                                'expiry_date': f"{rng.randint(1, 12):02d}/{rng.randint(26, 32)}", 'cvv': '*'},
+            'total': str(rng.choice([170, 250]) * rng.randint(1, 4)),
+            'timestamp': f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+                         f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}",
+        } for _ in range(bookings)],
+        'payment_info': {'method': 'Credit Card', 'details': {'card_number': '************4242'},
+                         'timestamp': '2025-06-01 18:30:00'},
+    }
+
+
+def cookie_header(response, name):
+    for header in response.headers.getlist('Set-Cookie'):
+        if header.startswith(name + '='):
+            return header.split(';', 1)[0]
+    return None
+
+
+def run(app, interface, data, rounds):
+    """(cookie bytes, read seconds/request, write seconds/request)."""
+    name = app.config['SESSION_COOKIE_NAME']
+    with app.test_request_context('/'):
+        session = interface.open_session(app, request)
+        session.update(data)
+        response = app.response_class()
+        interface.save_session(app, session, response)
+        cookie = cookie_header(response, name)
+
+    timings = []
+    for modify in (False, True):
+        start = time.perf_counter()
+        for n in range(rounds):
+            with app.test_request_context('/', headers={'Cookie': cookie}):
+                session = interface.open_session(app, request)
+                if modify:
+                    session['hold_id'] = f"hold{n}"
+                response = app.response_class()
+                interface.save_session(app, session, response)
+        timings.append((time.perf_counter() - start) / rounds)
+    return len(cookie), timings[0], timings[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, default=50)
+    parser.add_argument('--rounds', type=int, default=2000)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.secret_key = 'bench'
+    path = os.path.join(tempfile.mkdtemp(prefix='bench_sessions_'), 'sessions.db')
+    migrations.migrate(db.connect(path))
+    pool = db.ConnectionPool(path)
+
+    data = legacy_session(args.bookings)
+    backends = {
+        'cookie': SecureCookieSessionInterface(),
+        'memory': sessions.ServerSideSessionInterface(sessions.MemorySessionStore()),
+        'sqlite': sessions.ServerSideSessionInterface(sessions.SqliteSessionStore(pool)),
+    }
+    results = {}
+    for name, interface in backends.items():
+        size, read, write = run(app, interface, data, args.rounds)
+        results[name] = {'cookie_bytes': size, 'read_request_us': round(read * 1e6, 1),
+                         'write_request_us': round(write * 1e6, 1)}
+
+    serializer = SecureCookieSessionInterface().get_signing_serializer(app)
+    signed = serializer.dumps(data)
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        serializer.loads(serializer.dumps(data))
+    sign_us = (time.perf_counter() - start) / args.rounds * 1e6
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        sessions.loads(sessions.dumps(data))
+    marshal_us = (time.perf_counter() - start) / args.rounds * 1e6
+
+    print(json.dumps({
+        'bookings_in_session': args.bookings,
+        # Browsers drop cookies over 4096 bytes, which silently logs the user out
+        'signed_cookie_over_4kb': len(signed) > 4096,
+        'serialized_bytes': {'signed_cookie': len(signed), 'marshal': len(sessions.dumps(data))},
+        'serialize_roundtrip_us': {'sign_and_verify': round(sign_us, 1), 'marshal': round(marshal_us, 1)},
+        'backends': results,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
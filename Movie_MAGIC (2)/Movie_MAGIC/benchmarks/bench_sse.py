@@ -0,0 +1,103 @@
+"""Subscriber count against memory and broadcast latency for seat events.
+
+For each --subscribers count, starts that many threads reading
+seat_events.stream() for one show (what each open /api/shows/<id>/events
+response does in a gthread worker), publishes --events seat changes
+--interval seconds apart, and reports:
+
+  * memory per idle subscriber: Python heap (tracemalloc) and RSS growth
+  * publish() wall time: the call itself is O(1), but the publishing thread
+    then competes for the GIL with every subscriber it woke (SeatEvents
+    publishes from a timer thread, never from a request)
+  * delivery latency from publish to each subscriber's message (p50/p95/p99)
+    and until the last subscriber got it; SeatEvents adds COALESCE_SECONDS
+    before the publish
+
+    python benchmarks/bench_sse.py --subscribers 100 1000 5000
+"""
+import argparse
+import json
+import threading
+import time
+import tracemalloc
+
+from _harness import percentiles
+
+import seat_events  # noqa: E402
+from broadcast import Broadcaster  # noqa: E402
+
+SNAPSHOT = b'{}'
+
+
+def rss_mb():
+    with open('/proc/self/statm') as statm:
+        return int(statm.read().split()[1]) * 4096 / 2 ** 20
+
+
+def run(subscribers, events, interval):
+    broadcaster = Broadcaster()
+    received = [[] for _ in range(events)]
+    lock = threading.Lock()
+    ready = threading.Barrier(subscribers + 1)
+
+    def subscriber():
+        stream = seat_events.stream(broadcaster.subscribe('show'), lambda: SNAPSHOT)
+        next(stream)
+        next(stream)
+        ready.wait()
+        for chunk in stream:
+            now = time.perf_counter()
+            if chunk.startswith(b'event: seats'):
+                seats = [int(seat.split(b'"')[0]) - 1 for seat in chunk.split(b'"A')[1:]]
+                with lock:
+                    for n in seats:
+                        received[n].append(now)
+                if events - 1 in seats:
+                    break
+
+    tracemalloc.start()
+    heap_before = tracemalloc.get_traced_memory()[0]
+    rss_before = rss_mb()
+    threads = [threading.Thread(target=subscriber, daemon=True) for _ in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    ready.wait()
+    heap_per_subscriber = (tracemalloc.get_traced_memory()[0] - heap_before) / subscribers
+    tracemalloc.stop()
+    rss_per_subscriber = (rss_mb() - rss_before) * 1024 / subscribers
+
+    publish_seconds = []
+    published = []
+    for n in range(events):
+        time.sleep(interval)
+        start = time.perf_counter()
+        broadcaster.publish('show', json.dumps({'sold': [f"A{n + 1}"]}))
+        publish_seconds.append(time.perf_counter() - start)
+        published.append(start)
+    for thread in threads:
+        thread.join(30)
+
+    latencies = [at - published[n] for n in range(events) for at in received[n]]
+    last = [max(received[n]) - published[n] for n in range(events) if received[n]]
+    return {
+        'subscribers': subscribers,
+        'heap_kb_per_subscriber': round(heap_per_subscriber / 1024, 2),
+        'rss_kb_per_subscriber': round(rss_per_subscriber, 1),
+        'publish_us': round(sorted(publish_seconds)[len(publish_seconds) // 2] * 1e6, 1),
+        'delivered': f"{len(latencies)}/{subscribers * events}",
+        'latency': percentiles(latencies),
+        'all_delivered_ms': round(sorted(last)[len(last) // 2] * 1000, 1) if last else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--events', type=int, default=10)
+    parser.add_argument('--interval', type=float, default=0.5)
+    args = parser.parse_args()
+    print(json.dumps([run(count, args.events, args.interval) for count in args.subscribers], indent=2))
+
+
+if __name__ == '__main__':
+    main()
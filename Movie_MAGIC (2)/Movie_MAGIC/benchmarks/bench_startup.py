@@ -0,0 +1,110 @@
+"""Start-up cost of app.py and AWS_app.py.
+
+Each run is a fresh interpreter that imports the entry point (which builds
+the app) and then serves its first request (which starts the per-process
+state: catalog, seat inventory, background threads). Runs are made on a
+cold start (no database.db yet, so the schema is created) and a warm one,
+and report the median import and first-request times, peak RSS and whether
+boto3 got imported:
+
+    python benchmarks/bench_startup.py --repeat 9
+    python benchmarks/bench_startup.py --importtime     # + slowest imports
+
+--tree measures another checkout of the app directory, e.g. an older commit
+made with `git worktree add /tmp/before <rev>`.
+"""
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from _harness import APP_DIR
+
+CHILD = r'''
+import importlib, json, os, resource, sys, time
+sys.path.insert(0, sys.argv[2])
+start = time.perf_counter()
+module = importlib.import_module(sys.argv[1])
+imported = time.perf_counter()
+module.app.test_client().get('/login')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'first_request_ms': (served - imported) * 1000,
+    'boto3_imported': 'boto3' in sys.modules,
+    'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+sys.stdout.flush()
+# Skip joining the background threads on the way out
+os._exit(0)
+'''
+
+
+def run_once(name, tree, workdir, importtime=False):
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', CHILD, name, tree]
+    result = subprocess.run(command, cwd=workdir, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        sys.exit(f"{name} failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    """The `top` packages whose modules took longest to import (-X importtime self time)."""
+    packages = {}
+    for line in stderr.splitlines():
+        match = re.match(r"import time:\s+(\d+) \|\s+\d+ \| *(\S+)", line)
+        if match:
+            package = match.group(2).split('.')[0]
+            packages[package] = packages.get(package, 0) + int(match.group(1))
+    ordered = sorted(packages.items(), key=lambda item: -item[1])[:top]
+    return {package: round(us / 1000, 1) for package, us in ordered}
+
+
+def measure(name, tree, repeat, cold):
+    runs = []
+    for _ in range(repeat):
+        workdir = tempfile.mkdtemp(prefix='bench_startup_')
+        try:
+            if not cold:
+                run_once(name, tree, workdir)
+            runs.append(run_once(name, tree, workdir)[0])
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'import_ms': round(statistics.median(run['import_ms'] for run in runs), 1),
+        'first_request_ms': round(statistics.median(run['first_request_ms'] for run in runs), 1),
+        'peak_rss_mb': round(statistics.median(run['peak_rss_mb'] for run in runs), 1),
+        'boto3_imported': any(run['boto3_imported'] for run in runs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--tree', default=APP_DIR, help='app directory to measure')
+    parser.add_argument('--importtime', action='store_true', help='also list the slowest imports')
+    parser.add_argument('--top', type=int, default=8)
+    args = parser.parse_args()
+    tree = os.path.abspath(args.tree)
+
+    report = {}
+    for name in ('app', 'AWS_app'):
+        report[name] = {'cold': measure(name, tree, args.repeat, cold=True),
+                        'warm': measure(name, tree, args.repeat, cold=False)}
+        if args.importtime:
+            workdir = tempfile.mkdtemp(prefix='bench_startup_')
+            try:
+                report[name]['slowest_imports_ms'] = slowest_imports(
+                    run_once(name, tree, workdir, importtime=True)[1], args.top)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Batch generation of ticket files (QR code PNG + PDF, see tickets.py).
+
+Queues --tickets bookings (1-6 seats each, door codes of real length) with
+TicketArtifacts.submit(), as process_payment does, and waits for all of
+them, with:
+
+  * inline   TICKET_WORKERS = 0: rendered by the submitting thread, what
+             doing it in the request would cost
+  * thread   a pool of --workers threads
+  * process  a pool of --workers processes
+
+and reports tickets/s, p50/p99 of one ticket from submit() until its files
+are on disk (queueing included), p99 of submit() itself (what the request
+waits for) and the bytes written per ticket. Then it submits the same
+bookings again: the files are already there under the same content hash,
+so that pass renders nothing, and `repeat_per_sec` is the cache hit rate.
+
+    python benchmarks/bench_tickets.py --tickets 10000 --workers 1 2 4
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+
+from _harness import percentiles
+
+import tickets  # noqa: E402
+from seat_inventory import DEFAULT_LAYOUT  # noqa: E402
+
+MOVIES = ['KUBERA', 'DEVARA', 'ANIMAL']
+
+
+def bookings(count, seed=1):
+    rng = random.Random(seed)
+    for booking_id in range(1, count + 1):
+        first = rng.randrange(DEFAULT_LAYOUT.capacity - 6)
+        seats = [DEFAULT_LAYOUT.label(first + i) for i in range(rng.randint(1, 6))]
+        yield {
+            'booking_id': booking_id,
+            'email': f"user{booking_id % 5000}@example.com",
+            'movie': MOVIES[booking_id % len(MOVIES)],
+            'starts_at': f"2025-06-{1 + booking_id % 30:02d} 18:30",
+            'screen': 'Screen 1',
+            'seats': seats,
+            'total': 250 * len(seats),
+            'booked_at': '2025-05-20 12:00:00',
+        }
+
+
+def size_of(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def run(mode, workers, count):
+    with tempfile.TemporaryDirectory() as tmp:
+        artifacts = tickets.TicketArtifacts({'TICKET_DIR': tmp, 'SECRET_KEY': 'bench',
+                                             'TICKET_WORKERS': 0 if mode == 'inline' else workers,
+                                             'TICKET_POOL': 'thread' if mode == 'inline' else mode})
+        artifacts.start()
+        finished = {}
+        # Released by each future's callback, which runs after result() returns
+        rendered = threading.Semaphore(0)
+        submitted = []
+        futures = []
+        start = time.perf_counter()
+        for booking in bookings(count):
+            before = time.perf_counter()
+            key, future = artifacts.submit(booking)
+            after = time.perf_counter()
+            submitted.append((key, before, after - before))
+            if future is None:
+                finished[key] = after
+            else:
+                future.add_done_callback(lambda _, key=key: (finished.__setitem__(key, time.perf_counter()),
+                                                             rendered.release()))
+                futures.append(future)
+        for future in futures:
+            rendered.acquire()
+            # Raises if any of them failed
+            future.result()
+        seconds = time.perf_counter() - start
+        latencies = [finished[key] - before for key, before, _ in submitted]
+        submits = [spent for _, _, spent in submitted]
+
+        start = time.perf_counter()
+        hits = sum(artifacts.submit(booking)[1] is None for booking in bookings(count))
+        repeat_seconds = time.perf_counter() - start
+        artifacts.stop()
+        written = size_of(tmp)
+    return {
+        'mode': mode,
+        'workers': 0 if mode == 'inline' else workers,
+        'tickets': count,
+        'seconds': round(seconds, 2),
+        'tickets_per_sec': round(count / seconds),
+        'ticket': percentiles(latencies, (0.5, 0.99)),
+        'submit_p99_ms': percentiles(submits, (0.99,))['p99_ms'],
+        'bytes_per_ticket': round(written / count),
+        'repeat_cache_hits': hits,
+        'repeat_per_sec': round(count / repeat_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tickets', type=int, default=10000)
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument('--modes', nargs='+', default=['inline', 'thread', 'process'],
+                        choices=['inline', 'thread', 'process'])
+    args = parser.parse_args()
+    results = []
+    for mode in args.modes:
+        for workers in ([0] if mode == 'inline' else args.workers):
+            results.append(run(mode, workers, args.tickets))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Booking latency under 10x overload, with and without admission control.
+
+Runs load_funnel.py three times, each in its own process, on the steady
+profile with users already logged in (--pre-login: the spike is people
+going for the seats, not signing up) and enough client threads that
+arrivals never wait for one:
+
+  * nominal      --rate users/s, admission control off
+  * overload     --rate * --overload users/s, admission control off
+  * admission    the same overload with admission control on and the
+                 waiting room letting in --rate users/s
+
+and prints, per run, what happened to the users and the p50/p99 latency
+of the booking routes as seen by the users who got to them. Users kept in
+the waiting room are reported separately (how long admitted ones waited,
+how many left), as are requests turned away with 429/503.
+
+    python benchmarks/load_admission.py --rate 20 --overload 10 --duration 10
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BOOKING_ROUTES = ('/seating/<title>', '/seating/<title> POST', '/payment/<title>', '/process_payment POST')
+
+
+def run(args, label, rate, admission):
+    argv = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'load_funnel.py'),
+            '--app', args.app, '--profile', 'steady', '--rate', str(rate), '--duration', str(args.duration),
+            '--concurrency', str(args.concurrency), '--shows', str(args.shows), '--patience', str(args.patience),
+            '--admission', admission, '--waiting-room-rate', str(args.rate), '--seed', str(args.seed),
+            '--pre-login']
+    result = subprocess.run(argv, capture_output=True, text=True)
+    if result.returncode not in (0, 1):
+        raise SystemExit(f"{label}: load_funnel.py failed\n{result.stderr}")
+    report = json.loads(result.stdout)['results'][args.app]
+    routes = report['routes']
+    return {
+        'run': label,
+        'users_per_sec': rate,
+        'admission': admission,
+        'outcomes': report['outcomes'],
+        'bookings_per_sec': report['throughput']['bookings_per_sec'],
+        'errors': report['errors'],
+        'oversells': report['oversells']['total'],
+        # What users who got to the booking pages saw
+        'booking_routes': {route: {key: routes[route][key] for key in ('requests', 'p50_ms', 'p99_ms')}
+                           for route in BOOKING_ROUTES if route in routes},
+        'admitted_p99_ms': max((routes[route]['p99_ms'] for route in BOOKING_ROUTES
+                                if route in routes and routes[route]['p99_ms'] is not None), default=None),
+        'waiting_room': report['waiting_room'],
+        'turned_away': {route: stats['requests'] for route, stats in routes.items() if route.endswith('(turned away)')},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', choices=['app', 'AWS_app'], default='app')
+    parser.add_argument('--rate', type=float, default=20, help='nominal users/s, also the waiting room rate')
+    parser.add_argument('--overload', type=float, default=10)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--concurrency', type=int, default=2000, help='client threads')
+    parser.add_argument('--shows', type=int, default=64, help='enough seats that users rarely run out')
+    parser.add_argument('--patience', type=float, default=60)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    overload = args.rate * args.overload
+    print(json.dumps([
+        run(args, 'nominal', args.rate, 'off'),
+        run(args, 'overload', overload, 'off'),
+        run(args, 'admission', overload, 'on'),
+    ], indent=2))
+
+
+if __name__ == '__main__':
+    main()
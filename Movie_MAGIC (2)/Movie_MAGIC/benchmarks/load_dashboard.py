@@ -0,0 +1,157 @@
+"""Load test of /dashboard and /api/bookings for a user with a huge history.
+
+Loads app.py on a scratch database, gives one user --bookings bookings
+(two seats each) and compares, for that user:
+
+  * full render: every booking fetched and rendered at once, as
+    dashboard() used to do
+  * streamed page: the keyset-paginated, streamed /dashboard
+  * walking the whole history through /api/bookings page by page
+
+reporting time to first byte, total time, response size and peak Python
+memory per request, then runs concurrent /dashboard requests:
+
+    python benchmarks/load_dashboard.py --bookings 100000 --threads 8
+"""
+import argparse
+import datetime
+import json
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import flask
+
+from _harness import load_app, login, percentiles
+
+import booking_store  # noqa: E402
+import db  # noqa: E402
+
+EMAIL = 'bulk@example.com'
+SEATS_PER_SHOW = 80
+
+
+def populate(conn, count):
+    """count bookings of two seats each for EMAIL, spread over enough shows."""
+    per_show = SEATS_PER_SHOW // 2
+    rows = 'ABCDEFGHIJ'
+    base = datetime.datetime(2020, 1, 1)
+    with conn:
+        first_show = conn.execute("SELECT COALESCE(MAX(id), 0) FROM shows").fetchone()[0] + 1
+        conn.executemany("INSERT INTO shows (id, movie, starts_at) VALUES (?, 'KUBERA', ?)",
+                         [(first_show + n, (base + datetime.timedelta(hours=3 * n)).strftime("%Y-%m-%d %H:%M"))
+                          for n in range(count // per_show + 1)])
+        for offset in range(0, count, 10000):
+            bookings, seats = [], []
+            for n in range(offset, min(count, offset + 10000)):
+                show_id = first_show + n // per_show
+                row = rows[(n % per_show) // 4]
+                pair = [f"{row}{(n % 4) * 2 + 1}", f"{row}{(n % 4) * 2 + 2}"]
+                bookings.append((EMAIL, 'KUBERA', ','.join(pair), 700, show_id, 'UPI', '2025-01-01 12:00:00'))
+                seats.append((show_id, pair))
+            start_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM bookings").fetchone()[0] + 1
+            conn.executemany("INSERT INTO bookings (email, movie, seats, total, show_id, payment_method, created_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?, ?)", bookings)
+            conn.executemany("INSERT INTO booking_seats (show_id, seat, booking_id, tier) "
+                             "VALUES (?, ?, ?, 'premium')",
+                             [(show_id, seat, start_id + i) for i, (show_id, pair) in enumerate(seats) for seat in pair])
+
+
+def measure(fn):
+    """(first byte seconds, total seconds, bytes, peak MB) for fn() returning an iterable of chunks."""
+    tracemalloc.start()
+    start = time.perf_counter()
+    first = None
+    size = 0
+    for chunk in fn():
+        if first is None:
+            first = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'ttfb_ms': round(first * 1000, 1), 'total_ms': round(total * 1000, 1), 'bytes': size,
+            'peak_mb': round(peak / 2 ** 20, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bookings', type=int, default=100000)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=400)
+    args = parser.parse_args()
+
+    module = load_app('app', tempfile.mkdtemp(prefix='load_dashboard_'))
+    app = module.app
+    client = login(app, EMAIL)
+    with module.pool.connection() as conn:
+        populate(conn, args.bookings)
+
+    def full_render():
+        with app.test_request_context('/dashboard'):
+            conn = db.get_db()
+            yield flask.render_template('dashboard.html', bookings=booking_store.user_bookings(conn, EMAIL)).encode()
+
+    def streamed_page():
+        response = client.get('/dashboard', buffered=False)
+        try:
+            yield from response.response
+        finally:
+            response.close()
+
+    seen = []
+
+    def api_walk():
+        before = None
+        while True:
+            query = {'limit': 500} if before is None else {'limit': 500, 'before': before}
+            body = client.get('/api/bookings', query_string=query).get_json()
+            seen.extend(booking['id'] for booking in body['bookings'])
+            yield json.dumps(body).encode()
+            before = body['next_before']
+            if before is None:
+                return
+
+    results = {
+        'full_render': measure(full_render),
+        'streamed_page': measure(streamed_page),
+        'api_walk_all_pages': measure(api_walk),
+    }
+
+    # Every booking exactly once, newest first
+    if seen != sorted(set(seen), reverse=True) or len(seen) != args.bookings:
+        sys.exit(f"/api/bookings pages returned {len(seen)} bookings, expected {args.bookings}")
+
+    latencies = []
+    lock = threading.Lock()
+    per_thread = args.requests // args.threads
+
+    def worker():
+        local = app.test_client()
+        local.set_cookie('session', client.get_cookie('session').value)
+        for _ in range(per_thread):
+            start = time.perf_counter()
+            local.get('/dashboard').get_data()
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    print(json.dumps({
+        'bookings': args.bookings,
+        **results,
+        'concurrent_dashboard': {'threads': args.threads, 'requests': len(latencies),
+                                 'requests_per_sec': round(len(latencies) / elapsed, 1), **percentiles(latencies)},
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
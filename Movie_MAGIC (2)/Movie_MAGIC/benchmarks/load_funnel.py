@@ -0,0 +1,457 @@
+"""End-to-end load generator for the booking funnel of app.py and AWS_app.py.
+
+Every virtual user walks the real flow through the WSGI app:
+
+    /register -> /login -> /home -> /seating/<title> -> POST /seating/<title>
+    -> /payment/<title> -> POST /process_payment -> /tickets -> /dashboard
+
+picking random free-looking seats and trying again (up to --retries times)
+when they were just taken. AWS_app.py runs against the DynamoDB/SNS fakes
+from aws_fakes, and its outbox is drained before the oversell check.
+With --pre-login users are registered and logged in before the run starts
+(like customers who already had accounts), so it times /home onwards.
+
+Users sent to the waiting room by admission control poll /api/waiting-room
+until it is their turn, or leave if the wait would exceed --patience
+seconds; a 429 or 503 is retried after its Retry-After, up to --retries
+times. Those responses are timed under "<route> (turned away)", so the
+plain route figures are what admitted users got. --admission off runs
+without admission control.
+
+Arrival profiles (users started per second):
+
+  * steady  --rate users/s for --duration seconds
+  * ramp    from 0 up to --rate over --duration
+  * spike   "first-day-first-show": --rate in the background, then at
+            --spike-at a burst of --rate * --spike-factor for
+            --spike-seconds, all for the first show of the movie
+  * closed  --concurrency users booking back to back for --duration
+
+Open profiles start users on schedule into a pool of --concurrency workers;
+how late they started is reported as queue_delay. The JSON report has
+per-route p50/p95/p99, throughput, errors and oversells (a seat confirmed
+to two users, or stored twice in SQLite or DynamoDB), plus the commit, so
+runs can be compared; --baseline prints the change against an earlier
+report:
+
+    python benchmarks/load_funnel.py --app both --profile spike --output spike.json
+    python benchmarks/load_funnel.py --app both --profile spike --baseline spike.json
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+
+from _harness import APP_DIR, load_app, percentiles
+
+import admission  # noqa: E402
+import aws_fakes  # noqa: E402
+import catalog  # noqa: E402
+import outbox  # noqa: E402
+from seat_inventory import DEFAULT_LAYOUT  # noqa: E402
+
+MOVIE = 'KUBERA'
+
+
+def arrivals(args):
+    """Start offsets in seconds of every user of an open profile, and whether it joins the spike."""
+    rng = random.Random(args.seed)
+    times = []
+    t = 0.0
+    while True:
+        if args.profile == 'ramp':
+            # Rate grows linearly, so invert the cumulative count: n = rate * t^2 / (2 * duration)
+            t = (2 * args.duration * (len(times) + 1) / args.rate) ** 0.5
+        else:
+            t += rng.expovariate(args.rate)
+        if t >= args.duration:
+            break
+        times.append((t, False))
+    if args.profile == 'spike':
+        burst = int(args.rate * args.spike_factor * args.spike_seconds)
+        times += [(args.spike_at + rng.uniform(0, args.spike_seconds), True) for _ in range(burst)]
+        times.sort()
+    return times
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = Counter()
+        self.error_samples = []
+        self.outcomes = Counter()
+        self.queue_delays = []
+        # Time users spent in the waiting room before they were let in
+        self.queue_waits = []
+        # (show, seat) -> emails the app confirmed it to
+        self.confirmed = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def request(self, client, route, method, url, redirect_to=None, **kwargs):
+        """Issue one request, timed under `route`; returns the response, or None on an error.
+
+        Without redirect_to a 200 is expected, otherwise a redirect to one
+        of its paths.
+        """
+        start = time.perf_counter()
+        try:
+            response = client.open(url, method=method, **kwargs)
+            response.get_data()
+        except Exception as e:  # an exception escaping the app is a 500 to a real client
+            response, problem = None, f"{type(e).__name__}: {e}"
+        else:
+            location = response.headers.get('Location', '')
+            if turned_away(response):
+                problem = None
+                route = f"{route} (turned away)"
+            elif redirect_to is None:
+                problem = None if response.status_code == 200 else f"HTTP {response.status_code} {location}"
+            else:
+                problem = None if any(path in location for path in redirect_to) else \
+                    f"HTTP {response.status_code} -> {location or 'no redirect'}"
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[route].append(elapsed)
+            if problem:
+                self.errors[route] += 1
+                if len(self.error_samples) < 10:
+                    self.error_samples.append(f"{method} {url}: {problem}")
+        return None if problem else response
+
+    def count(self, outcome):
+        with self._lock:
+            self.outcomes[outcome] += 1
+
+
+def turned_away(response):
+    """Whether admission control sent `response` instead of the page: 429, 503 or the waiting room."""
+    return response.status_code in (429, 503) or '/waiting-room' in response.headers.get('Location', '')
+
+
+def wait_in_queue(recorder, client, args):
+    """Poll /api/waiting-room as the waiting room page would until admitted; False if the user leaves."""
+    start = time.perf_counter()
+    recorder.count('queued')
+    while True:
+        response = recorder.request(client, '/api/waiting-room', 'GET', '/api/waiting-room')
+        if response is None:
+            return False
+        status = response.get_json()
+        waited = time.perf_counter() - start
+        if status['admitted']:
+            with recorder._lock:
+                recorder.queue_waits.append(waited)
+            return True
+        if waited + status['wait_seconds'] > args.patience:
+            return False
+        time.sleep(min(status['wait_seconds'], admission.REFRESH_SECONDS))
+
+
+def admitted(recorder, client, route, method, url, redirect_to, args, **kwargs):
+    """recorder.request() for a route behind admission control, as a patient user.
+
+    Returns the response, None on an error, or 'left_queue' / 'shed' for
+    a user who gave up waiting.
+    """
+    retries = 0
+    while True:
+        response = recorder.request(client, route, method, url, redirect_to, **kwargs)
+        if response is None or not turned_away(response):
+            return response
+        if response.status_code in (429, 503):
+            recorder.count(f"http_{response.status_code}")
+            retries += 1
+            if retries > args.retries:
+                return 'shed'
+            time.sleep(float(response.headers.get('Retry-After', 1)))
+        elif not wait_in_queue(recorder, client, args):
+            return 'left_queue'
+
+
+def sign_in(recorder, client, n):
+    """Register and log in user `n` on `client`; False on an error."""
+    email = f"load{n}@example.com"
+    steps = [
+        ('/register POST', 'POST', '/register', ('/login',), {'data': {'name': 'load', 'email': email, 'password': 'pw'}}),
+        ('/login POST', 'POST', '/login', ('/home',), {'data': {'email': email, 'password': 'pw'}}),
+    ]
+    return all(recorder.request(client, route, method, url, redirect_to, **kwargs) is not None
+               for route, method, url, redirect_to, kwargs in steps)
+
+
+def run_user(module, recorder, n, show, args, rng, client=None):
+    """One visit through the funnel; returns 'booked', 'gave_up', 'left_queue', 'shed' or 'error'.
+
+    `client`, if given, is already logged in as user n (--pre-login).
+    """
+    email = f"load{n}@example.com"
+    if client is None:
+        client = module.app.test_client()
+        if not sign_in(recorder, client, n):
+            return 'error'
+    if recorder.request(client, '/home', 'GET', '/home') is None:
+        return 'error'
+    response = admitted(recorder, client, '/seating/<title>', 'GET', f"/seating/{MOVIE}?show={show}", None, args)
+    if response is None or isinstance(response, str):
+        return response or 'error'
+
+    layout = DEFAULT_LAYOUT
+    # First-day-first-show crowds go for the same middle rows; others spread out
+    rows = layout.rows[2:6] if args.profile == 'spike' else layout.rows
+    for _ in range(args.retries + 1):
+        count = rng.randint(1, args.max_seats)
+        seats = sorted({f"{rng.choice(rows)}{rng.randint(1, layout.seats_per_row)}" for _ in range(count)})
+        # As seating.html submits them: A1:premium,A2:premium
+        response = admitted(recorder, client, '/seating/<title> POST', 'POST', f"/seating/{MOVIE}?show={show}",
+                            ('/payment/', '/seating/'), args,
+                            data={'seats': ','.join(f"{seat}:{layout.tier_of(seat)}" for seat in seats)})
+        if response is None or isinstance(response, str):
+            return response or 'error'
+        location = response.headers['Location']
+        if '/payment/' not in location:
+            recorder.count('seat_conflicts')
+            continue
+        response = admitted(recorder, client, '/payment/<title>', 'GET', location, None, args)
+        if response is None or isinstance(response, str):
+            return response or 'error'
+        query = parse_qs(urlsplit(location).query)
+        response = admitted(recorder, client, '/process_payment POST', 'POST', '/process_payment',
+                            ('/tickets', '/seating/'), args, data={
+                                'movie': MOVIE, 'seats': query['seats'][0], 'total': query['total'][0],
+                                'payment_method': 'UPI', 'upi_id': f"load{n}@upi"})
+        if response is None or isinstance(response, str):
+            return response or 'error'
+        location = response.headers['Location']
+        if '/tickets' not in location:
+            # The hold expired or the seats went between /seating and payment
+            recorder.count('seat_conflicts')
+            continue
+        with recorder._lock:
+            for seat in parse_qs(urlsplit(location).query)['seats'][0].split(','):
+                recorder.confirmed[(show, seat.split(':')[0])].append(email)
+        if recorder.request(client, '/tickets', 'GET', location) is None:
+            return 'error'
+        if recorder.request(client, '/dashboard', 'GET', '/dashboard') is None:
+            return 'error'
+        return 'booked'
+    return 'gave_up'
+
+
+def add_shows(module, count):
+    """count shows of MOVIE on screen 1, a day apart from tomorrow; returns their ids, first show first."""
+    start = datetime.datetime.now().replace(hour=9, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
+    with module.pool.connection() as conn:
+        with conn:
+            ids = [catalog.add_show(conn, MOVIE, 1, (start + datetime.timedelta(days=n)).strftime("%Y-%m-%d %H:%M"))
+                   for n in range(count)]
+        module.catalog.load(conn)
+    return ids
+
+
+def check_oversells(module, recorder, show_ids):
+    """Seats sold more than once, per data store."""
+    duplicate_confirmed = sorted(f"{show}:{seat}" for (show, seat), emails in recorder.confirmed.items()
+                                 if len(emails) > 1)
+    with module.pool.connection() as conn:
+        marks = ','.join('?' * len(show_ids))
+        rows = conn.execute(f"SELECT show_id, seats FROM bookings WHERE show_id IN ({marks})", show_ids).fetchall()
+    stored = Counter((show, seat.split(':')[0]) for show, seats in rows for seat in seats.split(','))
+    report = {
+        'confirmed_seats': sum(len(emails) for emails in recorder.confirmed.values()),
+        'confirmed_twice': duplicate_confirmed,
+        'sqlite_sold_twice': sorted(f"{show}:{seat}" for (show, seat), n in stored.items() if n > 1),
+        'sqlite_over_capacity': sorted(show for show in show_ids
+                                       if sum(n for (s, _), n in stored.items() if s == show) > DEFAULT_LAYOUT.capacity),
+    }
+    if module.backend.name == 'aws':
+        # Every booking reaches DynamoDB through the outbox; wait for it to drain
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            with module.pool.connection() as conn:
+                if not conn.execute("SELECT COUNT(*) FROM outbox WHERE status IN (?, ?)",
+                                    (outbox.PENDING, outbox.INFLIGHT)).fetchone()[0]:
+                    break
+            module.backend.outbox_worker.notify()
+            time.sleep(0.1)
+        items = list(module.backend.bookings_table.items.values())
+        in_dynamo = Counter((item['show_key'], seat) for item in items for seat in item['seats'].split(','))
+        report['dynamodb_items'] = len(items)
+        report['dynamodb_sold_twice'] = sorted(f"{show}:{seat}" for (show, seat), n in in_dynamo.items() if n > 1)
+    report['total'] = sum(len(value) for key, value in report.items() if isinstance(value, list))
+    return report
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='load_funnel_')
+    config = {'ADMISSION_CONTROL': args.admission == 'on'}
+    if args.waiting_room_rate:
+        config['WAITING_ROOM_RATE'] = args.waiting_room_rate
+    module = load_app(args.app, workdir, dynamodb=aws_fakes.FakeDynamoResource(latency=args.aws_latency),
+                      sns=aws_fakes.FakeSNS(latency=args.aws_latency), config=config)
+    show_ids = add_shows(module, args.shows)
+    clients = {}
+    if args.pre_login:
+        # Everybody is signed in before the clock starts; only the booking is timed
+        setup = Recorder()
+        users = len(arrivals(args)) if args.profile != 'closed' else args.concurrency
+        for n in range(users):
+            clients[n] = module.app.test_client()
+            sign_in(setup, clients[n], n)
+    recorder = Recorder()
+    counter = iter(range(10 ** 9))
+    counter_lock = threading.Lock()
+
+    def user(spike, scheduled=None):
+        if scheduled is not None:
+            delay = max(0.0, time.perf_counter() - scheduled)
+            with recorder._lock:
+                recorder.queue_delays.append(delay)
+        with counter_lock:
+            n = next(counter)
+        rng = random.Random(args.seed * 1000003 + n)
+        show = show_ids[0] if spike else rng.choice(show_ids)
+        try:
+            recorder.count(run_user(module, recorder, n, show, args, rng, clients.pop(n, None)))
+        except Exception as e:
+            # A broken response the script could not follow; keep the run going
+            recorder.count('error')
+            with recorder._lock:
+                recorder.error_samples.append(f"user {n}: {type(e).__name__}: {e}")
+
+    start = time.perf_counter()
+    if args.profile == 'closed':
+        stop_at = start + args.duration
+
+        def loop():
+            while time.perf_counter() < stop_at:
+                user(False)
+
+        threads = [threading.Thread(target=loop) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            for offset, spike in arrivals(args):
+                scheduled = start + offset
+                time.sleep(max(0.0, scheduled - time.perf_counter()))
+                pool.submit(user, spike, scheduled)
+    elapsed = time.perf_counter() - start
+    oversells = check_oversells(module, recorder, show_ids)
+
+    requests = sum(len(latencies) for latencies in recorder.latencies.values())
+    return {
+        'app': args.app,
+        'profile': args.profile,
+        'elapsed_s': round(elapsed, 2),
+        'users': sum(recorder.outcomes[key] for key in ('booked', 'gave_up', 'left_queue', 'shed', 'error')),
+        'outcomes': dict(recorder.outcomes),
+        'throughput': {
+            'requests_per_sec': round(requests / elapsed, 1),
+            'bookings_per_sec': round(recorder.outcomes['booked'] / elapsed, 1),
+        },
+        'errors': sum(recorder.errors.values()),
+        'error_samples': recorder.error_samples,
+        'oversells': oversells,
+        'queue_delay': percentiles(recorder.queue_delays),
+        'waiting_room': {'users_let_in': len(recorder.queue_waits), **percentiles(recorder.queue_waits)},
+        'routes': {route: {'requests': len(latencies), 'errors': recorder.errors[route], **percentiles(latencies)}
+                   for route, latencies in recorder.latencies.items()},
+    }
+
+
+def compare(report, baseline):
+    """Lines describing how `report` moved against `baseline`, app by app."""
+    lines = []
+    for app, result in report['results'].items():
+        before = baseline['results'].get(app)
+        if before is None:
+            continue
+
+        def change(new, old):
+            return f"{old} -> {new}" + (f" ({(new - old) / old:+.0%})" if old else '')
+
+        lines.append(f"{app}: requests/s {change(result['throughput']['requests_per_sec'], before['throughput']['requests_per_sec'])}, "
+                     f"errors {before['errors']} -> {result['errors']}, "
+                     f"oversells {before['oversells']['total']} -> {result['oversells']['total']}")
+        for route, stats in result['routes'].items():
+            old = before['routes'].get(route)
+            if old:
+                lines.append(f"  {route}: p95 ms {change(stats['p95_ms'], old['p95_ms'])}")
+    return lines
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=APP_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', choices=['app', 'AWS_app', 'both'], default='both')
+    parser.add_argument('--profile', choices=['steady', 'ramp', 'spike', 'closed'], default='steady')
+    parser.add_argument('--rate', type=float, default=20, help='users started per second')
+    parser.add_argument('--duration', type=float, default=10, help='seconds')
+    parser.add_argument('--concurrency', type=int, default=32, help='users in flight at most')
+    parser.add_argument('--spike-at', type=float, default=3)
+    parser.add_argument('--spike-factor', type=float, default=10)
+    parser.add_argument('--spike-seconds', type=float, default=2)
+    parser.add_argument('--shows', type=int, default=8)
+    parser.add_argument('--max-seats', type=int, default=4)
+    parser.add_argument('--retries', type=int, default=2, help='new seat picks after a conflict')
+    parser.add_argument('--aws-latency', type=float, default=0.0, help='seconds added to every fake AWS call')
+    parser.add_argument('--admission', choices=['on', 'off'], default='on', help='admission control')
+    parser.add_argument('--waiting-room-rate', type=float, help='users let in per second (default: the app\'s)')
+    parser.add_argument('--patience', type=float, default=60, help='longest wait in the waiting room, seconds')
+    parser.add_argument('--pre-login', action='store_true', help='register and log users in before the run')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='also write the JSON report here')
+    parser.add_argument('--baseline', help='earlier JSON report to compare against')
+    args = parser.parse_args()
+
+    if args.app == 'both':
+        # Each app gets a fresh process: both open database.db relative to the working directory
+        results = {}
+        for app in ('app', 'AWS_app'):
+            argv = []
+            rest = iter(sys.argv[1:])
+            for arg in rest:
+                if arg in ('--app', '--output', '--baseline'):
+                    next(rest, None)
+                elif not arg.startswith(('--app=', '--output=', '--baseline=')):
+                    argv.append(arg)
+            out = subprocess.run([sys.executable, os.path.abspath(__file__), *argv, '--app', app],
+                                 capture_output=True, text=True, check=True).stdout
+            results.update(json.loads(out)['results'])
+    else:
+        results = {args.app: run(args)}
+
+    options = {key: value for key, value in vars(args).items() if key not in ('app', 'output', 'baseline')}
+    report = {'commit': git_commit(), 'options': options, 'results': results}
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if args.baseline:
+        with open(args.baseline) as f:
+            print('\n'.join(compare(report, json.load(f))), file=sys.stderr)
+    oversold = sum(result['oversells']['total'] for result in results.values())
+    sys.exit(1 if oversold else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+"""Bookings while seating pages hold seat event streams open, on one gthread-like worker.
+
+Serves the app over HTTP from a server that, like a gunicorn gthread
+worker, handles each connection on one of --threads threads, opens
+/api/shows/<id>/events streams as that many open seating pages would, and
+then has --bookings users each log in, pick seats and pay. Runs twice:
+
+  * threads     --thread-streams streams served by the Flask view, a
+                thread each: they take every thread, and logins and
+                bookings queue behind them until they time out
+  * event_loop  --streams streams served by seat_event_server.EventServer
+                (SEAT_EVENTS_BIND, as gunicorn.conf.py sets it) from the
+                worker's event loop, leaving the threads to the bookings
+
+and reports, per run, how many streams were served or left waiting for a
+thread, how many bookings completed within --timeout and their p50/p99,
+and how many served streams got the bookings' seat changes. Exits non-zero
+if, on the event loop, any booking failed or any stream missed its events.
+
+    python benchmarks/load_sse_bookings.py --threads 4 --streams 2000 --bookings 20
+"""
+import argparse
+import contextlib
+import http.cookiejar
+import io
+import json
+import os
+import queue
+import re
+import selectors
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from _harness import APP_DIR, load_app, percentiles
+
+from seat_inventory import DEFAULT_LAYOUT  # noqa: E402
+
+MOVIE = 'KUBERA'
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class GthreadServer(WSGIServer):
+    """WSGI server handling each connection on one of `threads` threads, as a gthread worker does."""
+
+    def __init__(self, address, threads):
+        super().__init__(address, QuietHandler)
+        self.connections = queue.Queue()
+        # Daemon threads: streams still open at exit don't keep the process alive
+        for _ in range(threads):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def process_request(self, request, client_address):
+        self.connections.put((request, client_address))
+
+    def _work(self):
+        while True:
+            request, client_address = self.connections.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+
+def read_until(received, marker, timeout):
+    """Read the sockets of `received` ({socket: bytes so far}) until each has `marker` or `timeout` passes.
+
+    Returns the sockets whose bytes contain it.
+    """
+    done = {sock for sock, data in received.items() if marker in data}
+    with selectors.DefaultSelector() as selector:
+        for sock in received.keys() - done:
+            selector.register(sock, selectors.EVENT_READ)
+        deadline = time.monotonic() + timeout
+        while len(done) < len(received) and time.monotonic() < deadline:
+            for key, _ in selector.select(max(0.0, deadline - time.monotonic())):
+                chunk = key.fileobj.recv(65536)
+                received[key.fileobj] += chunk
+                if marker in received[key.fileobj] or not chunk:
+                    selector.unregister(key.fileobj)
+                    if chunk:
+                        done.add(key.fileobj)
+    return done
+
+
+def open_streams(port, path, count, timeout):
+    """`count` sockets that asked for `path` as an EventSource would, and those answered with 200 and a snapshot."""
+    request = (f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\nAccept: text/event-stream\r\n\r\n").encode()
+    received = {}
+    for _ in range(count):
+        sock = socket.create_connection(('127.0.0.1', port))
+        sock.sendall(request)
+        received[sock] = b''
+    served = {sock for sock in read_until(received, b'event: snapshot', timeout)
+              if received[sock].startswith(b'HTTP/1.1 200') or received[sock].startswith(b'HTTP/1.0 200')}
+    return received, served
+
+
+def book(base, n, timeout):
+    """Log user n in, hold a seat and pay for it; the seconds it took, or None if it failed."""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    seat = DEFAULT_LAYOUT.label(n % DEFAULT_LAYOUT.capacity)
+    tier = DEFAULT_LAYOUT.tier_of(seat)
+    start = time.perf_counter()
+    try:
+        opener.open(f"{base}/login", urllib.parse.urlencode(
+            {'email': f"user{n}@example.com", 'password': 'pw'}).encode(), timeout=timeout)
+        response = opener.open(f"{base}/seating/{MOVIE}", urllib.parse.urlencode(
+            {'seats': f"{seat}:{tier}"}).encode(), timeout=timeout)
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(response.url).query)
+        response = opener.open(f"{base}/process_payment", urllib.parse.urlencode({
+            'movie': MOVIE, 'seats': query['seats'][0], 'total': query['total'][0], 'payment_method': 'UPI',
+            'upi_id': f"user{n}@upi"}).encode(), timeout=timeout)
+    except (urllib.error.URLError, socket.timeout, TimeoutError, KeyError):
+        return None
+    return time.perf_counter() - start if '/tickets' in response.url else None
+
+
+def run(label, args):
+    workdir = tempfile.mkdtemp()
+    received = {}
+    event_loop = label == 'event_loop'
+    try:
+        config = {'ADMISSION_CONTROL': False}
+        if event_loop:
+            config['SEAT_EVENTS_BIND'] = '127.0.0.1:0'
+        with contextlib.redirect_stdout(io.StringIO()):
+            state = load_app('app', workdir, config=config)
+        client = state.app.test_client()
+        for n in range(args.bookings):
+            client.post('/register', data={'name': 'load', 'email': f"user{n}@example.com", 'password': 'pw'})
+        client.post('/register', data={'name': 'load', 'email': 'viewer@example.com', 'password': 'pw'})
+        client.post('/login', data={'email': 'viewer@example.com', 'password': 'pw'})
+        events_path = json.loads(re.search(r"const eventsUrl = (\"[^\"]+\")",
+                                           client.get(f"/seating/{MOVIE}").get_data(as_text=True)).group(1))
+
+        server = GthreadServer(('127.0.0.1', 0), args.threads)
+        server.set_app(state.app)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1]
+
+        stream_port = state.event_server.port if event_loop else port
+        count = args.streams if event_loop else args.thread_streams
+        received, served = open_streams(stream_port, events_path, count, args.stream_timeout)
+
+        latencies = [None] * args.bookings
+
+        def user(n):
+            latencies[n] = book(f"http://127.0.0.1:{port}", n, args.timeout)
+
+        users = [threading.Thread(target=user, args=(n,)) for n in range(args.bookings)]
+        for thread in users:
+            thread.start()
+        for thread in users:
+            thread.join()
+        completed = [latency for latency in latencies if latency is not None]
+        # Every booking sold a seat, so every served stream should get a seats event
+        notified = set()
+        if completed:
+            notified = read_until({sock: b'' for sock in served}, b'event: seats', args.stream_timeout)
+        with state.pool.connection() as conn:
+            booked = conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0]
+        server.shutdown()
+        state.stop()
+        return {
+            'run': label,
+            'threads': args.threads,
+            'streams': {'served': len(served), 'waiting': count - len(served), 'notified': len(notified)},
+            'bookings_completed': len(completed),
+            'bookings_failed': args.bookings - len(completed),
+            'bookings_in_database': booked,
+            'booking': percentiles(completed, (0.5, 0.99)),
+        }
+    finally:
+        for sock in received:
+            sock.close()
+        os.chdir(APP_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=4, help='threads of the worker (gunicorn THREADS)')
+    parser.add_argument('--streams', type=int, default=2000,
+                        help='seating pages holding a stream open on the event loop')
+    parser.add_argument('--thread-streams', type=int, default=8,
+                        help='seating pages holding a stream open on the threads')
+    parser.add_argument('--bookings', type=int, default=20)
+    parser.add_argument('--timeout', type=float, default=5, help='seconds a booking request may take')
+    parser.add_argument('--stream-timeout', type=float, default=5,
+                        help='seconds to wait for streams to start, and for their events, before giving up')
+    args = parser.parse_args()
+    results = [run('threads', args), run('event_loop', args)]
+    print(json.dumps(results, indent=2))
+    event_loop = results[1]
+    sys.exit(1 if event_loop['bookings_failed'] or event_loop['streams']['notified'] < args.streams else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+"""Bytes transferred per page before and after the static asset pipeline.
+
+Loads app.py (run `python assets.py build` first) and, for each page, fetches
+the HTML plus what a browser would fetch for it: stylesheets, <img>/<picture>
+images (the srcset candidate for a 2x screen, WebP when offered) and the CSS
+background of the page's body class (the image-set() candidate for a 2x
+screen, after the @media (max-width) rules matching --viewport). Everything
+is requested with
+"Accept-Encoding: br, gzip", once with the pipeline off (plain static/ files,
+as before) and once on. Repeat visits re-request every asset before (ETag
+revalidation) and none after (immutable):
+
+    python benchmarks/report_page_bytes.py
+    python benchmarks/report_page_bytes.py --viewport 412   # a phone
+"""
+import argparse
+import json
+import posixpath
+import re
+import sys
+import tempfile
+
+from _harness import load_app, login
+
+PAGES = ['/', '/login', '/register', '/home', '/booking/KUBERA', '/seating/KUBERA',
+         '/payment/KUBERA?seats=A1&total=350', '/dashboard', '/about', '/services']
+HEADERS = {'Accept-Encoding': 'br, gzip', 'Accept': 'image/webp,*/*'}
+
+# Poster <img> elements are 170 CSS px wide; pick for a 2x screen
+IMAGE_WIDTH = 340
+DEVICE_PIXEL_RATIO = 2
+
+_RULE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+_URL = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)""")
+_COMMENT = re.compile(r"/\*.*?\*/", re.S)
+_MEDIA = re.compile(r"@media\s*\(max-width:\s*(\d+)px\)\s*\{((?:[^{}]*\{[^{}]*\})*[^{}]*)\}")
+_IMAGE_SET_OPTION = re.compile(r"""url\(\s*['"]?([^'")]+)['"]?\s*\)\s*type\('([^']+)'\)(?:\s*([\d.]+)x)?""")
+
+
+def pick_srcset(srcset):
+    candidates = []
+    for candidate in srcset.split(','):
+        url, _, width = candidate.strip().partition(' ')
+        candidates.append((int(width.rstrip('w') or 0), url))
+    candidates.sort()
+    return next((url for width, url in candidates if width >= IMAGE_WIDTH), candidates[-1][1])
+
+
+def apply_media(css, viewport):
+    """`css` as seen `viewport` CSS px wide: matching max-width rules unwrapped, the others dropped."""
+    return _MEDIA.sub(lambda match: match.group(2) if viewport <= int(match.group(1)) else '', css)
+
+
+def pick_image_set(image_set):
+    """The WebP option of an image-set() for a DEVICE_PIXEL_RATIO screen, or None if it has none."""
+    options = sorted((float(resolution or 1), url) for url, image_type, resolution in
+                     _IMAGE_SET_OPTION.findall(image_set) if image_type == 'image/webp')
+    fitting = [url for resolution, url in options if resolution <= DEVICE_PIXEL_RATIO]
+    return fitting[-1] if fitting else options[0][1] if options else None
+
+
+def page_assets(client, html, viewport):
+    """URLs a browser `viewport` CSS px wide would fetch for `html`."""
+    urls = re.findall(r'<link[^>]+href="([^"]+\.css)"', html)
+    for picture in re.findall(r'<picture>(.*?)</picture>', html, re.S):
+        webp = re.search(r'<source type="image/webp" srcset="([^"]+)"', picture)
+        img = re.search(r'<img src="([^"]+)"(?: srcset="([^"]*)")?', picture)
+        urls.append(pick_srcset(webp.group(1)) if webp else
+                    pick_srcset(img.group(2)) if img.group(2) else img.group(1))
+    html_without_pictures = re.sub(r'<picture>.*?</picture>', '', html, flags=re.S)
+    urls += re.findall(r'<img src="([^"]+)"', html_without_pictures)
+    urls += _URL.findall(''.join(re.findall(r'<style>(.*?)</style>', html, re.S)))
+
+    body = re.search(r'<body(?: class="([^"]*)")?', html)
+    body_classes = set((body.group(1) or '').split())
+    for css_url in re.findall(r'<link[^>]+href="([^"]+\.css)"', html):
+        css = apply_media(client.get(css_url).get_data(as_text=True), viewport)
+        # A comment before a rule would otherwise end up in its selectors
+        css = _COMMENT.sub('', css)
+        background = None
+        for selectors, declarations in _RULE.findall(css):
+            selectors = {selector.strip() for selector in selectors.split(',')}
+            if not any(f".{cls}" in selectors or f"body.{cls}" in selectors for cls in body_classes):
+                continue
+            image_set = pick_image_set(declarations.split('image-set(')[-1]) if 'image-set(' in declarations \
+                else None
+            found = [image_set] if image_set else [url for url in _URL.findall(declarations)
+                                                   if not url.startswith('http')]
+            if found:
+                background = posixpath.normpath(posixpath.join(posixpath.dirname(css_url), found[0]))
+        if background:
+            urls.append(background)
+    return list(dict.fromkeys(urls))
+
+
+def measure(client, path, viewport):
+    response = client.get(path, headers=HEADERS)
+    html = response.get_data(as_text=True)
+    total = len(response.get_data())
+    assets = {}
+    for url in page_assets(client, html, viewport):
+        asset = client.get(url, headers=HEADERS)
+        assets[url] = {'bytes': len(asset.get_data()), 'status': asset.status_code,
+                       'encoding': asset.headers.get('Content-Encoding'),
+                       'immutable': 'immutable' in asset.headers.get('Cache-Control', '')}
+    return {
+        'html_bytes': total,
+        'asset_bytes': sum(asset['bytes'] for asset in assets.values()),
+        'first_visit_bytes': total + sum(asset['bytes'] for asset in assets.values()),
+        'repeat_visit_asset_requests': sum(1 for asset in assets.values() if not asset['immutable']),
+        'assets': assets,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--verbose', action='store_true', help='list every asset')
+    parser.add_argument('--viewport', type=int, default=1280, help='browser width in CSS px, for @media rules')
+    args = parser.parse_args()
+
+    module = load_app('app', tempfile.mkdtemp(prefix='report_page_bytes_'))
+    assets = module.app.extensions['assets']
+    if not assets.files:
+        sys.exit('No static/dist/manifest.json: run `python assets.py build` first')
+    client = login(module.app, 'bytes@example.com')
+
+    report = {}
+    totals = {'before': 0, 'after': 0}
+    for label, enabled in (('before', False), ('after', True)):
+        assets.enabled = enabled
+        # Cached pages hold URLs from the other mode
+        module.pages.clear()
+        for path in PAGES:
+            result = measure(client, path, args.viewport)
+            if not args.verbose:
+                result.pop('assets')
+            report.setdefault(path, {})[label] = result
+            totals[label] += result['first_visit_bytes']
+    print(json.dumps({'pages': report, 'total_first_visit_bytes': totals,
+                      'saved_percent': round(100 * (1 - totals['after'] / totals['before']), 1)}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
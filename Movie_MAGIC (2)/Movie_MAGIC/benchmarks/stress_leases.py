@@ -0,0 +1,275 @@
+"""Multi-instance seat leasing: N app instances holding and selling the same seats.
+
+Starts --instances copies of the app, each with its own SeatInventory and
+HoldManager, as gunicorn workers or instances behind a load balancer have,
+and lets all of them hold and buy random seats among the first --hot-seats
+of --shows shows for --seconds:
+
+  * sqlite    every instance is its own process on one scratch
+              database.db (seat_leases table)
+  * dynamodb  AWS_app instances on threads of one process, each with a
+              database of its own, sharing one aws_fakes table with
+              --dynamodb-latency per call (the fake lives in memory, so it
+              can't be shared between processes)
+  * memory    instances on threads of one process, each with a database of
+              its own, sharing MemoryLeases
+  * none      no leases, one database.db as with sqlite: instances only
+              find out at payment, from the booking_seats primary key, that
+              another one sold the seat
+
+Instances with a database of their own create the shows in a different
+order, so each gives a show another id, as separate hosts would; leases
+shared between them have to name shows by booking_store.show_key().
+
+Each round places a hold (HoldManager.place: local hold + lease), then
+gives it back (--abandon-rate), pays for it after its lease has run out
+(--stall-rate; the instance's hold clock runs at half speed, like a paused
+or skewed host, so the hold is still live locally and only the fencing
+token can stop the sale if another instance has leased a seat meanwhile)
+or pays for it at once. Reports holds/s, conflicts/s and sales/s, p50/p99
+of placing a hold (the lock acquisition), and how many payments were
+turned away, then checks the databases: no seat of a show sold twice (in
+the legacy bookings.seats column, which has no constraint), and, with
+leases, exactly one sold lease per sold seat. Exits non-zero on any
+oversold or leaked seat.
+
+    python benchmarks/stress_leases.py --instances 1 2 4 8 --seconds 5
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from _harness import APP_DIR, load_app, percentiles
+
+import aws_fakes  # noqa: E402
+import booking_store  # noqa: E402
+import leases  # noqa: E402
+from seat_holds import HoldExpired  # noqa: E402
+from seat_inventory import DEFAULT_LAYOUT, SeatUnavailable  # noqa: E402
+
+MOVIES = ['KUBERA', 'DEVARA', 'ANIMAL']
+
+
+def instance_dir(backend, workdir, number):
+    """The directory of instance `number`'s database.db: `workdir` itself where instances share one."""
+    if backend in ('sqlite', 'none'):
+        return workdir
+    directory = os.path.join(workdir, f"instance{number}")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def start_instance(backend, workdir, number, ttl, slots, dynamodb=None, shared=None):
+    """A started app on its database.db, leasing seats from `backend`, and its (show id, movie) of each slot."""
+    directory = instance_dir(backend, workdir, number)
+    with contextlib.redirect_stdout(io.StringIO()):
+        state = load_app('AWS_app' if backend == 'dynamodb' else 'app', directory, dynamodb=dynamodb, config={
+            'SEAT_LEASE_BACKEND': backend if backend in ('sqlite', 'dynamodb') else 'memory',
+            # Absolute: instances on threads of one process share its working directory
+            'DATABASE': os.path.join(directory, 'database.db')})
+    state.holds.ttl = ttl
+    if backend == 'memory':
+        state.holds.leases = shared.sharing(state.show_keys)
+    elif backend == 'none':
+        state.holds.leases = None
+    # Each instance starts its shows from another slot, so ids differ between databases
+    start = number * 7 % len(slots)
+    with state.pool.connection() as conn:
+        ids = {slot: booking_store.show_id_for(conn, *slot) for slot in slots[start:] + slots[:start]}
+        conn.commit()
+    return state, [(ids[slot], slot[0]) for slot in slots]
+
+
+def play(state, number, args, shows, deadline):
+    """Hold and buy seats until `deadline`; returns the counts and hold latencies."""
+    rng = random.Random(number)
+    holds = state.holds
+    hot = [DEFAULT_LAYOUT.label(i) for i in range(args.hot_seats)]
+    email = f"instance{number}@example.com"
+    counts = Counter()
+    latencies = []
+
+    def write(conn, hold):
+        hold.booking_id = booking_store.insert_booking(conn, email, hold.show, hold.movie, hold.seats,
+                                                       hold.total, 'UPI')
+
+    while time.time() < deadline:
+        show, movie = rng.choice(shows)
+        seats = rng.sample(hot, rng.randint(1, args.max_seats))
+        start = time.perf_counter()
+        try:
+            hold = holds.place(show, movie, seats, email, 250 * len(seats))
+        except SeatUnavailable:
+            latencies.append(time.perf_counter() - start)
+            counts['conflicts'] += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+        counts['holds'] += 1
+        luck = rng.random()
+        if luck < args.abandon_rate:
+            holds.release(hold.hold_id)
+            counts['abandoned'] += 1
+            continue
+        if luck < args.abandon_rate + args.stall_rate:
+            time.sleep(holds.ttl * 1.5)
+            counts['stalled'] += 1
+        try:
+            holds.confirm(state.writer, hold.hold_id, write)
+            counts['sales'] += 1
+        except SeatUnavailable:
+            counts['turned_away_at_payment'] += 1
+        except HoldExpired:
+            counts['expired'] += 1
+    return {'counts': counts, 'latencies': latencies}
+
+
+def run_process(backend, workdir, number, args, slots, start_at):
+    """One instance in a process of its own (sqlite and none)."""
+    state, shows = start_instance(backend, workdir, number, args.ttl, slots)
+    if args.stall_rate:
+        state.holds.clock = lambda: time.monotonic() / 2
+    time.sleep(max(0.0, start_at - time.time()))
+    result = play(state, number, args, shows, start_at + args.seconds)
+    state.stop()
+    return result
+
+
+def run_threads(backend, workdir, count, args, slots, dynamodb, shared):
+    """`count` instances of one process on threads of their own (dynamodb and memory)."""
+    instances = [start_instance(backend, workdir, number, args.ttl, slots, dynamodb, shared)
+                 for number in range(count)]
+    states = [state for state, _ in instances]
+    for state in states:
+        if args.stall_rate:
+            state.holds.clock = lambda: time.monotonic() / 2
+    start_at = time.time() + 0.5
+    results = [None] * count
+
+    def instance(number):
+        time.sleep(max(0.0, start_at - time.time()))
+        state, shows = instances[number]
+        results[number] = play(state, number, args, shows, start_at + args.seconds)
+
+    threads = [threading.Thread(target=instance, args=(number,)) for number in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for state in states:
+        state.stop()
+    return results
+
+
+def sales(path):
+    """(show key, seat) of every seat sold in the database at `path`: booking_seats, the legacy
+    bookings.seats, the show key of each id, and the sold seat_leases rows."""
+    conn = sqlite3.connect(path)
+    try:
+        keys = {show: booking_store.show_key(movie, starts_at)
+                for show, movie, starts_at in conn.execute("SELECT id, movie, starts_at FROM shows")}
+        sold = Counter((keys[show], seat) for show, seat in conn.execute("SELECT show_id, seat FROM booking_seats"))
+        legacy = Counter((keys[show], seat) for show, seats in conn.execute("SELECT show_id, seats FROM bookings")
+                         for seat in seats.split(','))
+        leased = Counter((keys[show], seat) for show, seat in
+                         conn.execute("SELECT show_id, seat FROM seat_leases WHERE sold = 1"))
+    finally:
+        conn.close()
+    return sold, legacy, leased
+
+
+def sold_leases(backend, sqlite_leased, dynamodb, shared, table_name):
+    """(show key, seat) of every lease marked sold."""
+    if backend == 'sqlite':
+        return sqlite_leased
+    if backend == 'dynamodb':
+        return Counter(tuple(item['show_seat'].rsplit('#', 1)) for item in dynamodb.Table(table_name).items.values()
+                       if item['sold'])
+    return Counter((show, seat) for (show, seat), lease in shared._leases.items() if lease[3])
+
+
+def run(backend, count, args):
+    workdir = tempfile.mkdtemp()
+    try:
+        dynamodb = aws_fakes.FakeDynamoResource(latency=args.dynamodb_latency)
+        shared = leases.MemoryLeases() if backend == 'memory' else None
+        first = datetime.datetime.now() + datetime.timedelta(days=1)
+        slots = [(MOVIES[i % len(MOVIES)], (first + datetime.timedelta(hours=i)).strftime('%Y-%m-%d %H:%M'))
+                 for i in range(args.shows)]
+
+        if backend in ('sqlite', 'none'):
+            # Migrate and create the shows once, before the processes race to
+            setup, _ = start_instance(backend, workdir, 0, args.ttl, slots)
+            setup.stop()
+            start_at = time.time() + 3 + count * 0.5
+            with multiprocessing.get_context('spawn').Pool(count) as pool:
+                results = pool.starmap(run_process, [(backend, workdir, number, args, slots, start_at)
+                                                     for number in range(count)])
+        else:
+            results = run_threads(backend, workdir, count, args, slots, dynamodb, shared)
+
+        counts = sum((result['counts'] for result in results), Counter())
+        latencies = [latency for result in results for latency in result['latencies']]
+        sold, legacy, sqlite_leased = Counter(), Counter(), Counter()
+        for number in range(1 if backend in ('sqlite', 'none') else count):
+            found = sales(os.path.join(instance_dir(backend, workdir, number), 'database.db'))
+            for total, part in zip((sold, legacy, sqlite_leased), found):
+                total.update(part)
+        oversold = sorted(f"{show}#{seat}" for (show, seat), n in legacy.items() if n > 1)
+        if backend == 'none':
+            leaked = []
+        else:
+            leased = set(sold_leases(backend, sqlite_leased, dynamodb, shared,
+                                     leases.DEFAULTS['SEAT_LEASES_TABLE']))
+            leaked = sorted(f"{show}#{seat}" for show, seat in leased ^ set(sold))
+        return {
+            'backend': backend,
+            'instances': count,
+            'mode': 'processes' if backend in ('sqlite', 'none') else 'threads',
+            **{key: counts[key] for key in ('holds', 'conflicts', 'sales', 'abandoned', 'stalled',
+                                            'turned_away_at_payment', 'expired')},
+            'holds_per_sec': round(counts['holds'] / args.seconds),
+            'conflicts_per_sec': round(counts['conflicts'] / args.seconds),
+            'sales_per_sec': round(counts['sales'] / args.seconds),
+            'place_hold': percentiles(latencies, (0.5, 0.99)),
+            'seats_sold': sum(sold.values()),
+            'oversold': oversold,
+            'leaked': leaked,
+        }
+    finally:
+        os.chdir(APP_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backends', nargs='+', default=['sqlite', 'dynamodb', 'memory', 'none'],
+                        choices=['sqlite', 'dynamodb', 'memory', 'none'])
+    parser.add_argument('--instances', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--shows', type=int, default=200)
+    parser.add_argument('--hot-seats', type=int, default=16)
+    parser.add_argument('--max-seats', type=int, default=4)
+    parser.add_argument('--abandon-rate', type=float, default=0.3)
+    parser.add_argument('--stall-rate', type=float, default=0.01)
+    parser.add_argument('--ttl', type=float, default=0.5, help='seconds a hold and its leases last')
+    parser.add_argument('--dynamodb-latency', type=float, default=0.002)
+    args = parser.parse_args()
+    results = [run(backend, count, args) for backend in args.backends for count in args.instances]
+    print(json.dumps(results, indent=2))
+    sys.exit(1 if any(result['oversold'] or result['leaked'] for result in results) else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Concurrency stress test for seat reservation.
+
+Fires hundreds of parallel /seating + /process_payment POSTs for overlapping
+seats at a copy of app.py running on a scratch database, then checks the
+bookings table for any seat that was sold twice. Exits non-zero on double
+booking.
+
+    python benchmarks/stress_seating.py --requests 500 --threads 64
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from _harness import APP_DIR, load_app, login
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app', default='app')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=64)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--movie', default='KUBERA')
+    parser.add_argument('--max-seats', type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    state = None
+    try:
+        state = load_app(args.app, workdir)
+        app = state.app
+        clients = [(login(app, f"stress{i}@example.com"), threading.Lock()) for i in range(args.users)]
+
+        rows = 'ABCDEFGHIJ'
+        accepted = Counter()
+
+        def attempt(n):
+            rng = random.Random(n)
+            # Crowd everyone into the same few rows to force collisions
+            picks = {f"{rng.choice(rows[:3])}{rng.randint(1, 8)}" for _ in range(rng.randint(1, args.max_seats))}
+            seats = ','.join(f"{seat}:premium" for seat in picks)
+            client, lock = clients[n % len(clients)]
+            with lock:
+                resp = client.post(f"/seating/{args.movie}", data={'seats': seats})
+                if '/payment/' not in resp.headers.get('Location', ''):
+                    accepted['rejected'] += 1
+                    return
+                resp = client.post('/process_payment', data={
+                    'movie': args.movie, 'seats': seats, 'total': '0',
+                    'payment_method': 'UPI', 'upi_id': 'stress@upi'})
+            location = resp.headers.get('Location', '')
+            accepted['accepted' if '/tickets' in location else 'rejected'] += 1
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(args.threads) as pool:
+            list(pool.map(attempt, range(args.requests)))
+        elapsed = time.perf_counter() - start
+
+        import db
+        with db.get_pool(app).connection() as conn:
+            booked = conn.execute("SELECT seats FROM bookings WHERE movie = ?", (args.movie,)).fetchall()
+            sold = conn.execute("SELECT COUNT(*) FROM booking_seats AS s JOIN shows ON shows.id = s.show_id "
+                                "WHERE shows.movie = ?", (args.movie,)).fetchone()[0]
+
+        counts = Counter(seat.split(':')[0] for (seats,) in booked for seat in seats.split(','))
+        double_booked = sorted(seat for seat, n in counts.items() if n > 1)
+        report = {
+            'requests': args.requests,
+            'threads': args.threads,
+            'accepted': accepted['accepted'],
+            'rejected': accepted['rejected'],
+            'seats_sold': sum(counts.values()),
+            'booking_seats_rows': sold,
+            'double_booked': double_booked,
+            'requests_per_sec': round(args.requests / elapsed, 1),
+        }
+        print(json.dumps(report, indent=2))
+        sys.exit(1 if double_booked or sold != sum(counts.values()) else 0)
+    finally:
+        # The ticket pool renders into workdir; let it finish before that goes
+        if state is not None:
+            state.stop()
+        os.chdir(APP_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
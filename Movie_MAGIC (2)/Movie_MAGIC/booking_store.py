@@ -0,0 +1,199 @@
+"""SQL for shows and bookings on the normalized schema (see migrations.py).
+
+Seats live one per row in booking_seats, so reads never re-split the
+legacy bookings.seats CSV column; it is still written for older readers.
+"""
+import datetime
+import threading
+from itertools import groupby
+
+# Dashboard rows per page, and the most a client may ask for
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# Rows fetched per query while a page is streamed
+FETCH_SIZE = 100
+
+
+def show_id_for(conn, movie, starts_at=''):
+    """Id of the show of `movie` at `starts_at`, creating it on first use."""
+    row = conn.execute("SELECT id FROM shows WHERE movie = ? AND starts_at = ?", (movie, starts_at)).fetchone()
+    if row:
+        return row[0]
+    conn.execute("INSERT OR IGNORE INTO shows (movie, starts_at) VALUES (?, ?)", (movie, starts_at))
+    return conn.execute("SELECT id FROM shows WHERE movie = ? AND starts_at = ?", (movie, starts_at)).fetchone()[0]
+
+
+def show_key(movie, starts_at):
+    """A show's name on every app instance, e.g. 'KUBERA@2025-06-01 18:30'.
+
+    Show ids are handed out by each database as shows are first used, so
+    instances with databases of their own give one show different ids.
+    """
+    return f"{movie}@{starts_at}"
+
+
+class ShowKeys:
+    """show_key() of the shows of one database, by id. A show never changes, so each is read once."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, show_id):
+        key = self._keys.get(show_id)
+        if key is None:
+            with self.pool.connection() as conn:
+                row = conn.execute("SELECT movie, starts_at FROM shows WHERE id = ?", (show_id,)).fetchone()
+            if row is None:
+                raise KeyError(show_id)
+            with self._lock:
+                key = self._keys[show_id] = show_key(*row)
+        return key
+
+
+def now():
+    return datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def insert_booking(conn, email, show_id, movie, seats, total, payment_method=None, created_at=None):
+    """Insert the bookings row and return its id.
+
+    The seats themselves are written to booking_seats by
+    SeatInventory.reserve() in the same transaction.
+    """
+    created_at = created_at or now()
+    cur = conn.execute('''INSERT INTO bookings (email, movie, seats, total, show_id, payment_method, created_at)
+                          VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                       (email, movie, ','.join(seats), total, show_id, payment_method, created_at))
+    return cur.lastrowid
+
+
+def user_bookings(conn, email):
+    """All bookings of `email`, oldest first, with seats as lists.
+
+    Served by idx_bookings_email and the booking_seats primary key/index,
+    no table scan.
+    """
+    rows = conn.execute('''SELECT b.id, b.movie, b.total, b.payment_method, b.created_at, s.seat
+                           FROM bookings AS b
+                           LEFT JOIN booking_seats AS s ON s.booking_id = b.id
+                           WHERE b.email = ?
+                           ORDER BY b.id, s.seat''', (email,))
+    bookings = []
+    for _, group in groupby(rows, key=lambda row: row[0]):
+        group = list(group)
+        booking_id, movie, total, payment_method, created_at, _ = group[0]
+        bookings.append({
+            'id': booking_id,
+            'movie': movie,
+            'seats': [row[5] for row in group if row[5] is not None],
+            'total': total,
+            'payment_method': payment_method,
+            'timestamp': created_at,
+        })
+    return bookings
+
+
+def ticket(conn, booking_id, schema='main'):
+    """What goes on the ticket of `booking_id`, as a dict, or None if there is no such booking.
+
+    `schema` is where to look: 'main', or 'archive' for archived bookings (see archive.py).
+    """
+    row = conn.execute(f'''SELECT b.email, b.movie, sh.starts_at, sc.name, b.total, b.created_at
+                           FROM {schema}.bookings AS b
+                           LEFT JOIN main.shows AS sh ON sh.id = b.show_id
+                           LEFT JOIN main.screens AS sc ON sc.id = sh.screen_id
+                           WHERE b.id = ?''', (booking_id,)).fetchone()
+    if row is None:
+        return None
+    email, movie, starts_at, screen, total, created_at = row
+    seats = [seat for seat, in conn.execute(f"SELECT seat FROM {schema}.booking_seats WHERE booking_id = ? "
+                                            f"ORDER BY seat", (booking_id,))]
+    return {
+        'booking_id': booking_id,
+        'email': email,
+        'movie': movie,
+        'starts_at': starts_at or None,
+        'screen': screen,
+        'seats': seats,
+        'total': total,
+        'booked_at': created_at,
+    }
+
+
+def page_args(args):
+    """(before, limit) from ?before=<booking id>&limit=<n> query arguments."""
+    before = args.get('before', type=int)
+    limit = args.get('limit', PAGE_SIZE, type=int)
+    return before, max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def _with_seats(conn, rows, schema='main'):
+    """Turn (id, movie, total, payment_method, created_at) rows into booking dicts."""
+    ids = [row[0] for row in rows]
+    seats = {booking_id: [] for booking_id in ids}
+    marks = ','.join('?' * len(ids))
+    for booking_id, seat in conn.execute(f"SELECT booking_id, seat FROM {schema}.booking_seats "
+                                         f"WHERE booking_id IN ({marks}) ORDER BY booking_id, seat", ids):
+        seats[booking_id].append(seat)
+    return [{
+        'id': booking_id,
+        'movie': movie,
+        'seats': seats[booking_id],
+        'total': total,
+        'payment_method': payment_method,
+        'timestamp': created_at,
+    } for booking_id, movie, total, payment_method, created_at in rows]
+
+
+class BookingPage:
+    """One page of a user's bookings, newest first, read lazily by keyset.
+
+    Iterating fetches FETCH_SIZE rows at a time (WHERE id < last seen id on
+    idx_bookings_email), so a streamed page never holds more than one fetch
+    in memory and the cost does not grow with the length of the history.
+    next_before is the cursor for the following page, set once the page has
+    been iterated (None on the last page).
+
+    With schema='archive' the page comes from the archived bookings (see
+    archive.py), leaving out any whose move hasn't finished and that are
+    still in the hot table.
+    """
+
+    def __init__(self, conn, email, before=None, limit=PAGE_SIZE, schema='main'):
+        self.conn = conn
+        self.email = email
+        self.before = before
+        self.limit = limit
+        self.schema = schema
+        self.next_before = None
+
+    def __iter__(self):
+        before = self.before
+        left = self.limit
+        while left > 0:
+            # One extra row tells whether another page follows
+            size = min(FETCH_SIZE, left) + 1
+            rows = self._fetch(before, size)
+            more = len(rows) == size
+            rows = rows[:size - 1]
+            if not rows:
+                return
+            yield from _with_seats(self.conn, rows, self.schema)
+            before = rows[-1][0]
+            left -= len(rows)
+            if not more:
+                return
+        self.next_before = before
+
+    def _fetch(self, before, size):
+        sql = f"SELECT id, movie, total, payment_method, created_at FROM {self.schema}.bookings AS b WHERE email = ?"
+        args = [self.email]
+        if before is not None:
+            sql += " AND id < ?"
+            args.append(before)
+        if self.schema != 'main':
+            sql += " AND NOT EXISTS (SELECT 1 FROM main.bookings AS hot WHERE hot.id = b.id)"
+        return self.conn.execute(sql + " ORDER BY id DESC LIMIT ?", (*args, size)).fetchall()
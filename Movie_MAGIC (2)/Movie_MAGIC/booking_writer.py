@@ -0,0 +1,188 @@
+"""Group commit for booking transactions.
+
+Every booking used to run BEGIN IMMEDIATE ... COMMIT on its request's own
+connection, so concurrent bookings queued up on SQLite's write lock (each
+waiter polling it through busy_timeout) and paid for one commit apiece.
+
+BookingWriter runs them on one writer thread instead. Request threads
+submit() a function writing their booking; the writer collects whatever
+arrives within max_wait_us of the first one, up to max_batch, and runs
+them in a single transaction, each inside its own SAVEPOINT:
+
+    BEGIN IMMEDIATE
+      SAVEPOINT booking; <booking 1>; RELEASE booking
+      SAVEPOINT booking; <booking 2 raises>; ROLLBACK TO booking; RELEASE booking
+      ...
+    COMMIT
+
+The writer only waits while other submit() calls are under way, so a lone
+booking is committed straight away.
+
+A booking that raises is rolled back alone and its submit() re-raises the
+error; the others still commit. submit() only returns once COMMIT has
+returned, so a booking is exactly as durable as before when its request
+answers, and if the COMMIT itself fails every booking of the batch fails
+with it and nothing of the batch is stored.
+
+DirectWriter has the same submit() and keeps the old one transaction per
+booking on the calling thread (BOOKING_GROUP_COMMIT = False).
+"""
+import queue
+import threading
+import time
+
+import metrics
+from db import write_transaction
+
+# Most bookings committed in one transaction
+MAX_BATCH = 64
+
+# How long the writer waits for more bookings once the first of a batch has
+# arrived, in microseconds, if other bookings are being submitted
+MAX_WAIT_US = 500
+
+
+class WriterStopped(Exception):
+    """Raised by submit() once the writer has been stopped."""
+
+
+class _Request:
+    __slots__ = ('work', 'done', 'result', 'error')
+
+    def __init__(self, work):
+        self.work = work
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class DirectWriter:
+    """submit() runs each booking in its own transaction on the calling thread."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=None):
+        pass
+
+    def submit(self, work):
+        with self.pool.connection() as conn, write_transaction(conn):
+            result = work(conn)
+        metrics.BOOKING_BATCH_SIZE.observe(1)
+        return result
+
+
+class BookingWriter:
+    """Commits submitted bookings in groups on a single writer thread."""
+
+    def __init__(self, pool, max_batch=MAX_BATCH, max_wait_us=MAX_WAIT_US):
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_us / 1e6
+        self._queue = queue.SimpleQueue()
+        # submit() calls that have not returned yet
+        self._submitting = 0
+        self._thread = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='booking-writer', daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Commit what is queued, then stop the writer thread."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+            self._stopped = True
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, work):
+        """Run work(conn) in the next group transaction and return its result.
+
+        work must only execute statements on conn, never commit or roll
+        back. Whatever it raises is re-raised here after its changes were
+        rolled back; a failed COMMIT is re-raised for every booking in it.
+        """
+        if self._thread is None:
+            if self._stopped:
+                raise WriterStopped()
+            self.start()
+        request = _Request(work)
+        with self._lock:
+            self._submitting += 1
+        try:
+            self._queue.put(request)
+            request.done.wait()
+        finally:
+            with self._lock:
+                self._submitting -= 1
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def _run(self):
+        while True:
+            request = self._queue.get()
+            if request is None:
+                self._fail_queued()
+                return
+            batch = [request]
+            deadline = time.perf_counter() + self.max_wait
+            stopping = False
+            while len(batch) < self.max_batch:
+                try:
+                    if len(batch) >= self._submitting:
+                        # Nobody else is on the way
+                        request = self._queue.get_nowait()
+                    else:
+                        request = self._queue.get(timeout=max(0.0, deadline - time.perf_counter()))
+                except queue.Empty:
+                    break
+                if request is None:
+                    stopping = True
+                    break
+                batch.append(request)
+            self._commit(batch)
+            if stopping:
+                self._fail_queued()
+                return
+
+    def _fail_queued(self):
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None:
+                request.error = WriterStopped()
+                request.done.set()
+
+    def _commit(self, batch):
+        try:
+            with self.pool.connection() as conn:
+                with write_transaction(conn):
+                    for request in batch:
+                        conn.execute("SAVEPOINT booking")
+                        try:
+                            request.result = request.work(conn)
+                        except Exception as e:
+                            conn.execute("ROLLBACK TO booking")
+                            request.error = e
+                        conn.execute("RELEASE booking")
+        except Exception as e:
+            # BEGIN or COMMIT failed: nothing of the batch was stored
+            for request in batch:
+                request.error = e
+        metrics.BOOKING_BATCH_SIZE.observe(len(batch))
+        for request in batch:
+            request.done.set()
@@ -0,0 +1,122 @@
+"""In-process publish/subscribe for Server-Sent Events.
+
+Every topic (a show, for /api/shows/<id>/events) keeps the last `history`
+events in a ring buffer. Publishing appends to it and sets the topic's
+wakeup Event, swapping in a fresh one for the next event; nothing is
+copied or queued per subscriber, and subscribers don't contend for the
+topic's lock while they wait. An idle subscriber is just a cursor into the
+buffer plus the thread, or coroutine, serving its stream; on_publish()
+callbacks let an event loop (seat_event_server.py) wake its coroutines.
+
+Event ids are "<epoch>-<seq>". The epoch is random per Broadcaster, so ids
+from another process or from before a restart are recognised as unknown.
+A subscriber that resumes from a Last-Event-ID still in the buffer gets
+exactly the events it missed; any other id means missed events are gone,
+and Subscription.wait() returns None so the caller can send a snapshot.
+"""
+import itertools
+import os
+import threading
+from collections import deque
+
+# Events kept per topic for subscribers catching up or resuming
+HISTORY = 256
+
+
+class _Topic:
+    def __init__(self, history):
+        self.events = deque(maxlen=history)
+        self.seq = 0
+        # Set, and replaced, by every publish
+        self.wakeup = threading.Event()
+        self.lock = threading.Lock()
+
+
+class Subscription:
+    """A subscriber's position in a topic."""
+
+    def __init__(self, broadcaster, topic, seq):
+        self.broadcaster = broadcaster
+        self.topic = topic
+        # Sequence number of the last event this subscriber has seen
+        self.seq = seq
+
+    @property
+    def last_event_id(self):
+        return self.broadcaster.event_id(self.seq)
+
+    def wait(self, timeout=None):
+        """Events published since the last call, waiting up to `timeout` for one.
+
+        Returns a list of (event_id, data), empty on timeout, or None if
+        events were missed because they already left the buffer.
+        """
+        topic = self.broadcaster._topic(self.topic)
+        # Taken before looking at seq, so a publish in between still wakes us
+        wakeup = topic.wakeup
+        if topic.seq == self.seq:
+            wakeup.wait(timeout)
+        with topic.lock:
+            if topic.seq == self.seq:
+                return []
+            if topic.seq - self.seq > len(topic.events):
+                self.seq = topic.seq
+                return None
+            events = list(itertools.islice(reversed(topic.events), topic.seq - self.seq))[::-1]
+            self.seq = topic.seq
+        return [(self.broadcaster.event_id(seq), data) for seq, data in events]
+
+
+class Broadcaster:
+    def __init__(self, history=HISTORY):
+        self.history = history
+        self.epoch = os.urandom(4).hex()
+        self._topics = {}
+        self._lock = threading.Lock()
+        # Called with the topic after every publish, on the publishing thread
+        self._listeners = []
+
+    def _topic(self, name):
+        topic = self._topics.get(name)
+        if topic is None:
+            with self._lock:
+                topic = self._topics.setdefault(name, _Topic(self.history))
+        return topic
+
+    def on_publish(self, callback):
+        self._listeners.append(callback)
+
+    def event_id(self, seq):
+        return f"{self.epoch}-{seq}"
+
+    def publish(self, topic, data):
+        """Add an event to `topic` and wake its subscribers. Returns the event id."""
+        state = self._topic(topic)
+        with state.lock:
+            state.seq += 1
+            state.events.append((state.seq, data))
+            wakeup, state.wakeup = state.wakeup, threading.Event()
+            seq = state.seq
+        wakeup.set()
+        for listener in self._listeners:
+            listener(topic)
+        return self.event_id(seq)
+
+    def subscribe(self, topic, last_event_id=None):
+        """A Subscription starting after `last_event_id`, or at the current event.
+
+        A subscription resumed from an id that can't be honoured (another
+        epoch, or older than the buffer) returns None from its first wait().
+        """
+        state = self._topic(topic)
+        with state.lock:
+            current = state.seq
+        subscription = Subscription(self, topic, current)
+        if last_event_id:
+            epoch, _, seq = last_event_id.partition('-')
+            if epoch == self.epoch and seq.isdigit() and int(seq) <= current:
+                subscription.seq = int(seq)
+            else:
+                # Forces wait() to report a gap
+                subscription.seq = -1
+        return subscription
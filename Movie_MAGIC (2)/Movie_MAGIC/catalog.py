@@ -0,0 +1,232 @@
+"""Movies, screens and showtimes, served from immutable in-memory indexes.
+
+The catalog lives in the movies, screens and shows tables (migration 4).
+Catalog.load() builds a CatalogIndex snapshot from them: dicts by id and
+title, and per day, per screen and per movie tuples sorted by start time
+that are searched with bisect. A snapshot is never modified; a reload
+builds a new one and swaps the reference, so request threads read without
+locks. Triggers bump catalog_version on every change and Catalog.start()
+polls it, so edits made by another process show up within a second or two:
+
+    python catalog.py database.db add-show KUBERA "Screen 1" "2025-07-01 18:30"
+"""
+import argparse
+import datetime
+import threading
+import time
+import traceback
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from types import MappingProxyType
+
+import db
+
+Movie = namedtuple('Movie', 'id title price image')
+Screen = namedtuple('Screen', 'id name rows seats_per_row')
+# starts_at is 'YYYY-MM-DD HH:MM'; the per-movie default show has starts_at ''
+Show = namedtuple('Show', 'id movie screen_id starts_at')
+
+# Shows that started more than this many days ago are not loaded
+PAST_DAYS = 1
+
+RELOAD_INTERVAL = 1.0
+
+_EMPTY = ((), ())
+
+
+def _sorted_by_start(shows):
+    shows = tuple(sorted(shows, key=lambda show: (show.starts_at, show.id)))
+    return tuple(show.starts_at for show in shows), shows
+
+
+def _between(entry, start, end):
+    starts, shows = entry
+    return shows[bisect_left(starts, start):bisect_left(starts, end)]
+
+
+class CatalogIndex:
+    """One immutable snapshot of the catalog."""
+
+    def __init__(self, movies, screens, shows, version=0):
+        self.version = version
+        self.movies = tuple(sorted(movies, key=lambda movie: movie.id))
+        self.screens = tuple(sorted(screens, key=lambda screen: screen.id))
+        self._movies_by_id = MappingProxyType({movie.id: movie for movie in self.movies})
+        self._movies_by_title = MappingProxyType({movie.title: movie for movie in self.movies})
+        self._screens_by_id = MappingProxyType({screen.id: screen for screen in self.screens})
+        self._shows_by_id = MappingProxyType({show.id: show for show in shows})
+
+        by_day, by_day_screen, by_movie = {}, {}, {}
+        for show in shows:
+            if not show.starts_at:
+                continue
+            day = show.starts_at[:10]
+            by_day.setdefault(day, []).append(show)
+            by_day_screen.setdefault((day, show.screen_id), []).append(show)
+            by_movie.setdefault(show.movie, []).append(show)
+        self._by_day = MappingProxyType({key: _sorted_by_start(value) for key, value in by_day.items()})
+        self._by_day_screen = MappingProxyType({key: _sorted_by_start(value)
+                                                for key, value in by_day_screen.items()})
+        self._by_movie = MappingProxyType({key: _sorted_by_start(value) for key, value in by_movie.items()})
+
+    def movie(self, title):
+        return self._movies_by_title.get(title)
+
+    def movie_by_id(self, movie_id):
+        return self._movies_by_id.get(movie_id)
+
+    def screen(self, screen_id):
+        return self._screens_by_id.get(screen_id)
+
+    def show(self, show_id):
+        return self._shows_by_id.get(show_id)
+
+    def _day(self, day, screen_id):
+        if screen_id is None:
+            return self._by_day.get(day, _EMPTY)
+        return self._by_day_screen.get((day, screen_id), _EMPTY)
+
+    def shows_on(self, day, screen_id=None):
+        """Shows on `day` ('YYYY-MM-DD'), optionally on one screen, by start time."""
+        return self._day(day, screen_id)[1]
+
+    def shows_between(self, start, end, screen_id=None):
+        """Shows starting in [start, end), both 'YYYY-MM-DD HH:MM' on the same day."""
+        return _between(self._day(start[:10], screen_id), start, end)
+
+    def upcoming(self, title, after, limit=10):
+        """The next `limit` shows of a movie starting at or after `after`."""
+        starts, shows = self._by_movie.get(title, _EMPTY)
+        index = bisect_left(starts, after)
+        return shows[index:index + limit]
+
+    def show_at(self, screen_id, at):
+        """The show on a screen that started most recently at or before `at`."""
+        starts, shows = self._by_day_screen.get((at[:10], screen_id), _EMPTY)
+        index = bisect_right(starts, at)
+        return shows[index - 1] if index else None
+
+    def __len__(self):
+        return len(self._shows_by_id)
+
+
+def _load_index(conn, past_days=PAST_DAYS):
+    since = (datetime.date.today() - datetime.timedelta(days=past_days)).isoformat()
+    version = conn.execute("SELECT version FROM catalog_version").fetchone()[0]
+    movies = [Movie(*row) for row in conn.execute("SELECT id, title, price, image FROM movies")]
+    screens = [Screen(*row) for row in conn.execute("SELECT id, name, rows, seats_per_row FROM screens")]
+    # '' < any date, so the default shows are selected explicitly
+    shows = [Show(*row) for row in conn.execute("SELECT id, movie, screen_id, starts_at FROM shows "
+                                                "WHERE starts_at = '' OR starts_at >= ?", (since,))]
+    return CatalogIndex(movies, screens, shows, version)
+
+
+class Catalog:
+    """Holds the current CatalogIndex and replaces it when the tables change.
+
+    Callbacks registered with on_reload() are called with the new index
+    after every reload, e.g. to drop caches built from the old one.
+    """
+
+    def __init__(self):
+        self.current = CatalogIndex((), (), ())
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._poller = None
+
+    def on_reload(self, callback):
+        self._listeners.append(callback)
+        return callback
+
+    def load(self, conn):
+        """Build a new index from the database and make it current."""
+        with self._lock:
+            index = _load_index(conn)
+            self.current = index
+        for callback in self._listeners:
+            callback(index)
+        return index
+
+    def refresh(self, conn):
+        """Reload if catalog_version moved since the current index was built."""
+        version = conn.execute("SELECT version FROM catalog_version").fetchone()[0]
+        if version != self.current.version:
+            return self.load(conn)
+        return None
+
+    def start(self, pool, interval=RELOAD_INTERVAL):
+        """Run refresh() every `interval` seconds on a daemon thread."""
+        if self._poller is not None:
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                try:
+                    with pool.connection() as conn:
+                        self.refresh(conn)
+                except Exception:
+                    traceback.print_exc()
+
+        self._poller = threading.Thread(target=poll, name='catalog-reload', daemon=True)
+        self._poller.start()
+
+
+def add_movie(conn, title, price, image=None):
+    cur = conn.execute("INSERT INTO movies (title, price, image) VALUES (?, ?, ?)", (title, price, image))
+    return cur.lastrowid
+
+
+def add_screen(conn, name, rows, seats_per_row):
+    cur = conn.execute("INSERT INTO screens (name, rows, seats_per_row) VALUES (?, ?, ?)",
+                       (name, rows, seats_per_row))
+    return cur.lastrowid
+
+
+def add_show(conn, movie, screen_id, starts_at):
+    cur = conn.execute("INSERT INTO shows (movie, screen_id, starts_at) VALUES (?, ?, ?)",
+                       (movie, screen_id, starts_at))
+    return cur.lastrowid
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Edit the movie catalog.')
+    parser.add_argument('database')
+    commands = parser.add_subparsers(dest='command', required=True)
+    movie = commands.add_parser('add-movie')
+    movie.add_argument('title')
+    movie.add_argument('price', type=int)
+    movie.add_argument('image', nargs='?')
+    screen = commands.add_parser('add-screen')
+    screen.add_argument('name')
+    screen.add_argument('rows', help='row letters, e.g. ABCDEFGHIJ')
+    screen.add_argument('seats_per_row', type=int)
+    show = commands.add_parser('add-show')
+    show.add_argument('movie')
+    show.add_argument('screen')
+    show.add_argument('starts_at', help="'YYYY-MM-DD HH:MM'")
+    commands.add_parser('list')
+    args = parser.parse_args()
+
+    conn = db.connect(args.database)
+    with conn:
+        if args.command == 'add-movie':
+            add_movie(conn, args.title, args.price, args.image)
+        elif args.command == 'add-screen':
+            add_screen(conn, args.name, args.rows, args.seats_per_row)
+        elif args.command == 'add-show':
+            row = conn.execute("SELECT id FROM screens WHERE name = ?", (args.screen,)).fetchone()
+            if row is None:
+                parser.error(f"unknown screen {args.screen!r}")
+            if not conn.execute("SELECT 1 FROM movies WHERE title = ?", (args.movie,)).fetchone():
+                parser.error(f"unknown movie {args.movie!r}")
+            add_show(conn, args.movie, row[0], args.starts_at)
+    index = _load_index(conn)
+    for movie in index.movies:
+        shows = index.upcoming(movie.title, '', limit=len(index))
+        print(f"{movie.title}: {len(shows)} shows" + (f", next {shows[0].starts_at}" if shows else ''))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
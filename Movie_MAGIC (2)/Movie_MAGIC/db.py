@@ -0,0 +1,155 @@
+"""Shared SQLite connection layer used by app.py and AWS_app.py.
+
+Handlers used to open a brand new sqlite3 connection on every request. Here
+connections are opened once, tuned (WAL journaling, pragmas, busy timeout)
+and kept in a small pool so each request borrows one and gives it back when
+the app context tears down.
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from flask import current_app, g
+
+# Wait this long for a competing writer instead of failing with "database is locked"
+BUSY_TIMEOUT = 5.0
+
+# Per-connection cache of compiled statements, reused across requests
+STATEMENT_CACHE_SIZE = 256
+
+# Idle connections kept around; extra connections are closed on release
+POOL_SIZE = 16
+
+PRAGMAS = [
+    ('journal_mode', 'WAL'),        # readers no longer block the booking writer
+    ('synchronous', 'NORMAL'),      # fsync on checkpoint only, safe with WAL
+    ('cache_size', -16000),         # ~16 MB page cache per connection
+    ('mmap_size', 268435456),       # map up to 256 MB of the file
+    ('temp_store', 'MEMORY'),
+    ('busy_timeout', int(BUSY_TIMEOUT * 1000)),
+]
+
+
+# Pragmas that are per database file, set on attached databases too
+FILE_PRAGMAS = ('journal_mode', 'synchronous')
+
+
+def connect(path, factory=sqlite3.Connection, attach=None):
+    """Open a tuned connection to `path`, with `attach` ({schema: path}) ATTACHed."""
+    conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT,
+                           cached_statements=STATEMENT_CACHE_SIZE,
+                           check_same_thread=False, factory=factory)
+    for name, value in PRAGMAS:
+        conn.execute(f"PRAGMA {name} = {value}")
+    for schema, attached_path in (attach or {}).items():
+        conn.execute("ATTACH DATABASE ? AS " + schema, (attached_path,))
+        for name, value in PRAGMAS:
+            if name in FILE_PRAGMAS:
+                conn.execute(f"PRAGMA {schema}.{name} = {value}")
+    return conn
+
+
+class ConnectionPool:
+    """LIFO pool of tuned connections to a single database file.
+
+    A connection is only ever used by one thread at a time: it is handed out
+    by acquire() and comes back through release().
+    """
+
+    def __init__(self, path, size=POOL_SIZE, factory=sqlite3.Connection, attach=None):
+        self.path = path
+        self.size = size
+        # sqlite3.Connection subclass to open, e.g. metrics.TimedConnection
+        self.factory = factory
+        # {schema: path} of databases attached to every connection, e.g. archive.py's
+        self.attach = attach
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return connect(self.path, self.factory, self.attach)
+
+    def release(self, conn):
+        # Never hand a half-finished transaction to the next request
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if not self._closed:
+                try:
+                    self._idle.put_nowait(conn)
+                    return
+                except queue.Full:
+                    pass
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def clear(self):
+        """Close the idle connections; the pool stays usable and opens new ones."""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def init_app(app, path, attach=None):
+    """Create the pool for `path` and return connections after each request."""
+    pool = ConnectionPool(path, attach=attach)
+    app.extensions['db_pool'] = pool
+    app.teardown_appcontext(_release_db)
+    return pool
+
+
+def get_pool(app=None):
+    return (app or current_app).extensions['db_pool']
+
+
+def get_db():
+    """Connection for the current request, borrowed from the pool once."""
+    if '_db_conn' not in g:
+        g._db_conn = get_pool().acquire()
+    return g._db_conn
+
+
+def _release_db(exc=None):
+    conn = g.pop('_db_conn', None)
+    if conn is not None:
+        get_pool().release(conn)
+
+
+@contextmanager
+def write_transaction(conn):
+    """BEGIN IMMEDIATE ... COMMIT on `conn`.
+
+    Taking the write lock up front means a busy database is waited on
+    (busy_timeout) at BEGIN, rather than failing half way through.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    else:
+        conn.commit()
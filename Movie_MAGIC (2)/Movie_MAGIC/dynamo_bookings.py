@@ -0,0 +1,238 @@
+"""DynamoDB key design and Query-based reads for bookings.
+
+The old table used booking_id = f"{email}_{title}" as its only key, so a
+second booking of the same movie overwrote the first, and listing a user's
+or a show's bookings needed a Scan. The table is now keyed by user and
+time-ordered booking key, with a global secondary index by show:
+
+    partition key  email         (user)
+    sort key       booking_key   "<created_at>#<booking id>"
+    GSI show-index show_key / booking_key
+
+show_key is booking_store.show_key() (movie and start time): every instance
+writes and reads the table, and show ids are only good within the SQLite
+database that gave them out.
+
+Reads go through Query with pagination, and BookingReader puts an LRU
+read-through cache in front of them that is invalidated on write and
+expires after CACHE_TTL. Create the table (e.g. on DynamoDB Local) with:
+
+    python dynamo_bookings.py create-table --endpoint-url http://localhost:8000
+"""
+import argparse
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+SHOW_INDEX = 'show-index'
+
+# Seconds a cached read is served for. invalidate() only reaches the cache of
+# the process whose outbox worker wrote the booking; every other worker sees
+# it once its own entry expires, so this bounds how far behind they can be.
+CACHE_TTL = 5
+
+TABLE_DEFINITION = {
+    'KeySchema': [
+        {'AttributeName': 'email', 'KeyType': 'HASH'},
+        {'AttributeName': 'booking_key', 'KeyType': 'RANGE'},
+    ],
+    'AttributeDefinitions': [
+        {'AttributeName': 'email', 'AttributeType': 'S'},
+        {'AttributeName': 'booking_key', 'AttributeType': 'S'},
+        {'AttributeName': 'show_key', 'AttributeType': 'S'},
+    ],
+    'GlobalSecondaryIndexes': [{
+        'IndexName': SHOW_INDEX,
+        'KeySchema': [
+            {'AttributeName': 'show_key', 'KeyType': 'HASH'},
+            {'AttributeName': 'booking_key', 'KeyType': 'RANGE'},
+        ],
+        # Seat availability only needs the seats
+        'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['seats']},
+    }],
+    'BillingMode': 'PAY_PER_REQUEST',
+}
+
+KEY_NAMES = ('email', 'booking_key')
+
+# Items per Query page
+PAGE_SIZE = 100
+
+
+def create_table(dynamodb, table_name):
+    table = dynamodb.create_table(TableName=table_name, **TABLE_DEFINITION)
+    table.wait_until_exists()
+    return table
+
+
+def booking_item(email, booking_id, show_key, movie, seats, total, payment_method, created_at):
+    return {
+        'email': email,
+        'booking_key': f"{created_at}#{booking_id:012d}",
+        'booking_id': booking_id,
+        'show_key': show_key,
+        'movie': movie,
+        'seats': ','.join(seats),
+        'total': total,
+        'payment_method': payment_method,
+        'created_at': created_at,
+    }
+
+
+def _key(name):
+    # boto3 is imported on first use so that importing the app stays cheap
+    from boto3.dynamodb.conditions import Key
+    return Key(name)
+
+
+def _plain(item):
+    # The resource API returns numbers as Decimal
+    return {k: int(v) if isinstance(v, Decimal) else v for k, v in item.items()}
+
+
+def query_user_bookings(table, email, limit=PAGE_SIZE, start_key=None, newest_first=True):
+    """One page of a user's bookings. Returns (items, next_start_key or None)."""
+    kwargs = {
+        'KeyConditionExpression': _key('email').eq(email),
+        'ScanIndexForward': not newest_first,
+        'Limit': limit,
+    }
+    if start_key:
+        kwargs['ExclusiveStartKey'] = start_key
+    response = table.query(**kwargs)
+    return [_plain(item) for item in response.get('Items', [])], response.get('LastEvaluatedKey')
+
+
+def query_show_seats(table, show_key):
+    """Every seat sold for a show, following pagination through the GSI."""
+    seats = set()
+    start_key = None
+    while True:
+        kwargs = {
+            'IndexName': SHOW_INDEX,
+            'KeyConditionExpression': _key('show_key').eq(show_key),
+            'ProjectionExpression': 'seats',
+        }
+        if start_key:
+            kwargs['ExclusiveStartKey'] = start_key
+        response = table.query(**kwargs)
+        for item in response.get('Items', []):
+            seats.update(seat for seat in item.get('seats', '').split(',') if seat)
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key:
+            return seats
+
+
+class LRUCache:
+    """Thread-safe LRU mapping with an optional per-entry TTL in seconds."""
+
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (self.ttl is None or entry[1] > time.monotonic()):
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class BookingReader:
+    """Read-through cache over the DynamoDB booking queries.
+
+    Call invalidate() for every booking written, so the next read of that
+    user's history and that show's seats goes back to DynamoDB.
+    """
+
+    def __init__(self, table, cache=None, ttl=CACHE_TTL):
+        self.table = table
+        self.cache = cache if cache is not None else LRUCache(maxsize=10000, ttl=ttl)
+
+    def user_bookings(self, email, max_items=1000):
+        """A user's bookings as raw items, newest first (at most max_items)."""
+        key = ('user', email)
+        bookings = self.cache.get(key)
+        if bookings is None:
+            bookings = []
+            start_key = None
+            while len(bookings) < max_items:
+                page, start_key = query_user_bookings(self.table, email, min(PAGE_SIZE, max_items - len(bookings)),
+                                                      start_key)
+                bookings.extend(page)
+                if not start_key:
+                    break
+            self.cache.set(key, bookings)
+        return bookings
+
+    def dashboard_bookings(self, email, max_items=1000):
+        """Shaped like booking_store.BookingPage rows: newest first, seats as lists."""
+        return [{
+            'id': item['booking_id'],
+            'movie': item['movie'],
+            'seats': item['seats'].split(',') if item['seats'] else [],
+            'total': item['total'],
+            'payment_method': item.get('payment_method'),
+            'timestamp': item.get('created_at'),
+        } for item in self.user_bookings(email, max_items)]
+
+    def sold_seats(self, show_key):
+        """Seat labels sold for a show, by booking_store.show_key(), e.g. frozenset({'A1', 'A2'})."""
+        key = ('show', show_key)
+        seats = self.cache.get(key)
+        if seats is None:
+            seats = frozenset(query_show_seats(self.table, show_key))
+            self.cache.set(key, seats)
+        return seats
+
+    def invalidate(self, item):
+        self.cache.pop(('user', item['email']))
+        self.cache.pop(('show', item['show_key']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the DynamoDB bookings table.')
+    parser.add_argument('command', choices=['create-table'])
+    parser.add_argument('--table', default='movie ticket_booking_v2')
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--endpoint-url', help='e.g. http://localhost:8000 for DynamoDB Local')
+    args = parser.parse_args()
+
+    import boto3
+    dynamodb = boto3.resource('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url)
+    create_table(dynamodb, args.table)
+    print(f"Created {args.table} with index {SHOW_INDEX}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+"""gunicorn settings for wsgi:app.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+The app is imported once by the master (preload_app) and forked into
+workers, so its import and schema migration run once rather than per
+worker. Each worker then opens its own SQLite connections, loads the
+catalog and seat inventory, starts its background threads and creates
+its AWS clients in post_fork, and drains its outbox on the way out.
+
+Seat holds live in each worker's memory, and are leased from the
+seat_leases table (or DynamoDB with BACKEND=aws) so that no other worker,
+or other instance, holds or sells the same seat (see leases.py).
+
+Reloading:
+  kill -HUP <master>    replace the workers gracefully (settings only: the
+                        preloaded app code stays the same)
+  kill -USR2 <master>   start a new master with new code next to the old
+                        one, then kill -TERM the old master
+"""
+import multiprocessing
+import os
+
+import movie_magic
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Threads per worker; requests mostly wait on SQLite and the network
+worker_class = 'gthread'
+threads = int(os.environ.get('THREADS', 4))
+# /api/shows/<id>/events streams stay open as long as the seating page, so
+# rather than a thread each they are served from an event loop in every
+# worker, all accepting on this port (seat_event_server.py). Route
+# /api/shows/<id>/events to it in the proxy, or point MOVIE_MAGIC_SEAT_EVENTS_URL
+# at it. Read by the app (preloaded below) like any other MOVIE_MAGIC_ setting.
+os.environ.setdefault('MOVIE_MAGIC_SEAT_EVENTS_BIND', os.environ.get('EVENTS_BIND', '0.0.0.0:5001'))
+preload_app = True
+
+# In-flight requests get this long to finish on reload or shutdown
+graceful_timeout = 30
+timeout = 60
+keepalive = 5
+
+# Replace workers now and then, spread out so they don't all restart at once
+max_requests = 10000
+max_requests_jitter = 1000
+
+
+def post_fork(server, worker):
+    movie_magic.start(server.app.wsgi())
+
+
+def worker_exit(server, worker):
+    movie_magic.stop(server.app.wsgi(), timeout=graceful_timeout)
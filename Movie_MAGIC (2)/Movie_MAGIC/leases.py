@@ -0,0 +1,407 @@
+"""Seat leases with fencing tokens, shared by every app instance.
+
+SeatInventory and HoldManager only know about the process they run in, so
+two instances behind a load balancer could each hold, and sell, the same
+seat. HoldManager now also takes a lease on every seat it holds from a
+backend all instances share:
+
+    SqliteLeases   the seat_leases table (migration 8), for instances on
+                   one host sharing database.db
+    DynamoLeases   SEAT_LEASES_TABLE in DynamoDB, for AWS_app.py
+    MemoryLeases   a dict, for tests and benchmarks in one process
+
+A lease is a row per (show, seat) with its owner (the hold id), an expiry
+and a token. Backends shared by instances that may each have a database
+of their own (DynamoLeases, MemoryLeases.sharing()) name the show by
+booking_store.show_key() (movie and start time) rather than by its id,
+which is only good within one database. Taking a seat is a compare-and-set on that row: it succeeds
+only if the seat is not sold and its lease has expired or is already the
+owner's, and it adds one to the token. acquire() takes all the seats of a
+hold or none, returning {seat: token}.
+
+The token is the fence. A sale marks the seat sold only if its token is
+still the current one, so a holder whose lease ran out while it was paused
+(and whose seat somebody else has leased since) can't sell it: fence()
+raises SeatUnavailable instead. SqliteLeases does that inside the booking
+transaction itself (`transactional`); the others write before it, and the
+lease is given back if the booking then fails. Leases are released by
+expiring them in place rather than deleting the row, so a seat's token
+only ever goes up.
+
+Once a show started SEAT_LEASE_PURGE_AFTER seconds ago nobody holds its
+seats any more, and the hold sweeper deletes its sold leases and those
+that expired as long ago (purge()), so that the table doesn't keep a row
+for every seat ever leased. DynamoLeases keeps its items: finding them
+would take a Scan of the table by every instance.
+
+Expiry is wall-clock time (time.time()), which instances on different
+hosts have to agree on to within a small part of HOLD_TTL. Create the
+DynamoDB table (e.g. on DynamoDB Local) with:
+
+    python leases.py create-table --endpoint-url http://localhost:8000
+"""
+import argparse
+import datetime
+import threading
+import time
+import traceback
+
+import db
+import metrics
+from seat_inventory import SeatUnavailable
+
+DEFAULTS = {
+    # Where seats are leased so that app instances never sell the same seat:
+    # 'sqlite' (instances on one host), 'dynamodb' (SEAT_LEASES_TABLE, across
+    # hosts), 'memory' (one process) or None for the one that goes with BACKEND
+    'SEAT_LEASE_BACKEND': None,
+    'SEAT_LEASES_TABLE': 'movie_magic_seat_leases',
+    # Seconds after a show starts from which its sold and expired leases are
+    # deleted (None: never); far longer than any hold lasts
+    'SEAT_LEASE_PURGE_AFTER': 24 * 60 * 60,
+}
+
+# Leases deleted per purge transaction, so the booking writer never waits long
+PURGE_BATCH_SIZE = 1000
+
+TABLE_DEFINITION = {
+    # "<booking_store.show_key()>#<seat>"; no TTL attribute, as deleting an item would reset its token
+    'KeySchema': [{'AttributeName': 'show_seat', 'KeyType': 'HASH'}],
+    'AttributeDefinitions': [{'AttributeName': 'show_seat', 'AttributeType': 'S'}],
+    'BillingMode': 'PAY_PER_REQUEST',
+}
+
+# Takes (show_id, seat) for owner ?3 until ?4 unless it is sold or leased to
+# somebody else until after ?5 (now); returns the new token, or no row
+ACQUIRE_SQL = '''INSERT INTO seat_leases (show_id, seat, owner, token, expires_at, sold)
+                 VALUES (?1, ?2, ?3, 1, ?4, 0)
+                 ON CONFLICT (show_id, seat) DO UPDATE
+                 SET owner = excluded.owner, token = token + 1, expires_at = excluded.expires_at
+                 WHERE sold = 0 AND (expires_at <= ?5 OR owner = excluded.owner)
+                 RETURNING token'''
+
+# Up to ?3 leases, sold or expired by ?1, of shows that started before ?2
+PURGE_SQL = '''DELETE FROM seat_leases WHERE (show_id, seat) IN (
+                   SELECT l.show_id, l.seat FROM shows s JOIN seat_leases l ON l.show_id = s.id
+                   WHERE s.starts_at != '' AND s.starts_at < ?2 AND (l.sold = 1 OR l.expires_at <= ?1)
+                   LIMIT ?3)'''
+
+
+def create_table(dynamodb, table_name):
+    table = dynamodb.create_table(TableName=table_name, **TABLE_DEFINITION)
+    table.wait_until_exists()
+    return table
+
+
+def create(config, pool, show_key, aws=None):
+    """The backend named by SEAT_LEASE_BACKEND.
+
+    `show_key` maps this database's show ids to booking_store.show_key();
+    `aws` is the AWSBackend, if BACKEND is 'aws'.
+    """
+    name = config['SEAT_LEASE_BACKEND'] or ('dynamodb' if config['BACKEND'] == 'aws' else 'sqlite')
+    if name == 'sqlite':
+        return SqliteLeases(pool)
+    if name == 'dynamodb':
+        if aws is None:
+            raise ValueError("SEAT_LEASE_BACKEND 'dynamodb' needs BACKEND 'aws'")
+        return DynamoLeases(lambda: aws.seat_leases_table, show_key)
+    if name == 'memory':
+        return MemoryLeases(show_key=show_key)
+    raise ValueError(f"Unknown seat lease backend: {name}")
+
+
+class SeatLeases:
+    """What the backends share: timing, conflict counts and releasing quietly."""
+
+    name = None
+    # Whether fence() takes part in the booking transaction (conn) or writes on its own
+    transactional = False
+
+    def acquire(self, show, seats, owner, ttl):
+        """Lease `seats` of `show` to `owner` for `ttl` seconds, all or nothing.
+
+        Returns {seat: token}; raises SeatUnavailable if any seat is sold or
+        leased to somebody else.
+        """
+        return self._timed('acquire', self._acquire, show, seats, owner, ttl)
+
+    def fence(self, show, leases, conn=None):
+        """Mark the seats of `leases` ({seat: token}) sold, if every token is still current.
+
+        Raises SeatUnavailable, and marks none of them, if any lease has been
+        taken over. `conn` is the booking transaction, for backends that are
+        `transactional`.
+        """
+        return self._timed('fence', self._fence, show, leases, conn)
+
+    def release(self, show, leases):
+        """Give the seats of `leases` back, sold or not. Seats leased again since are left alone."""
+        if not leases:
+            return
+        try:
+            self._release(show, leases)
+        except Exception:
+            # They expire on their own
+            traceback.print_exc()
+
+    def purge(self, before):
+        """Delete the leases of shows that started before `before` (epoch seconds), if sold or expired by then.
+
+        Returns how many were deleted.
+        """
+        try:
+            return self._purge(before)
+        except Exception:
+            # The next purge gets them
+            traceback.print_exc()
+            return 0
+
+    def _purge(self, before):
+        return 0
+
+    def _timed(self, operation, function, *args):
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        except SeatUnavailable:
+            metrics.SEAT_LEASE_CONFLICTS.inc(self.name, operation)
+            raise
+        finally:
+            metrics.SEAT_LEASE_SECONDS.observe(time.perf_counter() - start, self.name, operation)
+
+
+class MemoryLeases(SeatLeases):
+    """Leases in a dict, for the instances of one process (tests and benchmarks)."""
+
+    name = 'memory'
+
+    def __init__(self, clock=time.time, show_key=None):
+        self.clock = clock
+        # Show id -> the name leases are kept under (None: the id itself)
+        self.show_key = show_key
+        # (show, seat) -> (owner, token, expires_at, sold)
+        self._leases = {}
+        self._lock = threading.Lock()
+
+    def sharing(self, show_key):
+        """These leases, for an instance whose database maps show ids to booking_store.show_key() by `show_key`."""
+        other = MemoryLeases(self.clock, show_key)
+        other._leases, other._lock = self._leases, self._lock
+        return other
+
+    def _show(self, show):
+        return show if self.show_key is None else self.show_key(show)
+
+    def _acquire(self, show, seats, owner, ttl):
+        now = self.clock()
+        show = self._show(show)
+        with self._lock:
+            current = {seat: self._leases.get((show, seat)) for seat in seats}
+            taken = [seat for seat, lease in current.items()
+                     if lease is not None and (lease[3] or (lease[2] > now and lease[0] != owner))]
+            if taken:
+                raise SeatUnavailable(taken)
+            leases = {}
+            for seat, lease in current.items():
+                leases[seat] = lease[1] + 1 if lease is not None else 1
+                self._leases[(show, seat)] = (owner, leases[seat], now + ttl, False)
+        return leases
+
+    def _fence(self, show, leases, conn):
+        show = self._show(show)
+        with self._lock:
+            current = {seat: self._leases.get((show, seat)) for seat in leases}
+            stale = [seat for seat, lease in current.items()
+                     if lease is None or lease[1] != leases[seat] or lease[3]]
+            if stale:
+                raise SeatUnavailable(stale)
+            for seat, (owner, token, expires_at, _) in current.items():
+                self._leases[(show, seat)] = (owner, token, expires_at, True)
+
+    def _release(self, show, leases):
+        show = self._show(show)
+        with self._lock:
+            for seat, token in leases.items():
+                lease = self._leases.get((show, seat))
+                if lease is not None and lease[1] == token:
+                    self._leases[(show, seat)] = (None, token, 0, False)
+
+    def _purge(self, before):
+        # Only shows named by their show_key() say when they start
+        if self.show_key is None:
+            return 0
+        starts_before = _starts_at(before)
+        with self._lock:
+            purged = [(show, seat) for (show, seat), (_, _, expires_at, sold) in self._leases.items()
+                      if '' < show.rpartition('@')[2] < starts_before and (sold or expires_at <= before)]
+            for key in purged:
+                del self._leases[key]
+        return len(purged)
+
+
+class SqliteLeases(SeatLeases):
+    """Leases in the seat_leases table, compare-and-set by a conditional upsert per seat."""
+
+    name = 'sqlite'
+    transactional = True
+
+    def __init__(self, pool, clock=time.time):
+        self.pool = pool
+        self.clock = clock
+
+    def _acquire(self, show, seats, owner, ttl):
+        now = self.clock()
+        leases, taken = {}, []
+        with self.pool.connection() as conn, db.write_transaction(conn):
+            for seat in seats:
+                row = conn.execute(ACQUIRE_SQL, (show, seat, owner, now + ttl, now)).fetchone()
+                if row is None:
+                    taken.append(seat)
+                else:
+                    leases[seat] = row[0]
+            if taken:
+                # Rolls back the seats already taken
+                raise SeatUnavailable(taken)
+        return leases
+
+    def _fence(self, show, leases, conn):
+        if conn is None:
+            with self.pool.connection() as conn, db.write_transaction(conn):
+                return self._fence(show, leases, conn)
+        stale = [seat for seat, token in leases.items() if conn.execute(
+            "UPDATE seat_leases SET sold = 1 WHERE show_id = ? AND seat = ? AND token = ? AND sold = 0",
+            (show, seat, token)).rowcount != 1]
+        if stale:
+            # The booking transaction (or savepoint) rolls back the ones that matched
+            raise SeatUnavailable(stale)
+
+    def _release(self, show, leases):
+        with self.pool.connection() as conn, db.write_transaction(conn):
+            conn.executemany("UPDATE seat_leases SET owner = NULL, expires_at = 0, sold = 0 "
+                             "WHERE show_id = ? AND seat = ? AND token = ?",
+                             [(show, seat, token) for seat, token in leases.items()])
+
+    def _purge(self, before):
+        purged = 0
+        while True:
+            with self.pool.connection() as conn, db.write_transaction(conn):
+                deleted = conn.execute(PURGE_SQL, (before, _starts_at(before), PURGE_BATCH_SIZE)).rowcount
+            purged += deleted
+            if deleted < PURGE_BATCH_SIZE:
+                return purged
+
+
+def _starts_at(timestamp):
+    """`timestamp` as shows.starts_at (local time), for comparing with it."""
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
+
+
+def _attr(name):
+    # boto3 is imported on first use so that importing the app stays cheap
+    from boto3.dynamodb.conditions import Attr
+    return Attr(name)
+
+
+def _condition_failed(error):
+    """Whether `error` is DynamoDB turning down a conditional write."""
+    response = getattr(error, 'response', None)
+    return isinstance(response, dict) and response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+class DynamoLeases(SeatLeases):
+    """Leases as items of SEAT_LEASES_TABLE, compare-and-set by conditional writes on the token.
+
+    Each seat is read (strongly consistent) and written back with the next
+    token on the condition that the token is still the one read. A hold's
+    seats are taken one at a time; if one is taken, those already leased are
+    released again. expires_at is in milliseconds, as DynamoDB numbers can't
+    be floats. Items are keyed "<show_key(show)>#<seat>", the same on every
+    instance whichever id its database gave the show.
+    """
+
+    name = 'dynamodb'
+
+    def __init__(self, table, show_key, clock=time.time):
+        # table() -> the process's Table (see AWSBackend.seat_leases_table)
+        self.table = table
+        # Show id -> booking_store.show_key() (see booking_store.ShowKeys)
+        self.show_key = show_key
+        self.clock = clock
+
+    def _key(self, show, seat):
+        return f"{self.show_key(show)}#{seat}"
+
+    def _acquire(self, show, seats, owner, ttl):
+        now = round(self.clock() * 1000)
+        leases = {}
+        try:
+            for seat in seats:
+                token = self._take(show, seat, owner, now, now + round(ttl * 1000))
+                if token is None:
+                    raise SeatUnavailable([seat])
+                leases[seat] = token
+        except BaseException:
+            self.release(show, leases)
+            raise
+        return leases
+
+    def _take(self, show, seat, owner, now, expires_at):
+        table = self.table()
+        key = self._key(show, seat)
+        item = table.get_item(Key={'show_seat': key}, ConsistentRead=True).get('Item')
+        if item is not None and (item['sold'] or (item['expires_at'] > now and item['owner'] != owner)):
+            return None
+        token = int(item['token']) + 1 if item is not None else 1
+        condition = _attr('token').eq(item['token']) if item is not None else _attr('show_seat').not_exists()
+        if not self._put(table, key, owner, token, expires_at, False, condition):
+            # Somebody else's write got in between
+            return None
+        return token
+
+    def _put(self, table, key, owner, token, expires_at, sold, condition):
+        try:
+            table.put_item(Item={'show_seat': key, 'owner': owner, 'token': token, 'expires_at': expires_at,
+                                 'sold': sold}, ConditionExpression=condition)
+        except Exception as e:
+            if _condition_failed(e):
+                return False
+            raise
+        return True
+
+    def _fence(self, show, leases, conn):
+        table = self.table()
+        fenced = {}
+        try:
+            for seat, token in leases.items():
+                # Owner and expiry are only read on acquire, so these need not be kept
+                if not self._put(table, self._key(show, seat), '', token, 0, True,
+                                 _attr('token').eq(token) & _attr('sold').eq(False)):
+                    raise SeatUnavailable([seat])
+                fenced[seat] = token
+        except BaseException:
+            self.release(show, fenced)
+            raise
+
+    def _release(self, show, leases):
+        table = self.table()
+        for seat, token in leases.items():
+            self._put(table, self._key(show, seat), '', token, 0, False, _attr('token').eq(token))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the DynamoDB seat leases table.')
+    parser.add_argument('command', choices=['create-table'])
+    parser.add_argument('--table', default=DEFAULTS['SEAT_LEASES_TABLE'])
+    parser.add_argument('--region', default='us-east-1')
+    parser.add_argument('--endpoint-url', help='e.g. http://localhost:8000 for DynamoDB Local')
+    args = parser.parse_args()
+
+    import boto3
+    dynamodb = boto3.resource('dynamodb', region_name=args.region, endpoint_url=args.endpoint_url)
+    create_table(dynamodb, args.table)
+    print(f"Created {args.table}")
+
+
+if __name__ == '__main__':
+    main()
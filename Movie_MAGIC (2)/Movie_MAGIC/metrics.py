@@ -0,0 +1,471 @@
+"""Request, SQLite, AWS and template timings in Prometheus text format.
+
+    metrics.init_app(app)                   # /metrics, per-route timings, SQL timings
+    dynamodb = metrics.timed_aws(boto3.resource('dynamodb'), 'dynamodb')
+
+Counters and histograms are sharded per thread: a thread only ever writes
+its own shard, so recording a value takes no lock, and /metrics adds the
+shards up when scraped. Shards of threads that have exited are folded into
+one, so short-lived threads don't pile up.
+
+With slow_request_seconds set, a sampler thread logs the stack of every
+request still running after that long (once per request), which shows
+where a slow request is stuck rather than only that it was slow.
+"""
+import functools
+import re
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import weakref
+from bisect import bisect_left
+from collections import deque
+
+from flask import Response, abort, before_render_template, g, request, template_rendered
+from werkzeug.wsgi import ClosingIterator
+
+import db
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upper bounds in seconds; requests and queries mostly land in the low milliseconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Slow-request stacks kept in memory for inspection, newest last
+SLOW_SAMPLES = 50
+
+# Client addresses /metrics answers by default (a scraper on the same host);
+# anybody else gets a 404
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base for per-thread sharded metrics; a shard maps label values to a value."""
+
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards = []
+        # Merged shards of threads that have exited
+        self._retired = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+            with self._lock:
+                self._retire_dead()
+                self._shards.append((weakref.ref(threading.current_thread()), shard))
+            return shard
+
+    def _retire_dead(self):
+        live = []
+        for thread, shard in self._shards:
+            if thread() is None or not thread().is_alive():
+                for key, value in shard.copy().items():
+                    self._retired[key] = self._merge(self._retired.get(key), value)
+            else:
+                live.append((thread, shard))
+        self._shards = live
+
+    def collect(self):
+        """{label values: merged value} over every thread."""
+        with self._lock:
+            self._retire_dead()
+            merged = dict(self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            # copy() is a single C call, so it never sees the dict mid-resize
+            for key, value in shard.copy().items():
+                merged[key] = self._merge(merged.get(key), value)
+        return merged
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(total, value):
+        return (total or 0) + value
+
+    def expose(self):
+        return [f"{self.name}{_labels(self.labelnames, key)} {_format(value)}"
+                for key, value in sorted(self.collect().items())]
+
+
+class Gauge(Counter):
+    """A counter that may go down; dec() from any thread balances inc()."""
+
+    kind = 'gauge'
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value, *labels):
+        shard = self._shard()
+        # [count per bucket..., count above the last bucket, sum]
+        counts = shard.get(labels)
+        if counts is None:
+            counts = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @staticmethod
+    def _merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def expose(self):
+        lines = []
+        for key, counts in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_format(counts[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def expose(self):
+        """Every metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+REQUEST_SECONDS = Histogram(REGISTRY, 'http_request_duration_seconds',
+                            'Time from receiving a request to sending the last byte of its body.',
+                            ('route', 'method', 'status'))
+IN_FLIGHT = Gauge(REGISTRY, 'http_requests_in_flight', 'Requests being handled right now.')
+SLOW_REQUESTS = Counter(REGISTRY, 'http_slow_requests_total',
+                        'Requests that ran past the slow-request threshold.', ('route',))
+SQL_SECONDS = Histogram(REGISTRY, 'sqlite_query_duration_seconds',
+                        'Time spent in execute()/executemany(), by statement verb and table.',
+                        ('verb', 'table'))
+AWS_SECONDS = Histogram(REGISTRY, 'aws_call_duration_seconds', 'Duration of boto3 calls.',
+                        ('service', 'operation'))
+AWS_ERRORS = Counter(REGISTRY, 'aws_call_errors_total', 'boto3 calls that raised, by error code.',
+                     ('service', 'operation', 'code'))
+AWS_BATCH_ITEMS = Counter(REGISTRY, 'aws_batch_items_total',
+                          'Messages sent through a batching client (see aws_batch.py).', ('client',))
+AWS_BATCH_CALLS = Counter(REGISTRY, 'aws_batch_calls_total', 'AWS calls the batching clients made.', ('client',))
+AWS_BATCH_CALLS_SAVED = Counter(REGISTRY, 'aws_batch_calls_saved_total',
+                                'AWS calls saved by batching: one per message, less the calls made.', ('client',))
+AWS_BATCH_RETRIES = Counter(REGISTRY, 'aws_batch_retries_total',
+                            'Batch calls repeated for throttled (unprocessed) items.', ('client',))
+AWS_BATCH_FLUSH_SECONDS = Histogram(REGISTRY, 'aws_batch_flush_duration_seconds',
+                                    'Time to send one batch of outbox messages, retries included.', ('client',))
+SEAT_EVENT_STREAMS = Gauge(REGISTRY, 'seat_event_streams_open', 'Open /api/shows/<id>/events streams.')
+TEMPLATE_SECONDS = Histogram(REGISTRY, 'template_render_duration_seconds',
+                             'Time to render a template (streamed templates: until the last chunk).',
+                             ('template',))
+BOOKING_BATCH_SIZE = Histogram(REGISTRY, 'booking_commit_batch_size',
+                               'Bookings committed per transaction (see booking_writer.py).',
+                               buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+ADMISSION_REJECTIONS = Counter(REGISTRY, 'admission_rejections_total',
+                               'Booking requests turned away or queued by admission.py, by reason.', ('reason',))
+WAITING_ROOM_TICKETS = Counter(REGISTRY, 'waiting_room_tickets_total', 'Queue tickets handed out.')
+PASSWORD_HASH_SECONDS = Histogram(REGISTRY, 'password_hash_duration_seconds',
+                                  'Time to hash a password, waiting for the hashing pool included.', ('scheme',))
+PASSWORD_HASH_REJECTIONS = Counter(REGISTRY, 'password_hash_rejections_total',
+                                   'Logins and registrations turned away because the hashing pool was full.')
+PASSWORD_UPGRADES = Counter(REGISTRY, 'password_hash_upgrades_total',
+                            'Stored password hashes replaced with the current scheme at login, by old scheme.',
+                            ('scheme',))
+TICKET_RENDER_SECONDS = Histogram(REGISTRY, 'ticket_render_duration_seconds',
+                                  'Time from a booking being queued for its ticket files to them being on disk.')
+TICKET_RENDER_ERRORS = Counter(REGISTRY, 'ticket_render_errors_total', 'Ticket files that failed to render.')
+BOOKINGS_ARCHIVED = Counter(REGISTRY, 'bookings_archived_total',
+                            'Bookings of past shows moved to the archive database (see archive.py).')
+SEAT_LEASE_SECONDS = Histogram(REGISTRY, 'seat_lease_duration_seconds',
+                               'Time to acquire or fence the seat leases of a hold (see leases.py).',
+                               ('backend', 'operation'))
+SEAT_LEASE_CONFLICTS = Counter(REGISTRY, 'seat_lease_conflicts_total',
+                               'Seat leases not acquired, or sales fenced off, because another hold had the seat.',
+                               ('backend', 'operation'))
+
+
+# Statements timed, by their first word; the rest (PRAGMA, CREATE, ALTER,
+# ATTACH, VACUUM, ...) are migrations and connection setup, not queries
+_TIMED_VERBS = {'SELECT', 'WITH', 'INSERT', 'REPLACE', 'UPDATE', 'DELETE',
+                'BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE'}
+# The table a statement reads from or writes to, whichever comes first
+_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE(?:\s+OR\s+\w+)?)\s+([\w.\"]+)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def statement_label(sql):
+    """(verb, table) for a statement, e.g. ('SELECT', 'bookings'); None for statements not timed.
+
+    Only the verb and the first table are kept, so there are a handful of
+    labels per table however many distinct statements run, and /metrics
+    shows no SQL text. Transaction control has no table ('').
+    """
+    words = sql.split(None, 1)
+    verb = words[0].upper() if words else ''
+    if verb not in _TIMED_VERBS:
+        return None
+    match = _TABLE.search(sql)
+    return verb, match.group(1).strip('"') if match else ''
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor timing execute()/executemany(); fetching rows afterwards is not included."""
+
+    def execute(self, sql, parameters=()):
+        label = statement_label(sql)
+        if label is None:
+            return super().execute(sql, parameters)
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - start, *label)
+
+    def executemany(self, sql, seq_of_parameters):
+        label = statement_label(sql)
+        if label is None:
+            return super().executemany(sql, seq_of_parameters)
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            SQL_SECONDS.observe(time.perf_counter() - start, *label)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Connection whose shortcut execute methods go through TimedCursor."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class _TimedAWS:
+    """Proxy timing every method call of a boto3 client, resource or Table."""
+
+    def __init__(self, target, service):
+        self._target = target
+        self._service = service
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        if not callable(attr):
+            return attr
+        service = self._service
+
+        @functools.wraps(attr)
+        def call(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = attr(*args, **kwargs)
+            except Exception as e:
+                # botocore's ClientError carries the AWS error code, e.g. ThrottlingException
+                response = getattr(e, 'response', None)
+                code = response.get('Error', {}).get('Code') if isinstance(response, dict) else None
+                AWS_ERRORS.inc(service, name, code or type(e).__name__)
+                raise
+            finally:
+                AWS_SECONDS.observe(time.perf_counter() - start, service, name)
+            # dynamodb.Table(name) hands out a resource whose calls should be timed too
+            return _TimedAWS(result, service) if name == 'Table' else result
+        return call
+
+
+def timed_aws(target, service):
+    return _TimedAWS(target, service)
+
+
+class _InstrumentedApp:
+    """WSGI wrapper timing each request until its body has been sent."""
+
+    def __init__(self, wsgi_app, sampler=None):
+        self.wsgi_app = wsgi_app
+        self.sampler = sampler
+
+    def __call__(self, environ, start_response):
+        start = time.perf_counter()
+        status = ['500']
+
+        def capture_status(code, headers, exc_info=None):
+            status[0] = code[:3]
+            return start_response(code, headers, exc_info)
+
+        def finish():
+            IN_FLIGHT.dec()
+            if self.sampler is not None:
+                self.sampler.active.pop(token, None)
+            REQUEST_SECONDS.observe(time.perf_counter() - start, environ.get('metrics.route', '<unmatched>'),
+                                    environ.get('REQUEST_METHOD', ''), status[0])
+
+        IN_FLIGHT.inc()
+        token = object()
+        if self.sampler is not None:
+            self.sampler.active[token] = [threading.get_ident(), start, environ, False]
+        try:
+            body = self.wsgi_app(environ, capture_status)
+        except BaseException:
+            finish()
+            raise
+        return ClosingIterator(body, finish)
+
+
+class SlowRequestSampler:
+    """Logs the stack of requests running longer than `threshold` seconds."""
+
+    def __init__(self, logger, threshold, interval=None):
+        self.logger = logger
+        self.threshold = threshold
+        self.interval = interval or max(threshold / 4, 0.05)
+        # token -> [thread id, start, environ, sampled yet]; written without a lock by request threads
+        self.active = {}
+        self.samples = deque(maxlen=SLOW_SAMPLES)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='slow-request-sampler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.sample()
+            except Exception:
+                traceback.print_exc()
+
+    def sample(self):
+        now = time.perf_counter()
+        frames = None
+        for entry in list(self.active.values()):
+            ident, start, environ, sampled = entry
+            # Streaming responses (metrics.streaming) are long by design
+            if sampled or now - start < self.threshold or environ.get('metrics.streaming'):
+                continue
+            if frames is None:
+                frames = sys._current_frames()
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+            entry[3] = True
+            route = environ.get('metrics.route', '<unmatched>')
+            SLOW_REQUESTS.inc(route)
+            stack = ''.join(traceback.format_stack(frame))
+            path = environ.get('PATH_INFO', '')
+            self.samples.append({'route': route, 'path': path, 'seconds': now - start, 'stack': stack})
+            self.logger.warning("Slow request %s %s (%s) still running after %.2fs:\n%s",
+                                environ.get('REQUEST_METHOD'), path, route, now - start, stack)
+
+
+def _record_route():
+    # Label by URL rule rather than path, so /booking/<title> is one series
+    if request.url_rule is not None:
+        request.environ['metrics.route'] = request.url_rule.rule
+
+
+def _template_started(app, template, **extra):
+    g.setdefault('_template_starts', []).append(time.perf_counter())
+
+
+def _template_finished(app, template, **extra):
+    starts = g.get('_template_starts')
+    if starts:
+        TEMPLATE_SECONDS.observe(time.perf_counter() - starts.pop(), template.name or '<string>')
+
+
+def metrics_view():
+    return Response(REGISTRY.expose(), mimetype=CONTENT_TYPE)
+
+
+def _restricted(view, allowed_addresses):
+    """`view`, answering only requests from `allowed_addresses` (None: anybody)."""
+    if allowed_addresses is None:
+        return view
+    allowed = frozenset(allowed_addresses)
+
+    @functools.wraps(view)
+    def restricted():
+        if request.remote_addr not in allowed:
+            abort(404)
+        return view()
+    return restricted
+
+
+def init_app(app, slow_request_seconds=None, allowed_addresses=LOCAL_ADDRESSES):
+    """Instrument `app` and serve /metrics. Call right after db.init_app().
+
+    /metrics only answers clients in `allowed_addresses` (request.remote_addr;
+    None lets anybody scrape it, an empty list nobody).
+
+    Returns the slow-request sampler (None unless slow_request_seconds is
+    set), which still has to be start()ed.
+    """
+    sampler = None
+    if slow_request_seconds:
+        # Started by the caller in each process that serves requests
+        sampler = SlowRequestSampler(app.logger, slow_request_seconds)
+    app.wsgi_app = _InstrumentedApp(app.wsgi_app, sampler)
+    app.before_request(_record_route)
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+    db.get_pool(app).factory = TimedConnection
+    app.add_url_rule('/metrics', 'metrics', _restricted(metrics_view, allowed_addresses))
+    app.extensions['metrics'] = sampler
+    return sampler
@@ -0,0 +1,337 @@
+"""Versioned schema migrations for the booking database.
+
+The schema version is kept in PRAGMA user_version. Every migration is safe
+to re-run, so an interrupted run simply picks up where it stopped. Data is
+copied in small batches, each in its own short transaction, so the app can
+keep serving (WAL readers are never blocked and writers only wait for one
+batch) while a large database is converted:
+
+    python migrations.py database.db --batch-size 5000
+    python migrations.py instance/cinema.db
+
+The apps also call migrate() from init_db() on startup.
+"""
+import argparse
+import time
+
+import db
+from seat_inventory import DEFAULT_LAYOUT
+
+BATCH_SIZE = 2000
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def _tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def _batched_copy(conn, select_sql, apply_batch, batch_size, progress, label):
+    """Run select_sql (which takes the last seen id) batch by batch.
+
+    apply_batch(rows) writes one batch; every batch is its own transaction.
+    """
+    last_id = 0
+    done = 0
+    while True:
+        rows = conn.execute(select_sql, (last_id, batch_size)).fetchall()
+        if not rows:
+            return done
+        with conn:
+            apply_batch(rows)
+        last_id = rows[-1][0]
+        done += len(rows)
+        if progress:
+            progress(label, done)
+
+
+def adopt_legacy_tables(conn, batch_size=BATCH_SIZE, progress=None):
+    """1: copy the Flask-SQLAlchemy `user`/`booking` tables (instance/cinema.db)."""
+    tables = _tables(conn)
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                            email TEXT PRIMARY KEY,
+                            name TEXT,
+                            password TEXT
+                        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS bookings (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            email TEXT,
+                            movie TEXT,
+                            seats TEXT,
+                            total INTEGER
+                        )''')
+    if 'user' in tables:
+        _batched_copy(
+            conn, "SELECT id, email, name, password FROM user WHERE id > ? ORDER BY id LIMIT ?",
+            lambda rows: conn.executemany("INSERT OR IGNORE INTO users (email, name, password) VALUES (?, ?, ?)",
+                                          [row[1:] for row in rows]),
+            batch_size, progress, 'users')
+    if 'booking' in tables:
+        _batched_copy(
+            conn, "SELECT id, user_email, movie, seats, total FROM booking WHERE id > ? ORDER BY id LIMIT ?",
+            lambda rows: conn.executemany("INSERT OR IGNORE INTO bookings (id, email, movie, seats, total) "
+                                          "VALUES (?, ?, ?, ?, ?)", rows),
+            batch_size, progress, 'bookings')
+
+
+def normalize_bookings(conn, batch_size=BATCH_SIZE, progress=None):
+    """2: shows + booking_seats, indexed bookings, seats moved out of the CSV column."""
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS shows (
+                            id INTEGER PRIMARY KEY,
+                            movie TEXT NOT NULL,
+                            starts_at TEXT NOT NULL DEFAULT '',
+                            UNIQUE (movie, starts_at)
+                        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS booking_seats (
+                            show_id INTEGER NOT NULL REFERENCES shows (id),
+                            seat TEXT NOT NULL,
+                            booking_id INTEGER NOT NULL REFERENCES bookings (id),
+                            tier TEXT,
+                            PRIMARY KEY (show_id, seat)
+                        ) WITHOUT ROWID''')
+        columns = _columns(conn, 'bookings')
+        for name, decl in [('show_id', 'INTEGER REFERENCES shows (id)'),
+                           ('payment_method', 'TEXT'),
+                           ('created_at', 'TEXT')]:
+            if name not in columns:
+                conn.execute(f"ALTER TABLE bookings ADD COLUMN {name} {decl}")
+        # Covering indexes: the dashboard and per-show reads never touch the table
+        conn.execute('''CREATE INDEX IF NOT EXISTS idx_bookings_email
+                        ON bookings (email, id, movie, total, payment_method, created_at)''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_bookings_show ON bookings (show_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_booking_seats_booking ON booking_seats (booking_id, seat)")
+
+    show_ids = {}
+    conflicts = [0]
+
+    def show_id(movie):
+        if movie not in show_ids:
+            conn.execute("INSERT OR IGNORE INTO shows (movie, starts_at) VALUES (?, '')", (movie,))
+            show_ids[movie] = conn.execute("SELECT id FROM shows WHERE movie = ? AND starts_at = ''",
+                                           (movie,)).fetchone()[0]
+        return show_ids[movie]
+
+    def apply_batch(rows):
+        updates = []
+        seats = []
+        for booking_id, movie, csv in rows:
+            sid = show_id(movie or '')
+            updates.append((sid, booking_id))
+            for seat in (csv or '').split(','):
+                try:
+                    label = DEFAULT_LAYOUT.label(DEFAULT_LAYOUT.index(seat))
+                except ValueError:
+                    continue
+                seats.append((sid, label, booking_id, DEFAULT_LAYOUT.tier_of(label)))
+        conn.executemany("UPDATE bookings SET show_id = ? WHERE id = ?", updates)
+        before = conn.total_changes
+        # Legacy rows were never checked for double booking: the first sale wins
+        conn.executemany("INSERT OR IGNORE INTO booking_seats (show_id, seat, booking_id, tier) "
+                         "VALUES (?, ?, ?, ?)", seats)
+        conflicts[0] += len(seats) - (conn.total_changes - before)
+
+    # Rows written by a not yet upgraded app while this runs still have
+    # show_id NULL and are picked up by the next pass
+    select_sql = "SELECT id, movie, seats FROM bookings WHERE show_id IS NULL AND id > ? ORDER BY id LIMIT ?"
+    while _batched_copy(conn, select_sql, apply_batch, batch_size, progress, 'booking_seats'):
+        pass
+
+    if 'sold_seats' in _tables(conn):
+        with conn:
+            conn.execute("DROP TABLE sold_seats")
+    if progress and conflicts[0]:
+        progress('double-booked legacy seats skipped', conflicts[0])
+
+
+def add_outbox(conn, batch_size=BATCH_SIZE, progress=None):
+    """3: outbox of DynamoDB/SNS side effects, written with the booking (see outbox.py)."""
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS outbox (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            kind TEXT NOT NULL,
+                            payload TEXT NOT NULL,
+                            status TEXT NOT NULL,
+                            attempts INTEGER NOT NULL DEFAULT 0,
+                            available_at REAL NOT NULL,
+                            created_at REAL NOT NULL,
+                            last_error TEXT
+                        )''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, available_at, id)")
+
+
+# The lineup that used to be hardcoded as MOVIES in app.py / AWS_app.py
+LAUNCH_MOVIES = [
+    ('KUBERA', 350, 'kubera.jpg'),
+    ('DEVARA', 300, 'devara.jpg'),
+    ('ANIMAL', 300, 'animal.jpg'),
+]
+
+
+def add_catalog(conn, batch_size=BATCH_SIZE, progress=None):
+    """4: movies and screens tables, screens on shows, and a change counter (see catalog.py)."""
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS movies (
+                            id INTEGER PRIMARY KEY,
+                            title TEXT NOT NULL UNIQUE,
+                            price INTEGER NOT NULL,
+                            image TEXT
+                        )''')
+        conn.execute('''CREATE TABLE IF NOT EXISTS screens (
+                            id INTEGER PRIMARY KEY,
+                            name TEXT NOT NULL UNIQUE,
+                            rows TEXT NOT NULL,
+                            seats_per_row INTEGER NOT NULL
+                        )''')
+        if 'screen_id' not in _columns(conn, 'shows'):
+            conn.execute("ALTER TABLE shows ADD COLUMN screen_id INTEGER REFERENCES screens(id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_shows_starts_at ON shows (starts_at)")
+        # Bumped by triggers on every catalog change, so running apps notice
+        # edits made by other processes with one cheap query
+        conn.execute("CREATE TABLE IF NOT EXISTS catalog_version (id INTEGER PRIMARY KEY CHECK (id = 1), "
+                     "version INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+        for table in ('movies', 'screens', 'shows'):
+            for event in ('INSERT', 'UPDATE', 'DELETE'):
+                conn.execute(f"CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_version "
+                             f"AFTER {event} ON {table} "
+                             f"BEGIN UPDATE catalog_version SET version = version + 1; END")
+        conn.executemany("INSERT OR IGNORE INTO movies (title, price, image) VALUES (?, ?, ?)", LAUNCH_MOVIES)
+        conn.execute("INSERT OR IGNORE INTO screens (name, rows, seats_per_row) VALUES ('Screen 1', ?, ?)",
+                     (DEFAULT_LAYOUT.rows, DEFAULT_LAYOUT.seats_per_row))
+
+
+def add_sessions(conn, batch_size=BATCH_SIZE, progress=None):
+    """5: server-side session data, keyed by the id in the session cookie (see sessions.py)."""
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS sessions (
+                            id TEXT PRIMARY KEY,
+                            data BLOB NOT NULL,
+                            expires_at REAL NOT NULL
+                        ) WITHOUT ROWID''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires_at ON sessions (expires_at)")
+
+
+def add_waiting_room(conn, batch_size=BATCH_SIZE, progress=None):
+    """6: when the next waiting room ticket gets in, shared by all workers (see admission.py)."""
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS waiting_room (
+                            id INTEGER PRIMARY KEY CHECK (id = 1),
+                            next_at REAL NOT NULL,
+                            issued INTEGER NOT NULL
+                        )''')
+        conn.execute("INSERT OR IGNORE INTO waiting_room (id, next_at, issued) VALUES (1, 0, 0)")
+
+
+def add_report_rollups(conn, batch_size=BATCH_SIZE, progress=None):
+    """7: revenue and occupancy rollups, kept up to date with every booking (see reports.py)."""
+    with conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS report_shows (
+                            show_id INTEGER PRIMARY KEY REFERENCES shows (id),
+                            bookings INTEGER NOT NULL,
+                            seats INTEGER NOT NULL,
+                            revenue INTEGER NOT NULL
+                        )''')
+        for table, key in (('report_movies', 'movie'), ('report_days', 'day'), ('report_tiers', 'tier')):
+            conn.execute(f'''CREATE TABLE IF NOT EXISTS {table} (
+                                 {key} TEXT PRIMARY KEY,
+                                 bookings INTEGER NOT NULL,
+                                 seats INTEGER NOT NULL,
+                                 revenue INTEGER NOT NULL
+                             ) WITHOUT ROWID''')
+        # Bookings with ids below `below` are added by `python reports.py`,
+        # which has got as far as done_through; the app counts the rest
+        conn.execute('''CREATE TABLE IF NOT EXISTS report_backfill (
+                            id INTEGER PRIMARY KEY CHECK (id = 1),
+                            below INTEGER NOT NULL,
+                            done_through INTEGER NOT NULL
+                        )''')
+        conn.execute("INSERT OR IGNORE INTO report_backfill (id, below, done_through) "
+                     "SELECT 1, COALESCE(MAX(id), 0) + 1, 0 FROM bookings")
+
+
+def add_seat_leases(conn, batch_size=BATCH_SIZE, progress=None):
+    """8: seat leases shared by the app instances on one host (see leases.py)."""
+    with conn:
+        # Rows are never deleted while their show is on (a released lease just
+        # expires), so a seat's token only goes up; those of past shows are
+        # purged by the hold sweeper (leases.SeatLeases.purge)
+        conn.execute('''CREATE TABLE IF NOT EXISTS seat_leases (
+                            show_id INTEGER NOT NULL,
+                            seat TEXT NOT NULL,
+                            owner TEXT,
+                            token INTEGER NOT NULL,
+                            expires_at REAL NOT NULL,
+                            sold INTEGER NOT NULL DEFAULT 0,
+                            PRIMARY KEY (show_id, seat)
+                        ) WITHOUT ROWID''')
+
+
+def add_outbox_claims(conn, batch_size=BATCH_SIZE, progress=None):
+    """9: who claimed an outbox row and when, so workers only take back abandoned claims."""
+    with conn:
+        columns = _columns(conn, 'outbox')
+        if 'claimed_by' not in columns:
+            conn.execute("ALTER TABLE outbox ADD COLUMN claimed_by TEXT")
+        if 'claimed_at' not in columns:
+            conn.execute("ALTER TABLE outbox ADD COLUMN claimed_at REAL")
+        # Rows in flight now count as claimed now: a live worker may still be
+        # sending them, so they are only delivered again after the claim timeout
+        conn.execute("UPDATE outbox SET claimed_at = strftime('%s', 'now') "
+                     "WHERE status = 'inflight' AND claimed_at IS NULL")
+
+
+MIGRATIONS = [
+    (1, adopt_legacy_tables),
+    (2, normalize_bookings),
+    (3, add_outbox),
+    (4, add_catalog),
+    (5, add_sessions),
+    (6, add_waiting_room),
+    (7, add_report_rollups),
+    (8, add_seat_leases),
+    (9, add_outbox_claims),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, batch_size=BATCH_SIZE, progress=None):
+    """Apply every pending migration. Returns the new schema version."""
+    version = schema_version(conn)
+    for number, migration in MIGRATIONS:
+        if version < number:
+            migration(conn, batch_size, progress)
+            conn.execute(f"PRAGMA user_version = {number}")
+            conn.commit()
+            version = number
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Upgrade a Movie Magic database to the latest schema.')
+    parser.add_argument('database')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    conn = db.connect(args.database)
+    start = time.perf_counter()
+    print(f"{args.database}: schema version {schema_version(conn)}")
+
+    def progress(label, count):
+        print(f"  {label}: {count}")
+
+    version = migrate(conn, args.batch_size, progress)
+    print(f"{args.database}: schema version {version} ({time.perf_counter() - start:.1f}s)")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
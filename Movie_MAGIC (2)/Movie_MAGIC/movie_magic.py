@@ -0,0 +1,824 @@
+"""Movie Magic: create_app(config) builds the booking site for either backend.
+
+    BACKEND = 'sqlite'   bookings and users in the local SQLite database
+    BACKEND = 'aws'      the same, plus DynamoDB copies of bookings and SNS
+                         notifications, sent through the outbox (aws_backend.py)
+
+app.py and AWS_app.py create the two variants for the development server;
+wsgi.py creates the one named by MOVIE_MAGIC_BACKEND for gunicorn. Every
+setting in DEFAULTS can be overridden by the config argument or by a
+MOVIE_MAGIC_<NAME> environment variable.
+
+create_app() only wires the app up and brings the database schema up to
+date. What belongs to one process - pooled connections, the seat inventory
+and catalog in memory, background threads, AWS clients - is set up by
+start(app): on the first request, or from gunicorn's post_fork hook, so a
+preloaded master can fork workers safely (see gunicorn.conf.py).
+"""
+import datetime
+import os
+import threading
+import traceback
+
+from flask import Flask, current_app, flash, jsonify, redirect, render_template, request, session, \
+    stream_template, url_for
+
+import admission
+import archive
+import assets
+import aws_backend
+import availability
+import booking_store
+import booking_writer
+import broadcast
+import db
+import leases
+import metrics
+import migrations
+import page_cache
+import passwords
+import reports
+import seat_event_server
+import seat_events
+import seat_inventory
+import sessions
+import tickets
+from catalog import Catalog
+from db import get_db
+from page_cache import PageCache
+from seat_holds import HoldExpired, HoldManager
+from seat_inventory import SeatUnavailable
+
+DEFAULTS = {
+    'BACKEND': 'sqlite',
+    'DATABASE': 'database.db',
+    'SECRET_KEY': 'your-secret-key',
+    # Where session data lives: 'sqlite', 'memory' or 'cookie' (Flask's signed cookie)
+    'SESSION_BACKEND': 'sqlite',
+    # Log the stack of any request still running after this many seconds (None: off)
+    'SLOW_REQUEST_SECONDS': None,
+    # Client addresses allowed to scrape /metrics (as Flask sees them, so behind
+    # a proxy that of the proxy); None: anybody, []: nobody
+    'METRICS_ALLOWED_ADDRESSES': list(metrics.LOCAL_ADDRESSES),
+    # Rows tried first by "pick seats for me": 'middle', 'front', 'back' or
+    # row letters in order of preference, e.g. 'DCE' (see SeatLayout.row_order)
+    'SEAT_ROW_PREFERENCE': 'middle',
+    # Commit concurrent bookings together, up to BOOKING_MAX_BATCH per transaction,
+    # waiting at most BOOKING_MAX_WAIT_US for more to arrive (see booking_writer.py)
+    'BOOKING_GROUP_COMMIT': True,
+    'BOOKING_MAX_BATCH': booking_writer.MAX_BATCH,
+    'BOOKING_MAX_WAIT_US': booking_writer.MAX_WAIT_US,
+    # Users allowed to see /admin/reports
+    'ADMIN_EMAILS': [],
+    **admission.DEFAULTS,
+    **passwords.DEFAULTS,
+    **tickets.DEFAULTS,
+    **archive.DEFAULTS,
+    **leases.DEFAULTS,
+    **seat_events.DEFAULTS,
+    **aws_backend.DEFAULTS,
+}
+
+# Ticket price per seat tier (see seat_inventory.DEFAULT_LAYOUT)
+SEAT_PRICES = {'premium': 250, 'gold': 170}
+
+# Most seats "pick seats for me" will place together in one go
+MAX_AUTO_SEATS = 10
+
+
+class LocalBackend:
+    """The 'sqlite' backend: the bookings table is all there is."""
+
+    name = 'sqlite'
+
+    def start(self):
+        pass
+
+    def stop(self, timeout=None):
+        pass
+
+    def record_booking(self, conn, email, hold, payment_method, created_at):
+        pass
+
+    def booking_committed(self):
+        pass
+
+    def dashboard_bookings(self, email):
+        return None
+
+
+class MovieMagic:
+    """Per-app state shared by the views: catalog, page cache, seats and backend."""
+
+    def __init__(self, app, pool):
+        self.app = app
+        self.pool = pool
+        # Sold seats per show, rebuilt from the booking_seats table in start()
+        self.inventory = seat_inventory.SeatInventory()
+        # Movies, screens and shows from the catalog tables, loaded in start()
+        # and reloaded whenever they change
+        self.catalog = Catalog()
+        # Rendered /, /about, /services and /home, dropped whenever the catalog reloads
+        self.pages = PageCache(lambda: self.catalog.current.version)
+        self.catalog.on_reload(lambda index: self.pages.clear())
+        # Names of shows that every instance agrees on, whatever their ids here
+        self.show_keys = booking_store.ShowKeys(pool)
+        if app.config['BACKEND'] == 'aws':
+            self.backend = aws_backend.AWSBackend(app.config, pool, self.show_keys, app.logger)
+        elif app.config['BACKEND'] == 'sqlite':
+            self.backend = LocalBackend()
+        else:
+            raise ValueError(f"Unknown backend: {app.config['BACKEND']}")
+        if self.backend.name == 'aws' and app.config['AVAILABILITY_FROM_DYNAMODB']:
+            self.inventory.sold_elsewhere = self.backend.sold_seats
+        # Seats held between /seating and /process_payment, released when they
+        # expire, and leased so that other app instances can't sell them
+        self.holds = HoldManager(self.inventory, leases=leases.create(
+            app.config, pool, self.show_keys, self.backend if self.backend.name == 'aws' else None),
+            purge_after=app.config['SEAT_LEASE_PURGE_AFTER'])
+        # Hashes passwords for /register and /login in a bounded pool
+        self.passwords = passwords.PasswordHasher(app.config)
+        # QR codes and PDF tickets of new bookings, rendered in a pool
+        self.tickets = tickets.TicketArtifacts(app.config, app.instance_path)
+        # Moves the bookings of past shows to the archive database now and then
+        self.archiver = archive.Archiver(pool, app.config, app.logger)
+        # Runs the booking transactions of /process_payment
+        if app.config['BOOKING_GROUP_COMMIT']:
+            self.writer = booking_writer.BookingWriter(pool, app.config['BOOKING_MAX_BATCH'],
+                                                       app.config['BOOKING_MAX_WAIT_US'])
+        else:
+            self.writer = booking_writer.DirectWriter(pool)
+        # Encoded seat maps for /api/shows/<id>/availability
+        self.availability = availability.AvailabilityCache(self.inventory, pool, SEAT_PRICES)
+        # Seat changes per show, streamed by /api/shows/<id>/events
+        self.events = broadcast.Broadcaster()
+        self.inventory.on_change(seat_events.SeatEvents(self.events))
+        # Serves those streams from an event loop rather than a thread each
+        self.event_server = None
+        if app.config['SEAT_EVENTS_BIND']:
+            self.event_server = seat_event_server.EventServer(
+                self.events, self.show_exists, lambda show: self.availability.get(show)[0], self.availability.get,
+                app.config['SEAT_EVENTS_BIND'])
+        # The process start() last ran in
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Load the catalog and seats and start the background threads, once per process."""
+        with self._lock:
+            if self.pid == os.getpid():
+                return
+            with self.pool.connection() as conn:
+                self.inventory.load(conn)
+                self.catalog.load(conn)
+            self.catalog.start(self.pool)
+            self.holds.start()
+            self.passwords.start()
+            self.tickets.start()
+            self.archiver.start()
+            self.writer.start()
+            self.backend.start()
+            if self.event_server is not None:
+                self.event_server.start()
+            sampler = self.app.extensions.get('metrics')
+            if sampler is not None:
+                sampler.start()
+            self.pid = os.getpid()
+
+    def stop(self, timeout=None):
+        if self.event_server is not None:
+            self.event_server.stop(timeout)
+        self.passwords.stop(timeout)
+        self.tickets.stop(timeout)
+        self.archiver.stop(timeout)
+        self.writer.stop(timeout)
+        self.backend.stop(timeout)
+
+    def show_exists(self, show_id):
+        if self.availability.known(show_id) or self.catalog.current.show(show_id) is not None:
+            return True
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT 1 FROM shows WHERE id = ?", (show_id,)).fetchone() is not None
+
+
+def state():
+    return current_app.extensions['movie_magic']
+
+
+def start(app):
+    app.extensions['movie_magic'].start()
+
+
+def stop(app, timeout=None):
+    app.extensions['movie_magic'].stop(timeout)
+
+
+def _start_process():
+    if state().pid != os.getpid():
+        state().start()
+
+
+def init_db(conn):
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS users (
+                    email TEXT PRIMARY KEY,
+                    name TEXT,
+                    password TEXT
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS bookings (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    email TEXT,
+                    movie TEXT,
+                    seats TEXT,
+                    total INTEGER
+                )''')
+    conn.commit()
+    migrations.migrate(conn)
+
+
+_routes = []
+
+
+def route(rule, **options):
+    """app.route() for the app create_app() is about to build."""
+    def decorator(view):
+        _routes.append((rule, view, options))
+        return view
+    return decorator
+
+
+def create_app(config=None):
+    app = Flask(__name__)
+    app.config.from_mapping(DEFAULTS)
+    app.config.from_prefixed_env('MOVIE_MAGIC')
+    app.config.update(config or {})
+
+    # Fingerprinted, precompressed files from static/dist once `python assets.py build` has run
+    assets.init_app(app)
+
+    # Bookings of past shows are moved to ARCHIVE_DATABASE, attached to every connection
+    attach = {archive.SCHEMA: app.config['ARCHIVE_DATABASE']} if app.config['ARCHIVE_DATABASE'] else None
+    pool = db.init_app(app, app.config['DATABASE'], attach)
+    app.extensions['movie_magic'] = movie_magic = MovieMagic(app, pool)
+
+    # Repeat /api/shows/<id>/availability polls are answered before Flask
+    availability.init_app(app, movie_magic.availability)
+
+    # Rendered ticket files are sent before Flask too, straight from disk
+    tickets.init_app(app, movie_magic.tickets)
+
+    # Waiting room, rate limits and the write limit on the booking routes
+    admission.init_app(app, pool)
+
+    # Request, SQL, AWS and template timings, scraped from /metrics
+    metrics.init_app(app, app.config['SLOW_REQUEST_SECONDS'], app.config['METRICS_ALLOWED_ADDRESSES'])
+
+    with pool.connection() as conn, conn:
+        init_db(conn)
+        if attach:
+            archive.create_tables(conn)
+    # Connections belong to one process; don't leave any for forked workers
+    pool.clear()
+
+    # Session data is kept server-side; the cookie only carries its id
+    sessions.init_app(app, app.config['SESSION_BACKEND'])
+
+    app.before_request(_start_process)
+    for rule, view, options in _routes:
+        app.add_url_rule(rule, view_func=view, **options)
+    return app
+
+
+@route('/')
+def index():
+    return state().pages.render('index.html', page_cache.PUBLIC)
+
+
+@route('/register', methods=['GET', 'POST'])
+def register():
+    if request.method == 'POST':
+        name = request.form['name']
+        email = request.form['email']
+
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute("SELECT * FROM users WHERE email = ?", (email,))
+            if c.fetchone():
+                flash("Email already registered.")
+                return redirect(url_for('register'))
+
+        try:
+            password = state().passwords.hash(request.form['password'])
+        except passwords.HashingBusy as e:
+            return _hashing_busy('register.html', e.retry_after)
+
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute("INSERT OR IGNORE INTO users (email, name, password) VALUES (?, ?, ?)", (email, name, password))
+            conn.commit()
+            if not c.rowcount:
+                # Somebody registered it while the password was hashing
+                flash("Email already registered.")
+                return redirect(url_for('register'))
+
+        flash("Registration successful! Please login.")
+        return redirect(url_for('login'))
+
+    return render_template('register.html')
+
+
+@route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        email = request.form['email']
+
+        with get_db() as conn:
+            c = conn.cursor()
+            c.execute("SELECT password FROM users WHERE email = ?", (email,))
+            user = c.fetchone()
+
+        try:
+            matches, upgraded = state().passwords.verify(request.form['password'], user[0] if user else None)
+        except passwords.HashingBusy as e:
+            return _hashing_busy('login.html', e.retry_after)
+
+        if matches:
+            if upgraded:
+                # Old sha256 or outdated cost: store the current kind of hash
+                with get_db() as conn:
+                    conn.execute("UPDATE users SET password = ? WHERE email = ? AND password = ?",
+                                 (upgraded, email, user[0]))
+                    conn.commit()
+            # New session id on login, so a planted cookie cannot be reused
+            sessions.regenerate(session)
+            session['email'] = email
+            return redirect(url_for('home'))
+        else:
+            flash("Invalid credentials")
+
+    return render_template('login.html')
+
+
+def _hashing_busy(template, retry_after):
+    flash(f"Lots of people are signing in right now, please try again in {retry_after} s.")
+    return render_template(template), 503, {'Retry-After': str(retry_after)}
+
+
+@route('/logout')
+def logout():
+    if session.get('hold_id'):
+        state().holds.release(session['hold_id'])
+    session.clear()
+    sessions.regenerate(session)
+    flash('Logged out successfully')
+    return redirect(url_for('index'))
+
+
+@route('/home')
+def home():
+    if 'email' not in session:
+        return redirect(url_for('login'))
+    # Same for every logged-in user, but not for anonymous shared caches
+    return state().pages.render('home.html', page_cache.PRIVATE, movies=state().catalog.current.movies)
+
+
+@route('/booking/<title>')
+def booking(title):
+    if 'email' not in session:
+        return redirect(url_for('login'))
+
+    movie = state().catalog.current.movie(title)
+    if not movie:
+        flash('Movie not found')
+        return redirect(url_for('home'))
+
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M")
+    return render_template('booking.html', movie=movie, shows=state().catalog.current.upcoming(movie.title, now))
+
+
+@route('/seating/<title>', methods=['GET', 'POST'])
+@admission.waiting_room
+@admission.rate_limited
+def seating(title):
+    if 'email' not in session:
+        return redirect(url_for('login'))
+
+    movie = state().catalog.current.movie(title)
+    if not movie:
+        flash('Movie not found')
+        return redirect(url_for('home'))
+
+    if request.method == 'POST' and request.form.get('auto'):
+        return _auto_allocate(movie)
+
+    if request.method == 'POST':
+        seats_raw = request.form.get('seats')
+        if not seats_raw:
+            flash('No seats selected.')
+            return redirect(url_for('seating', title=title, show=request.args.get('show')))
+
+        selected_seats = list(dict.fromkeys(seats_raw.split(',')))
+
+        total = 0
+        seat_list = []
+
+        for seat in selected_seats:
+            if ':' not in seat:
+                continue
+            seat_name, seat_type = seat.split(':')
+            seat_list.append(seat_name)
+
+            if seat_type not in SEAT_PRICES:
+                flash(f"Unknown seat type: {seat_type}")
+                return redirect(url_for('seating', title=title, show=request.args.get('show')))
+
+            total += SEAT_PRICES[seat_type]
+
+        if not seat_list:
+            flash('No seats selected.')
+            return redirect(url_for('seating', title=title, show=request.args.get('show')))
+
+        try:
+            seat_inventory.parse_seats(state().inventory.layout, seat_list)
+        except ValueError as e:
+            flash(str(e))
+            return redirect(url_for('seating', title=title, show=request.args.get('show')))
+
+        # Hold the seats until payment; the booking is only written once paid
+        if session.get('hold_id'):
+            state().holds.release(session['hold_id'])
+        try:
+            hold = state().holds.place(_seating_show(movie), movie.title, seat_list, session['email'], total)
+        except SeatUnavailable as e:
+            flash(f"Sorry, these seats were just booked: {', '.join(e.seats)}")
+            return redirect(url_for('seating', title=title, show=request.args.get('show')))
+        session['hold_id'] = hold.hold_id
+
+        return redirect(url_for('payment', title=title, seats=','.join(seat_list), total=total))
+
+    show_id = _seating_show(movie)
+    events_url = (current_app.config['SEAT_EVENTS_URL'] or '').rstrip('/') + url_for('api_seat_events',
+                                                                                       show_id=show_id)
+    return render_template('seating.html', movie=movie, show_id=show_id, events_url=events_url,
+                           seat_prices=SEAT_PRICES, max_auto_seats=MAX_AUTO_SEATS)
+
+
+def _auto_allocate(movie):
+    """Hold the best block of the posted `count` seats in `tier`, then go on to payment."""
+    retry = redirect(url_for('seating', title=movie.title, show=request.args.get('show')))
+    count = request.form.get('count', type=int)
+    tier = request.form.get('tier')
+    layout = state().inventory.layout
+    if tier not in SEAT_PRICES:
+        flash(f"Unknown seat type: {tier}")
+        return retry
+    if not count or not 0 < count <= min(MAX_AUTO_SEATS, layout.seats_per_row):
+        flash(f"Pick between 1 and {min(MAX_AUTO_SEATS, layout.seats_per_row)} seats.")
+        return retry
+
+    if session.get('hold_id'):
+        state().holds.release(session['hold_id'])
+    rows = layout.row_order(tier, current_app.config['SEAT_ROW_PREFERENCE'])
+    hold = state().holds.allocate(_seating_show(movie), movie.title, count, rows, session['email'],
+                                  SEAT_PRICES[tier])
+    if hold is None:
+        flash(f"Sorry, there are no {count} {tier} seats left together.")
+        return retry
+    session['hold_id'] = hold.hold_id
+    return redirect(url_for('payment', title=movie.title, seats=','.join(hold.seats), total=hold.total))
+
+
+def _seating_show(movie):
+    """The show picked on the booking page (?show=<id>), else the movie's default show."""
+    show = state().catalog.current.show(request.args.get('show', type=int))
+    if show is not None and show.movie == movie.title:
+        return show.id
+    with get_db() as conn:
+        return booking_store.show_id_for(conn, movie.title)
+
+
+@route('/api/shows/<int:show_id>/availability')
+def api_availability(show_id):
+    # Public and polled by every open seating page, so no login. Once a show
+    # is known, availability.init_app() answers its polls without Flask.
+    if not state().show_exists(show_id):
+        return jsonify({'error': 'Show not found'}), 404
+    body, etag = state().availability.get(show_id)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    # Browsers keep it but revalidate on every poll, getting a 304 while nothing changed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@route('/api/shows/<int:show_id>/events')
+def api_seat_events(show_id):
+    # Holds this thread while the page is open; with SEAT_EVENTS_BIND set,
+    # seat_event_server.py serves the streams instead
+    if not state().show_exists(show_id):
+        return jsonify({'error': 'Show not found'}), 404
+    # Sent by EventSource when it reconnects
+    last_event_id = request.headers.get('Last-Event-ID')
+    subscription = state().events.subscribe(show_id, last_event_id)
+    cache = state().availability
+    # Open for minutes by design; not a slow request
+    request.environ['metrics.streaming'] = True
+    metrics.SEAT_EVENT_STREAMS.inc()
+    response = current_app.response_class(
+        seat_events.stream(subscription, lambda: cache.get(show_id)[0], poll=lambda: cache.get(show_id),
+                           send_snapshot=not last_event_id),
+        mimetype='text/event-stream')
+    response.call_on_close(metrics.SEAT_EVENT_STREAMS.dec)
+    response.headers['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@route('/payment/<title>', methods=['GET', 'POST'])
+@admission.waiting_room
+@admission.rate_limited
+def payment(title):
+    if 'email' not in session:
+        return redirect(url_for('login'))
+
+    seats = request.args.get('seats', '')
+    total = request.args.get('total', 0)
+
+    return render_template('payment.html', movie=title, seats=seats, total=total)
+
+
+@route('/process_payment', methods=['POST'])
+@admission.waiting_room
+@admission.rate_limited
+@admission.write_limited
+def process_payment():
+    if 'email' not in session:
+        return redirect(url_for('login'))
+    
+    # Get form data
+    movie = request.form.get('movie')
+    seats = request.form.get('seats')
+    total = request.form.get('total')
+    payment_method = request.form.get('payment_method')
+    
+    # Validate payment method
+    if not payment_method:
+        flash('Payment method was not specified', 'error')
+        return redirect(url_for('payment', title=movie, seats=seats, total=total))
+    
+    # Validate required fields
+    if not all([movie, seats, total, payment_method]):
+        flash('Missing required payment information. Please try again.', 'error')
+        return redirect(url_for('payment', title=movie, seats=seats, total=total))
+    
+    # Get payment details based on the payment method
+    payment_details = {}
+    
+    try:
+        if payment_method == 'UPI':
+            upi_id = request.form.get('upi_id')
+            if not upi_id or '@' not in upi_id:
+                flash('Invalid UPI ID. Please enter a valid UPI ID.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+            payment_details['upi_id'] = upi_id
+            
+        elif payment_method == 'Credit Card':
+            card_number = request.form.get('card_number')
+            card_holder = request.form.get('name_on_card')
+            expiry_date = request.form.get('expiry_date')
+            cvv = request.form.get('cvv')
+            
+            if not all([card_number, card_holder, expiry_date, cvv]):
+                flash('Please fill in all credit card details.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+                
+            # Basic validation
+            if not (card_number.isdigit() and len(card_number) == 16):
+                flash('Invalid card number. Please enter a 16-digit number.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+                
+            payment_details['card_number'] = ''.join(['*' * 12, card_number[-4:]])  # Mask card number for security
+            payment_details['card_holder'] = card_holder
+            payment_details['expiry_date'] = expiry_date
+            payment_details['cvv'] = '*'  # Mask CVV for security
+            
+        elif payment_method == 'Debit Card':
+            card_number = request.form.get('debit_card_number')
+            card_holder = request.form.get('debit_name_on_card')
+            expiry_date = request.form.get('debit_expiry_date')
+            cvv = request.form.get('debit_cvv')
+            
+            if not all([card_number, card_holder, expiry_date, cvv]):
+                flash('Please fill in all debit card details.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+                
+            # Basic validation
+            if not (card_number.isdigit() and len(card_number) == 16):
+                flash('Invalid card number. Please enter a 16-digit number.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+                
+            payment_details['card_number'] = ''.join(['*' * 12, card_number[-4:]])  # Mask card number for security
+            payment_details['card_holder'] = card_holder
+            payment_details['expiry_date'] = expiry_date
+            payment_details['cvv'] = '*'  # Mask CVV for security
+            
+        elif payment_method == 'Netbanking':
+            bank = request.form.get('bank_name')
+            if not bank:
+                flash('Please select a bank for netbanking.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+            payment_details['bank'] = bank
+            
+        elif payment_method == 'PayPal':
+            paypal_email = request.form.get('paypal_email')
+            if not paypal_email or '@' not in paypal_email:
+                flash('Please enter a valid PayPal email address.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+            payment_details['paypal_email'] = paypal_email
+            
+        elif payment_method == 'Google Pay':
+            gpay_number = request.form.get('google_pay_number')
+            if not gpay_number or len(gpay_number) < 10:
+                flash('Please enter a valid phone number for Google Pay.', 'error')
+                return redirect(url_for('payment', title=movie, seats=seats, total=total))
+            payment_details['gpay_number'] = gpay_number
+            
+        else:
+            flash('Invalid payment method selected.', 'error')
+            return redirect(url_for('payment', title=movie, seats=seats, total=total))
+    except Exception as e:
+        flash(f'An error occurred while processing your payment: {str(e)}', 'error')
+        return redirect(url_for('payment', title=movie, seats=seats, total=total))
+
+    # Turn the seat hold from seating() into a booking. The backend records
+    # its side of it (with 'aws': DynamoDB and SNS messages queued in the
+    # outbox) in the same transaction, so this request makes no AWS calls.
+    # The transaction is committed together with other concurrent bookings.
+    email = session['email']
+    backend = state().backend
+    layout = state().inventory.layout
+
+    def write(conn, hold):
+        created_at = booking_store.now()
+        hold.booking_id = booking_store.insert_booking(conn, email, hold.show, hold.movie,
+                                                       hold.seats, hold.total, payment_method, created_at)
+        backend.record_booking(conn, email, hold, payment_method, created_at)
+        reports.record_booking(conn, hold.show, hold.movie, created_at, hold.total,
+                               [layout.tier_of(seat) for seat in hold.seats], SEAT_PRICES)
+
+    try:
+        hold = state().holds.confirm(state().writer, session.get('hold_id'), write)
+    except HoldExpired:
+        session.pop('hold_id', None)
+        flash('Your seat hold has expired. Please select your seats again.', 'error')
+        return redirect(url_for('seating', title=movie))
+    except SeatUnavailable as e:
+        session.pop('hold_id', None)
+        flash(f"Sorry, these seats were just booked: {', '.join(e.seats)}", 'error')
+        return redirect(url_for('seating', title=movie))
+    session.pop('hold_id', None)
+    state().backend.booking_committed()
+    movie, seats, total = hold.movie, ','.join(hold.seats), hold.total
+    try:
+        # Rendered in the background; the ticket page links to the files
+        state().tickets.submit(booking_store.ticket(get_db(), hold.booking_id))
+    except Exception:
+        # The booking stands; /bookings/<id>/ticket.pdf queues it again
+        traceback.print_exc()
+
+    # The booking itself is in the bookings table; the session only keeps
+    # what the ticket page shows, not a growing list of past bookings
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    session['last_booking'] = {
+        'payment_method': payment_method,
+        'total': total,
+        'timestamp': timestamp
+    }
+
+    flash('Payment successful! Your tickets are ready.', 'success')
+
+    # Store payment information in session for ticket display
+    session['payment_info'] = {
+        'method': payment_method,
+        'details': payment_details,
+        'timestamp': timestamp
+    }
+
+    return redirect(url_for('ticket_confirmation', title=movie, seats=seats, total=total,
+                            booking=hold.booking_id))
+
+
+@route('/tickets')
+def ticket_confirmation():
+    if 'email' not in session:
+        return redirect(url_for('login'))
+
+    title = request.args.get('title')
+    seats = request.args.get('seats')
+    total = request.args.get('total')
+
+    movie = state().catalog.current.movie(title)
+    if not movie or not seats:
+        flash('Invalid booking details.')
+        return redirect(url_for('home'))
+
+    seat_list = seats.split(',')
+    
+    # Get payment information from session
+    payment_info = session.get('payment_info', {
+        'method': 'Not specified',
+        'details': {},
+        'timestamp': 'Not available'
+    })
+    
+    return render_template('tickets.html', movie=movie, seats=seat_list, total=total, 
+                           payment_method=payment_info['method'], 
+                           payment_timestamp=payment_info['timestamp'],
+                           booking_id=request.args.get('booking', type=int))
+
+
+@route('/bookings/<int:booking_id>/ticket.<any(pdf, png):kind>')
+def booking_ticket(booking_id, kind):
+    if 'email' not in session:
+        return redirect(url_for('login'))
+
+    booking = booking_store.ticket(get_db(), booking_id)
+    if booking is None and current_app.config['ARCHIVE_DATABASE']:
+        booking = booking_store.ticket(get_db(), booking_id, archive.SCHEMA)
+    if booking is None or booking['email'] != session['email']:
+        return jsonify({'error': 'Booking not found'}), 404
+
+    # Usually rendered by now; otherwise wait a little for the pool
+    key = state().tickets.wait(booking, current_app.config['TICKET_WAIT'])
+    if key is None:
+        return 'Your ticket is being prepared.', 202, {'Retry-After': '1', 'Content-Type': 'text/plain'}
+    return redirect(url_for('ticket_file', key=key, kind=kind))
+
+
+@route('/dashboard')
+def dashboard():
+    if 'email' not in session:
+        return redirect(url_for('login'))
+
+    # Payment method and timestamp are recorded with every booking now
+    bookings = state().backend.dashboard_bookings(session['email'])
+    if bookings is not None:
+        return render_template('dashboard.html', bookings=bookings)
+
+    # Newest first, one page per request (?before= from the "Older bookings"
+    # link). Rows are read and rendered while the response streams out, so
+    # neither memory nor time to first byte depends on the history size.
+    # Bookings of past shows are only read from the archive with ?archived=1.
+    before, limit = booking_store.page_args(request.args)
+    schema = _bookings_schema()
+    page = booking_store.BookingPage(get_db(), session['email'], before, limit, schema)
+    return stream_template('dashboard.html', bookings=page, archived=schema == archive.SCHEMA,
+                           archive_enabled=bool(current_app.config['ARCHIVE_DATABASE']))
+
+
+def _bookings_schema():
+    """'archive' for ?archived=1 when there is an archive, else 'main'."""
+    if request.args.get('archived') == '1' and current_app.config['ARCHIVE_DATABASE']:
+        return archive.SCHEMA
+    return 'main'
+
+
+@route('/api/bookings')
+def api_bookings():
+    if 'email' not in session:
+        return jsonify({'error': 'Login required'}), 401
+
+    # ?before=<next_before of the previous page>&limit=<n>, &archived=1 for past shows
+    before, limit = booking_store.page_args(request.args)
+    page = booking_store.BookingPage(get_db(), session['email'], before, limit, _bookings_schema())
+    bookings = list(page)
+    return jsonify({'bookings': bookings, 'next_before': page.next_before})
+
+
+@route('/admin/reports')
+def admin_reports():
+    if 'email' not in session:
+        return jsonify({'error': 'Login required'}), 401
+    if session['email'] not in current_app.config['ADMIN_EMAILS']:
+        return jsonify({'error': 'Admins only'}), 403
+
+    # Read from the rollup tables, so the cost doesn't grow with the bookings
+    # (?days=<n>&shows=<n>: how many of the latest days and shows to list)
+    report = reports.summary(get_db(), state().inventory.layout.capacity,
+                             max(1, request.args.get('days', 30, type=int)),
+                             max(1, request.args.get('shows', 100, type=int)))
+    return jsonify(report)
+
+
+@route('/about')
+def about():
+    return state().pages.render('about.html', page_cache.PUBLIC)
+
+
+@route('/services')
+def services():
+    return state().pages.render('services.html', page_cache.PUBLIC)
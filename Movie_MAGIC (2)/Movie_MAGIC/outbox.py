@@ -0,0 +1,226 @@
+"""Transactional outbox for side effects such as DynamoDB writes and SNS messages.
+
+Request handlers call enqueue() inside the same SQLite transaction as the
+booking, so either both the booking and its side effects are stored or
+neither is, and the request itself does no network I/O. An OutboxWorker
+drains the table in the background: a dispatcher thread claims due rows and
+hands them to a small thread pool, one message per call or, for kinds with
+a BatchHandler, many messages per call. Failed deliveries are retried with
+exponential backoff and end up with status 'dead' after max_attempts, where
+they stay for inspection instead of being lost.
+
+Every gunicorn worker runs an OutboxWorker on the same table, so a claim
+records who made it and when (claimed_by, claimed_at, migration 9). A
+worker only writes back the outcome of rows it still holds, and rows
+stay claimed until claim_timeout has passed: only then are they taken to
+belong to a worker that died and delivered again. A worker starting up
+leaves its live siblings' claims alone.
+"""
+import json
+import os
+import random
+import socket
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from db import write_transaction
+
+PENDING = 'pending'
+INFLIGHT = 'inflight'
+DEAD = 'dead'
+
+
+def enqueue(conn, kind, payload):
+    """Add a message to the outbox as part of the caller's transaction."""
+    now = time.time()
+    conn.execute("INSERT INTO outbox (kind, payload, status, attempts, available_at, created_at) "
+                 "VALUES (?, ?, ?, 0, ?, ?)", (kind, json.dumps(payload), PENDING, now, now))
+
+
+def dead_letters(conn, limit=100):
+    """Messages that ran out of attempts, newest first."""
+    rows = conn.execute("SELECT id, kind, payload, attempts, last_error FROM outbox WHERE status = ? "
+                        "ORDER BY id DESC LIMIT ?", (DEAD, limit)).fetchall()
+    return [{'id': r[0], 'kind': r[1], 'payload': json.loads(r[2]), 'attempts': r[3], 'error': r[4]}
+            for r in rows]
+
+
+def requeue_dead(conn):
+    """Give every dead message a fresh set of attempts."""
+    with write_transaction(conn):
+        conn.execute("UPDATE outbox SET status = ?, attempts = 0, available_at = ? WHERE status = ?",
+                     (PENDING, time.time(), DEAD))
+
+
+class BatchHandler:
+    """Deliver many messages of one kind per call.
+
+    deliver(payloads) returns one error string (or None on success) per
+    payload. Messages are handed over once max_size of them are due, or
+    when the oldest has waited max_wait seconds.
+    """
+
+    def __init__(self, deliver, max_size, max_wait=0.0):
+        self.deliver = deliver
+        self.max_size = max_size
+        self.max_wait = max_wait
+
+
+# Seconds after which a claim is taken to be abandoned; longer than any
+# delivery should take, AWS retries and timeouts included
+CLAIM_TIMEOUT = 300
+
+
+def claimant():
+    """A name for this process's claims, unique across hosts and restarts."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+class OutboxWorker:
+    """Background delivery of outbox rows.
+
+    handlers maps a message kind to either a callable taking the decoded
+    payload (raising counts as a failed attempt) or a BatchHandler.
+    """
+
+    def __init__(self, pool, handlers, logger, workers=4, batch_size=50, max_attempts=8,
+                 base_delay=0.5, max_delay=300, poll_interval=0.5, claim_timeout=CLAIM_TIMEOUT):
+        self.pool = pool
+        self.handlers = handlers
+        self.logger = logger
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        # Name of this worker's claims; a new one in start(), so a forked worker has its own
+        self.owner = claimant()
+        self.delivered = 0
+        self.failed = 0
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._executor = None
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self.owner = claimant()
+        self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='outbox')
+        self._thread = threading.Thread(target=self._run, name='outbox-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._executor.shutdown(wait=True)
+            self._thread = None
+
+    def notify(self):
+        """Tell the dispatcher new rows were committed, instead of waiting for the next poll."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                claimed = self.drain_once()
+            except Exception:
+                traceback.print_exc()
+                claimed = 0
+            if claimed < self.batch_size:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+
+    def _claim(self):
+        """Mark due rows inflight and return them grouped as [(kind, rows)]."""
+        now = time.time()
+        single = [kind for kind, handler in self.handlers.items() if not isinstance(handler, BatchHandler)]
+        groups = []
+        with self.pool.connection() as conn, write_transaction(conn):
+            # Claims older than claim_timeout belong to a worker that died; deliver them again
+            conn.execute("UPDATE outbox SET status = ?, claimed_by = NULL, claimed_at = NULL "
+                         "WHERE status = ? AND claimed_at < ?", (PENDING, INFLIGHT, now - self.claim_timeout))
+            if single:
+                marks = ','.join('?' * len(single))
+                rows = conn.execute(f"SELECT id, kind, payload, attempts FROM outbox "
+                                    f"WHERE status = ? AND available_at <= ? AND kind IN ({marks}) "
+                                    f"ORDER BY id LIMIT ?", (PENDING, now, *single, self.batch_size)).fetchall()
+                groups.extend((None, [row]) for row in rows)
+            for kind, handler in self.handlers.items():
+                if not isinstance(handler, BatchHandler):
+                    continue
+                count, oldest = conn.execute("SELECT COUNT(*), MIN(created_at) FROM outbox "
+                                             "WHERE status = ? AND available_at <= ? AND kind = ?",
+                                             (PENDING, now, kind)).fetchone()
+                if not count or (count < handler.max_size and oldest > now - handler.max_wait):
+                    continue
+                rows = conn.execute("SELECT id, kind, payload, attempts FROM outbox "
+                                    "WHERE status = ? AND available_at <= ? AND kind = ? ORDER BY id LIMIT ?",
+                                    (PENDING, now, kind, handler.max_size)).fetchall()
+                groups.append((kind, rows))
+            conn.executemany("UPDATE outbox SET status = ?, claimed_by = ?, claimed_at = ? WHERE id = ?",
+                             [(INFLIGHT, self.owner, now, row[0]) for _, rows in groups for row in rows])
+        return groups
+
+    def drain_once(self):
+        """Claim one round of due messages and deliver it. Returns how many were claimed."""
+        groups = self._claim()
+        if groups:
+            if self._executor is None:
+                results = [self._deliver(group) for group in groups]
+            else:
+                results = list(self._executor.map(self._deliver, groups))
+            self._record([result for batch in results for result in batch])
+        return sum(len(rows) for _, rows in groups)
+
+    def _deliver(self, group):
+        kind, rows = group
+        if kind is not None:
+            try:
+                errors = self.handlers[kind].deliver([json.loads(row[2]) for row in rows])
+            except Exception as e:
+                errors = [f"{type(e).__name__}: {e}"] * len(rows)
+            return [(row[0], row[3] + 1, error) for row, error in zip(rows, errors)]
+        message_id, kind, payload, attempts = rows[0]
+        try:
+            self.handlers[kind](json.loads(payload))
+        except Exception as e:
+            return [(message_id, attempts + 1, f"{type(e).__name__}: {e}")]
+        return [(message_id, attempts + 1, None)]
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempts - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _record(self, results):
+        now = time.time()
+        done = []
+        retry = []
+        dead = []
+        for message_id, attempts, error in results:
+            if error is None:
+                done.append((message_id,))
+            elif attempts >= self.max_attempts:
+                dead.append((DEAD, attempts, error, message_id))
+            else:
+                retry.append((PENDING, attempts, error, now + self._backoff(attempts), message_id, self.owner))
+        with self.pool.connection() as conn, write_transaction(conn):
+            # Delivered is delivered, whoever holds the claim now
+            conn.executemany("DELETE FROM outbox WHERE id = ?", done)
+            # A failure only counts if the row is still ours (not reclaimed and retried elsewhere)
+            conn.executemany("UPDATE outbox SET status = ?, attempts = ?, last_error = ?, available_at = ?, "
+                             "claimed_by = NULL, claimed_at = NULL WHERE id = ? AND claimed_by = ?", retry)
+            conn.executemany("UPDATE outbox SET status = ?, attempts = ?, last_error = ?, "
+                             "claimed_by = NULL, claimed_at = NULL WHERE id = ? AND claimed_by = ?",
+                             [(*row, self.owner) for row in dead])
+        self.delivered += len(done)
+        self.failed += len(retry) + len(dead)
+        for _, _, error, message_id in dead:
+            self.logger.error("Outbox message %s moved to dead letters: %s", message_id, error)
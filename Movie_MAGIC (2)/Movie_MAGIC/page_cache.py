@@ -0,0 +1,95 @@
+"""Rendered-page cache with strong ETags and conditional GET.
+
+Pages such as /, /about, /services and /home render the same HTML for
+every visitor until the catalog or the template changes. PageCache.render()
+keeps the rendered bytes in an LRU keyed by template name and catalog
+version, serves them with a strong ETag and a per-route Cache-Control
+policy, and answers If-None-Match with 304 Not Modified. Call clear() when
+the catalog reloads (Catalog.on_reload); edited templates are picked up
+when Flask template auto-reload is on.
+
+Only use it for pages whose output is fully determined by the template,
+the catalog version and the `key` argument, never for per-user content.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import before_render_template, current_app, request, template_rendered
+
+# Anyone may cache these for a few minutes, then revalidate with the ETag
+PUBLIC = 'public, max-age=300'
+# Only the user's browser may keep it, and must revalidate every time
+PRIVATE = 'private, no-cache'
+
+
+class CachedPage:
+    def __init__(self, body, etag, template):
+        self.body = body
+        self.etag = etag
+        self.template = template
+
+
+def etag_for(body):
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+class PageCache:
+    """LRU of rendered pages; version() names the data they were rendered from."""
+
+    def __init__(self, version, maxsize=256):
+        self.version = version
+        self.maxsize = maxsize
+        self.enabled = True
+        self.hits = 0
+        self.misses = 0
+        self._pages = OrderedDict()
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+
+    def _get(self, key, env):
+        with self._lock:
+            page = self._pages.get(key)
+            if page is not None:
+                self._pages.move_to_end(key)
+        if page is not None and env.auto_reload and not page.template.is_up_to_date:
+            page = None
+        return page
+
+    def _put(self, key, page):
+        with self._lock:
+            self._pages[key] = page
+            self._pages.move_to_end(key)
+            while len(self._pages) > self.maxsize:
+                self._pages.popitem(last=False)
+
+    def render(self, template_name, cache_control=PUBLIC, key=(), **context):
+        """Response for `template_name`, from the cache when possible."""
+        app = current_app._get_current_object()
+        cache_key = (template_name, self.version(), key)
+        page = self._get(cache_key, app.jinja_env) if self.enabled else None
+        if page is None:
+            self.misses += 1
+            template = app.jinja_env.get_or_select_template(template_name)
+            app.update_template_context(context)
+            # The signals render_template() sends, so template hooks (metrics) still see cached pages
+            before_render_template.send(app, _async_wrapper=app.ensure_sync, template=template, context=context)
+            body = template.render(context).encode()
+            template_rendered.send(app, _async_wrapper=app.ensure_sync, template=template, context=context)
+            page = CachedPage(body, etag_for(body), template)
+            if self.enabled:
+                self._put(cache_key, page)
+        else:
+            self.hits += 1
+
+        response = app.response_class(page.body, mimetype='text/html')
+        response.set_etag(page.etag)
+        response.headers['Cache-Control'] = cache_control
+        # Turns the response into a bodyless 304 if If-None-Match matches
+        return response.make_conditional(request)
+
+    def __len__(self):
+        return len(self._pages)
@@ -0,0 +1,205 @@
+"""Password hashing for /register and /login.
+
+Passwords used to be stored as an unsalted sha256 hex digest: one table
+lookup away from a precomputed dictionary, and a billion guesses a second
+on a GPU. They are now stored salted and stretched, with the scheme and its
+cost in the stored string, so every user's hash says how to check it:
+
+    scrypt$16384$8$1$<salt>$<hash>          N, r, p
+    pbkdf2_sha256$600000$<salt>$<hash>      iterations
+    <64 hex digits>                         the old sha256
+
+New hashes use PASSWORD_SCHEME with the cost set in DEFAULTS. A login whose
+stored hash is the old sha256, or another scheme or cost than the current
+one, is rehashed with the current settings and written back once the
+password checked out, so raising the cost later only needs a config change.
+
+A good hash takes ~100 ms of CPU (and scrypt 16 MiB), so PasswordHasher
+runs them in a pool of PASSWORD_WORKERS threads (hashlib releases the GIL
+while hashing) or processes, with at most PASSWORD_QUEUE more waiting.
+Past that, hash() and verify() raise HashingBusy at once instead of
+queueing: a burst of logins gets 503 with Retry-After rather than every
+request in the worker waiting behind it.
+"""
+import base64
+import hashlib
+import hmac
+import math
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import metrics
+
+DEFAULTS = {
+    # 'scrypt' or 'pbkdf2_sha256', for new hashes and the ones upgraded at login
+    'PASSWORD_SCHEME': 'scrypt',
+    # scrypt cost: N (a power of 2), r and p; 2**14, 8, 1 is ~100 ms and 16 MiB a hash
+    'SCRYPT_N': 2 ** 14,
+    'SCRYPT_R': 8,
+    'SCRYPT_P': 1,
+    'PBKDF2_ITERATIONS': 600000,
+    # Hashes computed at once per worker, in a 'thread' or 'process' pool
+    # (0: on the request thread, unbounded), and how many more may wait,
+    # enough that a queued login waits for about 4 hashes at most
+    'PASSWORD_WORKERS': os.cpu_count() or 1,
+    'PASSWORD_POOL': 'thread',
+    'PASSWORD_QUEUE': 4 * (os.cpu_count() or 1),
+}
+
+# Random bytes of salt per hash, and bytes of derived key
+SALT_BYTES = 16
+KEY_BYTES = 32
+
+# Cost parameters stored with each scheme
+_PARAMS = {'scrypt': 3, 'pbkdf2_sha256': 1}
+
+# What unsalted sha256 hashes from before this module look like
+_LEGACY_LENGTH = 64
+_HEX = frozenset('0123456789abcdef')
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool and its queue are full."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"password hashing is busy, retry in {retry_after} s")
+        self.retry_after = retry_after
+
+
+def derive(scheme, params, password, salt):
+    """The key `scheme` derives from `password`; runs in the pool."""
+    if scheme == 'scrypt':
+        n, r, p = params
+        return hashlib.scrypt(password, salt=salt, n=n, r=r, p=p, maxmem=2 * 128 * r * n * p + 2 ** 20,
+                              dklen=KEY_BYTES)
+    if scheme == 'pbkdf2_sha256':
+        return hashlib.pbkdf2_hmac('sha256', password, salt, params[0], KEY_BYTES)
+    if scheme == 'sha256':
+        return hashlib.sha256(password).digest()
+    raise ValueError(f"Unknown password scheme: {scheme}")
+
+
+def encode(scheme, params, salt, key):
+    return '$'.join([scheme, *map(str, params), _b64(salt), _b64(key)])
+
+
+def parse(stored):
+    """(scheme, params, salt, key) of a stored hash."""
+    if len(stored) == _LEGACY_LENGTH and _HEX.issuperset(stored):
+        return 'sha256', (), b'', bytes.fromhex(stored)
+    scheme, *params, salt, key = stored.split('$')
+    if len(params) != _PARAMS.get(scheme):
+        raise ValueError(f"Not a password hash: {stored[:16]}...")
+    return scheme, tuple(map(int, params)), _unb64(salt), _unb64(key)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode().rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class PasswordHasher:
+    """hash() and verify() passwords with the app's current scheme, in a bounded pool."""
+
+    def __init__(self, config):
+        self.scheme = config['PASSWORD_SCHEME']
+        if self.scheme == 'scrypt':
+            self.params = (config['SCRYPT_N'], config['SCRYPT_R'], config['SCRYPT_P'])
+        elif self.scheme == 'pbkdf2_sha256':
+            self.params = (config['PBKDF2_ITERATIONS'],)
+        else:
+            raise ValueError(f"Unknown PASSWORD_SCHEME: {self.scheme}")
+        self.workers = config['PASSWORD_WORKERS']
+        self.pool_kind = config['PASSWORD_POOL']
+        if self.pool_kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown PASSWORD_POOL: {self.pool_kind}")
+        # Hashes running or queued; beyond workers + PASSWORD_QUEUE callers are turned away
+        self._slots = threading.BoundedSemaphore(self.workers + config['PASSWORD_QUEUE']) if self.workers else None
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+        # Recent seconds per hash, waiting for the pool included, for Retry-After
+        self._seconds = 0.1
+        # Checked against when there is no such user, so that takes as long as a wrong password
+        self._dummy = encode(self.scheme, self.params, b'\0' * SALT_BYTES, b'\0' * KEY_BYTES)
+
+    def start(self):
+        """Start the pool, once per process."""
+        with self._lock:
+            if self._pid == os.getpid() or not self.workers:
+                return
+            if self.pool_kind == 'process':
+                self._executor = ProcessPoolExecutor(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+            self._pid = os.getpid()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            executor, self._executor, self._pid = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password, wait=0):
+        """Salted hash of `password` to store, with the current scheme and cost.
+
+        Waits up to `wait` seconds for room in the queue before giving up
+        with HashingBusy.
+        """
+        salt = secrets.token_bytes(SALT_BYTES)
+        return encode(self.scheme, self.params, salt, self._derive(self.scheme, self.params, password, salt, wait))
+
+    def verify(self, password, stored):
+        """(matches, new_hash): new_hash replaces `stored` when it is not up to date.
+
+        `stored` is None when there is no such user; a dummy hash is still
+        computed so the answer takes as long as for a wrong password, and
+        the same goes for a stored value that isn't a hash this module wrote.
+        """
+        try:
+            scheme, params, salt, key = parse(stored)
+        except (AttributeError, TypeError, ValueError):
+            stored = None
+            scheme, params, salt, key = parse(self._dummy)
+        matches = hmac.compare_digest(self._derive(scheme, params, password, salt), key) and stored is not None
+        if not matches or (scheme, params) == (self.scheme, self.params):
+            return matches, None
+        try:
+            # The password checked out, so this login is worth about one
+            # queue's wait; the alternative is skipping it
+            upgraded = self.hash(password, wait=self._seconds)
+        except HashingBusy:
+            # Let them in; the next login upgrades it
+            return True, None
+        metrics.PASSWORD_UPGRADES.inc(scheme)
+        return True, upgraded
+
+    def _derive(self, scheme, params, password, salt, wait=0):
+        password = password.encode()
+        if scheme == 'sha256':
+            # Cheap; only ever checked, never written
+            return derive(scheme, params, password, salt)
+        start = time.perf_counter()
+        if self._slots is None:
+            key = derive(scheme, params, password, salt)
+        else:
+            if not self._slots.acquire(timeout=wait):
+                metrics.PASSWORD_HASH_REJECTIONS.inc()
+                # About how long the ones let in have been taking, queue included
+                raise HashingBusy(max(1, math.ceil(self._seconds)))
+            try:
+                if self._executor is None or self._pid != os.getpid():
+                    self.start()
+                key = self._executor.submit(derive, scheme, params, password, salt).result()
+            finally:
+                self._slots.release()
+        seconds = time.perf_counter() - start
+        self._seconds += (seconds - self._seconds) / 8
+        metrics.PASSWORD_HASH_SECONDS.observe(seconds, scheme)
+        return key
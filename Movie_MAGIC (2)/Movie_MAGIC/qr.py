@@ -0,0 +1,313 @@
+"""QR codes for ticket artifacts (see tickets.py), without a dependency.
+
+encode(data) returns the module matrix of a QR code holding `data` in byte
+mode at error correction level M (15% of the code can be damaged), in the
+smallest of versions 1-10 it fits (up to 213 bytes, far more than a ticket
+code). The construction follows ISO/IEC 18004: finder, timing and
+alignment patterns, Reed-Solomon codewords interleaved across blocks, the
+mask with the lowest penalty score, then format and version information.
+
+png(matrix) draws it as a 1-bit greyscale PNG with a quiet zone.
+"""
+import struct
+import zlib
+
+# Error correction codewords per block and number of blocks, level M, by version
+_ECC_PER_BLOCK = (None, 10, 16, 26, 18, 24, 16, 18, 22, 22, 26)
+_BLOCKS = (None, 1, 1, 1, 2, 2, 4, 4, 4, 5, 5)
+
+MAX_VERSION = len(_BLOCKS) - 1
+
+# Format information bits of level M
+_LEVEL_M = 0b00
+
+_MASKS = (
+    lambda x, y: (x + y) % 2 == 0,
+    lambda x, y: y % 2 == 0,
+    lambda x, y: x % 3 == 0,
+    lambda x, y: (x + y) % 3 == 0,
+    lambda x, y: (x // 3 + y // 2) % 2 == 0,
+    lambda x, y: x * y % 2 + x * y % 3 == 0,
+    lambda x, y: (x * y % 2 + x * y % 3) % 2 == 0,
+    lambda x, y: ((x + y) % 2 + x * y % 3) % 2 == 0,
+)
+
+
+def _raw_codewords(version):
+    """Codewords that fit in the data area of `version`, data and error correction together."""
+    modules = (16 * version + 128) * version + 64
+    if version >= 2:
+        aligns = version // 7 + 2
+        modules -= (25 * aligns - 10) * aligns - 55
+        if version >= 7:
+            modules -= 36
+    return modules // 8
+
+
+def _data_codewords(version):
+    return _raw_codewords(version) - _ECC_PER_BLOCK[version] * _BLOCKS[version]
+
+
+def _alignment_positions(version, size):
+    if version == 1:
+        return []
+    aligns = version // 7 + 2
+    step = (version * 8 + aligns * 3 + 5) // (aligns * 4 - 4) * 2
+    return [6] + [size - 7 - i * step for i in reversed(range(aligns - 1))]
+
+
+def _gf_multiply(x, y):
+    """Product in GF(2^8) modulo x^8 + x^4 + x^3 + x^2 + 1."""
+    z = 0
+    for i in reversed(range(8)):
+        z = (z << 1) ^ ((z >> 7) * 0x11D)
+        z ^= ((y >> i) & 1) * x
+    return z
+
+
+def _rs_divisor(degree):
+    result = [0] * (degree - 1) + [1]
+    root = 1
+    for _ in range(degree):
+        for j in range(degree):
+            result[j] = _gf_multiply(result[j], root)
+            if j + 1 < degree:
+                result[j] ^= result[j + 1]
+        root = _gf_multiply(root, 0x02)
+    return result
+
+
+def _rs_remainder(data, divisor):
+    result = [0] * len(divisor)
+    for byte in data:
+        factor = byte ^ result.pop(0)
+        result.append(0)
+        for i, coefficient in enumerate(divisor):
+            result[i] ^= _gf_multiply(coefficient, factor)
+    return result
+
+
+def _codewords(data, version):
+    """Data codewords of `data` in byte mode, padded, with their error correction interleaved."""
+    capacity = _data_codewords(version) * 8
+    bits = []
+
+    def put(value, length):
+        bits.extend((value >> i) & 1 for i in reversed(range(length)))
+
+    put(0b0100, 4)
+    put(len(data), 8 if version <= 9 else 16)
+    for byte in data:
+        put(byte, 8)
+    put(0, min(4, capacity - len(bits)))
+    put(0, -len(bits) % 8)
+    codewords = [int(''.join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8)]
+    pad = 0xEC
+    while len(codewords) < capacity // 8:
+        codewords.append(pad)
+        pad ^= 0xEC ^ 0x11
+
+    blocks = _BLOCKS[version]
+    ecc_length = _ECC_PER_BLOCK[version]
+    raw = _raw_codewords(version)
+    short_blocks = blocks - raw % blocks
+    short_length = raw // blocks
+    divisor = _rs_divisor(ecc_length)
+    interleaved = []
+    k = 0
+    split = []
+    for i in range(blocks):
+        block = codewords[k:k + short_length - ecc_length + (0 if i < short_blocks else 1)]
+        k += len(block)
+        ecc = _rs_remainder(block, divisor)
+        if i < short_blocks:
+            # Placeholder so every block has the same length; skipped below
+            block.append(0)
+        split.append(block + ecc)
+    for i in range(len(split[0])):
+        for j, block in enumerate(split):
+            if i != short_length - ecc_length or j >= short_blocks:
+                interleaved.append(block[i])
+    return interleaved
+
+
+class _Matrix:
+    def __init__(self, version):
+        self.version = version
+        self.size = version * 4 + 17
+        self.dark = [[False] * self.size for _ in range(self.size)]
+        self.function = [[False] * self.size for _ in range(self.size)]
+
+    def set_function(self, x, y, dark):
+        self.dark[y][x] = dark
+        self.function[y][x] = True
+
+    def draw_function_patterns(self):
+        size = self.size
+        for i in range(size):
+            self.set_function(6, i, i % 2 == 0)
+            self.set_function(i, 6, i % 2 == 0)
+        for cx, cy in ((3, 3), (size - 4, 3), (3, size - 4)):
+            for dy in range(-4, 5):
+                for dx in range(-4, 5):
+                    x, y = cx + dx, cy + dy
+                    if 0 <= x < size and 0 <= y < size:
+                        self.set_function(x, y, max(abs(dx), abs(dy)) not in (2, 4))
+        positions = _alignment_positions(self.version, size)
+        last = len(positions) - 1
+        for i, cx in enumerate(positions):
+            for j, cy in enumerate(positions):
+                # Not where the finder patterns are
+                if (i, j) in ((0, 0), (0, last), (last, 0)):
+                    continue
+                for dy in range(-2, 3):
+                    for dx in range(-2, 3):
+                        self.set_function(cx + dx, cy + dy, max(abs(dx), abs(dy)) != 1)
+        # Reserved now, drawn for real once the mask is chosen
+        self.draw_format(0)
+        self.draw_version()
+
+    def draw_format(self, mask):
+        data = _LEVEL_M << 3 | mask
+        remainder = data
+        for _ in range(10):
+            remainder = (remainder << 1) ^ ((remainder >> 9) * 0x537)
+        bits = (data << 10 | remainder) ^ 0x5412
+        size = self.size
+
+        def bit(i):
+            return (bits >> i) & 1 == 1
+
+        for i in range(6):
+            self.set_function(8, i, bit(i))
+        self.set_function(8, 7, bit(6))
+        self.set_function(8, 8, bit(7))
+        self.set_function(7, 8, bit(8))
+        for i in range(9, 15):
+            self.set_function(14 - i, 8, bit(i))
+        for i in range(8):
+            self.set_function(size - 1 - i, 8, bit(i))
+        for i in range(8, 15):
+            self.set_function(8, size - 15 + i, bit(i))
+        # Always dark
+        self.set_function(8, size - 8, True)
+
+    def draw_version(self):
+        if self.version < 7:
+            return
+        remainder = self.version
+        for _ in range(12):
+            remainder = (remainder << 1) ^ ((remainder >> 11) * 0x1F25)
+        bits = self.version << 12 | remainder
+        for i in range(18):
+            dark = (bits >> i) & 1 == 1
+            a, b = self.size - 11 + i % 3, i // 3
+            self.set_function(a, b, dark)
+            self.set_function(b, a, dark)
+
+    def draw_codewords(self, codewords):
+        size = self.size
+        i = 0
+        total = len(codewords) * 8
+        right = size - 1
+        while right >= 1:
+            if right == 6:
+                # Skip the vertical timing pattern
+                right = 5
+            upward = (right + 1) & 2 == 0
+            for vertical in range(size):
+                y = size - 1 - vertical if upward else vertical
+                for x in (right, right - 1):
+                    if not self.function[y][x] and i < total:
+                        self.dark[y][x] = (codewords[i >> 3] >> (7 - (i & 7))) & 1 == 1
+                        i += 1
+            right -= 2
+
+    def apply_mask(self, mask):
+        masked = _MASKS[mask]
+        for y in range(self.size):
+            row, function = self.dark[y], self.function[y]
+            for x in range(self.size):
+                if not function[x] and masked(x, y):
+                    row[x] = not row[x]
+
+    def penalty(self):
+        size = self.size
+        score = 0
+        lines = [''.join('1' if dark else '0' for dark in row) for row in self.dark]
+        lines += [''.join(line[x] for line in lines[:size]) for x in range(size)]
+        for line in lines:
+            # Runs of five or more modules of one colour
+            run = 1
+            for a, b in zip(line, line[1:]):
+                if a == b:
+                    run += 1
+                else:
+                    score += run - 2 if run >= 5 else 0
+                    run = 1
+            score += run - 2 if run >= 5 else 0
+            # Patterns that look like a finder
+            padded = '0000' + line + '0000'
+            score += 40 * (padded.count('10111010000') + padded.count('00001011101'))
+        for y in range(size - 1):
+            for x in range(size - 1):
+                colour = self.dark[y][x]
+                if colour == self.dark[y][x + 1] == self.dark[y + 1][x] == self.dark[y + 1][x + 1]:
+                    score += 3
+        dark = sum(map(sum, self.dark))
+        total = size * size
+        score += ((abs(dark * 20 - total * 10) + total - 1) // total - 1) * 10
+        return score
+
+
+def encode(data):
+    """Module matrix (rows of booleans, True for dark) of a level M QR code holding `data`."""
+    if isinstance(data, str):
+        data = data.encode()
+    for version in range(1, MAX_VERSION + 1):
+        header_bits = 4 + (8 if version <= 9 else 16)
+        if header_bits + len(data) * 8 <= _data_codewords(version) * 8:
+            break
+    else:
+        raise ValueError(f"{len(data)} bytes do not fit in a version {MAX_VERSION} QR code")
+
+    matrix = _Matrix(version)
+    matrix.draw_function_patterns()
+    matrix.draw_codewords(_codewords(data, version))
+    best, best_score = None, None
+    for mask in range(len(_MASKS)):
+        matrix.apply_mask(mask)
+        matrix.draw_format(mask)
+        score = matrix.penalty()
+        if best_score is None or score < best_score:
+            best, best_score = mask, score
+        # Masking twice undoes it
+        matrix.apply_mask(mask)
+    matrix.apply_mask(best)
+    matrix.draw_format(best)
+    return matrix.dark
+
+
+def png(matrix, scale=8, border=4):
+    """A 1-bit greyscale PNG of `matrix`, `scale` pixels per module, `border` modules of quiet zone."""
+    width = (len(matrix) + 2 * border) * scale
+    light_row = bytes([0]) + b'\xff' * ((width + 7) // 8)
+    rows = [light_row] * (border * scale)
+    for modules in matrix:
+        bits = [False] * border + list(modules) + [False] * border
+        value = 0
+        for dark in bits:
+            # Each module is `scale` pixels; 1 is white in greyscale
+            value = (value << scale) | (0 if dark else (1 << scale) - 1)
+        value <<= -width % 8
+        row = bytes([0]) + value.to_bytes((width + 7) // 8, 'big')
+        rows += [row] * scale
+    rows += [light_row] * (border * scale)
+
+    def chunk(kind, body):
+        return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, width, 1, 0, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(b''.join(rows), 9))
+            + chunk(b'IEND', b''))
@@ -0,0 +1,194 @@
+"""Revenue and occupancy rollups behind /admin/reports.
+
+Revenue per movie used to mean reading every booking and its seats. Every
+booking now adds itself to four small rollup tables (migration 7) in the
+transaction that writes it (record_booking(), from process_payment):
+
+    report_shows    bookings, seats sold and revenue per show
+    report_movies   the same per movie
+    report_days     per day the booking was made (YYYY-MM-DD)
+    report_tiers    per seat tier, a booking's total split between its
+                    tiers in proportion to their list prices
+
+so summary() reads one row per movie, tier, day and show it returns,
+however many bookings there are. Occupancy is a show's seats sold over its
+screen's capacity.
+
+Bookings from before migration 7 are added by a one-time backfill:
+
+    python reports.py database.db
+
+which brings the schema up to date first. Migration 7 records the first
+booking id the app counts itself; the backfill walks the ids below it in
+batches, aggregates each batch from one GROUP BY query and adds it to the
+rollups in the transaction that moves its cursor on. It can be stopped and
+rerun, and runs alongside the app.
+"""
+import argparse
+import time
+from collections import Counter
+
+import db
+import migrations
+
+# Bookings aggregated per backfill transaction
+BATCH_SIZE = 5000
+
+# Rollup tables and their key column
+TABLES = {
+    'report_shows': 'show_id',
+    'report_movies': 'movie',
+    'report_days': 'day',
+    'report_tiers': 'tier',
+}
+
+# Most days and shows summary() returns
+MAX_DAYS = 366
+MAX_SHOWS = 1000
+
+
+def split_total(total, seats, prices):
+    """{tier: revenue}: `total` split between the tiers of `seats` ({tier: count}) by list price.
+
+    Whatever integer division leaves over goes to the tier with the most
+    weight, so the shares always add up to `total`.
+    """
+    weights = {tier: count * prices.get(tier, 1) for tier, count in seats.items() if count}
+    weight = sum(weights.values())
+    if not weight:
+        return {}
+    shares = {tier: total * w // weight for tier, w in weights.items()}
+    shares[max(sorted(weights), key=weights.get)] += total - sum(shares.values())
+    return shares
+
+
+def rollup(bookings, prices):
+    """Sum (show_id, movie, day, total, {tier: seats}) bookings into {table: {key: [bookings, seats, revenue]}}."""
+    tables = {table: {} for table in TABLES}
+    for show_id, movie, day, total, seats in bookings:
+        total = total or 0
+        count = sum(seats.values())
+        for table, key in (('report_shows', show_id), ('report_movies', movie), ('report_days', day)):
+            if key is not None:
+                row = tables[table].setdefault(key, [0, 0, 0])
+                row[0] += 1
+                row[1] += count
+                row[2] += total
+        for tier, revenue in split_total(total, seats, prices).items():
+            row = tables['report_tiers'].setdefault(tier, [0, 0, 0])
+            row[0] += 1
+            row[1] += seats[tier]
+            row[2] += revenue
+    return tables
+
+
+def apply(conn, tables):
+    """Add rollup() output to the rollup tables, one executemany per table."""
+    for table, rows in tables.items():
+        if rows:
+            key = TABLES[table]
+            conn.executemany(f'''INSERT INTO {table} ({key}, bookings, seats, revenue) VALUES (?, ?, ?, ?)
+                                 ON CONFLICT ({key}) DO UPDATE SET bookings = bookings + excluded.bookings,
+                                                                   seats = seats + excluded.seats,
+                                                                   revenue = revenue + excluded.revenue''',
+                             [(key_value, *sums) for key_value, sums in rows.items()])
+
+
+def record_booking(conn, show_id, movie, created_at, total, tiers, prices):
+    """Count one new booking, in its transaction; `tiers` has the tier of each of its seats."""
+    apply(conn, rollup([(show_id, movie, created_at[:10], total, Counter(tiers))], prices))
+
+
+def backfill(conn, prices, batch_size=BATCH_SIZE, progress=None):
+    """Add the bookings made before migration 7 to the rollups. Returns how many were added."""
+    below, done_through = conn.execute("SELECT below, done_through FROM report_backfill WHERE id = 1").fetchone()
+    added = 0
+    while True:
+        # The batch is the next batch_size ids; its last one bounds the GROUP BY
+        last = conn.execute("SELECT MAX(id) FROM (SELECT id FROM bookings WHERE id > ? AND id < ? "
+                            "ORDER BY id LIMIT ?)", (done_through, below, batch_size)).fetchone()[0]
+        if last is None:
+            return added
+        bookings = {}
+        for booking_id, show_id, movie, day, total, tier, seats in conn.execute(
+                '''SELECT b.id, b.show_id, b.movie, substr(b.created_at, 1, 10), b.total, s.tier, COUNT(s.seat)
+                   FROM bookings AS b
+                   LEFT JOIN booking_seats AS s ON s.booking_id = b.id
+                   WHERE b.id > ? AND b.id <= ?
+                   GROUP BY b.id, s.tier''', (done_through, last)):
+            booking = bookings.setdefault(booking_id, (show_id, movie, day, total, Counter()))
+            if tier is not None:
+                booking[4][tier] += seats
+        with db.write_transaction(conn):
+            # Only the process that moves the cursor on may add the batch
+            moved = conn.execute("UPDATE report_backfill SET done_through = ? WHERE id = 1 AND done_through = ?",
+                                 (last, done_through)).rowcount
+            if moved:
+                apply(conn, rollup(bookings.values(), prices))
+        if not moved:
+            raise RuntimeError("another backfill is running on this database")
+        done_through = last
+        added += len(bookings)
+        if progress:
+            progress(added)
+
+
+def backfill_pending(conn):
+    """Whether bookings from before migration 7 are still missing from the rollups."""
+    below, done_through = conn.execute("SELECT below, done_through FROM report_backfill WHERE id = 1").fetchone()
+    return conn.execute("SELECT EXISTS (SELECT 1 FROM bookings WHERE id > ? AND id < ?)",
+                        (done_through, below)).fetchone()[0] == 1
+
+
+def summary(conn, capacity, days=30, shows=100):
+    """The rollups as a dict for /admin/reports.
+
+    Every movie and tier, the last `days` days and the `shows` most recently
+    added shows that have bookings; `capacity` is the seat count of shows
+    without a screen.
+    """
+    def totals(row):
+        return {'bookings': row[0], 'seats': row[1], 'revenue': row[2]}
+
+    show_rows = conn.execute('''SELECT r.show_id, sh.movie, sh.starts_at, r.bookings, r.seats, r.revenue,
+                                       COALESCE(length(sc.rows) * sc.seats_per_row, ?)
+                                FROM report_shows AS r
+                                JOIN shows AS sh ON sh.id = r.show_id
+                                LEFT JOIN screens AS sc ON sc.id = sh.screen_id
+                                ORDER BY r.show_id DESC LIMIT ?''', (capacity, min(shows, MAX_SHOWS))).fetchall()
+    return {
+        'movies': [{'movie': movie, **totals(row)} for movie, *row in conn.execute(
+            "SELECT movie, bookings, seats, revenue FROM report_movies ORDER BY revenue DESC")],
+        'tiers': [{'tier': tier, **totals(row)} for tier, *row in conn.execute(
+            "SELECT tier, bookings, seats, revenue FROM report_tiers ORDER BY tier")],
+        'days': [{'day': day, **totals(row)} for day, *row in conn.execute(
+            "SELECT day, bookings, seats, revenue FROM report_days ORDER BY day DESC LIMIT ?",
+            (min(days, MAX_DAYS),))],
+        'shows': [{'show_id': show_id, 'movie': movie, 'starts_at': starts_at, **totals(row),
+                   'capacity': seats_in_screen,
+                   'occupancy': round(row[1] / seats_in_screen, 4) if seats_in_screen else None}
+                  for show_id, movie, starts_at, *row, seats_in_screen in show_rows],
+        'backfill_pending': backfill_pending(conn),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Add bookings made before the rollup tables existed to them.')
+    parser.add_argument('database')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    # The prices the app splits booking totals by
+    from movie_magic import SEAT_PRICES
+
+    conn = db.connect(args.database)
+    start = time.perf_counter()
+    # The rollup tables and the backfill cursor come with migration 7
+    migrations.migrate(conn)
+    added = backfill(conn, SEAT_PRICES, args.batch_size, lambda count: print(f"  bookings: {count}"))
+    print(f"{args.database}: {added} bookings added to the rollups ({time.perf_counter() - start:.1f}s)")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
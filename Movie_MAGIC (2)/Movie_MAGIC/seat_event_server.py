@@ -0,0 +1,244 @@
+"""asyncio server for /api/shows/<id>/events, next to the gthread worker.
+
+A stream served by the Flask view holds one of the worker's THREADS for as
+long as the seating page stays open, so a handful of pages would take
+every thread. EventServer serves the streams from one event loop on a
+thread of each worker process instead, listening on SEAT_EVENTS_BIND with
+SO_REUSEPORT so that every worker's loop accepts on the same port
+(gunicorn.conf.py sets it). An idle stream is a socket, a Subscription and
+a coroutine waiting on its show's asyncio.Event, so a worker keeps
+thousands open while its threads stay free for logins and bookings.
+
+The loop follows the worker's own Broadcaster, which SeatEvents publishes
+to: Broadcaster.on_publish() calls wake() from the publishing thread, and
+wake() sets the show's Event on the loop. Anything that reads SQLite
+(whether the show exists, the availability snapshot, sales by other
+processes) runs on the loop's default executor, and other processes' sales
+are picked up once per show every WAKE_SECONDS rather than once per stream.
+
+It only speaks as much HTTP as EventSource needs: GET (and the CORS
+preflight OPTIONS) of /api/shows/<id>/events, answered with Connection:
+close. Seating pages connect to SEAT_EVENTS_URL when it is set, and
+otherwise to their own origin, whose proxy sends /api/shows/<id>/events to
+SEAT_EVENTS_BIND.
+"""
+import asyncio
+import os
+import re
+import threading
+import traceback
+from collections import Counter
+from urllib.parse import urlsplit
+
+import metrics
+from seat_events import HEARTBEAT_SECONDS, MAX_STREAM_SECONDS, RETRY_MS, WAKE_SECONDS, message
+
+# Seconds a client gets to send its request headers, and the most it may send
+REQUEST_TIMEOUT = 10
+MAX_REQUEST_BYTES = 8192
+# Connections waiting to be accepted, as with gunicorn's backlog
+BACKLOG = 2048
+
+_PATH = re.compile(r"/api/shows/(\d+)/events\Z")
+
+# The seating page may live on another origin (SEAT_EVENTS_URL); the seat map is public
+_CORS = (b"Access-Control-Allow-Origin: *\r\n"
+         b"Access-Control-Allow-Methods: GET\r\n"
+         b"Access-Control-Allow-Headers: Last-Event-ID\r\n")
+
+_STREAM_HEAD = (b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/event-stream\r\n"
+                b"Cache-Control: no-cache\r\n"
+                b"X-Accel-Buffering: no\r\n" + _CORS + b"Connection: close\r\n\r\n")
+
+
+def _response(status, body=b''):
+    return (f"HTTP/1.1 {status}\r\nContent-Type: text/plain\r\nContent-Length: {len(body)}\r\n".encode() + _CORS
+            + b"Connection: close\r\n\r\n" + body)
+
+
+def parse_bind(bind):
+    """('0.0.0.0', 5001) for '0.0.0.0:5001'."""
+    host, _, port = bind.rpartition(':')
+    return host or '0.0.0.0', int(port)
+
+
+class EventServer:
+    """Seat event streams of one process, served from an event loop on a thread of their own.
+
+    exists(show) says whether a show id is known; snapshot(show) returns its
+    availability body and refresh(show) picks up seats other processes sold,
+    publishing them (see availability.AvailabilityCache.get).
+    """
+
+    def __init__(self, broadcaster, exists, snapshot, refresh, bind):
+        self.broadcaster = broadcaster
+        self.exists = exists
+        self.snapshot = snapshot
+        self.refresh = refresh
+        self.host, self.port = parse_bind(bind)
+        # show -> streams open, polled for other processes' sales while non-zero
+        self.streams = Counter()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        # show -> asyncio.Event set by the next publish; created by waiting streams
+        self._wakeups = {}
+        self._pid = None
+        self._lock = threading.Lock()
+        broadcaster.on_publish(self.wake)
+
+    def start(self):
+        """Bind and serve on a new thread, once per process (so in each forked worker)."""
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._loop = asyncio.new_event_loop()
+            # Bound here, so a port that can't be had fails start() rather than the thread
+            self._server = self._loop.run_until_complete(asyncio.start_server(
+                self._serve, self.host, self.port, reuse_port=True, backlog=BACKLOG, limit=MAX_REQUEST_BYTES))
+            # The port actually bound, for SEAT_EVENTS_BIND ending in :0
+            self.port = self._server.sockets[0].getsockname()[1]
+            self._thread = threading.Thread(target=self._run, name='seat-event-server', daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def stop(self, timeout=None):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+            try:
+                asyncio.run_coroutine_threadsafe(self._close(), self._loop).result(timeout)
+            except Exception:
+                traceback.print_exc()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout)
+            self._pid = None
+
+    def wake(self, show):
+        """Broadcaster.on_publish() callback: wake the show's streams. Any thread may call it."""
+        loop = self._loop
+        if loop is None or self._pid != os.getpid():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake, show)
+        except RuntimeError:
+            # The loop has been closed by stop()
+            pass
+
+    def _wake(self, show):
+        wakeup = self._wakeups.pop(show, None)
+        if wakeup is not None:
+            wakeup.set()
+
+    def _run(self):
+        poller = self._loop.create_task(self._poll())
+        try:
+            self._loop.run_forever()
+        finally:
+            poller.cancel()
+            self._loop.run_until_complete(asyncio.gather(poller, return_exceptions=True))
+            self._loop.close()
+
+    async def _close(self):
+        self._server.close()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _poll(self):
+        """Refresh every show with open streams each WAKE_SECONDS, so sales elsewhere reach them."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(WAKE_SECONDS)
+            for show in list(self.streams):
+                try:
+                    await loop.run_in_executor(None, self.refresh, show)
+                except Exception:
+                    traceback.print_exc()
+
+    async def _serve(self, reader, writer):
+        try:
+            try:
+                head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), REQUEST_TIMEOUT)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                return
+            request_line, *header_lines = head.decode('latin-1').split('\r\n')
+            method, _, rest = request_line.partition(' ')
+            headers = {}
+            for line in header_lines:
+                name, colon, value = line.partition(':')
+                if colon:
+                    headers[name.strip().lower()] = value.strip()
+            match = _PATH.match(urlsplit(rest.rpartition(' ')[0]).path)
+            if match is None:
+                writer.write(_response('404 Not Found', b'Not found\n'))
+            elif method == 'OPTIONS':
+                writer.write(_response('204 No Content'))
+            elif method != 'GET':
+                writer.write(_response('405 Method Not Allowed', b'Method not allowed\n'))
+            elif not await asyncio.get_running_loop().run_in_executor(None, self.exists, int(match.group(1))):
+                writer.write(_response('404 Not Found', b'Show not found\n'))
+            else:
+                # Sent by EventSource when it reconnects
+                await self._stream(writer, int(match.group(1)), headers.get('last-event-id'))
+            await writer.drain()
+        except ConnectionError:
+            # The page was closed or reloaded
+            pass
+        except asyncio.CancelledError:
+            # stop(); ending quietly, as asyncio.start_server() reports a cancelled handler as an error
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, writer, show, last_event_id):
+        """seat_events.stream(), waiting on the loop rather than on a thread."""
+        loop = asyncio.get_running_loop()
+        subscription = self.broadcaster.subscribe(show, last_event_id)
+        self.streams[show] += 1
+        metrics.SEAT_EVENT_STREAMS.inc()
+        try:
+            started = idle_since = loop.time()
+            writer.write(_STREAM_HEAD + f"retry: {RETRY_MS}\n\n".encode())
+            if not last_event_id:
+                await self._send_snapshot(writer, subscription)
+            await writer.drain()
+            while loop.time() - started < MAX_STREAM_SECONDS:
+                events = await self._wait(subscription, WAKE_SECONDS)
+                if events is None:
+                    await self._send_snapshot(writer, subscription)
+                elif events:
+                    writer.write(b''.join(message(data, 'seats', event_id) for event_id, data in events))
+                elif loop.time() - idle_since < HEARTBEAT_SECONDS:
+                    continue
+                else:
+                    writer.write(b": keep-alive\n\n")
+                await writer.drain()
+                idle_since = loop.time()
+        finally:
+            metrics.SEAT_EVENT_STREAMS.dec()
+            self.streams[show] -= 1
+            if not self.streams[show]:
+                del self.streams[show]
+
+    async def _send_snapshot(self, writer, subscription):
+        event_id = subscription.last_event_id
+        body = await asyncio.get_running_loop().run_in_executor(None, self.snapshot, subscription.topic)
+        writer.write(message(body.decode(), 'snapshot', event_id))
+
+    async def _wait(self, subscription, timeout):
+        """Subscription.wait(), without holding a thread while nothing happens."""
+        events = subscription.wait(0)
+        if events != []:
+            return events
+        # A publish from now on runs _wake() after this coroutine yields, so it can't be missed
+        wakeup = self._wakeups.get(subscription.topic)
+        if wakeup is None:
+            wakeup = self._wakeups[subscription.topic] = asyncio.Event()
+        try:
+            await asyncio.wait_for(wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return subscription.wait(0)
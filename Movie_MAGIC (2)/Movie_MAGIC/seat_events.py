@@ -0,0 +1,113 @@
+"""Server-Sent Events stream of seat changes for /api/shows/<id>/events.
+
+SeatEvents, registered with SeatInventory.on_change(), publishes the
+seat changes of each show to a broadcast.Broadcaster topic; stream() turns
+a subscription into text/event-stream messages:
+
+    event: snapshot     the /api/shows/<id>/availability body, sent first
+                        and whenever the client has missed events
+    event: seats        {"sold": [...], "held": [...], "free": [...]}
+
+Changes to a show within COALESCE_SECONDS of the first one are published
+as one "seats" event with the latest state of each seat, so a burst costs
+one wakeup and one JSON encoding however many subscribers there are. Every
+message has an id, so a reconnecting EventSource resumes from its
+Last-Event-ID.
+
+stream() holds the thread serving it for as long as the page is open, so
+the Flask view is for `flask run` and single-process setups. Under
+gunicorn, seat_event_server.EventServer serves the same messages from an
+event loop in each worker (SEAT_EVENTS_BIND), where an open stream costs no
+thread.
+"""
+import json
+import threading
+import time
+
+DEFAULTS = {
+    # "host:port" on which every process serves /api/shows/<id>/events from an
+    # event loop (seat_event_server.py; gunicorn.conf.py sets it). None: the
+    # Flask view serves them, a thread per stream
+    'SEAT_EVENTS_BIND': None,
+    # Where seating pages open their streams, e.g. "https://events.example.com"
+    # for SEAT_EVENTS_BIND behind its own host name. None: the page's own
+    # origin, whose proxy passes /api/shows/<id>/events on to SEAT_EVENTS_BIND
+    'SEAT_EVENTS_URL': None,
+}
+
+# Changes are collected for this long after the first one, then published together
+COALESCE_SECONDS = 0.05
+# Idle streams wake up this often; a comment goes out every HEARTBEAT_SECONDS
+# so proxies keep the connection open and dead clients are noticed
+WAKE_SECONDS = 2.0
+HEARTBEAT_SECONDS = 15
+# Streams end after this long and the browser reconnects, resuming from
+# its last event, so no worker is held forever (e.g. across a reload)
+MAX_STREAM_SECONDS = 300
+# How soon the browser reconnects after the stream ends
+RETRY_MS = 2000
+
+
+class SeatEvents:
+    """SeatInventory.on_change() callback publishing coalesced changes per show."""
+
+    def __init__(self, broadcaster, coalesce=COALESCE_SECONDS):
+        self.broadcaster = broadcaster
+        self.coalesce = coalesce
+        # show -> {seat: latest state} not yet published
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, show, changes):
+        if not changes:
+            return
+        with self._lock:
+            pending = self._pending.get(show)
+            if pending is not None:
+                pending.update(changes)
+                return
+            self._pending[show] = dict(changes)
+        timer = threading.Timer(self.coalesce, self.flush, (show,))
+        timer.daemon = True
+        timer.start()
+
+    def flush(self, show):
+        with self._lock:
+            changes = self._pending.pop(show, None)
+        if changes:
+            grouped = {}
+            for seat, seat_state in changes.items():
+                grouped.setdefault(seat_state, []).append(seat)
+            self.broadcaster.publish(show, json.dumps(grouped, separators=(',', ':')))
+
+
+def message(data, event, event_id):
+    return f"event: {event}\nid: {event_id}\ndata: {data}\n\n".encode()
+
+
+def stream(subscription, snapshot, poll=None, send_snapshot=True, clock=time.monotonic):
+    """text/event-stream chunks for `subscription`.
+
+    snapshot() returns the current availability body. poll(), if given, is
+    called whenever the stream wakes up with nothing to send, e.g. to pick
+    up other processes' sales.
+    """
+    started = idle_since = clock()
+    yield f"retry: {RETRY_MS}\n\n".encode()
+    if send_snapshot:
+        event_id = subscription.last_event_id
+        yield message(snapshot().decode(), 'snapshot', event_id)
+    while clock() - started < MAX_STREAM_SECONDS:
+        events = subscription.wait(WAKE_SECONDS)
+        if events is None:
+            event_id = subscription.last_event_id
+            yield message(snapshot().decode(), 'snapshot', event_id)
+        elif events:
+            yield b''.join(message(data, 'seats', event_id) for event_id, data in events)
+        else:
+            if poll is not None:
+                poll()
+            if clock() - idle_since < HEARTBEAT_SECONDS:
+                continue
+            yield b": keep-alive\n\n"
+        idle_since = clock()
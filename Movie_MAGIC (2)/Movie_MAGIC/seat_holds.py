@@ -0,0 +1,217 @@
+"""Time-limited seat holds between /seating and /process_payment.
+
+seating() places a hold instead of writing a booking. The seats stay
+unavailable to everybody else until the hold is confirmed by a successful
+payment, released, or expires. Holds are indexed by expiry in a heap, so
+expired ones are evicted lazily on every call and by a background sweeper
+without scanning all live holds.
+
+With a `leases` backend (see leases.py) every hold also leases its seats,
+so that other app instances can't hold them too, and its sale is fenced
+on the lease tokens: a hold whose lease was taken over is not sold. The
+sweeper also purges the leases of shows that started `purge_after`
+seconds ago every LEASE_PURGE_INTERVAL.
+"""
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+from seat_inventory import SeatUnavailable
+
+# How long seats stay held while the user is on the payment page
+HOLD_TTL = 10 * 60
+
+# How often the background sweeper wakes up to evict expired holds
+SWEEP_INTERVAL = 5
+
+# How often the sweeper deletes the leases of past shows (see leases.SeatLeases.purge)
+LEASE_PURGE_INTERVAL = 60 * 60
+
+# Blocks allocate() tries when the seats it picks are leased by another instance
+ALLOCATE_ATTEMPTS = 3
+
+
+class HoldExpired(Exception):
+    """Raised when a hold is confirmed after it has expired or been released."""
+
+
+class Hold:
+    def __init__(self, hold_id, show, movie, seats, email, total, expires_at):
+        self.hold_id = hold_id
+        self.show = show
+        self.movie = movie
+        self.seats = seats
+        self.email = email
+        self.total = total
+        self.expires_at = expires_at
+        # Set by the caller of HoldManager.confirm() once the booking row exists
+        self.booking_id = None
+        # {seat: fencing token} from HoldManager.leases
+        self.leases = {}
+
+
+class HoldManager:
+    def __init__(self, inventory, ttl=HOLD_TTL, clock=time.monotonic, leases=None, purge_after=None):
+        self.inventory = inventory
+        self.ttl = ttl
+        self.clock = clock
+        # Seat leases shared with the other app instances (None: this process only)
+        self.leases = leases
+        # Seconds after a show's start from which its leases are purged (None: never)
+        self.purge_after = purge_after
+        self._holds = {}
+        # (expires_at, seq, hold_id); entries of confirmed/released holds are skipped
+        self._expiry = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def place(self, show, movie, seats, email, total):
+        """Hold `seats` of `show` for `email`; raises SeatUnavailable if any is taken."""
+        self.evict_expired()
+        return self._track(show, movie, self.inventory.hold(show, seats), email, total)
+
+    def allocate(self, show, movie, count, rows, email, price):
+        """Hold the best block of `count` seats in `rows` (see SeatInventory.allocate()).
+
+        Returns the hold, or None if no row has `count` adjacent free seats.
+        Seats another instance has leased are held here while the next block
+        is picked, and let go again afterwards.
+        """
+        self.evict_expired()
+        blocked = []
+        try:
+            for _ in range(ALLOCATE_ATTEMPTS):
+                seats = self.inventory.allocate(show, count, rows)
+                if seats is None:
+                    return None
+                try:
+                    return self._track(show, movie, seats, email, price * count)
+                except SeatUnavailable as e:
+                    for seat in e.seats:
+                        try:
+                            blocked += self.inventory.hold(show, [seat])
+                        except SeatUnavailable:
+                            pass
+            return None
+        finally:
+            if blocked:
+                self.inventory.release(show, blocked)
+
+    def _track(self, show, movie, seats, email, total):
+        """Lease the held `seats` and keep track of the hold; lets go of the seats if they can't be leased."""
+        hold = Hold(uuid.uuid4().hex, show, movie, seats, email, total, self.clock() + self.ttl)
+        if self.leases is not None:
+            try:
+                hold.leases = self.leases.acquire(show, seats, hold.hold_id, self.ttl)
+            except BaseException:
+                self.inventory.release(show, seats)
+                raise
+        with self._lock:
+            self._holds[hold.hold_id] = hold
+            heapq.heappush(self._expiry, (hold.expires_at, next(self._seq), hold.hold_id))
+        return hold
+
+    def get(self, hold_id):
+        self.evict_expired()
+        with self._lock:
+            return self._holds.get(hold_id)
+
+    def release(self, hold_id):
+        with self._lock:
+            hold = self._holds.pop(hold_id, None)
+        if hold is not None:
+            self.inventory.release(hold.show, hold.seats)
+            self._release_leases(hold)
+        return hold
+
+    def _release_leases(self, hold):
+        if self.leases is not None:
+            self.leases.release(hold.show, hold.leases)
+
+    def confirm(self, writer, hold_id, write):
+        """Turn a live hold into a sale, in a booking transaction on `writer`.
+
+            def write(conn, hold):
+                hold.booking_id = booking_store.insert_booking(conn, ...)
+
+            hold = holds.confirm(writer, hold_id, write)
+
+        write runs on the writer's thread (see booking_writer.py), so it
+        must not touch the request. Raises HoldExpired if the hold is gone,
+        and SeatUnavailable if another instance has taken over its leases.
+        If the booking fails the seats are released rather than put back
+        on hold.
+        """
+        self.evict_expired()
+        with self._lock:
+            hold = self._holds.pop(hold_id, None) if hold_id else None
+        if hold is None:
+            raise HoldExpired(hold_id)
+        leases = self.leases
+        # In the booking transaction if the backend can be, else just before it
+        fence_in_transaction = leases is not None and leases.transactional
+
+        def write_sale(conn, sale):
+            if fence_in_transaction:
+                leases.fence(hold.show, hold.leases, conn)
+            write(conn, hold)
+            sale.booking_id = hold.booking_id
+
+        try:
+            if leases is not None and not fence_in_transaction:
+                leases.fence(hold.show, hold.leases)
+            self.inventory.reserve(writer, hold.show, hold.seats, write_sale, held=True)
+        except BaseException:
+            self.inventory.release(hold.show, hold.seats)
+            self._release_leases(hold)
+            raise
+        return hold
+
+    def evict_expired(self):
+        """Release every hold whose TTL has passed. Returns how many were evicted."""
+        now = self.clock()
+        expired = []
+        with self._lock:
+            while self._expiry and self._expiry[0][0] <= now:
+                _, _, hold_id = heapq.heappop(self._expiry)
+                hold = self._holds.pop(hold_id, None)
+                if hold is not None:
+                    expired.append(hold)
+        for hold in expired:
+            self.inventory.release(hold.show, hold.seats)
+            self._release_leases(hold)
+        return len(expired)
+
+    def purge_leases(self, now=None):
+        """Delete the sold and expired leases of shows that started purge_after seconds ago.
+
+        Returns how many were deleted.
+        """
+        if self.leases is None or self.purge_after is None:
+            return 0
+        # Lease expiry and show times are wall-clock time, unlike self.clock
+        return self.leases.purge((time.time() if now is None else now) - self.purge_after)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._holds)
+
+    def start(self, interval=SWEEP_INTERVAL):
+        """Run evict_expired() every `interval` seconds, and purge_leases() hourly, on a daemon thread."""
+        if self._sweeper is not None:
+            return
+
+        def sweep():
+            purged_at = time.monotonic()
+            while True:
+                time.sleep(interval)
+                self.evict_expired()
+                if time.monotonic() - purged_at >= LEASE_PURGE_INTERVAL:
+                    purged_at = time.monotonic()
+                    self.purge_leases()
+
+        self._sweeper = threading.Thread(target=sweep, name='seat-hold-sweeper', daemon=True)
+        self._sweeper.start()
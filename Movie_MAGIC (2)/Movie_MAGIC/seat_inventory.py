@@ -0,0 +1,406 @@
+"""Per-show seat inventory backed by a bitmap.
+
+Every show gets one bit per seat of the auditorium (the 10x8 grid drawn by
+seating.html by default), so "is A1 taken?" is a single bit test instead of
+splitting every booking row. Sold seats are also written to the
+booking_seats table, whose (show_id, seat) primary key is the last line of
+defence when more than one process sells seats, and which is used to
+rebuild the bitmaps on startup.
+"""
+import itertools
+import sqlite3
+import threading
+
+
+class SeatUnavailable(Exception):
+    """Raised when some of the requested seats are already taken."""
+
+    def __init__(self, seats):
+        super().__init__(f"Seats not available: {', '.join(seats)}")
+        self.seats = seats
+
+
+class SeatLayout:
+    """Rows of equally sized seat rows, split into price tiers by row."""
+
+    def __init__(self, rows, seats_per_row, tiers):
+        self.rows = rows
+        self.seats_per_row = seats_per_row
+        # tiers: [(name, first_row, last_row), ...]
+        self.tiers = tiers
+        self.capacity = len(rows) * seats_per_row
+        self._row_index = {row: i for i, row in enumerate(rows)}
+
+    def index(self, seat):
+        """Bit position of a seat label such as 'A1' or 'A1:premium'."""
+        label = seat.split(':')[0].strip().upper()
+        row, number = label[:1], label[1:]
+        if row not in self._row_index or not number.isdigit():
+            raise ValueError(f"Invalid seat: {seat}")
+        col = int(number) - 1
+        if not 0 <= col < self.seats_per_row:
+            raise ValueError(f"Invalid seat: {seat}")
+        return self._row_index[row] * self.seats_per_row + col
+
+    def label(self, index):
+        row, col = divmod(index, self.seats_per_row)
+        return f"{self.rows[row]}{col + 1}"
+
+    def tier_of(self, seat):
+        row = self.rows[self.index(seat) // self.seats_per_row]
+        for name, first, last in self.tiers:
+            if self._row_index[first] <= self._row_index[row] <= self._row_index[last]:
+                return name
+        return None
+
+    def row_order(self, tier, preference='middle'):
+        """Row numbers of `tier`, best first.
+
+        preference is 'front' (first rows first), 'back', 'middle' (rows
+        nearest the middle of the tier first) or an explicit string of row
+        letters such as 'DCE'; rows it leaves out follow in 'middle' order.
+        """
+        for name, first, last in self.tiers:
+            if name == tier:
+                rows = list(range(self._row_index[first], self._row_index[last] + 1))
+                break
+        else:
+            raise ValueError(f"Unknown seat tier: {tier}")
+        middle = sorted(rows, key=lambda row: (abs(row - (rows[0] + rows[-1]) / 2), row))
+        if preference == 'front':
+            return rows
+        if preference == 'back':
+            return rows[::-1]
+        if preference == 'middle':
+            return middle
+        preferred = [self._row_index[row] for row in preference.upper()
+                     if row in self._row_index and self._row_index[row] in rows]
+        return list(dict.fromkeys(preferred + middle))
+
+
+# The grid drawn by seating.html: premium rows A-E, gold rows F-J, 8 seats each
+DEFAULT_LAYOUT = SeatLayout('ABCDEFGHIJ', 8, [('premium', 'A', 'E'), ('gold', 'F', 'J')])
+
+
+def parse_seats(layout, seats):
+    """Normalise seat labels, dropping duplicates; raises ValueError on bad labels."""
+    labels = []
+    seen = set()
+    for seat in seats:
+        index = layout.index(seat)
+        if index not in seen:
+            seen.add(index)
+            labels.append(layout.label(index))
+    return labels
+
+
+class Sale:
+    """Seats being sold by SeatInventory.reserve(); the caller sets booking_id."""
+
+    def __init__(self, show, seats):
+        self.show = show
+        self.seats = seats
+        self.booking_id = None
+
+
+# allocate() would rather seat a party this many seats off the middle of a
+# row than one row further down the preference order
+ROW_WEIGHT = 4
+
+# Bitmap versions; never reused, even when load() replaces a show's bitmaps
+_versions = itertools.count()
+
+
+class _ShowSeats:
+    """Bitmaps of one show: seats sold (persisted) and seats held (memory only)."""
+
+    def __init__(self, capacity):
+        self.sold = bytearray((capacity + 7) // 8)
+        self.held = bytearray((capacity + 7) // 8)
+        # Changed whenever either bitmap changes (see SeatInventory.version())
+        self.version = next(_versions)
+        # Free-run index for allocate(), built on first use: per row, a bit
+        # mask of free seats and the longest run of them
+        self.free_rows = None
+        self.longest_runs = None
+        self.lock = threading.Lock()
+
+
+def _runs_of(mask, count):
+    """Bit i set where seats i..i+count-1 are all set in `mask`."""
+    for _ in range(count - 1):
+        mask &= mask >> 1
+    return mask
+
+
+def _longest_run(mask):
+    length = 0
+    while mask:
+        mask &= mask >> 1
+        length += 1
+    return length
+
+
+def _nearest(starts, ideal):
+    """The set bit of `starts` nearest to position `ideal` (a lower one on a tie)."""
+    below = starts & ((2 << ideal) - 1)
+    above = starts >> (ideal + 1)
+    best_below = below.bit_length() - 1 if below else None
+    best_above = ideal + (above & -above).bit_length() if above else None
+    if best_above is None or (best_below is not None and ideal - best_below <= best_above - ideal):
+        return best_below
+    return best_above
+
+
+def _test(bitmap, index):
+    return bitmap[index >> 3] & (1 << (index & 7))
+
+
+def _set(bitmap, index):
+    bitmap[index >> 3] |= 1 << (index & 7)
+
+
+def _clear(bitmap, index):
+    bitmap[index >> 3] &= ~(1 << (index & 7)) & 0xFF
+
+
+class SeatInventory:
+    """In-memory seat bitmaps for every show, kept in step with booking_seats.
+
+    A seat is unavailable when it is either sold or held. Holds live only in
+    memory (see seat_holds.py); sales are persisted.
+
+    Callbacks registered with on_change() are called with the show and a
+    {seat: 'held' | 'sold' | 'free'} dict after every change, while the
+    show is still locked so they see changes in order; keep them quick.
+    """
+
+    def __init__(self, layout=DEFAULT_LAYOUT):
+        self.layout = layout
+        self._shows = {}
+        self._lock = threading.Lock()
+        self._listeners = []
+        # Optional sold_elsewhere(show) -> seat labels sold outside this
+        # booking_seats table (e.g. by instances on other databases, see
+        # aws_backend.AWSBackend.sold_seats); refresh() counts them as sold
+        self.sold_elsewhere = None
+
+    def on_change(self, callback):
+        self._listeners.append(callback)
+        return callback
+
+    def _changed(self, show, state, changes):
+        state.version = next(_versions)
+        if state.free_rows is not None:
+            for row in {self.layout.index(seat) // self.layout.seats_per_row for seat in changes}:
+                self._index_row(state, row)
+        for callback in self._listeners:
+            callback(show, changes)
+
+    def _show(self, show):
+        state = self._shows.get(show)
+        if state is None:
+            with self._lock:
+                state = self._shows.get(show)
+                if state is None:
+                    state = self._shows[show] = _ShowSeats(self.layout.capacity)
+        return state
+
+    def is_available(self, show, seat):
+        state = self._show(show)
+        index = self.layout.index(seat)
+        return not (_test(state.sold, index) or _test(state.held, index))
+
+    def version(self, show):
+        """A number that changes whenever a seat of `show` is sold, held or released."""
+        return self._show(show).version
+
+    def snapshot(self, show):
+        """(version, bitmap of sold or held seats) for a show."""
+        state = self._show(show)
+        with state.lock:
+            return state.version, bytes(sold | held for sold, held in zip(state.sold, state.held))
+
+    def taken(self, show):
+        """Labels of all sold seats for a show, in seat order."""
+        sold = self._show(show).sold
+        return [self.layout.label(i) for i in range(self.layout.capacity) if _test(sold, i)]
+
+    def unavailable(self, show, seats, include_held=True):
+        state = self._show(show)
+        result = []
+        for seat in seats:
+            index = self.layout.index(seat)
+            if _test(state.sold, index) or (include_held and _test(state.held, index)):
+                result.append(seat)
+        return result
+
+    def hold(self, show, seats):
+        """Mark `seats` as held, all or nothing. Returns the normalised labels."""
+        seats = parse_seats(self.layout, seats)
+        state = self._show(show)
+        with state.lock:
+            taken = self.unavailable(show, seats)
+            if taken:
+                raise SeatUnavailable(taken)
+            for seat in seats:
+                _set(state.held, self.layout.index(seat))
+            self._changed(show, state, dict.fromkeys(seats, 'held'))
+        return seats
+
+    def release(self, show, seats):
+        """Drop the hold on `seats` (sold seats are left alone)."""
+        state = self._show(show)
+        with state.lock:
+            freed = {}
+            for seat in parse_seats(self.layout, seats):
+                index = self.layout.index(seat)
+                _clear(state.held, index)
+                if not _test(state.sold, index):
+                    freed[seat] = 'free'
+            self._changed(show, state, freed)
+
+    def _index_row(self, state, row):
+        mask = 0
+        base = row * self.layout.seats_per_row
+        for col in range(self.layout.seats_per_row):
+            if not (_test(state.sold, base + col) or _test(state.held, base + col)):
+                mask |= 1 << col
+        state.free_rows[row] = mask
+        state.longest_runs[row] = _longest_run(mask)
+
+    def allocate(self, show, count, rows):
+        """Hold the best block of `count` adjacent free seats in one of `rows`.
+
+        rows are row numbers, best first (see SeatLayout.row_order()). A
+        block scores ROW_WEIGHT for each place its row is down that list
+        plus one for each seat it is off the middle of the row; the lowest
+        score wins, so the hall fills outwards from the middle of the best
+        row. Returns the held seat labels, or None if no row has room.
+
+        Rows without a long enough free run are skipped on the index, and
+        the best block of a row is found with a few integer operations, so
+        a request costs about one step per row whatever the hall size.
+        """
+        seats_per_row = self.layout.seats_per_row
+        if not 0 < count <= seats_per_row:
+            raise ValueError(f"Can't seat {count} together in rows of {seats_per_row}")
+        state = self._show(show)
+        with state.lock:
+            if state.free_rows is None:
+                state.free_rows = [0] * len(self.layout.rows)
+                state.longest_runs = [0] * len(self.layout.rows)
+                for row in range(len(self.layout.rows)):
+                    self._index_row(state, row)
+            ideal = (seats_per_row - count) // 2
+            best = None
+            for rank, row in enumerate(rows):
+                if best is not None and rank * ROW_WEIGHT >= best[0]:
+                    break
+                if state.longest_runs[row] < count:
+                    continue
+                start = _nearest(_runs_of(state.free_rows[row], count), ideal)
+                score = rank * ROW_WEIGHT + abs(start - ideal)
+                if best is None or score < best[0]:
+                    best = (score, row, start)
+            if best is None:
+                return None
+            _, row, start = best
+            seats = [self.layout.label(row * seats_per_row + col) for col in range(start, start + count)]
+            for col in range(start, start + count):
+                _set(state.held, row * seats_per_row + col)
+            self._changed(show, state, dict.fromkeys(seats, 'held'))
+            return seats
+
+    def reserve(self, writer, show, seats, write, held=False):
+        """Sell `seats` for `show`, all or nothing, and return the Sale.
+
+        write(conn, sale) inserts the booking and sets sale.booking_id; it
+        runs with the booking_seats rows in one transaction submitted to
+        `writer` (see booking_writer.py), possibly alongside other bookings:
+
+            def write(conn, sale):
+                sale.booking_id = booking_store.insert_booking(conn, ...)
+
+            sale = inventory.reserve(writer, show_id, seats, write)
+
+        Pass held=True when the caller already holds the seats. Raises
+        SeatUnavailable if any seat is already sold (or held by somebody
+        else); the bitmaps only change once the transaction has committed.
+        Two sales of one seat that race past the bitmap check end up in the
+        same or consecutive transactions, where the booking_seats primary
+        key turns the second one away.
+        """
+        seats = parse_seats(self.layout, seats)
+        state = self._show(show)
+        with state.lock:
+            taken = self.unavailable(show, seats, include_held=not held)
+        if taken:
+            raise SeatUnavailable(taken)
+
+        def work(conn):
+            sale = Sale(show, seats)
+            write(conn, sale)
+            if sale.booking_id is None:
+                raise ValueError("reserve() needs sale.booking_id to be set")
+            try:
+                conn.executemany("INSERT INTO booking_seats (show_id, seat, booking_id, tier) VALUES (?, ?, ?, ?)",
+                                 [(show, seat, sale.booking_id, self.layout.tier_of(seat)) for seat in seats])
+            except sqlite3.IntegrityError:
+                raise SeatUnavailable(seats) from None
+            return sale
+
+        try:
+            sale = writer.submit(work)
+        except SeatUnavailable:
+            # Sold by another process or an earlier booking of the same
+            # group, both committed by now; catch up from the table
+            with writer.pool.connection() as conn:
+                self.refresh(conn, show)
+            raise SeatUnavailable(self.unavailable(show, seats, include_held=False) or seats) from None
+        with state.lock:
+            for seat in seats:
+                index = self.layout.index(seat)
+                _set(state.sold, index)
+                _clear(state.held, index)
+            self._changed(show, state, dict.fromkeys(seats, 'sold'))
+        return sale
+
+    def refresh(self, conn, show):
+        """Re-read the sold seats of `show` from booking_seats, e.g. to see other processes' sales."""
+        # Read before locking the show, as sold_elsewhere may be a network call
+        elsewhere = self.sold_elsewhere(show) if self.sold_elsewhere is not None else ()
+        state = self._show(show)
+        with state.lock:
+            self._refresh(conn, show, elsewhere)
+
+    def _refresh(self, conn, show, elsewhere=()):
+        state = self._show(show)
+        sold = bytearray(len(state.sold))
+        for (seat,) in conn.execute("SELECT seat FROM booking_seats WHERE show_id = ?", (show,)):
+            _set(sold, self.layout.index(seat))
+        for seat in elsewhere:
+            try:
+                _set(sold, self.layout.index(seat))
+            except ValueError:
+                # Sold on an instance with another seat layout
+                pass
+        if sold != state.sold:
+            changes = {}
+            for index in range(self.layout.capacity):
+                now_sold = _test(sold, index)
+                if bool(now_sold) != bool(_test(state.sold, index)):
+                    changes[self.layout.label(index)] = 'sold' if now_sold else \
+                        'held' if _test(state.held, index) else 'free'
+            state.sold[:] = sold
+            self._changed(show, state, changes)
+
+    def load(self, conn):
+        """Rebuild every sold bitmap from booking_seats. Holds are dropped."""
+        with self._lock:
+            self._shows.clear()
+        # New _ShowSeats, so the free-run indexes are rebuilt on first use
+        for show, seat in conn.execute("SELECT show_id, seat FROM booking_seats"):
+            _set(self._show(show).sold, self.layout.index(seat))
+        for state in list(self._shows.values()):
+            state.version = next(_versions)
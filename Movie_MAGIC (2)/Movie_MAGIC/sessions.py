@@ -0,0 +1,241 @@
+"""Server-side sessions: the cookie carries only a random session id.
+
+Flask's default session is the whole dict, serialized, signed and sent in
+the cookie on every request and response. Here the data stays on the
+server in a SessionStore and the cookie holds a 256-bit random id (which
+needs no signature: it cannot be guessed, and it carries no data). Session
+data is serialized with marshal, which is compact and fast for the plain
+dicts, lists and strings the apps keep there; anything marshal cannot
+handle falls back to pickle. Only server-written bytes are ever
+deserialized.
+
+Stores:
+    SqliteSessionStore  sessions table (migration 5), shared by all workers
+    MemorySessionStore  in-process LRU with TTL, for a single worker/tests
+
+    sessions.init_app(app, 'sqlite')
+"""
+import marshal
+import pickle
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SecureCookieSession, SessionInterface
+
+import db
+
+# Sessions idle for longer than this are dropped
+SESSION_TTL = 7 * 24 * 3600
+
+# A session that was only read is written back (to extend its expiry) once
+# this much of its TTL has passed
+REFRESH_AFTER = 0.5
+
+_MARSHAL = b'M'
+_PICKLE = b'P'
+
+
+def dumps(data):
+    try:
+        return _MARSHAL + marshal.dumps(data)
+    except ValueError:
+        return _PICKLE + pickle.dumps(data, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def loads(blob):
+    blob = bytes(blob)
+    if blob[:1] == _MARSHAL:
+        return marshal.loads(blob[1:])
+    return pickle.loads(blob[1:])
+
+
+def new_session_id():
+    return secrets.token_urlsafe(32)
+
+
+class ServerSideSession(SecureCookieSession):
+    """Session dict that remembers its id and when it expires."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.sid = sid
+        self.new = sid is None
+        self.expires_at = expires_at
+        self.previous_sid = None
+
+    def regenerate(self):
+        """Move the data to a new id, e.g. on login (prevents session fixation)."""
+        if self.sid is not None and self.previous_sid is None:
+            self.previous_sid = self.sid
+        self.sid = None
+        self.modified = True
+
+
+class MemorySessionStore:
+    """Sessions in a dict, least recently used evicted beyond maxsize."""
+
+    def __init__(self, maxsize=100000, ttl=SESSION_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        """(data, expires_at) for a live session, else None."""
+        with self._lock:
+            entry = self._data.get(sid)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._data[sid]
+                return None
+            self._data.move_to_end(sid)
+        return loads(entry[0]), entry[1]
+
+    def save(self, sid, data, expires_at):
+        blob = dumps(data)
+        with self._lock:
+            self._data[sid] = (blob, expires_at)
+            self._data.move_to_end(sid)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._data.items() if expires_at <= now]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SqliteSessionStore:
+    """Sessions in the sessions table of the app database."""
+
+    # Expired rows are deleted every this many saves
+    PURGE_EVERY = 1000
+
+    def __init__(self, pool, ttl=SESSION_TTL):
+        self.pool = pool
+        self.ttl = ttl
+        self._saves = 0
+
+    def load(self, sid):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?",
+                               (sid, time.time())).fetchone()
+        if row is None:
+            return None
+        return loads(row[0]), row[1]
+
+    def save(self, sid, data, expires_at):
+        with self.pool.connection() as conn, conn:
+            conn.execute("INSERT OR REPLACE INTO sessions (id, data, expires_at) VALUES (?, ?, ?)",
+                         (sid, dumps(data), expires_at))
+        self._saves += 1
+        if self._saves % self.PURGE_EVERY == 0:
+            self.purge_expired()
+
+    def delete(self, sid):
+        with self.pool.connection() as conn, conn:
+            conn.execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def purge_expired(self):
+        with self.pool.connection() as conn, conn:
+            return conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """Flask session interface backed by a MemorySessionStore or SqliteSessionStore."""
+
+    session_class = ServerSideSession
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            found = self.store.load(sid)
+            if found is not None:
+                data, expires_at = found
+                return self.session_class(data, sid, expires_at)
+        return self.session_class()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.previous_sid is not None:
+            self.store.delete(session.previous_sid)
+            session.previous_sid = None
+
+        if not session:
+            if session.sid is not None:
+                self.store.delete(session.sid)
+            if session.modified or session.sid is not None:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        now = time.time()
+        ttl = self.store.ttl
+        if session.accessed:
+            response.vary.add('Cookie')
+        refresh = session.expires_at is None or session.expires_at - now < ttl * (1 - REFRESH_AFTER)
+        if not (session.modified or refresh):
+            return
+
+        new_cookie = session.sid is None
+        if new_cookie:
+            session.sid = new_session_id()
+        session.expires_at = now + ttl
+        self.store.save(session.sid, dict(session), session.expires_at)
+        # The id never changes, so the cookie is only re-sent when it is new
+        # or carries an expiry (permanent sessions)
+        if new_cookie or session.permanent:
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+def regenerate(session):
+    """Give a server-side session a new id; signed-cookie sessions have none."""
+    if isinstance(session, ServerSideSession):
+        session.regenerate()
+
+
+def init_app(app, backend='sqlite', **kwargs):
+    """Use server-side sessions for `app`; backend is 'sqlite', 'memory' or 'cookie'.
+
+    'cookie' keeps Flask's default signed-cookie sessions. The sqlite
+    backend uses the app's connection pool (db.init_app() must come first).
+    """
+    if backend == 'cookie':
+        return None
+    if backend == 'sqlite':
+        store = SqliteSessionStore(db.get_pool(app), **kwargs)
+    elif backend == 'memory':
+        store = MemorySessionStore(**kwargs)
+    else:
+        raise ValueError(f"Unknown session backend: {backend}")
+    app.session_interface = ServerSideSessionInterface(store)
+    return store
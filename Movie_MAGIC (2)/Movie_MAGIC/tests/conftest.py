@@ -0,0 +1,33 @@
+"""pytest fixtures: the app on a scratch database, loaded as benchmarks/_harness.py does.
+
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
+
+# Also puts the app's directory on sys.path
+from _harness import load_app  # noqa: E402
+
+
+@pytest.fixture
+def start_app(tmp_path, monkeypatch):
+    """start_app(name='app', config=None, **kwargs): a started MovieMagic on tmp_path, stopped afterwards.
+
+    kwargs (dynamodb, sns) go to _harness.load_app().
+    """
+    # load_app() changes into tmp_path; monkeypatch changes back afterwards
+    monkeypatch.chdir(tmp_path)
+    started = []
+
+    def start(name='app', config=None, **kwargs):
+        state = load_app(name, str(tmp_path), config=config, **kwargs)
+        started.append(state)
+        return state
+
+    yield start
+    for state in started:
+        state.stop(5)
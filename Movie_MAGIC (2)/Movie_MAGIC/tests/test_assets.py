@@ -0,0 +1,52 @@
+"""assets.build(): CSS backgrounds get their downscaled widths through @media rules."""
+import re
+
+import pytest
+
+import assets
+
+Image = pytest.importorskip('PIL.Image')
+
+CSS = """/* Backgrounds */
+.hero {
+  background:
+    linear-gradient(#000, #fff),
+    url('/static/hero.jpg') center/cover no-repeat;
+}
+
+@media (max-width: 768px) {
+  .panel { background-image: url("../static/hero.jpg"); }
+}
+
+.plain {
+  background-image: url('/static/small.jpg');
+}
+"""
+
+
+def test_backgrounds_get_width_variants(tmp_path):
+    Image.new('RGB', (1000, 500), (200, 40, 40)).save(tmp_path / 'hero.jpg')
+    # No generated width is below it, so nothing to swap in
+    Image.new('RGB', (200, 100), (40, 40, 200)).save(tmp_path / 'small.jpg')
+    (tmp_path / 'style.css').write_text(CSS)
+    manifest = assets.build(str(tmp_path))
+    css = (tmp_path / assets.DIST / manifest['files']['style.css']['path']).read_text()
+    hero = {(variant['width'], variant['type']): variant['path']
+            for variant in manifest['files']['hero.jpg']['variants']}
+
+    rules = re.findall(r"@media \(max-width: (\d+)px\) \{\n  ([^{]+) \{\n(.*?)\n  \}\n\}", css, re.S)
+    assert [(width, selector) for width, selector, _ in rules] == [
+        ('640', '.hero'), ('480', '.hero'), ('240', '.hero'), ('640', '.panel'), ('480', '.panel'), ('240', '.panel')]
+    fallback, image_set = rules[1][2].splitlines()
+    # The gradient layer stays; the image layer gets the 480px variant, and one twice as wide for 2x screens
+    assert fallback == f"    background-image: linear-gradient(#000, #fff), url('{hero[480, 'image/jpeg']}');"
+    assert image_set == (
+        f"    background-image: linear-gradient(#000, #fff), image-set("
+        f"url('{hero[480, 'image/webp']}') type('image/webp') 1x, "
+        f"url('{hero[1000, 'image/webp']}') type('image/webp') 2x, "
+        f"url('{hero[480, 'image/jpeg']}') type('image/jpeg') 1x, "
+        f"url('{manifest['files']['hero.jpg']['path']}') type('image/jpeg') 2x);")
+    assert f"url('{hero[480, 'image/webp']}') type('image/webp') 2x" in rules[2][2]
+    # The narrowest rule comes last, so it wins where several match
+    assert css.index('(max-width: 240px)') > css.index('(max-width: 480px)') > css.index('(max-width: 640px)')
+    assert '.plain {' in css and css.count('.plain') == 1
@@ -0,0 +1,171 @@
+"""DynamoBatchWriter and SnsDigest against aws_fakes: batching and partial failures.
+
+See also benchmarks/bench_aws_batch.py.
+"""
+import logging
+
+import aws_fakes
+import outbox
+from aws_batch import DYNAMODB_BATCH_LIMIT, DynamoBatchWriter, SnsDigest
+
+TABLE = 'movie ticket_booking'
+TOPIC = 'arn:aws:sns:us-east-1:000000000000:test'
+
+
+def bookings(count):
+    return [{'booking_id': f"user{n}@example.com_{n}", 'email': f"user{n}@example.com", 'movie': 'KUBERA',
+             'seats': 'A1,A2', 'total': 500} for n in range(count)]
+
+
+def alerts(count):
+    return [{'subject': 'New Movie Booking Alert', 'message': f"New Booking!\nUser: user{n}@example.com"}
+            for n in range(count)]
+
+
+def writer(dynamodb, **kwargs):
+    # No backoff sleeps between retries
+    return DynamoBatchWriter(dynamodb, TABLE, base_delay=0, **kwargs)
+
+
+class FailingCalls:
+    """A FakeDynamoResource whose batch_write_item calls numbered in `failing` (from 1) raise."""
+
+    def __init__(self, dynamodb, failing):
+        self.dynamodb = dynamodb
+        self.failing = failing
+        self.calls = 0
+
+    def batch_write_item(self, **kwargs):
+        self.calls += 1
+        if self.calls in self.failing:
+            raise aws_fakes.FakeAWSError("ProvisionedThroughputExceededException: slow down")
+        return self.dynamodb.batch_write_item(**kwargs)
+
+
+def test_writes_in_chunks_of_25():
+    dynamodb = aws_fakes.FakeDynamoResource()
+    items = bookings(2 * DYNAMODB_BATCH_LIMIT + 10)
+    batch = writer(dynamodb)
+    assert batch.write(items) == [None] * len(items)
+    # The fake refuses more than 25 requests per call, so three calls carried all 60
+    assert dynamodb.calls == 3
+    assert dynamodb.Table(TABLE).items == {(item['booking_id'],): item for item in items}
+    snapshot = batch.metrics.snapshot()
+    assert (snapshot['items'], snapshot['calls'], snapshot['calls_saved'], snapshot['retries']) == (60, 3, 57, 0)
+
+
+def test_duplicate_keys_send_the_last_item_only():
+    dynamodb = aws_fakes.FakeDynamoResource()
+    first, second = bookings(2)
+    updated = dict(first, seats='B1')
+    assert writer(dynamodb).write([first, second, updated]) == [None, None, None]
+    assert dynamodb.calls == 1
+    assert dynamodb.Table(TABLE).items[(first['booking_id'],)]['seats'] == 'B1'
+
+
+def test_unprocessed_items_are_retried():
+    dynamodb = aws_fakes.FakeDynamoResource(unprocessed_rate=0.3, seed=7)
+    items = bookings(100)
+    batch = writer(dynamodb, max_retries=20)
+    assert batch.write(items) == [None] * len(items)
+    assert len(dynamodb.Table(TABLE).items) == 100
+    retries = batch.metrics.snapshot()['retries']
+    assert retries > 0
+    # Four chunks, plus one call per retry; retries resend only what came back
+    assert dynamodb.calls == 4 + retries
+
+
+def test_items_still_unprocessed_after_retries_fail_alone():
+    dynamodb = aws_fakes.FakeDynamoResource(unprocessed_rate=0.5, seed=3)
+    items = bookings(DYNAMODB_BATCH_LIMIT)
+    errors = writer(dynamodb, max_retries=1).write(items)
+    stored = dynamodb.Table(TABLE).items
+    assert stored and len(stored) < len(items)
+    for item, error in zip(items, errors):
+        if (item['booking_id'],) in stored:
+            assert error is None
+        else:
+            assert error == 'UnprocessedItems after retries'
+
+
+def test_failed_call_fails_only_its_chunk():
+    dynamodb = aws_fakes.FakeDynamoResource()
+    items = bookings(3 * DYNAMODB_BATCH_LIMIT)
+    errors = writer(FailingCalls(dynamodb, {2})).write(items)
+    middle = slice(DYNAMODB_BATCH_LIMIT, 2 * DYNAMODB_BATCH_LIMIT)
+    failure = "FakeAWSError: ProvisionedThroughputExceededException: slow down"
+    assert errors[middle] == [failure] * DYNAMODB_BATCH_LIMIT
+    assert errors[:DYNAMODB_BATCH_LIMIT] + errors[2 * DYNAMODB_BATCH_LIMIT:] == [None] * 2 * DYNAMODB_BATCH_LIMIT
+    assert set(dynamodb.Table(TABLE).items) == {(item['booking_id'],) for item in items if item not in items[middle]}
+
+
+def test_digest_folds_alerts_into_one_publish():
+    sns = aws_fakes.FakeSNS()
+    payloads = alerts(40)
+    assert SnsDigest(sns, TOPIC).send(payloads) == [None] * 40
+    [digest] = sns.messages
+    assert digest['Subject'] == 'Movie Booking Digest (40 bookings)'
+    assert digest['Message'].split('\n\n----\n\n') == [payload['message'] for payload in payloads]
+
+
+def test_single_alert_keeps_its_subject():
+    sns = aws_fakes.FakeSNS()
+    assert SnsDigest(sns, TOPIC).send(alerts(1)) == [None]
+    assert [(message['Subject'], message['Message']) for message in sns.messages] == [
+        ('New Movie Booking Alert', 'New Booking!\nUser: user0@example.com')]
+
+
+def test_digests_split_at_max_bytes_and_fail_per_digest():
+    sns = aws_fakes.FakeSNS()
+    payloads = alerts(30)
+    # Room for about ten messages per digest
+    digest = SnsDigest(sns, TOPIC, max_bytes=10 * (len(payloads[0]['message'].encode()) + 8))
+    original = sns.publish
+    published = []
+
+    def publish(**kwargs):
+        published.append(kwargs)
+        if len(published) == 2:
+            raise aws_fakes.FakeAWSError("Injected failure in Publish")
+        return original(**kwargs)
+
+    sns.publish = publish
+    errors = digest.send(payloads)
+    sizes = [len(kwargs['Message'].split('\n\n----\n\n')) for kwargs in published]
+    assert len(published) >= 3 and sum(sizes) == 30
+    assert all(len(kwargs['Message'].encode()) <= digest.max_bytes for kwargs in published)
+    # Only the messages of the digest that failed are reported as failed
+    first, second = sizes[0], sizes[1]
+    assert errors[:first] == [None] * first
+    assert errors[first:first + second] == ["FakeAWSError: Injected failure in Publish"] * second
+    assert errors[first + second:] == [None] * (30 - first - second)
+
+
+def test_outbox_retries_only_the_failed_part_of_a_batch(start_app):
+    pool = start_app().pool
+    dynamodb = aws_fakes.FakeDynamoResource()
+    failing = FailingCalls(dynamodb, {2})
+    batch = writer(failing)
+    handler = outbox.BatchHandler(lambda payloads: batch.write([payload['item'] for payload in payloads]), 100)
+    worker = outbox.OutboxWorker(pool, {'dynamodb_put': handler}, logging.getLogger(__name__), batch_size=100)
+    items = bookings(2 * DYNAMODB_BATCH_LIMIT)
+    with pool.connection() as conn:
+        for item in items:
+            outbox.enqueue(conn, 'dynamodb_put', {'item': item})
+        conn.commit()
+
+    assert worker.drain_once() == len(items)
+    with pool.connection() as conn:
+        left = conn.execute("SELECT payload, attempts FROM outbox ORDER BY id").fetchall()
+        # Skip the backoff
+        conn.execute("UPDATE outbox SET available_at = 0")
+        conn.commit()
+    # The chunk the failed call carried stays queued; the one that went through is gone
+    assert len(left) == DYNAMODB_BATCH_LIMIT and {attempts for _, attempts in left} == {1}
+    assert len(dynamodb.Table(TABLE).items) == DYNAMODB_BATCH_LIMIT
+
+    assert worker.drain_once() == DYNAMODB_BATCH_LIMIT
+    assert failing.calls == 3
+    assert dynamodb.Table(TABLE).items == {(item['booking_id'],): item for item in items}
+    with pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 0
@@ -0,0 +1,154 @@
+"""Fencing tokens: a holder whose lease was taken over can't sell its seats (see also benchmarks/stress_leases.py).
+
+Also purging the leases of past shows.
+"""
+import time
+
+import pytest
+
+import aws_fakes
+import booking_store
+import leases
+from seat_holds import HoldManager
+from seat_inventory import SeatInventory, SeatUnavailable
+
+MOVIE = 'KUBERA'
+TTL = 30
+
+
+class Clock:
+    """Wall-clock time for the leases, moved on by hand."""
+
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'dynamodb'])
+def instances(request, start_app):
+    """The app, leases of two instances on one backend as [(leases, show id)], and the clock they run on.
+
+    Memory and DynamoDB leases stand for instances with databases of their
+    own, which gave the show different ids; SQLite leases share a database.
+    """
+    state = start_app()
+    with state.pool.connection() as conn:
+        show = booking_store.show_id_for(conn, MOVIE)
+        conn.commit()
+    clock = Clock()
+    # The second instance's database numbered the show differently
+    other = show + 100
+    keys = {show: booking_store.show_key(MOVIE, ''), other: booking_store.show_key(MOVIE, '')}
+    if request.param == 'memory':
+        shared = leases.MemoryLeases(clock)
+        return state, [(shared.sharing(keys.__getitem__), show), (shared.sharing(keys.__getitem__), other)], clock
+    if request.param == 'sqlite':
+        return state, [(leases.SqliteLeases(state.pool, clock), show),
+                       (leases.SqliteLeases(state.pool, clock), show)], clock
+    dynamodb = aws_fakes.FakeDynamoResource()
+    table = leases.create_table(dynamodb, leases.DEFAULTS['SEAT_LEASES_TABLE'])
+    return state, [(leases.DynamoLeases(lambda: table, keys.__getitem__, clock), show),
+                   (leases.DynamoLeases(lambda: table, keys.__getitem__, clock), other)], clock
+
+
+def test_taken_over_lease_is_fenced(instances):
+    _, [(first, first_show), (second, second_show)], clock = instances
+    paused = first.acquire(first_show, ['A1', 'A2'], 'paused', TTL)
+    with pytest.raises(SeatUnavailable):
+        second.acquire(second_show, ['A2'], 'other', TTL)
+
+    # The first holder stalls past its TTL, and the other instance leases A2
+    clock.now += TTL + 1
+    current = second.acquire(second_show, ['A2'], 'other', TTL)
+    assert current['A2'] > paused['A2']
+
+    with pytest.raises(SeatUnavailable) as raised:
+        first.fence(first_show, paused)
+    assert raised.value.seats == ['A2']
+    # Neither seat was sold: A1 is free for anybody once its lease has run out
+    assert 'A1' in first.acquire(first_show, ['A1'], 'late', TTL)
+
+    second.fence(second_show, current)
+    with pytest.raises(SeatUnavailable):
+        first.acquire(first_show, ['A2'], 'late', TTL)
+
+
+def test_stale_release_leaves_the_new_lease_alone(instances):
+    _, [(first, first_show), (second, second_show)], clock = instances
+    paused = first.acquire(first_show, ['B1'], 'paused', TTL)
+    clock.now += TTL + 1
+    current = second.acquire(second_show, ['B1'], 'other', TTL)
+    first.release(first_show, paused)
+    with pytest.raises(SeatUnavailable):
+        first.acquire(first_show, ['B1'], 'late', TTL)
+    second.fence(second_show, current)
+
+
+def test_confirming_a_taken_over_hold_sells_nothing(instances):
+    state, [(first, show), (second, second_show)], clock = instances
+    inventory = SeatInventory()
+    with state.pool.connection() as conn:
+        inventory.load(conn)
+    holds = HoldManager(inventory, ttl=TTL, leases=first)
+    hold = holds.place(show, MOVIE, ['C1', 'C2'], 'paused@example.com', 500)
+
+    # Paused past its lease; this instance's own clock hasn't seen the hold expire
+    clock.now += TTL + 1
+    current = second.acquire(second_show, ['C1'], 'other', TTL)
+
+    written = []
+
+    def write(conn, hold):
+        written.append(hold)
+        hold.booking_id = booking_store.insert_booking(conn, hold.email, hold.show, hold.movie, hold.seats,
+                                                       hold.total, 'UPI')
+
+    with pytest.raises(SeatUnavailable):
+        holds.confirm(state.writer, hold.hold_id, write)
+    assert written == []
+    with state.pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM bookings").fetchone()[0] == 0
+        assert conn.execute("SELECT COUNT(*) FROM booking_seats").fetchone()[0] == 0
+    # The seats are let go here, and the other instance's lease still holds
+    assert inventory.unavailable(show, ['C1', 'C2']) == []
+    assert len(holds) == 0
+    second.fence(second_show, current)
+
+
+@pytest.mark.parametrize('backend', ['memory', 'sqlite'])
+def test_purge_deletes_sold_and_expired_leases_of_past_shows(start_app, monkeypatch, backend):
+    # One lease per purge transaction, so the batches are exercised too
+    monkeypatch.setattr(leases, 'PURGE_BATCH_SIZE', 1)
+    state = start_app()
+    clock = Clock()
+    clock.now = now = time.time()
+    day = 24 * 60 * 60
+    with state.pool.connection() as conn:
+        shows = {name: booking_store.show_id_for(conn, MOVIE, starts_at) for name, starts_at in (
+            ('past', leases._starts_at(now - 2 * day)), ('recent', leases._starts_at(now - 60 * 60)),
+            ('default', ''))}
+        conn.commit()
+    if backend == 'memory':
+        backend_leases = leases.MemoryLeases(clock, booking_store.ShowKeys(state.pool))
+    else:
+        backend_leases = leases.SqliteLeases(state.pool, clock)
+    for show in shows.values():
+        backend_leases.fence(show, backend_leases.acquire(show, ['A1'], 'sold', TTL))
+        backend_leases.release(show, backend_leases.acquire(show, ['A2'], 'released', TTL))
+        backend_leases.acquire(show, ['A3'], 'live', TTL)
+    holds = HoldManager(SeatInventory(), leases=backend_leases, purge_after=day)
+
+    assert holds.purge_leases(now) == 2
+    assert holds.purge_leases(now) == 0
+    # The past show's sold and released leases are gone; its live one stays
+    assert backend_leases.acquire(shows['past'], ['A1', 'A2'], 'new', TTL) == {'A1': 1, 'A2': 1}
+    with pytest.raises(SeatUnavailable):
+        backend_leases.acquire(shows['past'], ['A3'], 'new', TTL)
+    # Shows that started less than purge_after ago, and the default show, keep theirs
+    for name in ('recent', 'default'):
+        with pytest.raises(SeatUnavailable):
+            backend_leases.acquire(shows[name], ['A1'], 'new', TTL)
+        # The released lease's row is still there, so its token goes on from 1
+        assert backend_leases.acquire(shows[name], ['A2'], 'new', TTL) == {'A2': 2}
@@ -0,0 +1,181 @@
+"""The outbox against aws_fakes: delivery, retries with backoff, dead letters and stale claims."""
+import logging
+import time
+
+import pytest
+
+import aws_fakes
+import outbox
+
+TOPIC = 'arn:aws:sns:us-east-1:000000000000:test'
+
+
+@pytest.fixture
+def pool(start_app):
+    # The 'sqlite' app: its migrations create the outbox table, and it runs no OutboxWorker of its own
+    return start_app().pool
+
+
+def publisher(sns):
+    def publish(payload):
+        sns.publish(TopicArn=TOPIC, Message=payload['message'], Subject=payload.get('subject'))
+    return publish
+
+
+def worker(pool, sns, **kwargs):
+    """An OutboxWorker that is never started: tests drive it with drain_once()."""
+    return outbox.OutboxWorker(pool, {'sns_publish': publisher(sns)}, logging.getLogger(__name__), **kwargs)
+
+
+def enqueue(pool, *messages):
+    with pool.connection() as conn:
+        for message in messages:
+            outbox.enqueue(conn, 'sns_publish', {'message': message})
+        conn.commit()
+
+
+def rows(pool):
+    with pool.connection() as conn:
+        return conn.execute("SELECT id, status, attempts, last_error, available_at, claimed_by FROM outbox "
+                            "ORDER BY id").fetchall()
+
+
+def make_due(pool):
+    """Skip the backoff, as if its time had passed."""
+    with pool.connection() as conn:
+        conn.execute("UPDATE outbox SET available_at = 0")
+        conn.commit()
+
+
+def test_delivers_and_deletes(pool):
+    sns = aws_fakes.FakeSNS()
+    enqueue(pool, 'one', 'two', 'three')
+    assert worker(pool, sns).drain_once() == 3
+    assert sorted(message['Message'] for message in sns.messages) == ['one', 'three', 'two']
+    assert rows(pool) == []
+
+
+def test_failure_is_retried_after_backoff(pool):
+    sns = aws_fakes.FakeSNS(failure_rate=1.0)
+    delivery = worker(pool, sns, base_delay=10)
+    enqueue(pool, 'hello')
+    before = time.time()
+    assert delivery.drain_once() == 1
+    [(_, status, attempts, error, available_at, claimed_by)] = rows(pool)
+    assert (status, attempts, claimed_by) == (outbox.PENDING, 1, None)
+    assert 'Injected failure' in error
+    # First retry after base_delay, with up to half of it taken off as jitter
+    assert before + 5 <= available_at <= time.time() + 10
+    # Not due yet
+    assert delivery.drain_once() == 0
+
+    sns.failure_rate = 0.0
+    make_due(pool)
+    assert delivery.drain_once() == 1
+    assert [message['Message'] for message in sns.messages] == ['hello']
+    assert rows(pool) == []
+    assert (delivery.delivered, delivery.failed) == (1, 1)
+
+
+def test_backoff_doubles_up_to_max_delay(pool):
+    delivery = worker(pool, aws_fakes.FakeSNS(), base_delay=0.5, max_delay=60)
+    for attempts in range(1, 12):
+        full = min(60, 0.5 * 2 ** (attempts - 1))
+        for _ in range(20):
+            assert full / 2 <= delivery._backoff(attempts) <= full
+
+
+def test_dead_letter_after_max_attempts(pool, caplog):
+    sns = aws_fakes.FakeSNS(failure_rate=1.0)
+    delivery = worker(pool, sns, max_attempts=3)
+    enqueue(pool, 'doomed')
+    for _ in range(3):
+        make_due(pool)
+        assert delivery.drain_once() == 1
+    [(message_id, status, attempts, _, _, _)] = rows(pool)
+    assert (status, attempts) == (outbox.DEAD, 3)
+    # Dead letters stay put, however due they are
+    make_due(pool)
+    assert delivery.drain_once() == 0
+    with pool.connection() as conn:
+        [dead] = outbox.dead_letters(conn)
+    assert (dead['id'], dead['payload'], dead['attempts']) == (message_id, {'message': 'doomed'}, 3)
+    assert 'Injected failure' in dead['error']
+    assert f"Outbox message {message_id} moved to dead letters" in caplog.text
+
+    # Requeued with fresh attempts, it goes out once SNS is back
+    with pool.connection() as conn:
+        outbox.requeue_dead(conn)
+    sns.failure_rate = 0.0
+    assert delivery.drain_once() == 1
+    assert [message['Message'] for message in sns.messages] == ['doomed']
+    assert rows(pool) == []
+
+
+def test_stale_claim_is_delivered_again(pool):
+    sns = aws_fakes.FakeSNS()
+    crashed = worker(pool, sns, claim_timeout=300)
+    survivor = worker(pool, sns, claim_timeout=300)
+    enqueue(pool, 'orphan')
+    # Claimed, then the process died before delivering it
+    [(_, [(message_id, *_)])] = crashed._claim()
+    [(_, status, _, _, _, claimed_by)] = rows(pool)
+    assert (status, claimed_by) == (outbox.INFLIGHT, crashed.owner)
+
+    # A live sibling's claim is left alone...
+    assert survivor.drain_once() == 0
+    assert sns.messages == []
+    # ...until claim_timeout has passed
+    with pool.connection() as conn:
+        conn.execute("UPDATE outbox SET claimed_at = claimed_at - 301")
+        conn.commit()
+    assert survivor.drain_once() == 1
+    assert [message['Message'] for message in sns.messages] == ['orphan']
+    assert rows(pool) == []
+
+    # The first claimant's late failure report changes nothing
+    crashed._record([(message_id, 1, 'TimeoutError: too late')])
+    assert rows(pool) == []
+
+
+def test_late_failure_does_not_touch_a_reclaimed_row(pool):
+    sns = aws_fakes.FakeSNS()
+    slow = worker(pool, sns, claim_timeout=300)
+    enqueue(pool, 'contested')
+    [(_, [(message_id, *_)])] = slow._claim()
+    with pool.connection() as conn:
+        conn.execute("UPDATE outbox SET claimed_at = claimed_at - 301")
+        conn.commit()
+    other = worker(pool, sns, claim_timeout=300)
+    other._claim()
+    # The row is the other worker's now; the slow one's failure must not put it back in the queue
+    slow._record([(message_id, 1, 'TimeoutError: slow')])
+    [(_, status, attempts, error, _, claimed_by)] = rows(pool)
+    assert (status, attempts, error, claimed_by) == (outbox.INFLIGHT, 0, None, other.owner)
+
+
+def test_bookings_reach_dynamodb_and_sns(start_app):
+    dynamodb, sns = aws_fakes.FakeDynamoResource(), aws_fakes.FakeSNS()
+    # Alert digests go out at once rather than after a minute
+    state = start_app('AWS_app', dynamodb=dynamodb, sns=sns, config={'SNS_DIGEST_MAX_WAIT': 0,
+                                                                     'ADMISSION_CONTROL': False})
+    client = state.app.test_client()
+    client.post('/register', data={'name': 'test', 'email': 'fan@example.com', 'password': 'pw'})
+    client.post('/login', data={'email': 'fan@example.com', 'password': 'pw'})
+    assert '/payment/' in client.post('/seating/KUBERA', data={'seats': 'A1:premium,A2:premium'}).location
+    response = client.post('/process_payment', data={'movie': 'KUBERA', 'seats': 'A1,A2', 'total': '500',
+                                                     'payment_method': 'UPI', 'upi_id': 'fan@upi'})
+    assert '/tickets' in response.location
+
+    table = dynamodb.Table(state.app.config['BOOKINGS_TABLE'])
+    deadline = time.time() + 10
+    while (not table.items or len(sns.messages) < 2) and time.time() < deadline:
+        state.backend.outbox_worker.notify()
+        time.sleep(0.05)
+    [item] = table.items.values()
+    assert (item['email'], item['movie'], item['seats'], item['show_key']) == (
+        'fan@example.com', 'KUBERA', 'A1,A2', 'KUBERA@')
+    assert sorted(message['Subject'] for message in sns.messages) == ['Movie Booking Confirmation',
+                                                                      'New Movie Booking Alert']
+    with state.pool.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0] == 0
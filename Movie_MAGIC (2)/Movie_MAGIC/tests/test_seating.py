@@ -0,0 +1,83 @@
+"""Concurrent SeatInventory.reserve() calls never sell a seat twice (see also benchmarks/stress_seating.py)."""
+import random
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import booking_store
+from seat_inventory import SeatInventory, SeatUnavailable
+
+MOVIE = 'KUBERA'
+ATTEMPTS = 400
+THREADS = 32
+# Every attempt wants some of these, so nearly all of them collide
+HOT_SEATS = ['A1', 'A2', 'A3', 'A4', 'A5', 'A6', 'A7', 'A8', 'B1', 'B2', 'B3', 'B4']
+
+
+def sold_per_seat(conn, show):
+    """booking_seats and the legacy bookings.seats column, as {seat: times sold}."""
+    rows = Counter(seat for (seat,) in conn.execute("SELECT seat FROM booking_seats WHERE show_id = ?", (show,)))
+    legacy = Counter(seat.split(':')[0] for (seats,) in conn.execute("SELECT seats FROM bookings WHERE show_id = ?",
+                                                                     (show,))
+                     for seat in seats.split(','))
+    return rows, legacy
+
+
+@pytest.mark.parametrize('group_commit', [True, False], ids=['group-commit', 'direct'])
+@pytest.mark.parametrize('inventories', [1, 2], ids=['one-inventory', 'two-inventories'])
+def test_concurrent_reserve_never_oversells(start_app, group_commit, inventories):
+    state = start_app(config={'BOOKING_GROUP_COMMIT': group_commit})
+    with state.pool.connection() as conn:
+        show = booking_store.show_id_for(conn, MOVIE)
+        conn.commit()
+    # A second inventory on the same database stands in for another worker
+    # process: its bitmaps never see this one's sales, so only the
+    # booking_seats primary key can turn its duplicates away
+    shared = [state.inventory]
+    for _ in range(inventories - 1):
+        other = SeatInventory()
+        with state.pool.connection() as conn:
+            other.load(conn)
+        shared.append(other)
+
+    sales = []
+    rejected = Counter()
+    lock = threading.Lock()
+
+    def attempt(n):
+        rng = random.Random(n)
+        seats = rng.sample(HOT_SEATS, rng.randint(1, 3))
+
+        def write(conn, sale):
+            sale.booking_id = booking_store.insert_booking(conn, f"user{n}@example.com", show, MOVIE, sale.seats,
+                                                           250 * len(sale.seats), 'UPI')
+
+        try:
+            sale = shared[n % inventories].reserve(state.writer, show, seats, write)
+        except SeatUnavailable:
+            with lock:
+                rejected['unavailable'] += 1
+            return
+        with lock:
+            sales.append(sale)
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(attempt, range(ATTEMPTS)))
+
+    sold = Counter(seat for sale in sales for seat in sale.seats)
+    assert sales and rejected['unavailable'], "the attempts should both succeed and collide"
+    assert [seat for seat, n in sold.items() if n > 1] == []
+    assert len(sales) + rejected['unavailable'] == ATTEMPTS
+    with state.pool.connection() as conn:
+        rows, legacy = sold_per_seat(conn, show)
+        bookings = conn.execute("SELECT COUNT(*) FROM bookings WHERE show_id = ?", (show,)).fetchone()[0]
+    assert rows == sold
+    assert legacy == sold
+    # A sale turned away by the primary key leaves no bookings row behind
+    assert bookings == len(sales)
+    for inventory in shared:
+        with state.pool.connection() as conn:
+            inventory.refresh(conn, show)
+        assert set(inventory.unavailable(show, list(sold), include_held=False)) == set(sold)
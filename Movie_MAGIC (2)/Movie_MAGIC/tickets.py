@@ -0,0 +1,340 @@
+"""Downloadable tickets: a QR code (PNG) and a PDF per booking.
+
+Rendering a ticket is ~10-50 ms of pure-Python CPU (qr.py encodes the
+code, the PDF is written by hand below), so it never happens on a request
+thread. Once process_payment has committed a booking, TicketArtifacts
+queues the booking in a pool of TICKET_WORKERS processes ('process': they
+don't share the workers' GIL) or threads, and the ticket page links to
+/bookings/<id>/ticket.pdf, which waits up to TICKET_WAIT seconds for the
+files and otherwise answers 202 with Retry-After.
+
+Files are content-addressed: their name is the sha256 of what is printed
+on them (booking_store.ticket() plus the door code), under TICKET_DIR:
+
+    <TICKET_DIR>/3f/3f9c...e1.pdf
+    <TICKET_DIR>/3f/3f9c...e1.png
+
+so a booking renders once however many workers and requests ask for it,
+files never change (a changed booking gets a new name), and they are
+written to a temporary file and renamed into place, never half-written.
+The door code is an HMAC of the booking id with SECRET_KEY, which is what
+the QR code holds and what the door checks; it also makes the names
+unguessable, so /ticket-files/<sha256>.<pdf|png> needs no session. Those
+are served by init_app()'s WSGI wrapper straight from the open file
+(wsgi.file_wrapper: sendfile under gunicorn), before Flask, with an
+immutable Cache-Control.
+"""
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from flask import abort, send_from_directory
+from werkzeug.http import parse_etags
+from werkzeug.wsgi import wrap_file
+
+import metrics
+import qr
+
+DEFAULTS = {
+    # Where rendered tickets are kept (None: tickets/ in the app's instance folder)
+    'TICKET_DIR': None,
+    # Tickets rendered at once per worker, in a 'process' or 'thread' pool
+    # (0: on the request thread). Every gunicorn worker has a pool of its own,
+    # so keep it small: the box runs workers x TICKET_WORKERS renderers
+    'TICKET_WORKERS': 2,
+    'TICKET_POOL': 'process',
+    # Seconds /bookings/<id>/ticket.<kind> waits for a ticket before answering 202
+    'TICKET_WAIT': 2.0,
+}
+
+# Part of every file name: bump it when the look of a ticket changes
+FORMAT = 1
+
+# Files rendered per ticket, by extension
+KINDS = {'pdf': 'application/pdf', 'png': 'image/png'}
+
+# Names are content hashes, so a file is never replaced; private as they are personal
+IMMUTABLE = 'private, max-age=31536000, immutable'
+
+# How the 'process' pool starts its processes. The app's processes have
+# threads of their own (outbox, holds, catalog, booking writer) and open
+# SQLite connections, and a fork can copy a lock one of them holds, so
+# renderers come from a forkserver, itself started by fork + exec, instead.
+# Like spawned processes they import the main script again, so scripts that
+# run the app keep that under `if __name__ == '__main__':`, as app.py does
+_START_METHOD = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+
+# A6 portrait, in points
+_PAGE_WIDTH, _PAGE_HEIGHT = 298, 420
+
+# Seat labels printed per line of the PDF
+_SEATS_PER_LINE = 12
+
+
+def door_code(secret, booking_id):
+    """What the QR code of `booking_id` holds; only someone with `secret` can make one."""
+    mac = hmac.new(secret.encode(), f"booking:{booking_id}".encode(), hashlib.sha256).hexdigest()
+    return f"MM-{booking_id}-{mac[:16]}"
+
+
+def ticket_key(ticket):
+    """The content hash the files of `ticket` are named by."""
+    return hashlib.sha256(json.dumps([FORMAT, ticket], sort_keys=True).encode()).hexdigest()
+
+
+def file_path(directory, key, kind):
+    return os.path.join(directory, key[:2], f"{key}.{kind}")
+
+
+def _pdf_text(text):
+    text = str(text).encode('cp1252', 'replace')
+    return b'(' + text.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def render_pdf(ticket, matrix):
+    """A one-page PDF of `ticket` with its QR code `matrix` drawn as vector rectangles."""
+    lines = [('F2', 16, 'MOVIE MAGIC'), ('F2', 14, ticket['movie'])]
+    if ticket.get('starts_at'):
+        lines.append(('F1', 11, f"Show: {ticket['starts_at']}"))
+    if ticket.get('screen'):
+        lines.append(('F1', 11, f"Screen: {ticket['screen']}"))
+    seats = ticket['seats']
+    for i in range(0, len(seats), _SEATS_PER_LINE):
+        lines.append(('F1', 11, ('Seats: ' if i == 0 else '           ') + ', '.join(seats[i:i + _SEATS_PER_LINE])))
+    lines.append(('F1', 11, f"Total: Rs. {ticket['total']}"))
+    lines.append(('F1', 9, f"Booking #{ticket['booking_id']}, booked {ticket['booked_at']}"))
+
+    content = [b'BT']
+    y = _PAGE_HEIGHT - 36
+    for font, size, text in lines:
+        content.append(b'/%s %d Tf 1 0 0 1 24 %d Tm %s Tj' % (font.encode(), size, y, _pdf_text(text)))
+        y -= size + 8
+    code_size = 150
+    # The door code under the QR code, for when the scanner can't read it
+    content.append(b'/F1 9 Tf 1 0 0 1 %d 24 Tm %s Tj' % ((_PAGE_WIDTH - code_size) // 2,
+                                                         _pdf_text(ticket['door_code'])))
+    content.append(b'ET')
+
+    # One rectangle per run of dark modules in a row
+    module = code_size / len(matrix)
+    left, bottom = (_PAGE_WIDTH - code_size) / 2, 40
+    for row, modules in enumerate(matrix):
+        y = bottom + (len(matrix) - 1 - row) * module
+        x = 0
+        while x < len(modules):
+            if modules[x]:
+                run = x
+                while run < len(modules) and modules[run]:
+                    run += 1
+                content.append(b'%.2f %.2f %.2f %.2f re' % (left + x * module, y, (run - x) * module, module))
+                x = run
+            else:
+                x += 1
+    content.append(b'f')
+    stream = zlib.compress(b'\n'.join(content), 6)
+
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] /Contents 4 0 R '
+        b'/Resources << /Font << /F1 5 0 R /F2 6 0 R >> >> >>' % (_PAGE_WIDTH, _PAGE_HEIGHT),
+        b'<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream' % (len(stream), stream),
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+        b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    ]
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n%s\nendobj\n' % (number, body)
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def render(directory, ticket):
+    """Write the files of `ticket` under `directory` unless they are there. Runs in the pool."""
+    key = ticket_key(ticket)
+    paths = {kind: file_path(directory, key, kind) for kind in KINDS}
+    if all(os.path.exists(path) for path in paths.values()):
+        return key
+    matrix = qr.encode(ticket['door_code'])
+    _write(paths['png'], qr.png(matrix))
+    _write(paths['pdf'], render_pdf(ticket, matrix))
+    return key
+
+
+class TicketArtifacts:
+    """Renders the ticket files of new bookings in a pool and finds them for the views."""
+
+    def __init__(self, config, instance_path=None):
+        # Absolute, as the pool's processes don't share the app's idea of the cwd
+        self.directory = os.path.abspath(config['TICKET_DIR'] or os.path.join(instance_path, 'tickets'))
+        self.secret = config['SECRET_KEY']
+        self.workers = config['TICKET_WORKERS']
+        self.pool_kind = config['TICKET_POOL']
+        if self.pool_kind not in ('thread', 'process'):
+            raise ValueError(f"Unknown TICKET_POOL: {self.pool_kind}")
+        self._executor = None
+        self._pid = None
+        # Reentrant: a future that is already done runs its callback in submit()
+        self._lock = threading.RLock()
+        # Futures of the keys being rendered, so each is queued once
+        self._pending = {}
+
+    def start(self):
+        """Start the pool, once per process."""
+        with self._lock:
+            if self._pid == os.getpid() or not self.workers:
+                return
+            if self.pool_kind == 'process':
+                context = multiprocessing.get_context(_START_METHOD)
+                if _START_METHOD == 'forkserver':
+                    # Renderers forked from the server start with the module imported
+                    context.set_forkserver_preload(['tickets'])
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='ticket-render')
+            self._pending = {}
+            self._pid = os.getpid()
+
+    def stop(self, timeout=None):
+        """Drop queued tickets and wait for the ones being rendered, so none is left half written."""
+        with self._lock:
+            executor, self._executor, self._pid = self._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def ticket(self, booking):
+        """booking_store.ticket() output with its door code: everything the files show."""
+        return dict(booking, door_code=door_code(self.secret, booking['booking_id']))
+
+    def path(self, key, kind):
+        return file_path(self.directory, key, kind)
+
+    def ready(self, key):
+        return all(os.path.exists(self.path(key, kind)) for kind in KINDS)
+
+    def submit(self, booking):
+        """Queue the files of `booking` unless they exist. Returns (key, future or None)."""
+        ticket = self.ticket(booking)
+        key = ticket_key(ticket)
+        if self.ready(key):
+            return key, None
+        if not self.workers:
+            start = time.perf_counter()
+            render(self.directory, ticket)
+            metrics.TICKET_RENDER_SECONDS.observe(time.perf_counter() - start)
+            return key, None
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self.start()
+            future = self._pending.get(key)
+            if future is None:
+                start = time.perf_counter()
+                future = self._pending[key] = self._executor.submit(render, self.directory, ticket)
+                future.add_done_callback(lambda done: self._rendered(key, done, start))
+        return key, future
+
+    def wait(self, booking, timeout):
+        """The key of `booking`'s files once they are on disk, or None after `timeout` seconds."""
+        key, future = self.submit(booking)
+        if future is not None:
+            try:
+                future.result(timeout)
+            except futures.TimeoutError:
+                return None
+            except Exception:
+                # Logged by _rendered(); the next request queues it again
+                return None
+        return key
+
+    def _rendered(self, key, future, start):
+        with self._lock:
+            self._pending.pop(key, None)
+        if future.cancelled():
+            return
+        if future.exception() is not None:
+            metrics.TICKET_RENDER_ERRORS.inc()
+            error = future.exception()
+            traceback.print_exception(type(error), error, error.__traceback__)
+            return
+        metrics.TICKET_RENDER_SECONDS.observe(time.perf_counter() - start)
+
+
+_PATH = re.compile(r"/ticket-files/([0-9a-f]{64})\.(pdf|png)\Z")
+
+
+class _FileApp:
+    """WSGI wrapper sending rendered ticket files without going through Flask."""
+
+    def __init__(self, wsgi_app, artifacts):
+        self.wsgi_app = wsgi_app
+        self.artifacts = artifacts
+
+    def __call__(self, environ, start_response):
+        match = _PATH.match(environ.get('PATH_INFO', ''))
+        method = environ.get('REQUEST_METHOD')
+        if match is None or method not in ('GET', 'HEAD'):
+            return self.wsgi_app(environ, start_response)
+        key, kind = match.groups()
+        try:
+            f = open(self.artifacts.path(key, kind), 'rb')
+        except OSError:
+            # Flask's view answers the 404
+            return self.wsgi_app(environ, start_response)
+        # Labels the request for metrics, as the Flask view would
+        environ['metrics.route'] = '/ticket-files/<key>.<kind>'
+        headers = [('ETag', f'"{key}"'), ('Cache-Control', IMMUTABLE)]
+        if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and parse_etags(if_none_match).contains(key):
+            f.close()
+            start_response('304 NOT MODIFIED', headers)
+            return []
+        start_response('200 OK', headers + [('Content-Type', KINDS[kind]),
+                                            ('Content-Length', str(os.fstat(f.fileno()).st_size))])
+        if method == 'HEAD':
+            f.close()
+            return []
+        # Handed to the server's wsgi.file_wrapper, which can sendfile() it
+        return wrap_file(environ, f)
+
+
+def init_app(app, artifacts):
+    """Serve /ticket-files/<key>.<kind> from `artifacts`' directory."""
+    app.wsgi_app = _FileApp(app.wsgi_app, artifacts)
+
+    def ticket_file(key, kind):
+        # Only reached when the file isn't there (or the wrapper was bypassed)
+        if not re.fullmatch(r'[0-9a-f]{64}', key):
+            abort(404)
+        response = send_from_directory(os.path.abspath(artifacts.directory), f"{key[:2]}/{key}.{kind}",
+                                       mimetype=KINDS[kind], max_age=None, etag=key)
+        response.headers['Cache-Control'] = IMMUTABLE
+        return response
+
+    app.add_url_rule('/ticket-files/<key>.<any(pdf, png):kind>', 'ticket_file', ticket_file)
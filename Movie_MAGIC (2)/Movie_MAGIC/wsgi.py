@@ -0,0 +1,10 @@
+"""WSGI entry point for production servers:
+
+    MOVIE_MAGIC_BACKEND=aws gunicorn -c gunicorn.conf.py wsgi:app
+
+Settings come from MOVIE_MAGIC_<NAME> environment variables (see
+movie_magic.DEFAULTS).
+"""
+from movie_magic import create_app
+
+app = create_app()